@@ -1,7 +1,11 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_from_directory
+from functools import wraps
+from contextlib import contextmanager
+from werkzeug.wsgi import ClosingIterator
+from flask import Flask, Request, render_template, request, jsonify, session, redirect, url_for, send_from_directory, send_file, Response, g, has_app_context
 from flask_cors import CORS
 import sqlite3
 import hashlib
+import json
 import os
 from datetime import datetime
 import serial
@@ -24,9 +28,62 @@ except (ImportError, RuntimeError):
 # Importar threading para lock
 import threading
 from collections import deque
+import itertools
+import bisect
+import zlib
+
+# Extração do toolpath em colunas (NumPy é opcional)
+from gcode_toolpath import build_toolpath, load_toolpath, ToolpathBuilder, TOOLPATH_SUFFIX, NUMPY_AVAILABLE
+from gcode_geometry import (build_geometry, ensure_geometry, read_geometry_header, geometry_path, layer_range,
+                            level_for_budget, GEOMETRY_SUFFIX, GEOMETRY_VERTEX_BYTES)
+from gcode_metadata import scan_gcode_metadata, parse_metadata_windows, filament_grams, METADATA_PARSER_VERSION
+from gcode_ingest import GcodeUpload, read_line_blocks
+from gcode_analysis import AnalysisPool
+from resource_governor import ResourceGovernor, RemoteGovernor
+from print_streamer import StreamProcess, AckJitter, encode_frame, plan_resend
+from printer_daemon import PrinterDaemonClient, PrinterDaemonError
+from status_board import StatusBoard, StatusBoardReader
+from gcode_estimator import (estimate_toolpath, scan_limit_changes, find_limit_changes, parse_marlin_settings,
+                             default_motion_limits, motion_limits_signature, elapsed_at_offset)
+
+def load_secret_key() -> bytes:
+    """Chave das sessões: SECRET_KEY, ou um arquivo gerado uma vez (SECRET_KEY_FILE).
+
+    Os workers da interface web (e a interface reiniciada no meio de uma impressão)
+    precisam da mesma chave, senão quem está logado perde a sessão.
+    """
+    key = os.environ.get('SECRET_KEY')
+    if key:
+        return key.encode()
+    path = os.environ.get('SECRET_KEY_FILE') or '.secret_key'
+    try:
+        with open(path, 'rb') as f:
+            key = f.read()
+        if len(key) >= 24:
+            return key
+    except OSError:
+        pass
+    key = os.urandom(24)
+    # Workers subindo juntos: a chave é gravada num temporário e ligada ao nome final;
+    # quem perde a corrida usa a do vencedor
+    tmp_path = f"{path}.{os.getpid()}"
+    try:
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(key)
+        try:
+            os.link(tmp_path, path)
+        except FileExistsError:
+            with open(path, 'rb') as f:
+                key = f.read()
+        finally:
+            os.remove(tmp_path)
+    except OSError as e:
+        print(f"⚠️ Não foi possível gravar a chave das sessões ({path}): {e}")
+    return key
 
 app = Flask(__name__)
-app.secret_key = os.urandom(24)
+app.secret_key = load_secret_key()
 CORS(app)
 
 # Versão do app (mostrada no rodapé)
@@ -139,8 +196,20 @@ serial_lock = threading.Lock()
 # Lock para sincronizar acesso ao histórico de comandos
 history_lock = threading.Lock()
 
-# Histórico de comandos G-code (últimos 100 comandos)
-commands_history = deque(maxlen=100)
+# Histórico de comandos G-code (anel com as últimas linhas do terminal)
+# Entradas compactas (seq, monotonic, tipo, texto); a data só é formatada ao servir
+COMMANDS_HISTORY_SIZE = int(os.environ.get('COMMANDS_HISTORY_SIZE') or '2000')
+commands_history = deque(maxlen=COMMANDS_HISTORY_SIZE)
+_history_seq = 0
+# Converte time.monotonic() em horário de parede na hora de servir
+_HISTORY_CLOCK_OFFSET = time.time() - time.monotonic()
+
+# Clientes conectados ao stream de eventos (/api/events)
+_event_lock = threading.Lock()
+_event_subscribers = []
+EVENTS_MAX_CLIENTS = int(os.environ.get('EVENTS_MAX_CLIENTS') or '16')
+EVENTS_TERMINAL_BACKLOG = int(os.environ.get('EVENTS_TERMINAL_BACKLOG') or '500')
+EVENTS_KEEPALIVE_SEC = float(os.environ.get('EVENTS_KEEPALIVE_SEC') or '15')
 
 # Flags de controle de impressão
 print_paused = False
@@ -148,11 +217,29 @@ print_stopped = False
 print_paused_by_filament = False  # Flag para pausar por falta de filamento
 printing_thread = None
 printing_in_progress = False
-g28_executed = False  # Pular G28 duplicado durante a impressão
-g29_executed = False  # Pular G29 duplicado durante a impressão
 
 # Configuração do banco de dados
 DB_NAME = 'croma.db'
+# Conexões reaproveitadas: as requisições pegam uma do pool (devolvida no fim da
+# requisição); threads de fundo (impressão, telemetria) ficam com uma conexão própria
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE') or '8')
+DB_CACHED_STATEMENTS = 256  # Statements preparados mantidos por conexão
+_db_pool = deque()
+_db_pool_lock = threading.Lock()
+_db_thread_local = threading.local()
+
+# Impressão atual em memória: o /api/printer/status lê daqui e o banco é atualizado
+# por uma thread própria (a cada JOB_PERSIST_INTERVAL_SEC e nas transições de estado),
+# em vez de um commit (fsync no cartão SD) a cada 50 linhas no meio do streaming
+JOB_PERSIST_INTERVAL_SEC = float(os.environ.get('JOB_PERSIST_INTERVAL_SEC') or '30')
+JOB_FINAL_STATUSES = ('completed', 'cancelled', 'error')
+current_job = {}  # id, filename, status, progress, started_at, total_seconds, remaining_seconds
+_job_lock = threading.Lock()
+_job_dirty = False
+_job_persist_event = threading.Event()
+_job_persist_thread = None
+_job_db_conn = None  # Conexão única (WAL) usada só para persistir o progresso
+_job_db_lock = threading.Lock()
 
 # Configuração de upload de arquivos G-code
 GCODE_FOLDER = 'gcode_files'
@@ -160,6 +247,35 @@ THUMBNAIL_FOLDER = 'static/thumbnails'
 ALLOWED_EXTENSIONS = {'gcode', 'gco', 'g'}
 MAX_FILE_SIZE = 100 * 1024 * 1024  # 100MB
 
+# G-code compilado no upload (arquivo "<gcode>.stream" ao lado do original):
+# sem comentários, G28/G29 duplicados já removidos e cada linha com a classe pré-calculada
+# e o offset da linha no G-code original ("<classe> <offset> <comando>")
+GCODE_STREAM_SUFFIX = '.stream'
+GCODE_STREAM_HEADER = ';CROMA-STREAM 2\n'
+GCODE_STREAM_OFFSET_STRIDE = 1000  # Guardar o offset em bytes a cada N comandos
+PREVIEW_CHUNK_BYTES = 64 * 1024  # Blocos do streaming do preview (/api/files/preview)
+_geometry_lock = threading.Lock()  # Uma geração de .geometry por vez (arquivo .tmp compartilhado)
+_gcode_blob_lock = threading.Lock()  # Threads deste processo; entre processos: gcode_blob_transaction
+# Vértices por requisição de /api/files/geometry/<id>/data quando o cliente não escolhe o nível
+GEOMETRY_VERTEX_BUDGET = int(os.environ.get('GEOMETRY_VERTEX_BUDGET') or '1000000')
+
+# Classes de comando: código de 1 caractere no .stream -> (nome, timeout do "ok" em s)
+GCODE_KINDS = {
+    'm': ('motion', 10),      # G0/G1/G2/G3
+    'w': ('heat_wait', 300),  # M109/M190/M191 - aquecer e aguardar
+    'h': ('home', 60),        # G28
+    'l': ('level', 120),      # G29 - auto bed leveling
+    't': ('tool_change', 10), # T<n>
+    'x': ('mixing', 5),       # M163/M164/M165/M166/M182
+    'o': ('other', 5),
+}
+_GCODE_KIND_BY_WORD = {
+    'G0': 'm', 'G1': 'm', 'G2': 'm', 'G3': 'm', 'G00': 'm', 'G01': 'm', 'G02': 'm', 'G03': 'm',
+    'M109': 'w', 'M190': 'w', 'M191': 'w',
+    'G28': 'h', 'G29': 'l',
+    'M163': 'x', 'M164': 'x', 'M165': 'x', 'M166': 'x', 'M182': 'x',
+}
+
 # Criar pastas se não existirem
 if not os.path.exists(GCODE_FOLDER):
     os.makedirs(GCODE_FOLDER)
@@ -192,12 +308,155 @@ FILAMENT_CHECK_INTERVAL_PRINT_SEC = float(os.environ.get('FILAMENT_CHECK_INTERVA
 MARLIN_FILAMENT_INVERT = (os.environ.get('MARLIN_FILAMENT_INVERT') or '0').strip() in ('1', 'true', 'True', 'yes', 'YES')
 FILAMENT_M119_DURING_PRINT = (os.environ.get('FILAMENT_M119_DURING_PRINT') or '0').strip() in ('1', 'true', 'True', 'yes', 'YES')
 
-# Evitar interferência no fluxo do G-code durante impressão (dashboard / status)
+# Telemetria (temperaturas / progresso SD): intervalo do autoreport do Marlin (M155 / M27 S)
+TELEMETRY_INTERVAL_SEC = float(os.environ.get('TELEMETRY_INTERVAL_SEC') or '2.0')
+# Sem autoreport no firmware: intervalo do M105 durante impressão (evita interferir no streaming)
 TEMP_CHECK_INTERVAL_PRINT_SEC = float(os.environ.get('TEMP_CHECK_INTERVAL_PRINT_SEC') or '5.0')
 
+# Streaming do G-code durante a impressão:
+# - window: mantém vários comandos em trânsito, limitado pelo buffer RX do firmware
+#           (o planner do Marlin não esvazia entre comandos)
+# - sync: modo antigo, envia uma linha e espera o "ok" antes da próxima
+STREAM_MODE = (os.environ.get('STREAM_MODE') or 'window').strip().lower()
+# Buffer RX do Marlin (RX_BUFFER_SIZE, padrão 128) - mantém 1 byte de folga
+STREAM_RX_BUFFER_BYTES = int(os.environ.get('STREAM_RX_BUFFER_BYTES') or '127')
+# Máximo de comandos em trânsito (BUFSIZE do Marlin, padrão 4)
+STREAM_MAX_INFLIGHT = int(os.environ.get('STREAM_MAX_INFLIGHT') or '4')
+# Numerar (N<linha>) e adicionar checksum (*<cs>) às linhas do streaming, com reenvio
+# automático quando o firmware pede "Resend: N" (cabo USB ruidoso não trava a impressão)
+STREAM_CHECKSUM = (os.environ.get('STREAM_CHECKSUM') or '1').strip() in ('1', 'true', 'True', 'yes', 'YES')
+# Quantas linhas enviadas ficam guardadas para reenvio
+STREAM_RESEND_HISTORY = int(os.environ.get('STREAM_RESEND_HISTORY') or '256')
+# Leitura antecipada do .stream: uma thread mantém pelo menos N KB de comandos prontos
+# em memória, para que uma demora do cartão SD (ex: upload em paralelo) não pare a impressora
+PRINT_PREFETCH_KB = int(os.environ.get('PRINT_PREFETCH_KB') or '256')
+PRINT_PREFETCH_CHUNK_BYTES = 64 * 1024
+# Upload: blocos esperando o .stream/toolpath na memória; acima disso eles leem do arquivo
+# recém-gravado (a gravação nunca espera pelo processamento)
+UPLOAD_QUEUE_MB = int(os.environ.get('UPLOAD_QUEUE_MB') or '32')
+# Threads da fila de análise (.stream, toolpath, estimativa, geometria). Durante a impressão
+# só uma thread extra, de baixa prioridade, continua trabalhando
+ANALYSIS_WORKERS = int(os.environ.get('ANALYSIS_WORKERS') or '2')
+# Intervalo entre as gravações do progresso da análise no banco (visto por todos os workers)
+ANALYSIS_PROGRESS_SEC = float(os.environ.get('ANALYSIS_PROGRESS_SEC') or '1')
+# Controle de admissão durante a impressão (resource_governor.py): banda de gravação do
+# upload, vagas simultâneas do visualizador e quanto uma requisição espera por uma vaga
+PRINT_UPLOAD_KBPS = int(os.environ.get('PRINT_UPLOAD_KBPS') or '2048')
+PRINT_PREVIEW_SLOTS = int(os.environ.get('PRINT_PREVIEW_SLOTS') or '1')
+PRINT_ADMISSION_WAIT_SEC = float(os.environ.get('PRINT_ADMISSION_WAIT_SEC') or '5')
+# Envio da impressão num processo próprio (print_streamer.py), fora do GIL e do coletor de
+# lixo do Flask: núcleo dedicado (-1: o último) e prioridade SCHED_FIFO (0: só nice -10)
+STREAM_PROCESS = (os.environ.get('STREAM_PROCESS') or '0').strip() in ('1', 'true', 'True', 'yes', 'YES')
+STREAM_CPU = int(os.environ.get('STREAM_CPU') or '-1')
+STREAM_RT_PRIORITY = int(os.environ.get('STREAM_RT_PRIORITY') or '10')
+# Daemon da impressora (printer_daemon.py): com PRINTER_DAEMON=1 este processo é só a
+# interface web e as operações da impressora vão para o daemon pelo socket Unix
+PRINTER_DAEMON = (os.environ.get('PRINTER_DAEMON') or '0').strip() in ('1', 'true', 'True', 'yes', 'YES')
+PRINTER_DAEMON_SOCKET = os.environ.get('PRINTER_DAEMON_SOCKET') or '/tmp/croma-printer.sock'
+PRINTER_DAEMON_TIMEOUT_SEC = float(os.environ.get('PRINTER_DAEMON_TIMEOUT_SEC') or '30')
+# Quadro de status em memória compartilhada (status_board.py): o dono da impressora publica e
+# o /api/printer/status de qualquer worker lê dali, sem lock, banco ou pedido ao daemon
+STATUS_BOARD = (os.environ.get('STATUS_BOARD') or '1').strip() in ('1', 'true', 'True', 'yes', 'YES')
+STATUS_BOARD_PATH = os.environ.get('STATUS_BOARD_PATH') or '/dev/shm/croma-status'
+
 # Variável global para conexão serial
 printer_serial = None
 
+# Condição associada ao serial_lock: a thread leitora avisa quando chega um "ok"
+serial_cond = threading.Condition(serial_lock)
+
+# Comandos escritos aguardando "ok", em ordem de envio (streaming e send_gcode)
+_ack_waiters = deque()
+_link_inflight_bytes = 0
+_link_last_progress_ts = 0.0
+_stream_slots_hint = None  # vagas livres reportadas pelo ADVANCED_OK (B<n>)
+_serial_reader_thread = None
+_serial_reader_stop = threading.Event()  # Pedido de parada da leitora atual (desconexão)
+
+# Handlers para linhas não solicitadas, por tipo (ver classify_printer_line)
+_serial_line_handlers = {}
+
+# Numeração de linhas do streaming e histórico limitado para atender pedidos de reenvio
+_stream_line_number = 0
+_stream_sent_history = deque(maxlen=STREAM_RESEND_HISTORY)
+_stream_resend_queue = deque()  # (número, linha) a reenviar antes de linhas novas
+_stream_resend_from = None
+_stream_resend_ignore = 0
+
+# Intervalo entre o "ok" que abriu vaga para o streaming e a escrita da linha seguinte
+stream_jitter = AckJitter()
+_stream_waiting_room = False  # o streaming está esperando vaga na janela
+_link_ack_ts = None
+
+# Processo de envio (STREAM_PROCESS=1) com a porta emprestada: send_gcode() vai para ele
+_stream_process = None
+_stream_cpu = None
+_serial_lent = False
+_serial_reader_parked = threading.Event()
+
+# Operações da impressora (@printer_method): executadas aqui ou, com PRINTER_DAEMON=1,
+# no daemon dono da porta (printer_call)
+PRINTER_METHODS = {}
+_printer_client = None
+_printer_client_lock = threading.Lock()
+
+# Quadro de status: escritor no dono da impressora, leitor em cada processo da interface
+status_board = None
+_status_board_reader = None
+_status_board_open_ts = 0.0
+_status_board_cache = (None, None)  # ((sequência, segundo), resposta JSON pronta)
+
+_ADVANCED_OK_SLOTS_RE = re.compile(r'\bB(\d+)')
+_RESEND_RE = re.compile(r'(?:resend|rs)[:\s]\s*n?(\d+)')
+_TEMP_REPORT_RE = re.compile(r'^\s*(?:T\d?|B|C):\s*-?\d')
+# Linhas de relatório que fazem parte da resposta quando o comando em espera as pediu
+_TEMP_NOZZLE_RE = re.compile(r'T:(\d+\.?\d*)\s*/(\d+\.?\d*)')
+_TEMP_BED_RE = re.compile(r'B:(\d+\.?\d*)\s*/(\d+\.?\d*)')
+_SD_PROGRESS_RE = re.compile(r'(\d+)/(\d+)')
+_CAPABILITY_RE = re.compile(r'Cap:([A-Z0-9_]+):([01])', re.IGNORECASE)
+_RESPONSE_KIND_FOR_COMMAND = {
+    'temperature': ('M105',),
+    'sd_status': ('M27',),
+}
+
+# Estatísticas do streaming da impressão atual/última (para comparar os modos)
+stream_stats = {
+    'mode': STREAM_MODE,
+    'started_at': 0.0,
+    'elapsed_sec': 0.0,
+    'lines_sent': 0,
+    'lines_acked': 0,
+    'timeouts': 0,
+    'max_inflight': 0,
+    'resends': 0,
+    'resent_lines': 0,
+    'lines_per_sec': 0.0,
+    'recent_lines_per_sec': 0.0,
+    'prefetch_bytes': 0,
+    'prefetch_min_bytes': 0,
+    'prefetch_underruns': 0,
+    'prefetch_underrun_ms': 0.0,
+    'ack_to_write': {},
+    'process': None,
+    '_recent_ts': 0.0,
+    '_recent_lines': 0,
+}
+
+# Escalonador de comandos: emergency (escrito na hora, fora da janela),
+# interactive (terminal, pausa, pincel: pega a próxima vaga) e bulk (linhas da impressão,
+# telemetria: preenchem o resto). M108/M112/M410 são tratados pelo EMERGENCY_PARSER do
+# Marlin assim que os bytes chegam, mesmo com o buffer de comandos cheio.
+COMMAND_PRIORITIES = ('emergency', 'interactive', 'bulk')
+_EMERGENCY_COMMANDS = ('M108', 'M112', 'M410')
+_interactive_waiting = 0  # comandos interativos esperando vaga (o streaming cede a vez)
+
+# Latência de fila por classe (da chamada até a escrita na serial)
+command_latency = {
+    priority: {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'last_ms': 0.0,
+               '_samples': deque(maxlen=500)}
+    for priority in COMMAND_PRIORITIES
+}
+
 # Variável global para estado do filamento
 filament_status = {
     'has_filament': True,
@@ -212,14 +471,26 @@ _gpio_poll_thread_started = False
 _filament_last_check_idle_ts = 0.0
 _filament_last_check_print_ts = 0.0
 
-_temp_last_check_print_ts = 0.0
-_temp_cache_print = {
+# Última leitura de telemetria (atualizada pela thread leitora; /api/printer/status só lê daqui)
+printer_telemetry = {
     'bed': 0,
     'nozzle': 0,
     'target_bed': 0,
     'target_nozzle': 0,
+    'sd_printing': False,
+    'sd_progress': 0,
+    'updated_at': None,  # time.time() da última leitura de temperatura
+    'source': None,      # 'autoreport' ou 'poll'
 }
 
+# Capacidades informadas pelo firmware no M115 (ex: AUTOREPORT_TEMP)
+printer_capabilities = {}
+
+# Limites de movimento (M203/M201/M204/M205 do M503) para a estimativa de tempo
+printer_motion_limits = None
+
+_telemetry_thread_started = False
+
 
 def _maybe_mark_filament_runout_from_printer_line(line: str) -> bool:
     """Detecta mensagens de runout do Marlin no fluxo serial.
@@ -259,6 +530,7 @@ def _maybe_mark_filament_runout_from_printer_line(line: str) -> bool:
         print_paused_by_filament = True
         print_paused = True
         print("🚨 Marlin sinalizou falta de filamento (runout). Impressão pausada.")
+        publish_printer_state()
 
     return True
 
@@ -479,7 +751,7 @@ def check_filament_sensor(during_print: bool = False):
                 return filament_status
 
             # M119 pode responder rápido; mantém timeout curto
-            m119 = send_gcode('M119', wait_for_ok=True, timeout=5, retries=1)
+            m119 = send_gcode('M119', wait_for_ok=True, timeout=5, retries=1, priority='bulk')
             parsed = _parse_marlin_m119_for_filament(m119 or '')
             if parsed is not None:
                 filament_status['has_filament'] = parsed
@@ -511,9 +783,53 @@ def check_filament_sensor(during_print: bool = False):
     
     return filament_status
 
+# Abrir conexão com o banco já configurada (WAL e pragmas para o cartão SD)
+def open_db_connection():
+    conn = sqlite3.connect(DB_NAME, timeout=10, check_same_thread=False,
+                           cached_statements=DB_CACHED_STATEMENTS)
+    conn.execute('PRAGMA journal_mode=WAL')     # Leitores não bloqueiam quem escreve
+    conn.execute('PRAGMA synchronous=NORMAL')   # Em WAL: sem fsync a cada commit
+    conn.execute('PRAGMA cache_size=-4000')     # ~4 MB de cache de páginas
+    conn.execute('PRAGMA temp_store=MEMORY')
+    return conn
+
+def get_db():
+    """Conexão reaproveitada: do pool durante uma requisição, por thread fora dela.
+
+    Não feche a conexão retornada - ela volta para o pool em close_request_db().
+    """
+    if has_app_context():
+        if 'db' not in g:
+            with _db_pool_lock:
+                g.db = _db_pool.pop() if _db_pool else None
+            if g.db is None:
+                g.db = open_db_connection()
+        return g.db
+    
+    conn = getattr(_db_thread_local, 'conn', None)
+    if conn is None:
+        conn = _db_thread_local.conn = open_db_connection()
+    return conn
+
+@app.teardown_appcontext
+def close_request_db(exception=None):
+    conn = g.pop('db', None)
+    if conn is None:
+        return
+    if conn.in_transaction:
+        conn.rollback()  # Requisição terminou sem commit (erro no meio)
+    with _db_pool_lock:
+        if len(_db_pool) < DB_POOL_SIZE:
+            _db_pool.append(conn)
+            return
+    conn.close()
+
 # Inicializar banco de dados
 def init_db():
-    conn = sqlite3.connect(DB_NAME)
+    # timeout + BEGIN IMMEDIATE: workers da interface subindo juntos criam/migram em fila
+    # (um ALTER TABLE repetido falharia com "duplicate column")
+    conn = sqlite3.connect(DB_NAME, timeout=30)
+    conn.execute('BEGIN IMMEDIATE')
     cursor = conn.cursor()
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS users (
@@ -532,6 +848,8 @@ def init_db():
             progress REAL,
             started_at TIMESTAMP,
             completed_at TIMESTAMP,
+            file_id INTEGER,
+            actual_seconds REAL,
             FOREIGN KEY (user_id) REFERENCES users (id)
         )
     ''')
@@ -558,9 +876,53 @@ def init_db():
             uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             last_printed TIMESTAMP,
             print_count INTEGER DEFAULT 0,
+            stream_commands INTEGER,
+            stream_offsets TEXT,
+            estimated_seconds REAL,
+            layer_seconds TEXT,
+            time_index TEXT,
+            estimate_limits TEXT,
+            layer_index TEXT,
+            metadata_version INTEGER,
+            content_hash TEXT,
+            analysis_status TEXT,
+            analysis_pid INTEGER,
+            analysis_progress REAL,
             FOREIGN KEY (user_id) REFERENCES users (id)
         )
     ''')
+    # Bancos criados por versões antigas: adicionar colunas novas
+    cursor.execute('PRAGMA table_info(print_jobs)')
+    existing_columns = {row[1] for row in cursor.fetchall()}
+    for column, column_type in (('file_id', 'INTEGER'), ('actual_seconds', 'REAL')):
+        if column not in existing_columns:
+            cursor.execute(f'ALTER TABLE print_jobs ADD COLUMN {column} {column_type}')
+    cursor.execute('PRAGMA table_info(gcode_files)')
+    existing_columns = {row[1] for row in cursor.fetchall()}
+    for column, column_type in (('stream_commands', 'INTEGER'), ('stream_offsets', 'TEXT'),
+                                ('estimated_seconds', 'REAL'), ('layer_seconds', 'TEXT'),
+                                ('time_index', 'TEXT'), ('estimate_limits', 'TEXT'), ('layer_index', 'TEXT'),
+                                ('metadata_version', 'INTEGER'), ('content_hash', 'TEXT'),
+                                ('analysis_status', 'TEXT'), ('analysis_pid', 'INTEGER'),
+                                ('analysis_progress', 'REAL')):
+        if column not in existing_columns:
+            cursor.execute(f'ALTER TABLE gcode_files ADD COLUMN {column} {column_type}')
+    # Índices das consultas frequentes (impressão atual, lista de arquivos, busca por nome)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_print_jobs_status_started ON print_jobs (status, started_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_gcode_files_user_uploaded ON gcode_files (user_id, uploaded_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_gcode_files_original_name ON gcode_files (original_name)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_gcode_files_content_hash ON gcode_files (content_hash)')
+    # Conteúdo dos G-codes (gcode_files/<sha256>.gcode e os .stream/.toolpath/.geometry ao lado),
+    # compartilhado pelas linhas de gcode_files com o mesmo content_hash
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS gcode_blobs (
+            content_hash TEXT PRIMARY KEY,
+            filename TEXT NOT NULL,
+            file_size INTEGER,
+            refcount INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS brush_mixtures (
             brush_id INTEGER PRIMARY KEY,
@@ -572,6 +934,14 @@ def init_db():
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
+    # Configurações lidas da impressora (ex: limites de movimento do M503)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS printer_settings (
+            key TEXT PRIMARY KEY,
+            value TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
     conn.commit()
     conn.close()
 
@@ -579,7 +949,64 @@ def init_db():
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
+def printer_method(name: str):
+    """Registra uma operação da impressora, chamada pelas rotas via printer_call()."""
+    def register(fn):
+        PRINTER_METHODS[name] = fn
+        return fn
+    return register
+
+
+def printer_call(method: str, call_timeout: Optional[float] = None, **params):
+    """Executa uma operação da impressora: aqui ou, com PRINTER_DAEMON=1, no daemon.
+
+    No daemon, falhas de comunicação (e erros da operação) viram PrinterDaemonError.
+    """
+    if PRINTER_DAEMON:
+        return get_printer_client().call(method, params, timeout=call_timeout)
+    return PRINTER_METHODS[method](**params)
+
+
+def get_printer_client() -> PrinterDaemonClient:
+    """Cliente do daemon deste processo (criado no primeiro uso: depois do fork dos workers)."""
+    global _printer_client
+    if _printer_client is None:
+        with _printer_client_lock:
+            if _printer_client is None:
+                client = PrinterDaemonClient(PRINTER_DAEMON_SOCKET, on_event=_on_printer_daemon_event,
+                                             timeout=PRINTER_DAEMON_TIMEOUT_SEC)
+                client.start_events()
+                _printer_client = client
+    return _printer_client
+
+
+def _on_printer_daemon_event(event_type: str, data):
+    """Evento do daemon: repassa aos clientes do /api/events deste processo."""
+    global printing_in_progress
+    if event_type == 'state':
+        # Espelho local para o controle de admissão e a fila de análise
+        printing_in_progress = data.get('state') in ('printing', 'paused')
+    if event_type == 'terminal':
+        for entry in data:
+            publish_event('terminal', tuple(entry))
+    else:
+        publish_event(event_type, data)
+
+
+@app.before_request
+def start_printer_client():
+    # Assinar os eventos do daemon já na primeira requisição do worker (espelho do estado)
+    if PRINTER_DAEMON and _printer_client is None:
+        get_printer_client()
+
+
+@app.errorhandler(PrinterDaemonError)
+def printer_daemon_error(e):
+    return jsonify({'success': False, 'message': str(e)}), 503
+
+
 # Conectar à impressora via serial
+@printer_method('connect')
 def connect_printer():
     global printer_serial
     try:
@@ -632,7 +1059,12 @@ def connect_printer():
         except Exception as e:
             print(f"   Aviso ao verificar resposta: {e}")
         
+        # A partir daqui, toda leitura da serial passa pela thread leitora
+        start_serial_reader()
+        start_telemetry()
+        
         print(f"✓ Conectado à impressora em {SERIAL_PORT} @ {SERIAL_BAUDRATE} baud")
+        publish_printer_state()
         return True
     except serial.SerialException as e:
         print(f"✗ ERRO Serial: {e}")
@@ -649,16 +1081,19 @@ def connect_printer():
         return False
 
 # Desconectar impressora
+@printer_method('disconnect')
 def disconnect_printer():
     global printer_serial
     try:
         if printer_serial and printer_serial.is_open:
+            stop_serial_reader()
             printer_serial.close()
             print("✓ Impressora desconectada")
     except Exception as e:
         print(f"Erro ao desconectar: {e}")
     finally:
         printer_serial = None
+        publish_printer_state()
 
 # Verificar se impressora está pronta (como OctoPrint)
 def check_printer_ready():
@@ -676,481 +1111,1770 @@ def check_printer_ready():
         print(f"  ✗ Erro ao verificar prontidão: {e}")
         return False
 
-# Enviar comando G-code para impressora
-def send_gcode(command, wait_for_ok=True, timeout=None, retries=1):
-    global printer_serial
+class _EventSubscriber:
+    """Fila de eventos de um cliente SSE.
+
+    Eventos de estado (temperatura, progresso...) são coalescidos: só o último de cada
+    tipo fica pendente. Linhas do terminal vão para uma fila limitada; se o cliente
+    não acompanhar, a fila transborda e ele recebe "resync" para recarregar via polling.
+    """
+
+    def __init__(self):
+        self.latest = {}
+        self.terminal = deque()
+        self.overflowed = False
+        self.event = threading.Event()
+
+
+def publish_event(event_type: str, data):
+    """Publica um evento para todos os clientes conectados em /api/events."""
+    if not _event_subscribers:
+        return
+    with _event_lock:
+        for sub in _event_subscribers:
+            if event_type == 'terminal':
+                if len(sub.terminal) >= EVENTS_TERMINAL_BACKLOG:
+                    sub.terminal.clear()
+                    sub.overflowed = True
+                else:
+                    sub.terminal.append(data)
+            else:
+                sub.latest[event_type] = data
+            sub.event.set()
+
+
+def _event_subscribe() -> Optional[_EventSubscriber]:
+    with _event_lock:
+        if len(_event_subscribers) >= EVENTS_MAX_CLIENTS:
+            return None
+        sub = _EventSubscriber()
+        _event_subscribers.append(sub)
+        return sub
+
+
+def _event_unsubscribe(sub: _EventSubscriber):
+    with _event_lock:
+        if sub in _event_subscribers:
+            _event_subscribers.remove(sub)
+
+
+def _event_take(sub: _EventSubscriber, format_terminal: bool = True):
+    """Retira tudo que está pendente para o cliente: [(tipo, dados), ...].
+
+    format_terminal=False mantém as linhas do terminal como entradas compactas (para o
+    daemon repassar à interface web, que formata ao servir).
+    """
+    with _event_lock:
+        sub.event.clear()
+        events = list(sub.latest.items())
+        sub.latest.clear()
+        if sub.overflowed:
+            sub.overflowed = False
+            events.append(('resync', {'reason': 'terminal_backlog'}))
+        elif sub.terminal:
+            terminal = list(sub.terminal)
+            sub.terminal.clear()
+            if format_terminal:
+                terminal = [format_history_entry(entry) for entry in terminal]
+            events.append(('terminal', terminal))
+    return events
+
+
+def log_command_history(entry_type: str, command: str):
+    """Registra uma linha do terminal (sent/response/error) e avisa os clientes conectados.
+
+    Roda no caminho quente do streaming (duas vezes por linha impressa): só guarda uma
+    tupla; número de sequência e horário formatado ficam para quando alguém ler.
+    """
+    global _history_seq
+    with history_lock:
+        _history_seq += 1
+        entry = (_history_seq, time.monotonic(), entry_type, command)
+        commands_history.append(entry)
+    publish_event('terminal', entry)
+
+
+def format_history_entry(entry) -> dict:
+    """Converte uma entrada compacta do histórico no formato servido pela API."""
+    seq, ts, entry_type, command = entry
+    return {
+        'seq': seq,
+        'time': datetime.fromtimestamp(ts + _HISTORY_CLOCK_OFFSET).isoformat(),
+        'command': command,
+        'type': entry_type
+    }
+
+
+def get_history_since(since: int = 0):
+    """Entradas com seq > since: (entradas, último seq, truncado).
+
+    "truncado" indica que o cursor é mais antigo que o anel (ou de antes de um restart)
+    e linhas se perderam - o cliente deve tratar a resposta como o histórico completo.
+    """
+    with history_lock:
+        last_seq = _history_seq
+        if since == last_seq:
+            return [], last_seq, False
+        oldest_seq = commands_history[0][0] if commands_history else last_seq + 1
+        truncated = since > last_seq or 0 < since < oldest_seq - 1
+        if since > last_seq:
+            since = 0
+        # seq é contíguo dentro do anel: fatiar a partir do índice certo
+        start = max(0, since - oldest_seq + 1)
+        entries = list(itertools.islice(commands_history, start, None))
+    return entries, last_seq, truncated
+
+
+def get_printer_state() -> str:
+    """Estado atual da impressão: printing, paused ou idle."""
+    if printing_in_progress:
+        return 'paused' if print_paused else 'printing'
+    return 'idle'
+
+
+def printer_state_event() -> dict:
+    """Dados do evento 'state'."""
+    return {
+        'state': get_printer_state(),
+        'connected': bool(printer_serial and printer_serial.is_open),
+        'paused_by_filament': print_paused_by_filament,
+    }
+
+
+def publish_printer_state():
+    """Publica uma transição de estado (início, pausa, retomada, fim, conexão)."""
+    publish_status_board()
+    publish_event('state', printer_state_event())
+    # Transição de estado: gravar o progresso já, sem esperar o intervalo
+    request_job_flush()
+
+
+@printer_method('events_snapshot')
+def printer_event_snapshot() -> dict:
+    """Estado inicial de quem começa a receber eventos: {tipo: dados}."""
+    telemetry = dict(printer_telemetry)
+    return {
+        'state': printer_state_event(),
+        'temperature': {k: telemetry[k] for k in ('bed', 'nozzle', 'target_bed', 'target_nozzle')},
+        'filament': dict(filament_status),
+    }
+
+
+def printer_daemon_subscribe():
+    """Assinatura de eventos de uma instância da interface web (printer_daemon.py).
+
+    Devolve (estado inicial, gerador de lotes de eventos; lote vazio a cada
+    EVENTS_KEEPALIVE_SEC sem eventos) ou None se o limite de clientes foi atingido.
+    """
+    sub = _event_subscribe()
+    if sub is None:
+        return None
     
-    with serial_lock:  # Garantir acesso exclusivo à porta serial
-        for attempt in range(retries):
-            try:
-                if not printer_serial or not printer_serial.is_open:
-                    if not connect_printer():
-                        return None
-                
-                # Adicionar newline se não existir
-                if not command.endswith('\n'):
-                    command += '\n'
-                
-                # Extrair comando (sempre necessário para verificações)
-                cmd = command.strip().upper()
-                
-                # Determinar timeout baseado no comando
-                if timeout is None:
-                    if cmd.startswith('G28'):  # Home - pode levar até 60s
-                        timeout = 60
-                    elif cmd.startswith('G29'):  # Auto bed leveling - pode levar até 120s
-                        timeout = 120
-                    elif cmd.startswith('M109') or cmd.startswith('M190'):  # Aquecimento - até 300s
-                        timeout = 300
-                    elif cmd.startswith('T'):  # Trocar extrusora - pode levar até 10s
-                        timeout = 10
-                    elif cmd.startswith(('G0 ', 'G1 ')) and ' E' in cmd:
-                        timeout = 10  # Comandos de extrusão - aumentado de 5 para 10
-                    elif cmd.startswith(('G0 ', 'G1 ')):
-                        timeout = 10  # Movimentos XYZ - aumentado de 3 para 10 segundos
-                    else:
-                        timeout = 5  # Timeout padrão - aumentado de 3 para 5
-                
-                # Para comandos de movimento (G0/G1), não limpar buffer - mais rápido
-                if not cmd.startswith(('G0 ', 'G1 ')):
-                    try:
-                        printer_serial.reset_input_buffer()
-                    except:
-                        pass
-                    time.sleep(0.01)  # Aguardar limpeza do buffer
-                
-                # Enviar comando
-                printer_serial.write(command.encode())
-                printer_serial.flush()
-                
-                # Log do comando enviado no histórico
-                global commands_history, history_lock
-                with history_lock:
-                    commands_history.append({
-                        'time': datetime.now().isoformat(),
-                        'command': command.strip(),
-                        'type': 'sent'
-                    })
-                
-                if not wait_for_ok:
-                    return 'ok'
-                
-                # Ler resposta (pode ter múltiplas linhas)
-                responses = []
-                start_time = time.time()
-                
-                while time.time() - start_time < timeout:
-                    if printer_serial.in_waiting > 0:
-                        line = printer_serial.readline().decode('utf-8', errors='ignore').strip()
-                        if line:
-                            # Detectar mensagens assíncronas relevantes (ex: runout) sem polling.
-                            try:
-                                _maybe_mark_filament_runout_from_printer_line(line)
-                            except Exception:
-                                pass
-
-                            responses.append(line)
-                            # Se recebeu 'ok', terminou
-                            if 'ok' in line.lower():
-                                # Log da resposta no histórico
-                                with history_lock:
-                                    commands_history.append({
-                                        'time': datetime.now().isoformat(),
-                                        'command': '\n'.join(responses),
-                                        'type': 'response'
-                                    })
-                                return '\n'.join(responses)
-                    else:
-                        time.sleep(0.01)  # Pequena pausa para não saturar CPU
-                
-                # Se chegou aqui, timeout - tentar novamente se tiver retries
-                if attempt < retries - 1:
-                    print(f"  ⚠️ Timeout ao enviar '{command.strip()}', tentando novamente ({attempt + 2}/{retries})...")
-                    time.sleep(0.5)
-                    continue
-                
-                return '\n'.join(responses) if responses else None
-            except Exception as e:
-                if attempt < retries - 1:
-                    print(f"  ⚠️ Erro ao enviar '{command.strip()}': {e}, tentando novamente ({attempt + 2}/{retries})...")
-                    time.sleep(0.5)
+    def batches():
+        try:
+            while True:
+                if not sub.event.wait(EVENTS_KEEPALIVE_SEC):
+                    yield []
                     continue
-                print(f"Erro ao enviar comando '{command.strip()}': {e}")
-                return None
-        
-        return None
+                yield _event_take(sub, format_terminal=False)
+        finally:
+            _event_unsubscribe(sub)
+    
+    return printer_event_snapshot(), batches()
+
 
-# Ler status da impressora
-def get_printer_status_serial():
+def open_status_board():
+    """Cria/reabre o quadro de status (só no dono da impressora)."""
+    global status_board
     try:
-        status = {
-            'connected': printer_serial and printer_serial.is_open,
-            'printing': False,
-            'progress': 0,
-            'bed_temp': 0,
-            'nozzle_temp': 0,
-            'target_bed_temp': 0,
-            'target_nozzle_temp': 0
-        }
-        
-        if not status['connected']:
-            return status
-        
-        # Enviar M105 para ler temperatura (tentar 2 vezes)
-        temp_response = None
-        for attempt in range(2):
-            temp_response = send_gcode('M105')
-            if temp_response and 'T:' in temp_response:
-                break
-            time.sleep(0.1)
-        
-        # Parse da temperatura (ex: "ok T:210.0 /210.0 B:60.0 /60.0" ou "T:25.0 /0.0 B:24.5 /0.0")
-        if temp_response:
-            try:
-                # Procurar em todas as linhas da resposta
-                for line in temp_response.split('\n'):
-                    if 'T:' in line:
-                        # Extrai temperatura do bico
-                        t_match = re.search(r'T:(\d+\.?\d*)\s*/(\d+\.?\d*)', line)
-                        if t_match:
-                            status['nozzle_temp'] = float(t_match.group(1))
-                            status['target_nozzle_temp'] = float(t_match.group(2))
-                        
-                        # Extrai temperatura da mesa
-                        b_match = re.search(r'B:(\d+\.?\d*)\s*/(\d+\.?\d*)', line)
-                        if b_match:
-                            status['bed_temp'] = float(b_match.group(1))
-                            status['target_bed_temp'] = float(b_match.group(2))
-                        break
-            except Exception as e:
-                print(f"Erro ao parsear temperatura: {e}")
-                print(f"Resposta: {temp_response}")
-        
-        # Enviar M27 para ler progresso de impressão
-        progress_response = send_gcode('M27')
-        
-        # Parse do progresso (ex: "SD printing byte 1234/5678")
-        if progress_response and 'SD printing' in progress_response:
-            try:
-                match = re.search(r'(\d+)/(\d+)', progress_response)
-                if match:
-                    current = int(match.group(1))
-                    total = int(match.group(2))
-                    status['progress'] = (current / total) * 100 if total > 0 else 0
-                    status['printing'] = True
-            except Exception as e:
-                print(f"Erro ao parsear progresso: {e}")
-        
-        return status
-    except Exception as e:
-        print(f"Erro ao obter status: {e}")
-        return {
-            'connected': False,
-            'printing': False,
-            'progress': 0,
-            'bed_temp': 0,
-            'nozzle_temp': 0,
-            'target_bed_temp': 0,
-            'target_nozzle_temp': 0
+        status_board = StatusBoard(STATUS_BOARD_PATH)
+    except OSError as e:
+        print(f"⚠️ Quadro de status indisponível ({STATUS_BOARD_PATH}): {e}")
+        return
+    publish_status_board()
+    print(f"📋 Quadro de status em {STATUS_BOARD_PATH}")
+
+
+def publish_status_board():
+    """Grava o estado atual no quadro de status (sem quadro aberto, não faz nada)."""
+    board = status_board
+    if board is None:
+        return
+    job = get_current_job() or {}
+    last_check = filament_status.get('last_check')
+    board.publish({
+        'state': ('paused' if print_paused else 'printing') if job else 'idle',
+        'connected': bool(printer_serial and printer_serial.is_open),
+        'paused_by_filament': print_paused_by_filament,
+        'has_filament': filament_status.get('has_filament'),
+        'filament_sensor': filament_status.get('sensor_enabled'),
+        'filament_source': filament_status.get('source'),
+        'filament_checked_at': datetime.fromisoformat(last_check).timestamp() if last_check else None,
+        'nozzle': printer_telemetry['nozzle'],
+        'bed': printer_telemetry['bed'],
+        'target_nozzle': printer_telemetry['target_nozzle'],
+        'target_bed': printer_telemetry['target_bed'],
+        'temperature_at': printer_telemetry['updated_at'],
+        'job_id': job.get('id'),
+        'filename': job.get('filename'),
+        'progress': job.get('progress'),
+        'offset': job.get('offset'),
+        'layer': job.get('layer'),
+        'total_layers': job.get('total_layers'),
+        'started_at': job.get('started_ts'),
+        'total_seconds': job.get('total_seconds'),
+        'remaining_seconds': job.get('remaining_seconds'),
+    })
+
+
+def start_job(job_id: int, filename: str, started_at: str, total_seconds: Optional[float],
+              total_layers: int = 0):
+    """Registra em memória a impressão que está começando (a linha já foi inserida no banco)."""
+    global current_job, _job_dirty
+    with _job_lock:
+        current_job = {
+            'id': job_id,
+            'filename': filename,
+            'status': 'printing',
+            'progress': 0.0,
+            'started_at': started_at,
+            'started_ts': datetime.strptime(started_at, '%Y-%m-%d %H:%M:%S').timestamp(),
+            'total_seconds': total_seconds,
+            'remaining_seconds': None,
+            'offset': 0,
+            'layer': 0,
+            'total_layers': total_layers,
         }
+        _job_dirty = False
+    start_job_persistence()
+
+
+def update_job_progress(progress: float, remaining_seconds: Optional[float] = None,
+                        offset: Optional[int] = None, layer: Optional[int] = None):
+    """Atualiza o progresso (tempo restante estimado, offset e camada) em memória, sem tocar no banco."""
+    global _job_dirty
+    with _job_lock:
+        if current_job and current_job['status'] == 'printing':
+            current_job['progress'] = progress
+            if remaining_seconds is not None:
+                current_job['remaining_seconds'] = remaining_seconds
+            if offset is not None:
+                current_job['offset'] = offset
+            if layer is not None:
+                current_job['layer'] = layer
+            _job_dirty = True
+    publish_status_board()
+
+
+def finish_job(status: str, progress: Optional[float] = None) -> bool:
+    """Marca a impressão atual como completed/cancelled/error e grava na hora.
+
+    Retorna False se não havia impressão ativa (ou ela já tinha sido finalizada).
+    """
+    global _job_dirty
+    with _job_lock:
+        if not current_job or current_job['status'] in JOB_FINAL_STATUSES:
+            return False
+        current_job['status'] = status
+        if progress is not None:
+            current_job['progress'] = progress
+        _job_dirty = True
+    flush_job_state()
+    return True
 
-# Verificar extensão de arquivo permitida
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# Obter informações do arquivo G-code
-def get_gcode_info(filepath):
-    try:
-        file_size = os.path.getsize(filepath)
-        # Aqui poderia analisar o G-code para estimar tempo, etc
-        return {'size': file_size}
-    except:
-        return {'size': 0}
+def get_current_job() -> Optional[dict]:
+    """Cópia da impressão em andamento, ou None."""
+    with _job_lock:
+        if current_job and current_job['status'] == 'printing':
+            return dict(current_job)
+    return None
 
-# Extrair thumbnail do G-code (PrusaSlicer, OrcaSlicer, BambuStudio)
-def extract_thumbnail(gcode_path, file_id):
-    try:
-        with open(gcode_path, 'r', encoding='utf-8', errors='ignore') as f:
-            lines = f.readlines(500000)  # Ler primeiras linhas onde geralmente está o thumbnail
-        
-        # Procurar thumbnail no formato OrcaSlicer/BambuStudio
-        in_thumbnail = False
-        thumbnail_data = []
-        thumbnail_width = 0
-        thumbnail_height = 0
-        max_thumbnail_size = 0
-        best_thumbnail_data = []
-        
-        for line in lines:
-            line = line.strip()
-            
-            # Início do thumbnail
-            if 'thumbnail begin' in line or 'thumbnail_PNG begin' in line:
-                match = re.search(r'(\d+)x(\d+)', line)
-                if match:
-                    width = int(match.group(1))
-                    height = int(match.group(2))
-                    current_size = width * height
-                    
-                    if current_size > max_thumbnail_size:
-                        # Este é maior, começar a capturar
-                        max_thumbnail_size = current_size
-                        thumbnail_width = width
-                        thumbnail_height = height
-                        thumbnail_data = []
-                        in_thumbnail = True
-                    else:
-                        # Ignorar thumbnails menores
-                        in_thumbnail = False
-            
-            # Fim do thumbnail
-            elif 'thumbnail end' in line or 'thumbnail_PNG end' in line:
-                if in_thumbnail and thumbnail_data:
-                    best_thumbnail_data = thumbnail_data[:]
-                in_thumbnail = False
-            
-            # Dados do thumbnail (linhas com base64)
-            elif in_thumbnail and line.startswith(';'):
-                # Remover o ';' e espaços
-                data = line[1:].strip()
-                if data:  # Adicionar apenas se não for vazio
-                    thumbnail_data.append(data)
-        
-        # Se encontrou thumbnail, processar
-        if best_thumbnail_data:
-            try:
-                # Juntar todas as linhas base64
-                base64_string = ''.join(best_thumbnail_data)
-                image_data = base64.b64decode(base64_string)
-                thumbnail_filename = f"thumb_{file_id}.png"
-                thumbnail_path = os.path.join(app.config['THUMBNAIL_FOLDER'], thumbnail_filename)
-                
-                with open(thumbnail_path, 'wb') as img_file:
-                    img_file.write(image_data)
-                
-                return f"thumbnails/{thumbnail_filename}"
-            except Exception as e:
-                print(f"Erro ao decodificar thumbnail: {e}")
-                return None
-        
-        return None
-    except Exception as e:
-        print(f"Erro ao extrair thumbnail: {e}")
-        return None
 
-def parse_gcode_metadata(gcode_path):
-    """Extrai metadados completos do G-code (OrcaSlicer, PrusaSlicer, Cura, etc.)"""
-    metadata = {
-        'print_time': None,
-        'filament_used': None,
-        'filament_type': None,
-        'nozzle_temp': None,
-        'bed_temp': None,
-        'layer_height': None,
-        'infill': None,
-        'slicer': None,
-        'total_layers': None,
-        'filament_density': None,
-        'filament_diameter': None,
-        'max_z_height': None
-    }
+def _get_job_db():
+    """Conexão de vida longa para o progresso das impressões (_job_db_lock já adquirido)."""
+    global _job_db_conn
+    if _job_db_conn is None:
+        _job_db_conn = open_db_connection()
+    return _job_db_conn
+
+
+def flush_job_state():
+    """Grava no banco o estado em memória da impressão, se mudou desde a última gravação."""
+    global _job_dirty
+    with _job_lock:
+        if not _job_dirty or not current_job:
+            return
+        job = dict(current_job)
+        _job_dirty = False
     
     try:
-        with open(gcode_path, 'r', encoding='utf-8', errors='ignore') as f:
-            # Variáveis para extrair temperaturas dos comandos M104/M140
-            found_m104 = False
-            found_m140 = False
-            
-            # Ler primeiras 500 linhas (onde geralmente estão os comentários com metadados)
-            for i, line in enumerate(f):
-                if i > 500:
-                    break
-                
-                line = line.strip()
-                
-                # Identificar o slicer
-                if 'generated by' in line.lower():
-                    if 'orcaslicer' in line.lower():
-                        slicer_match = re.search(r'OrcaSlicer\s+([\d.]+)', line, re.IGNORECASE)
-                        if slicer_match:
-                            metadata['slicer'] = f"OrcaSlicer {slicer_match.group(1)}"
-                    elif 'prusaslicer' in line.lower():
-                        slicer_match = re.search(r'PrusaSlicer\s+([\d.]+)', line, re.IGNORECASE)
-                        if slicer_match:
-                            metadata['slicer'] = f"PrusaSlicer {slicer_match.group(1)}"
-                    elif 'cura' in line.lower():
-                        metadata['slicer'] = "Cura"
-                
-                # Remove o ponto e vírgula para processar comentários
-                comment_line = line[1:].strip() if line.startswith(';') else line
-                
-                # Total de camadas (OrcaSlicer)
-                if 'total layer number' in comment_line.lower():
-                    layers_match = re.search(r':\s*(\d+)', comment_line)
-                    if layers_match:
-                        metadata['total_layers'] = int(layers_match.group(1))
-                
-                # Densidade do filamento (OrcaSlicer)
-                if 'filament_density' in comment_line.lower() and not metadata['filament_density']:
-                    density_match = re.search(r':\s*([\d.]+)', comment_line)
-                    if density_match:
-                        metadata['filament_density'] = float(density_match.group(1))
-                
-                # Diâmetro do filamento (OrcaSlicer)
-                if 'filament_diameter' in comment_line.lower() and not metadata['filament_diameter']:
-                    diameter_match = re.search(r':\s*([\d.]+)', comment_line)
-                    if diameter_match:
-                        metadata['filament_diameter'] = float(diameter_match.group(1))
-                
-                # Altura máxima Z (OrcaSlicer)
-                if 'max_z_height' in comment_line.lower():
-                    z_match = re.search(r':\s*([\d.]+)', comment_line)
-                    if z_match:
-                        metadata['max_z_height'] = float(z_match.group(1))
-                
-                # Tempo de impressão (extrair do nome do arquivo se disponível)
-                if not metadata['print_time']:
-                    # Tentar extrair do nome do arquivo (ex: "Cubo_PETG_52m31s.gcode")
-                    filename = os.path.basename(gcode_path)
-                    time_match = re.search(r'(\d+)h(\d+)m(\d+)s', filename)
-                    if time_match:
-                        h, m, s = time_match.groups()
-                        metadata['print_time'] = f"{h}h {m}m {s}s"
-                    else:
-                        time_match = re.search(r'(\d+)m(\d+)s', filename)
-                        if time_match:
-                            m, s = time_match.groups()
-                            metadata['print_time'] = f"{m}m {s}s"
-                
-                # Tempo de impressão (de comentários)
-                if 'estimated printing time' in comment_line.lower() or 'TIME:' in comment_line:
-                    time_match = re.search(r'=\s*(.+)', comment_line)
-                    if time_match:
-                        metadata['print_time'] = time_match.group(1).strip()
-                    else:
-                        time_match = re.search(r'TIME:\s*(\d+)', comment_line)
-                        if time_match:
-                            total_seconds = int(time_match.group(1))
-                            hours = total_seconds // 3600
-                            minutes = (total_seconds % 3600) // 60
-                            seconds = total_seconds % 60
-                            if hours > 0:
-                                metadata['print_time'] = f"{hours}h {minutes}m {seconds}s"
-                            else:
-                                metadata['print_time'] = f"{minutes}m {seconds}s"
-                
-                # Filamento usado (gramas ou metros)
-                if 'filament used' in comment_line.lower() or 'material used' in comment_line.lower():
-                    weight_match = re.search(r'\[g\]\s*=\s*([\d.]+)', comment_line)
-                    length_match = re.search(r'\[mm\]\s*=\s*([\d.]+)', comment_line)
-                    simple_match = re.search(r':\s*([\d.]+)\s*g', comment_line)
-                    
-                    if weight_match:
-                        metadata['filament_used'] = float(weight_match.group(1))
-                    elif simple_match:
-                        metadata['filament_used'] = float(simple_match.group(1))
-                    elif length_match:
-                        length_mm = float(length_match.group(1))
-                        # Converter mm para gramas usando densidade se disponível
-                        if metadata['filament_density'] and metadata['filament_diameter']:
-                            # Volume = π * r² * comprimento
-                            radius = metadata['filament_diameter'] / 2
-                            volume_mm3 = 3.14159 * (radius ** 2) * length_mm
-                            # Massa = volume * densidade (convertendo mm³ para cm³)
-                            metadata['filament_used'] = round((volume_mm3 / 1000) * metadata['filament_density'], 2)
-                        else:
-                            # Estimativa padrão para PLA 1.75mm
-                            metadata['filament_used'] = round((length_mm * 0.0028), 2)
-                
-                # Tipo de filamento (extrair do nome do arquivo se disponível)
-                if not metadata['filament_type']:
-                    filename = os.path.basename(gcode_path)
-                    # Procurar por tipos comuns no nome do arquivo
-                    for material in ['PETG', 'PLA', 'ABS', 'TPU', 'NYLON', 'ASA', 'PC']:
-                        if material in filename.upper():
-                            metadata['filament_type'] = material
-                            break
-                
-                # Tipo de filamento (de comentários)
-                if 'filament_type' in comment_line.lower() and not metadata['filament_type']:
-                    type_match = re.search(r'=\s*(.+)', comment_line)
-                    if type_match:
-                        filament_value = type_match.group(1).strip().split(',')[0]  # Pegar primeiro valor se for lista
-                        metadata['filament_type'] = filament_value.strip('"\'')
-                
-                # Temperatura do bico (M104 - prioridade)
-                if not found_m104 and line.startswith('M104'):
-                    temp_match = re.search(r'S(\d+)', line)
-                    if temp_match:
-                        metadata['nozzle_temp'] = int(temp_match.group(1))
-                        found_m104 = True
-                
-                # Temperatura do bico (comentários - fallback)
-                if not found_m104 and ('nozzle_temperature' in comment_line.lower() or 
-                    'first_layer_temperature' in comment_line.lower()):
-                    temp_match = re.search(r'=\s*([\d]+)', comment_line)
-                    if temp_match:
-                        metadata['nozzle_temp'] = int(temp_match.group(1))
-                
-                # Temperatura da mesa (M140 - prioridade)
-                if not found_m140 and line.startswith('M140'):
-                    temp_match = re.search(r'S(\d+)', line)
-                    if temp_match:
-                        metadata['bed_temp'] = int(temp_match.group(1))
-                        found_m140 = True
-                
-                # Temperatura da mesa (comentários - fallback)
-                if not found_m140 and ('bed_temperature' in comment_line.lower() or 
-                    'first_layer_bed_temperature' in comment_line.lower()):
-                    temp_match = re.search(r'=\s*([\d]+)', comment_line)
-                    if temp_match:
-                        metadata['bed_temp'] = int(temp_match.group(1))
-                
-                # Altura da camada
-                if 'layer_height' in comment_line.lower() and not metadata['layer_height']:
-                    height_match = re.search(r'=\s*([\d.]+)', comment_line)
-                    if height_match:
-                        metadata['layer_height'] = float(height_match.group(1))
-                
-                # Preenchimento (infill)
-                if ('fill_density' in comment_line.lower() or 'infill' in comment_line.lower() or 
-                    'sparse infill density' in comment_line.lower()) and not metadata['infill']:
-                    infill_match = re.search(r'=\s*([\d.]+)', comment_line)
-                    if infill_match:
-                        value = float(infill_match.group(1))
-                        metadata['infill'] = int(value * 100) if value < 1 else int(value)
-    
+        with _job_db_lock:
+            conn = _get_job_db()
+            if job['status'] in JOB_FINAL_STATUSES:
+                conn.execute('''
+                    UPDATE print_jobs
+                    SET status = ?, progress = ?, completed_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                ''', (job['status'], job['progress'], job['id']))
+            else:
+                conn.execute('UPDATE print_jobs SET progress = ? WHERE id = ?',
+                             (job['progress'], job['id']))
+            conn.commit()
     except Exception as e:
-        print(f"Erro ao parsear metadados do G-code: {e}")
-    
-    return metadata
+        print(f"⚠️ Erro ao salvar progresso da impressão: {e}")
+        with _job_lock:
+            _job_dirty = True
 
-# Rotas de autenticação
-@app.route('/')
-def index():
-    if 'user_id' in session:
-        return redirect(url_for('dashboard'))
-    return redirect(url_for('login'))
 
-@app.route('/login')
-def login():
-    # Verificar se existem usuários cadastrados
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute('SELECT COUNT(*) FROM users')
-    user_count = cursor.fetchone()[0]
-    conn.close()
-    
-    return render_template('login.html', allow_registration=(user_count == 0))
+def request_job_flush():
+    """Pede à thread de persistência uma gravação imediata."""
+    _job_persist_event.set()
 
-@app.route('/register')
-def register():
-    # Verificar se já existem usuários
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute('SELECT COUNT(*) FROM users')
-    user_count = cursor.fetchone()[0]
-    conn.close()
+
+def _job_persist_loop():
+    while True:
+        _job_persist_event.wait(JOB_PERSIST_INTERVAL_SEC)
+        _job_persist_event.clear()
+        flush_job_state()
+
+
+def start_job_persistence():
+    global _job_persist_thread
+    if _job_persist_thread and _job_persist_thread.is_alive():
+        return
+    _job_persist_thread = threading.Thread(target=_job_persist_loop, daemon=True)
+    _job_persist_thread.start()
+
+
+def classify_gcode_command(cmd: str) -> str:
+    """Código da classe (ver GCODE_KINDS) de um comando já sem comentário e em maiúsculas."""
+    word = cmd.split(None, 1)[0] if cmd else ''
+    kind = _GCODE_KIND_BY_WORD.get(word)
+    if kind:
+        return kind
+    if word.startswith('T'):
+        return 't'
+    return 'o'
+
+
+def _gcode_timeout_for(cmd: str) -> float:
+    """Timeout (s) para aguardar o "ok" de um comando (já em maiúsculas), conforme o tipo."""
+    return GCODE_KINDS[classify_gcode_command(cmd)][1]
+
+
+def classify_printer_line(line: str) -> str:
+    """Classifica uma linha recebida do firmware.
+
+    Tipos: ok, resend, busy, error, action, temperature, sd_status, echo, other.
+    """
+    lower = line.lower()
+    if lower.startswith('ok'):
+        return 'ok'
+    if lower.startswith(('resend', 'rs ')):
+        return 'resend'
+    if lower.startswith(('echo:busy', 'busy:')):
+        return 'busy'
+    if lower.startswith(('error', '!!')):
+        return 'error'
+    if lower.startswith('//action:'):
+        return 'action'
+    if _TEMP_REPORT_RE.match(line):
+        return 'temperature'
+    if lower.startswith(('sd printing byte', 'not sd printing', 'done printing file')):
+        return 'sd_status'
+    if lower.startswith('echo:'):
+        return 'echo'
+    return 'other'
+
+
+def register_serial_line_handler(kind: str, handler):
+    """Registra um handler para linhas não solicitadas de um tipo (ex: 'temperature', 'action')."""
+    _serial_line_handlers.setdefault(kind, []).append(handler)
+
+
+def _dispatch_serial_line(kind: str, line: str):
+    for handler in _serial_line_handlers.get(kind, ()):
+        try:
+            handler(line)
+        except Exception as e:
+            print(f"Erro no handler de '{kind}': {e}")
+
+
+class _PendingCommand:
+    """Comando escrito na serial aguardando o "ok" correspondente (fila FIFO)."""
+
+    __slots__ = ('line', 'nbytes', 'timeout', 'line_number', 'source',
+                 'responses', 'ok', 'event')
+
+    def __init__(self, line, nbytes, timeout, line_number=None, source='cmd'):
+        self.line = line
+        self.nbytes = nbytes
+        self.timeout = timeout
+        self.line_number = line_number
+        self.source = source  # 'stream' (impressão) ou 'cmd' (send_gcode)
+        self.responses = []
+        self.ok = False
+        self.event = threading.Event()
+
+
+def _link_window_has_room(nbytes: int) -> bool:
+    """Verifica se cabe mais um comando em trânsito sem estourar o buffer do firmware."""
+    if not _ack_waiters:
+        return True
+    if len(_ack_waiters) >= STREAM_MAX_INFLIGHT:
+        return False
+    # ADVANCED_OK informa quantas vagas restam na fila de comandos do Marlin
+    if _stream_slots_hint is not None and _stream_slots_hint <= 0:
+        return False
+    return _link_inflight_bytes + nbytes <= STREAM_RX_BUFFER_BYTES
+
+
+def _link_encode(line: str, line_number: Optional[int]) -> bytes:
+    """Monta os bytes enviados: "N<n> <cmd>*<checksum>" ou a linha crua (print_streamer.encode_frame)."""
+    return encode_frame(line.encode(), line_number)
+
+
+def _link_transmit(line: str, line_number: Optional[int] = None, source: str = 'cmd',
+                   timeout: Optional[float] = None, data: Optional[bytes] = None) -> _PendingCommand:
+    """Escreve uma linha e registra quem espera o "ok" (serial_lock já adquirido).
+
+    data: os bytes já montados por _link_encode (quem conferiu a vaga na janela com eles).
+    """
+    global _link_inflight_bytes, _stream_slots_hint, _link_last_progress_ts
+
+    if data is None:
+        data = _link_encode(line, line_number)
+    if timeout is None:
+        timeout = _gcode_timeout_for(line.upper())
+    pending = _PendingCommand(line, len(data), timeout, line_number, source)
+
+    if not _ack_waiters:
+        _link_last_progress_ts = time.time()
+    printer_serial.write(data)
+
+    _ack_waiters.append(pending)
+    _link_inflight_bytes += len(data)
+    if _stream_slots_hint is not None:
+        _stream_slots_hint -= 1
+
+    if len(_ack_waiters) > stream_stats['max_inflight']:
+        stream_stats['max_inflight'] = len(_ack_waiters)
+    return pending
+
+
+def _link_resolve_oldest(ok: bool):
+    """Entrega o resultado ao comando mais antigo da fila (serial_lock já adquirido)."""
+    global _link_inflight_bytes, _link_last_progress_ts, _link_ack_ts
+
+    pending = _ack_waiters.popleft()
+    _link_inflight_bytes -= pending.nbytes
+    _link_last_progress_ts = time.time()
+    if ok and _stream_waiting_room:
+        _link_ack_ts = time.perf_counter()
+    pending.ok = ok
+    pending.event.set()
+    if ok and pending.source == 'stream':
+        stream_stats['lines_acked'] += 1
+    serial_cond.notify_all()
+    return pending
+
+
+def _link_fail_all():
+    """Libera todos os que esperam "ok" (porta fechada / leitor encerrado)."""
+    global _link_inflight_bytes, _stream_slots_hint
+
+    while _ack_waiters:
+        pending = _ack_waiters.popleft()
+        pending.event.set()
+    _stream_resend_queue.clear()
+    _link_inflight_bytes = 0
+    _stream_slots_hint = None
+    serial_cond.notify_all()
+
+
+def _link_expire_oldest():
+    """Descarta o comando mais antigo se o "ok" dele passou do timeout (serial_lock já adquirido)."""
+    global _stream_slots_hint
+
+    if not _ack_waiters:
+        return
+    oldest = _ack_waiters[0]
+    if time.time() - _link_last_progress_ts < oldest.timeout:
+        return
+    _stream_slots_hint = None
+    _link_resolve_oldest(ok=False)
+    if oldest.source == 'stream':
+        stream_stats['timeouts'] += 1
+        print(f"⚠️ Sem 'ok' para '{oldest.line}' após {oldest.timeout}s - CONTINUANDO impressão...")
+
+
+def _stream_next_line_number() -> Optional[int]:
+    """Número que a próxima linha nova do arquivo vai receber (None sem checksum)."""
+    return _stream_line_number + 1 if STREAM_CHECKSUM else None
+
+
+def _stream_write_line(line: str, timeout: Optional[float] = None, data: Optional[bytes] = None):
+    """Escreve uma linha nova do arquivo, numerada e com checksum se habilitado."""
+    global _stream_line_number, _link_ack_ts
+
+    if _link_ack_ts is not None:
+        stream_jitter.record(time.perf_counter() - _link_ack_ts)
+        _link_ack_ts = None
+    line_number = _stream_next_line_number()
+    if line_number is not None:
+        _stream_line_number = line_number
+        _stream_sent_history.append(line)
+
+    _link_transmit(line, line_number, source='stream', timeout=timeout, data=data)
+    stream_stats['lines_sent'] += 1
+
+    log_command_history('sent', line)
+
+
+def _stream_request_resend(line_number: int):
+    """Agenda o reenvio a partir da linha pedida pelo firmware (Resend: N / rs N)."""
+    global _stream_resend_ignore, _stream_resend_from
+
+    # Mesma regra do processo de envio (print_streamer.plan_resend)
+    numbered_inflight = sum(1 for p in _ack_waiters if p.line_number is not None)
+    action, _stream_resend_from, _stream_resend_ignore = plan_resend(
+        line_number, _stream_line_number, len(_stream_sent_history), numbered_inflight,
+        _stream_resend_from, _stream_resend_ignore)
+    if action == 'ignore':
+        return
+
+    _stream_resend_queue.clear()
+    first_in_history = _stream_line_number - len(_stream_sent_history) + 1
+    if action == 'resync':
+        print(f"⚠️ Reenvio da linha {line_number} impossível (histórico {first_in_history}-{_stream_line_number}) - CONTINUANDO impressão...")
+        _link_transmit(f"M110 N{_stream_line_number}", timeout=5)
+        return
+
+    for n in range(line_number, _stream_line_number + 1):
+        _stream_resend_queue.append((n, _stream_sent_history[n - first_in_history]))
+    stream_stats['resends'] += 1
+    stream_stats['resent_lines'] += len(_stream_resend_queue)
+    print(f"  🔁 Firmware pediu reenvio a partir da linha {line_number} ({len(_stream_resend_queue)} linhas)")
+
+
+def _serial_handle_line(line: str):
+    """Despacha uma linha recebida: resolve o "ok" pendente ou encaminha aos handlers."""
+    global _stream_slots_hint, _link_last_progress_ts
+
+    kind = classify_printer_line(line)
+
+    with serial_lock:
+        oldest = _ack_waiters[0] if _ack_waiters else None
+
+        if kind == 'ok':
+            if oldest is None:
+                return  # "ok" sem dono (ex: comando enviado antes da conexão)
+            oldest.responses.append(line)
+            # ADVANCED_OK: "ok N123 P15 B3" (B = vagas livres na fila de comandos)
+            slots_match = _ADVANCED_OK_SLOTS_RE.search(line)
+            _stream_slots_hint = int(slots_match.group(1)) if slots_match else None
+            pending = _link_resolve_oldest(ok=True)
+            log_command_history('response', '\n'.join(pending.responses))
+        elif kind == 'resend':
+            resend_match = _RESEND_RE.match(line.lower())
+            if resend_match and STREAM_CHECKSUM:
+                _stream_request_resend(int(resend_match.group(1)))
+                serial_cond.notify_all()
+        elif kind == 'busy':
+            # Firmware ocupado (ex: aquecendo) mas vivo - renovar o prazo
+            _link_last_progress_ts = time.time()
+        elif oldest is not None and (
+                kind in ('echo', 'other', 'error')
+                or _RESPONSE_KIND_FOR_COMMAND.get(kind, ()) and oldest.line.upper().startswith(_RESPONSE_KIND_FOR_COMMAND[kind])):
+            # Parte da resposta do comando em espera (ex: M115, M119, M105 sem "ok" na mesma linha)
+            oldest.responses.append(line)
+
+    if kind == 'error':
+        log_command_history('error', line)
+
+    # Mensagens não solicitadas (autoreport, runout, //action:) vão para os handlers
+    _dispatch_serial_line(kind, line)
+
+
+def _serial_reader_loop(ser, stop: threading.Event):
+    """Thread leitora: única dona do readline() da porta serial."""
+    buffer = b''
+    try:
+        while ser.is_open and not stop.is_set():
+            if _serial_lent:
+                # Porta com o processo de envio: não ler até ela voltar
+                buffer = b''
+                _serial_reader_parked.set()
+                time.sleep(0.1)
+                continue
+            _serial_reader_parked.clear()
+            data = ser.read(ser.in_waiting or 1)  # bloqueia até SERIAL_TIMEOUT por 1 byte
+            if not data:
+                with serial_lock:
+                    _link_expire_oldest()
+                continue
+            buffer += data
+            while b'\n' in buffer:
+                raw, buffer = buffer.split(b'\n', 1)
+                line = raw.decode('utf-8', errors='ignore').strip()
+                if line:
+                    _serial_handle_line(line)
+            with serial_lock:
+                _link_expire_oldest()
+    except Exception as e:
+        if ser.is_open and not stop.is_set():
+            print(f"✗ Leitor serial encerrado: {e}")
+    finally:
+        with serial_lock:
+            _link_fail_all()
+
+
+def start_serial_reader():
+    """Inicia a thread leitora para a conexão atual (chamado ao conectar)."""
+    global _serial_reader_thread, _serial_reader_stop
+
+    with serial_lock:
+        _link_fail_all()
+    _serial_reader_stop = threading.Event()
+    _serial_reader_thread = threading.Thread(target=_serial_reader_loop,
+                                             args=(printer_serial, _serial_reader_stop), daemon=True)
+    _serial_reader_thread.start()
+
+
+def stop_serial_reader():
+    """Para a thread leitora antes de fechar a porta (desconexão normal não é falha do leitor)."""
+    _serial_reader_stop.set()
+    reader = _serial_reader_thread
+    if reader is None or reader is threading.current_thread():
+        return
+    try:
+        printer_serial.cancel_read()  # Acordar o read() em andamento em vez de esperar o timeout
+    except Exception:
+        pass
+    reader.join(SERIAL_TIMEOUT + 1.0)
+
+
+def _stream_pump_locked():
+    """Um passo enquanto se espera vaga: reenvia linhas pendentes ou aguarda o leitor."""
+    if _stream_resend_queue:
+        line_number, line = _stream_resend_queue[0]
+        data = _link_encode(line, line_number)
+        if _link_window_has_room(len(data)):
+            _stream_resend_queue.popleft()
+            _link_transmit(line, line_number, source='stream', data=data)
+            return
+    serial_cond.wait(0.5)
+
+
+def stream_gcode_line(line: str, timeout: Optional[float] = None) -> bool:
+    """Envia uma linha no modo window: espera vaga na janela e escreve sem aguardar o "ok".
+
+    O "ok" é consumido pela thread leitora; reenvios pedidos pelo firmware e comandos
+    interativos esperando vaga têm prioridade sobre linhas novas.
+    """
+    global _stream_waiting_room
+    if not printer_serial or not printer_serial.is_open:
+        if not connect_printer():
+            return False
+    queued_at = time.monotonic()
+    with serial_lock:
+        try:
+            # Bytes reais ("N<n> " + linha + "*<cs>"): o número cresce com a impressão.
+            # Só esta thread numera linhas novas, então o número não muda enquanto espera
+            data = _link_encode(line, _stream_next_line_number())
+            while True:
+                if not printer_serial or not printer_serial.is_open:
+                    return False
+                if not _stream_resend_queue and not _interactive_waiting and _link_window_has_room(len(data)):
+                    _stream_write_line(line, timeout, data)
+                    _record_command_latency('bulk', time.monotonic() - queued_at)
+                    return True
+                _stream_waiting_room = True
+                _stream_pump_locked()
+        except Exception as e:
+            print(f"Erro ao enviar comando '{line}': {e}")
+            return False
+        finally:
+            _stream_waiting_room = False
+
+
+def stream_process_cpu() -> Optional[int]:
+    """Núcleo do processo de envio: STREAM_CPU ou o último (None com um núcleo só)."""
+    global _stream_cpu
+    if _stream_cpu is None and hasattr(os, 'sched_getaffinity'):
+        cpus = sorted(os.sched_getaffinity(0))
+        if STREAM_CPU >= 0:
+            _stream_cpu = STREAM_CPU
+        elif len(cpus) > 1:
+            _stream_cpu = cpus[-1]
+    return _stream_cpu
+
+
+def reserve_stream_cpu():
+    """Tira o núcleo do processo de envio da thread atual; as threads criadas depois
+    (servidor, telemetria, análise) herdam a afinidade. Chamar antes de iniciar as threads."""
+    cpu = stream_process_cpu()
+    if cpu is None:
+        return
+    try:
+        others = os.sched_getaffinity(0) - {cpu}
+        if others:
+            os.sched_setaffinity(0, others)
+            print(f"📌 Núcleo {cpu} reservado para o processo de envio da impressão")
+    except OSError as e:
+        print(f"⚠️ Não foi possível reservar o núcleo {cpu}: {e}")
+
+
+def _stream_process_line(line: str):
+    """Linha do firmware repassada pelo processo de envio (o que a thread leitora faria)."""
+    kind = classify_printer_line(line)
+    if kind == 'error':
+        log_command_history('error', line)
+    _dispatch_serial_line(kind, line)
+
+
+def lend_serial_port(process: StreamProcess) -> bool:
+    """Passa a porta ao processo de envio: espera os "ok" pendentes, encaminha send_gcode()
+    ao processo e estaciona a thread leitora (ela termina o read() atual)."""
+    global _stream_process, _serial_lent
+    deadline = time.monotonic() + SERIAL_TIMEOUT + 10
+    with serial_lock:
+        while _ack_waiters and time.monotonic() < deadline:
+            serial_cond.wait(0.5)
+        if _ack_waiters:
+            return False
+        _serial_reader_parked.clear()
+        _serial_lent = True
+        _stream_process = process
+    try:
+        printer_serial.cancel_read()  # Acordar o read() em andamento em vez de esperar o timeout
+    except Exception:
+        pass
+    if _serial_reader_parked.wait(SERIAL_TIMEOUT + 1.0):
+        process.start()
+        return True
+    reclaim_serial_port(process)
+    return False
+
+
+def reclaim_serial_port(process: StreamProcess):
+    """Devolve a porta à thread leitora depois que o processo de envio termina os comandos em
+    trânsito (send_gcode() espera no serial_lock enquanto isso)."""
+    global _stream_process, _serial_lent
+    with serial_lock:
+        _stream_process = None
+        process.close()
+        _serial_lent = False
+
+
+def _send_gcode_via_stream_process(process: StreamProcess, command: str, wait_for_ok: bool,
+                                   timeout: Optional[float], priority: str):
+    """send_gcode() enquanto o processo de envio está com a porta."""
+    log_command_history('sent', command)
+    reply = process.command(command, priority, timeout, wait=wait_for_ok)
+    if not wait_for_ok:
+        return 'ok'
+    if reply is None:
+        return None
+    with serial_lock:
+        _record_command_latency(priority, reply['queued_ms'] / 1000.0)
+    response = '\n'.join(reply['responses'])
+    if reply['ok']:
+        log_command_history('response', response)
+        return response
+    return response or None
+
+
+def _apply_stream_process_stats(stats: dict):
+    """Copia os contadores do processo de envio para stream_stats."""
+    for key in ('lines_sent', 'lines_acked', 'timeouts', 'max_inflight', 'resends', 'resent_lines',
+                'prefetch_bytes', 'prefetch_underruns', 'prefetch_underrun_ms', 'ack_to_write'):
+        if key in stats:
+            stream_stats[key] = stats[key]
+    if stream_stats['process'] is not None:
+        stream_stats['process'].update({key: stats[key] for key in ('inflight', 'inflight_bytes', 'gc')
+                                        if key in stats})
+
+
+def stream_print_in_process(stream_path: str, max_inflight: int, on_progress) -> int:
+    """Envia o .stream pelo processo de envio (STREAM_PROCESS=1); devolve as linhas enviadas.
+
+    Pausa, parada e falta de filamento continuam decididas aqui, como no laço em thread;
+    on_progress(linhas, offset) é chamado a cada atualização do processo.
+    """
+    global print_paused, print_paused_by_filament
+    config = {
+        'stream_path': stream_path,
+        'checksum': STREAM_CHECKSUM,
+        'rx_buffer_bytes': STREAM_RX_BUFFER_BYTES,
+        'max_inflight': max_inflight,
+        'resend_history': STREAM_RESEND_HISTORY,
+        'prefetch_bytes': PRINT_PREFETCH_KB * 1024,
+        'timeouts': {kind: spec[1] for kind, spec in GCODE_KINDS.items()},
+        'command_timeout': GCODE_KINDS['o'][1],
+        'cpu': stream_process_cpu(),
+        'rt_priority': STREAM_RT_PRIORITY,
+    }
+    process = StreamProcess(printer_serial.fileno(), config, on_line=_stream_process_line)
+    if not lend_serial_port(process):
+        raise RuntimeError('a thread leitora não liberou a porta serial')
+    try:
+        if process.wait_ready():
+            stream_stats['process'] = {'pid': process.info['pid'], 'cpu': process.info['cpu'],
+                                       'scheduler': process.info['scheduler']}
+            print(f"  ⚡ Processo de envio {process.info['pid']}: núcleo {process.info['cpu']}, "
+                  f"escalonamento {process.info['scheduler']}")
+        paused = stopped = False
+        last_sent = 0
+        while not process.done.wait(0.25):
+            if print_stopped and not stopped:
+                stopped = True
+                print("✗ Impressão PARADA pelo usuário")
+                process.stop()
+            if not stopped and not print_paused and not check_filament_sensor(during_print=True).get('has_filament'):
+                print_paused_by_filament = True
+                print_paused = True
+                print("🚨 ALERTA: Filamento acabou! Impressão pausada automaticamente.")
+                publish_printer_state()
+                print("   Recarregue o filamento e clique em CONTINUAR para retomar.")
+            if print_paused and not paused:
+                paused = True
+                process.pause()  # A impressora termina o que já recebeu
+                print("⏸️ Impressão em PAUSA...")
+            elif paused and not print_paused:
+                paused = False
+                process.resume()
+                print("▶️ Envio retomado")
+            progress = process.progress
+            if progress['sent'] != last_sent:
+                last_sent = progress['sent']
+                _apply_stream_process_stats(progress['stats'])
+                on_progress(progress['sent'], progress['offset'])
+    finally:
+        reclaim_serial_port(process)
+    result = process.result
+    _apply_stream_process_stats(result.get('stats') or {})
+    if result['reason'] == 'error':
+        raise RuntimeError('o processo de envio terminou sem concluir a impressão')
+    return result['sent']
+
+
+def stream_wait_idle():
+    """Bloqueia até que todos os comandos do streaming tenham recebido "ok"."""
+    with serial_lock:
+        try:
+            while _stream_resend_queue or any(p.source == 'stream' for p in _ack_waiters):
+                if not printer_serial or not printer_serial.is_open:
+                    break
+                _stream_pump_locked()
+        except Exception as e:
+            print(f"Erro ao aguardar comandos em trânsito: {e}")
+
+
+def stream_resync_line_numbers() -> bool:
+    """Zera a numeração de linhas no firmware (M110 N0) - apenas no início da impressão."""
+    global _stream_line_number, _stream_resend_from, _stream_resend_ignore
+
+    response = send_gcode('M110 N0', retries=3, priority='bulk')
+    with serial_lock:
+        _stream_line_number = 0
+        _stream_sent_history.clear()
+        _stream_resend_queue.clear()
+        _stream_resend_from = None
+        _stream_resend_ignore = 0
+    return bool(response)
+
+
+class _GcodePrefetcher:
+    """Lê o .stream numa thread própria e entrega (classe, offset, comando) já prontos.
+
+    O produtor lê em blocos de PRINT_PREFETCH_CHUNK_BYTES e mantém entre min_bytes e
+    2 * min_bytes em memória (bytes do .stream: os registros ficam em bytes na fila e só
+    viram texto ao sair dela); o loop de impressão só tira da fila. Se a fila esvaziar
+    antes do fim do arquivo (SD lento), conta um underrun e o tempo esperado.
+    """
+
+    def __init__(self, stream_path: str, min_bytes: int):
+        self.stream_path = stream_path
+        self.min_bytes = max(min_bytes, PRINT_PREFETCH_CHUNK_BYTES)
+        self.max_bytes = 2 * self.min_bytes
+        self.records = deque()
+        self.buffered_bytes = 0
+        self.min_seen_bytes = None
+        self.underruns = 0
+        self.underrun_sec = 0.0
+        self.done = False
+        self.closed = False
+        self.error = None
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._produce, daemon=True)
+        self.thread.start()
+
+    def _produce(self):
+        try:
+            with open(self.stream_path, 'rb') as f:
+                f.readline()  # cabeçalho
+                while True:
+                    with self.cond:
+                        while self.buffered_bytes >= self.max_bytes and not self.closed:
+                            self.cond.wait()
+                        if self.closed:
+                            return
+                    chunk = f.readlines(PRINT_PREFETCH_CHUNK_BYTES)
+                    if not chunk:
+                        break
+                    nbytes = sum(len(record) for record in chunk)
+                    with self.cond:
+                        self.records.extend(chunk)
+                        self.buffered_bytes += nbytes
+                        self.cond.notify_all()
+        except Exception as e:
+            self.error = e
+            print(f"✗ Erro ao ler G-code compilado: {e}")
+        finally:
+            with self.cond:
+                self.done = True
+                self.cond.notify_all()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self.cond:
+            if not self.records and not self.done:
+                # Underrun: o produtor não acompanhou o streaming
+                self.underruns += 1
+                wait_start = time.monotonic()
+                while not self.records and not self.done:
+                    self.cond.wait()
+                self.underrun_sec += time.monotonic() - wait_start
+            if not self.records:
+                raise StopIteration
+            record = self.records.popleft()
+            self.buffered_bytes -= len(record)
+            if not self.done:
+                if self.min_seen_bytes is None or self.buffered_bytes < self.min_seen_bytes:
+                    self.min_seen_bytes = self.buffered_bytes
+                if self.buffered_bytes < self.min_bytes:
+                    self.cond.notify_all()
+        kind, offset, line = record[:-1].decode('utf-8', errors='ignore').split(' ', 2)
+        return kind, int(offset), line
+
+    def wait_ready(self):
+        """Aguarda o primeiro enchimento (min_bytes ou o arquivo inteiro, se for menor)."""
+        with self.cond:
+            while self.buffered_bytes < self.min_bytes and not self.done:
+                self.cond.wait()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def update_stats(self):
+        """Copia ocupação e underruns para stream_stats."""
+        stream_stats['prefetch_bytes'] = self.buffered_bytes
+        stream_stats['prefetch_min_bytes'] = self.min_seen_bytes or 0
+        stream_stats['prefetch_underruns'] = self.underruns
+        stream_stats['prefetch_underrun_ms'] = round(self.underrun_sec * 1000.0, 1)
+
+
+# Runout / pausa sinalizados pelo firmware chegam sem ninguém ter pedido
+for _kind in ('action', 'echo', 'error', 'other'):
+    register_serial_line_handler(_kind, _maybe_mark_filament_runout_from_printer_line)
+
+
+def reset_stream_stats(mode: str):
+    """Zera as estatísticas de streaming no início de uma impressão."""
+    global _link_ack_ts
+    now_ts = time.time()
+    stream_jitter.reset()
+    _link_ack_ts = None
+    stream_stats.update({
+        'mode': mode,
+        'started_at': now_ts,
+        'elapsed_sec': 0.0,
+        'lines_sent': 0,
+        'lines_acked': 0,
+        'timeouts': 0,
+        'max_inflight': 0,
+        'resends': 0,
+        'resent_lines': 0,
+        'lines_per_sec': 0.0,
+        'recent_lines_per_sec': 0.0,
+        'prefetch_bytes': 0,
+        'prefetch_min_bytes': 0,
+        'prefetch_underruns': 0,
+        'prefetch_underrun_ms': 0.0,
+        'ack_to_write': {},
+        'process': None,
+        '_recent_ts': now_ts,
+        '_recent_lines': 0,
+    })
+
+
+def update_stream_rate(recent: bool = True):
+    """Atualiza linhas/s (total e desde a última atualização) nas estatísticas de streaming."""
+    now_ts = time.time()
+    sent = stream_stats['lines_sent']
+    elapsed = now_ts - stream_stats['started_at']
+    stream_stats['elapsed_sec'] = round(elapsed, 2)
+    if elapsed > 0:
+        stream_stats['lines_per_sec'] = round(sent / elapsed, 1)
+    if not recent:
+        return
+    recent_elapsed = now_ts - stream_stats['_recent_ts']
+    if recent_elapsed > 0:
+        stream_stats['recent_lines_per_sec'] = round((sent - stream_stats['_recent_lines']) / recent_elapsed, 1)
+    stream_stats['_recent_ts'] = now_ts
+    stream_stats['_recent_lines'] = sent
+
+
+def command_priority(command: str) -> str:
+    """Classe de prioridade padrão de um comando: emergency para M108/M112/M410, senão interactive."""
+    code = command.split(None, 1)[0].upper() if command else ''
+    return 'emergency' if code in _EMERGENCY_COMMANDS else 'interactive'
+
+
+def _record_command_latency(priority: str, seconds: float):
+    """Acumula a latência de fila de um comando (serial_lock já adquirido)."""
+    stats = command_latency[priority]
+    ms = seconds * 1000.0
+    stats['count'] += 1
+    stats['total_ms'] += ms
+    stats['last_ms'] = ms
+    if ms > stats['max_ms']:
+        stats['max_ms'] = ms
+    stats['_samples'].append(ms)
+
+
+def get_command_latency_stats() -> dict:
+    """Resumo da latência de fila por classe (média, p95 das últimas amostras, máximo)."""
+    with serial_lock:
+        snapshot = {priority: (dict(stats), sorted(stats['_samples']))
+                    for priority, stats in command_latency.items()}
+    result = {}
+    for priority, (stats, samples) in snapshot.items():
+        count = stats['count']
+        result[priority] = {
+            'count': count,
+            'avg_ms': round(stats['total_ms'] / count, 2) if count else 0.0,
+            'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 2) if samples else 0.0,
+            'max_ms': round(stats['max_ms'], 2),
+            'last_ms': round(stats['last_ms'], 2),
+        }
+    return result
+
+
+# Enviar comando G-code para impressora
+@printer_method('gcode')
+def send_gcode(command, wait_for_ok=True, timeout=None, retries=1, priority=None):
+    """Envia um comando e aguarda o "ok" correspondente (entregue pela thread leitora).
+
+    O lock da serial fica preso só durante a escrita; a espera pelo "ok" é feita
+    sem o lock, então o streaming e outros comandos continuam fluindo.
+
+    priority: 'emergency' (escreve na hora, sem esperar vaga), 'interactive' (próxima
+    vaga, na frente do streaming) ou 'bulk' (impressão/telemetria). Padrão: command_priority().
+    """
+    global _interactive_waiting
+    command = command.strip()
+    cmd = command.upper()
+    if priority is None:
+        priority = command_priority(cmd)
+    
+    # Determinar timeout baseado no comando
+    if timeout is None:
+        timeout = _gcode_timeout_for(cmd)
+    
+    if PRINTER_DAEMON:
+        # Interface web: a porta é do daemon (ele aplica o timeout e as tentativas)
+        try:
+            return printer_call('gcode', call_timeout=timeout * max(1, retries) + PRINTER_DAEMON_TIMEOUT_SEC,
+                                command=command, wait_for_ok=wait_for_ok, timeout=timeout,
+                                retries=retries, priority=priority)
+        except PrinterDaemonError as e:
+            print(f"Erro ao enviar comando '{command}': {e}")
+            return None
+    
+    for attempt in range(retries):
+        try:
+            if not printer_serial or not printer_serial.is_open:
+                if not connect_printer():
+                    return None
+            
+            queued_at = time.monotonic()
+            with serial_lock:  # Garantir acesso exclusivo à escrita na porta serial
+                # Respeitar o buffer do firmware (pode haver linhas do streaming em trânsito).
+                # Emergência não espera: o firmware age sobre ela na recepção.
+                if priority == 'interactive':
+                    _interactive_waiting += 1
+                try:
+                    while _stream_process is None and priority != 'emergency' and (
+                            not _link_window_has_room(len(command) + 1)
+                            or (priority == 'bulk' and _interactive_waiting)):
+                        if not printer_serial or not printer_serial.is_open:
+                            return None
+                        serial_cond.wait(0.5)
+                    process = _stream_process
+                    if process is None:
+                        pending = _link_transmit(command, timeout=timeout)
+                finally:
+                    if priority == 'interactive':
+                        _interactive_waiting -= 1
+                        serial_cond.notify_all()
+                if process is None:
+                    _record_command_latency(priority, time.monotonic() - queued_at)
+            if process is not None:
+                # Porta com o processo de envio: o comando entra na janela dele
+                return _send_gcode_via_stream_process(process, command, wait_for_ok, timeout, priority)
+            
+            # Log do comando enviado no histórico
+            log_command_history('sent', command)
+            
+            if not wait_for_ok:
+                return 'ok'
+            
+            # Aguardar a thread leitora entregar o "ok" (ou o timeout dela)
+            while not pending.event.wait(1.0):
+                if not _serial_reader_thread or not _serial_reader_thread.is_alive():
+                    break
+            
+            if pending.ok:
+                return '\n'.join(pending.responses)
+            
+            # Se chegou aqui, timeout - tentar novamente se tiver retries
+            if attempt < retries - 1:
+                print(f"  ⚠️ Timeout ao enviar '{command}', tentando novamente ({attempt + 2}/{retries})...")
+                time.sleep(0.5)
+                continue
+            
+            return '\n'.join(pending.responses) if pending.responses else None
+        except Exception as e:
+            if attempt < retries - 1:
+                print(f"  ⚠️ Erro ao enviar '{command}': {e}, tentando novamente ({attempt + 2}/{retries})...")
+                time.sleep(0.5)
+                continue
+            print(f"Erro ao enviar comando '{command}': {e}")
+            return None
+    
+    return None
+
+def _telemetry_on_temperature(line: str):
+    """Handler de linhas com temperatura (autoreport do M155 ou resposta do M105)."""
+    if 'T:' not in line and 'B:' not in line:
+        return
+    updates = {}
+    t_match = _TEMP_NOZZLE_RE.search(line)
+    if t_match:
+        updates['nozzle'] = float(t_match.group(1))
+        updates['target_nozzle'] = float(t_match.group(2))
+    b_match = _TEMP_BED_RE.search(line)
+    if b_match:
+        updates['bed'] = float(b_match.group(1))
+        updates['target_bed'] = float(b_match.group(2))
+    if updates:
+        changed = any(printer_telemetry.get(k) != v for k, v in updates.items())
+        updates['updated_at'] = time.time()
+        printer_telemetry.update(updates)
+        publish_status_board()
+        if changed:
+            publish_event('temperature', {
+                'bed': printer_telemetry['bed'],
+                'nozzle': printer_telemetry['nozzle'],
+                'target_bed': printer_telemetry['target_bed'],
+                'target_nozzle': printer_telemetry['target_nozzle'],
+            })
+
+
+def _telemetry_on_sd_status(line: str):
+    """Handler de progresso do SD ("SD printing byte 1234/5678" / "Not SD printing")."""
+    match = _SD_PROGRESS_RE.search(line)
+    if match:
+        current = int(match.group(1))
+        total = int(match.group(2))
+        printer_telemetry['sd_progress'] = (current / total) * 100 if total > 0 else 0
+        printer_telemetry['sd_printing'] = True
+    else:
+        printer_telemetry['sd_printing'] = False
+
+
+register_serial_line_handler('temperature', _telemetry_on_temperature)
+register_serial_line_handler('ok', _telemetry_on_temperature)
+register_serial_line_handler('sd_status', _telemetry_on_sd_status)
+
+
+def _read_motion_limits():
+    """Lê os limites de movimento do firmware (M503) e guarda no banco se mudaram."""
+    global printer_motion_limits
+    response = send_gcode('M503', timeout=10, priority='bulk')
+    limits = parse_marlin_settings(response)
+    if not limits:
+        print("⚠️ M503 sem limites de movimento - estimativa usa os padrões do Marlin")
+        return
+    if printer_motion_limits == limits:
+        return
+    printer_motion_limits = limits
+    try:
+        conn = get_db()
+        conn.execute('''
+            INSERT OR REPLACE INTO printer_settings (key, value, updated_at)
+            VALUES ('motion_limits', ?, CURRENT_TIMESTAMP)
+        ''', (json.dumps(limits),))
+        conn.commit()
+    except Exception as e:
+        print(f"⚠️ Erro ao salvar limites de movimento: {e}")
+    print(f"📏 Limites de movimento (M503): aceleração {limits['accel_print']:.0f} mm/s², "
+          f"feedrate X {limits['max_feedrate']['x']:.0f} mm/s")
+
+
+def get_motion_limits() -> dict:
+    """Limites da última conexão (memória ou banco); padrões do Marlin se nunca foram lidos."""
+    global printer_motion_limits
+    if printer_motion_limits is None:
+        try:
+            row = get_db().execute("SELECT value FROM printer_settings WHERE key = 'motion_limits'").fetchone()
+            if row:
+                printer_motion_limits = json.loads(row[0])
+        except Exception as e:
+            print(f"⚠️ Erro ao ler limites de movimento: {e}")
+    return printer_motion_limits or default_motion_limits()
+
+
+def _telemetry_enable_autoreport() -> bool:
+    """Lê as capacidades (M115) e liga o autoreport do firmware quando suportado."""
+    printer_capabilities.clear()
+    response = send_gcode('M115', timeout=10, priority='bulk')
+    for line in (response or '').split('\n'):
+        match = _CAPABILITY_RE.match(line.strip())
+        if match:
+            printer_capabilities[match.group(1).upper()] = match.group(2) == '1'
+
+    _read_motion_limits()
+
+    interval = max(1, int(round(TELEMETRY_INTERVAL_SEC)))
+    autoreport = False
+    if printer_capabilities.get('AUTOREPORT_TEMP'):
+        autoreport = bool(send_gcode(f'M155 S{interval}', priority='bulk'))
+    if printer_capabilities.get('AUTOREPORT_SD_STATUS'):
+        send_gcode(f'M27 S{interval}', priority='bulk')
+
+    print(f"📡 Telemetria: {'autoreport (M155)' if autoreport else 'polling (M105)'}")
+    return autoreport
+
+
+def _telemetry_loop():
+    """Thread única de telemetria: liga o autoreport ou faz o polling (fallback)."""
+    connection = None
+    autoreport = False
+    last_poll_ts = 0.0
+    last_filament = None
+    while True:
+        try:
+            filament_key = (filament_status.get('has_filament'), filament_status.get('sensor_enabled'))
+            if filament_key != last_filament:
+                last_filament = filament_key
+                publish_event('filament', dict(filament_status))
+            # Pulso do quadro de status (conexão, última leitura do sensor)
+            publish_status_board()
+
+            if not printer_serial or not printer_serial.is_open:
+                connection = None
+                time.sleep(1)
+                continue
+
+            # Nova conexão (a placa reinicia ao abrir a porta): reconfigurar o autoreport
+            if printer_serial is not connection:
+                connection = printer_serial
+                autoreport = _telemetry_enable_autoreport()
+                printer_telemetry['source'] = 'autoreport' if autoreport else 'poll'
+
+            now_ts = time.time()
+            updated_at = printer_telemetry['updated_at'] or 0.0
+            stale = (now_ts - updated_at) > TELEMETRY_INTERVAL_SEC * 3
+
+            # Fallback: um único poller, com intervalo maior durante a impressão
+            interval = TEMP_CHECK_INTERVAL_PRINT_SEC if printing_in_progress else TELEMETRY_INTERVAL_SEC
+            if (not autoreport or stale) and (now_ts - last_poll_ts) >= interval:
+                last_poll_ts = now_ts
+                send_gcode('M105', priority='bulk')
+
+            # Sensor de filamento (M119 no modo marlin) também sai da thread de requisição
+            check_filament_sensor(during_print=printing_in_progress)
+        except Exception as e:
+            print(f"Erro na telemetria: {e}")
+        time.sleep(0.5)
+
+
+def start_telemetry():
+    """Inicia (uma vez) a thread de telemetria."""
+    global _telemetry_thread_started
+    if _telemetry_thread_started:
+        return
+    _telemetry_thread_started = True
+    threading.Thread(target=_telemetry_loop, daemon=True).start()
+
+
+def get_printer_status_snapshot():
+    """Status da impressora a partir da memória (sem tocar na porta serial)."""
+    telemetry = dict(printer_telemetry)
+    return {
+        'connected': bool(printer_serial and printer_serial.is_open),
+        'printing': telemetry['sd_printing'],
+        'progress': telemetry['sd_progress'],
+        'bed_temp': telemetry['bed'],
+        'nozzle_temp': telemetry['nozzle'],
+        'target_bed_temp': telemetry['target_bed'],
+        'target_nozzle_temp': telemetry['target_nozzle']
+    }
+
+# Verificar extensão de arquivo permitida
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+# Compilar G-code para o formato de streaming (uma passada, feita no upload)
+class GcodeStreamCompiler:
+    """Gera "<gcode>.stream" a partir de blocos de linhas completas, na ordem do arquivo.
+
+    feed() pode ser chamado enquanto o upload ainda está chegando (ver GcodeUpload);
+    finish() troca o temporário pelo .stream e retorna o mesmo que compile_gcode_stream.
+    """
+
+    def __init__(self, gcode_path):
+        self.gcode_path = gcode_path
+        self.stream_path = gcode_path + GCODE_STREAM_SUFFIX
+        # Temporário único: o upload e uma impressão podem compilar o mesmo arquivo ao mesmo tempo
+        self.tmp_path = f"{self.stream_path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        self.commands = 0
+        self.offsets = []
+        self.skipped = 0
+        self.seen_home = self.seen_level = False
+        self.pos = len(GCODE_STREAM_HEADER)
+        self.dst = open(self.tmp_path, 'wb')
+        self.dst.write(GCODE_STREAM_HEADER.encode())
+
+    def feed(self, block, offset):
+        records = []
+        src_pos = offset
+        for raw in block.split(b'\n'):
+            line_offset = src_pos
+            src_pos += len(raw) + 1
+            line = raw.split(b';', 1)[0].strip().decode('utf-8', errors='ignore')
+            if not line:
+                continue
+            kind = classify_gcode_command(line.upper())
+            if kind == 'h':
+                if self.seen_home:
+                    self.skipped += 1
+                    continue
+                self.seen_home = True
+            elif kind == 'l':
+                if self.seen_level:
+                    self.skipped += 1
+                    continue
+                self.seen_level = True
+            
+            if self.commands % GCODE_STREAM_OFFSET_STRIDE == 0:
+                self.offsets.append(self.pos)
+            record = f"{kind} {line_offset} {line}\n".encode()
+            records.append(record)
+            self.pos += len(record)
+            self.commands += 1
+        self.dst.write(b''.join(records))
+
+    def finish(self, gcode_path=None):
+        """gcode_path: nome final do G-code, se mudou depois do início (upload guardado pelo hash)."""
+        self.dst.close()
+        if gcode_path:
+            self.gcode_path = gcode_path
+            self.stream_path = gcode_path + GCODE_STREAM_SUFFIX
+        os.replace(self.tmp_path, self.stream_path)
+        if self.skipped:
+            print(f"  ⏭️ {self.skipped} G28/G29 duplicado(s) removido(s) de {os.path.basename(self.gcode_path)}")
+        return {'commands': self.commands, 'offsets': self.offsets, 'skipped': self.skipped}
+
+    def abort(self):
+        self.dst.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+def compile_gcode_stream(gcode_path):
+    """Gera "<gcode>.stream": uma linha por comando, "<classe> <offset> <comando>".
+
+    Remove comentários e linhas vazias e descarta G28/G29 repetidos (mantém a 1ª
+    ocorrência de cada), para que o loop de impressão só itere os registros.
+    Retorna {'commands', 'offsets', 'skipped'} - offsets: posição em bytes do
+    comando i * GCODE_STREAM_OFFSET_STRIDE dentro do .stream. O offset de cada registro
+    é a posição da linha no G-code original (para o tempo restante e o índice de camadas).
+    """
+    compiler = GcodeStreamCompiler(gcode_path)
+    try:
+        for block, offset in read_line_blocks(gcode_path):
+            compiler.feed(block, offset)
+    except BaseException:
+        compiler.abort()
+        raise
+    return compiler.finish()
+
+def gcode_stream_is_current(gcode_path) -> bool:
+    """Verifica se o .stream existe, é da versão atual e não é mais antigo que o G-code."""
+    stream_path = gcode_path + GCODE_STREAM_SUFFIX
+    try:
+        if os.path.getmtime(stream_path) < os.path.getmtime(gcode_path):
+            return False
+        with open(stream_path, 'r') as f:
+            return f.readline() == GCODE_STREAM_HEADER
+    except OSError:
+        return False
+
+def save_gcode_stream_info(cursor, file_id, compiled):
+    """Grava no banco o total de comandos e o índice de offsets do .stream."""
+    cursor.execute('UPDATE gcode_files SET stream_commands = ?, stream_offsets = ? WHERE id = ?',
+                   (compiled['commands'], json.dumps(compiled['offsets']), file_id))
+
+def save_toolpath_summary(cursor, file_id, summary, metadata=None):
+    """Grava o índice de camadas e completa camadas, altura máxima e filamento que o fatiador não informou."""
+    metadata = metadata or {}
+    filament_g = None
+    if summary['filament_mm'] > 0:
+        filament_g = filament_grams(summary['filament_mm'], metadata.get('filament_density'),
+                                    metadata.get('filament_diameter'))
+    max_z = summary['bbox_max'][2] if summary['bbox_max'] else None
+    cursor.execute('''
+        UPDATE gcode_files
+        SET total_layers = COALESCE(total_layers, ?),
+            max_z_height = COALESCE(max_z_height, ?),
+            filament_used = COALESCE(filament_used, ?),
+            layer_index = ?
+        WHERE id = ?
+    ''', (summary['layers'] or None, max_z, filament_g, json.dumps(summary['layer_index']), file_id))
+
+def estimate_gcode_file(cursor, file_id, gcode_path, limit_changes=None) -> Optional[dict]:
+    """Estima o tempo pela cinemática (toolpath + limites do M503) e grava os números no banco.
+
+    limit_changes: M201/M203/M204/M205 do G-code já encontrados (upload); senão o arquivo é lido.
+    Retorna {'total_seconds', 'layer_seconds', 'index', 'limits'} ou None sem toolpath/NumPy.
+    """
+    toolpath = load_toolpath(gcode_path)
+    if toolpath is None and build_toolpath(gcode_path):
+        toolpath = load_toolpath(gcode_path)
+    if toolpath is None:
+        return None
+    limits = get_motion_limits()
+    if limit_changes is None:
+        limit_changes = scan_limit_changes(gcode_path)
+    estimate = estimate_toolpath(toolpath, limits, limit_changes)
+    estimate['limits'] = motion_limits_signature(limits)
+    cursor.execute('''
+        UPDATE gcode_files
+        SET estimated_seconds = ?, layer_seconds = ?, time_index = ?, estimate_limits = ?
+        WHERE id = ?
+    ''', (estimate['total_seconds'], json.dumps(estimate['layer_seconds']), json.dumps(estimate['index']),
+          estimate['limits'], file_id))
+    return estimate
+
+# Extrair thumbnail do G-code (PrusaSlicer, OrcaSlicer, BambuStudio)
+def extract_thumbnail(gcode_path, file_id, head=None):
+    try:
+        if head is None:
+            with open(gcode_path, 'r', encoding='utf-8', errors='ignore') as f:
+                lines = f.readlines(500000)  # Ler primeiras linhas onde geralmente está o thumbnail
+        else:
+            # Upload: o começo do arquivo já está na memória (GcodeUpload.head)
+            lines = head.decode('utf-8', errors='ignore').splitlines()
+        
+        # Procurar thumbnail no formato OrcaSlicer/BambuStudio
+        in_thumbnail = False
+        thumbnail_data = []
+        thumbnail_width = 0
+        thumbnail_height = 0
+        max_thumbnail_size = 0
+        best_thumbnail_data = []
+        
+        for line in lines:
+            line = line.strip()
+            
+            # Início do thumbnail
+            if 'thumbnail begin' in line or 'thumbnail_PNG begin' in line:
+                match = re.search(r'(\d+)x(\d+)', line)
+                if match:
+                    width = int(match.group(1))
+                    height = int(match.group(2))
+                    current_size = width * height
+                    
+                    if current_size > max_thumbnail_size:
+                        # Este é maior, começar a capturar
+                        max_thumbnail_size = current_size
+                        thumbnail_width = width
+                        thumbnail_height = height
+                        thumbnail_data = []
+                        in_thumbnail = True
+                    else:
+                        # Ignorar thumbnails menores
+                        in_thumbnail = False
+            
+            # Fim do thumbnail
+            elif 'thumbnail end' in line or 'thumbnail_PNG end' in line:
+                if in_thumbnail and thumbnail_data:
+                    best_thumbnail_data = thumbnail_data[:]
+                in_thumbnail = False
+            
+            # Dados do thumbnail (linhas com base64)
+            elif in_thumbnail and line.startswith(';'):
+                # Remover o ';' e espaços
+                data = line[1:].strip()
+                if data:  # Adicionar apenas se não for vazio
+                    thumbnail_data.append(data)
+        
+        # Se encontrou thumbnail, processar
+        if best_thumbnail_data:
+            try:
+                # Juntar todas as linhas base64
+                base64_string = ''.join(best_thumbnail_data)
+                image_data = base64.b64decode(base64_string)
+                thumbnail_filename = f"thumb_{file_id}.png"
+                thumbnail_path = os.path.join(app.config['THUMBNAIL_FOLDER'], thumbnail_filename)
+                
+                with open(thumbnail_path, 'wb') as img_file:
+                    img_file.write(image_data)
+                
+                return f"thumbnails/{thumbnail_filename}"
+            except Exception as e:
+                print(f"Erro ao decodificar thumbnail: {e}")
+                return None
+        
+        return None
+    except Exception as e:
+        print(f"Erro ao extrair thumbnail: {e}")
+        return None
+
+def parse_gcode_metadata(gcode_path, name=None):
+    """Extrai metadados completos do G-code (OrcaSlicer, PrusaSlicer, Cura, etc.)
+
+    Lê só o começo e o fim do arquivo (ver gcode_metadata.py); o dict traz também
+    'parser_version', gravado em gcode_files.metadata_version. name: nome original do
+    arquivo (o do disco é o hash do conteúdo).
+    """
+    return scan_gcode_metadata(gcode_path, name=name)
+
+def save_gcode_metadata(cursor, file_id, metadata):
+    """Grava os metadados do fatiador; campos que o fatiador não informou mantêm o valor do banco
+    (ex: camadas e filamento completados pelo toolpath, tempo estimado pela cinemática)."""
+    cursor.execute('''
+        UPDATE gcode_files 
+        SET print_time = COALESCE(?, print_time), filament_used = COALESCE(?, filament_used),
+            filament_type = COALESCE(?, filament_type), nozzle_temp = COALESCE(?, nozzle_temp),
+            bed_temp = COALESCE(?, bed_temp), layer_height = COALESCE(?, layer_height),
+            infill = COALESCE(?, infill), slicer = COALESCE(?, slicer),
+            total_layers = COALESCE(?, total_layers), filament_density = COALESCE(?, filament_density),
+            filament_diameter = COALESCE(?, filament_diameter), max_z_height = COALESCE(?, max_z_height),
+            metadata_version = ?
+        WHERE id = ?
+    ''', (metadata['print_time'], metadata['filament_used'], metadata['filament_type'],
+          metadata['nozzle_temp'], metadata['bed_temp'], metadata['layer_height'],
+          metadata['infill'], metadata['slicer'], metadata['total_layers'],
+          metadata['filament_density'], metadata['filament_diameter'],
+          metadata['max_z_height'], metadata['parser_version'], file_id))
+
+# Armazenamento pelo conteúdo: cada G-code fica uma vez só no cartão, não importa quantas
+# vezes for enviado; as linhas de gcode_files apontam para ele (gcode_blobs.refcount)
+GCODE_SIDECAR_SUFFIXES = (GCODE_STREAM_SUFFIX, TOOLPATH_SUFFIX, GEOMETRY_SUFFIX)
+# Colunas calculadas a partir do conteúdo (iguais para todas as cópias do mesmo arquivo)
+GCODE_SHARED_COLUMNS = ('thumbnail_path', 'stream_commands', 'stream_offsets', 'estimated_seconds',
+                        'layer_seconds', 'time_index', 'estimate_limits', 'layer_index', 'analysis_status',
+                        'analysis_pid')
+# Completadas pelo toolpath só quando o fatiador não informou
+GCODE_COMPLETED_COLUMNS = ('total_layers', 'max_z_height', 'filament_used')
+
+def gcode_blob_filename(content_hash):
+    return f"{content_hash}.gcode"
+
+@contextmanager
+def gcode_blob_transaction(conn):
+    """gcode_blobs.refcount e os arquivos no cartão mudam juntos, em todos os processos
+    (interface web, daemon da impressora): BEGIN IMMEDIATE segura a escrita no banco até o
+    commit, então quem apaga o último uso e quem reaproveita o mesmo conteúdo nunca se
+    cruzam. Apagar/renomear os arquivos dentro do bloco; commit na saída, rollback com erro.
+    """
+    with _gcode_blob_lock:
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn.cursor()
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+def find_gcode_blob(cursor, content_hash):
+    """Nome do arquivo já guardado com esse conteúdo, ou None."""
+    cursor.execute('SELECT filename FROM gcode_blobs WHERE content_hash = ?', (content_hash,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def acquire_gcode_blob(cursor, content_hash, filename, file_size):
+    """Mais uma linha de gcode_files usando o conteúdo (cria o registro na primeira)."""
+    cursor.execute('''
+        INSERT INTO gcode_blobs (content_hash, filename, file_size, refcount) VALUES (?, ?, ?, 1)
+        ON CONFLICT(content_hash) DO UPDATE SET refcount = refcount + 1, filename = excluded.filename
+    ''', (content_hash, filename, file_size))
+
+def release_gcode_blob(cursor, content_hash):
+    """Uma linha a menos usando o conteúdo. Retorna o nome do arquivo quando era a última
+    (o chamador apaga o arquivo depois do commit), senão None."""
+    cursor.execute('UPDATE gcode_blobs SET refcount = refcount - 1 WHERE content_hash = ?', (content_hash,))
+    cursor.execute('SELECT filename, refcount FROM gcode_blobs WHERE content_hash = ?', (content_hash,))
+    row = cursor.fetchone()
+    if not row or row[1] > 0:
+        return None
+    cursor.execute('DELETE FROM gcode_blobs WHERE content_hash = ?', (content_hash,))
+    return row[0]
+
+def gcode_file_in_use(cursor, filename) -> bool:
+    """O arquivo ainda é usado por alguma linha de gcode_files (não foi apagado)?"""
+    cursor.execute('''
+        SELECT 1 FROM gcode_blobs WHERE filename = ?
+        UNION ALL SELECT 1 FROM gcode_files WHERE filename = ? LIMIT 1
+    ''', (filename, filename))
+    return cursor.fetchone() is not None
+
+def remove_gcode_file(filepath):
+    """Apaga o G-code e os arquivos gerados ao lado (.stream/.toolpath/.geometry)."""
+    for path in (filepath, *(filepath + suffix for suffix in GCODE_SIDECAR_SUFFIXES)):
+        if os.path.exists(path):
+            os.remove(path)
+
+def share_gcode_analysis(cursor, source_id, content_hash):
+    """Copia miniatura, .stream, estimativa e índice de camadas de source_id para as outras
+    linhas com o mesmo conteúdo (upload repetido não recalcula nada)."""
+    columns = GCODE_SHARED_COLUMNS + GCODE_COMPLETED_COLUMNS
+    cursor.execute(f'SELECT {", ".join(columns)} FROM gcode_files WHERE id = ?', (source_id,))
+    row = cursor.fetchone()
+    if not row:
+        return
+    assignments = [f'{column} = COALESCE(?, {column})' for column in GCODE_SHARED_COLUMNS]
+    assignments += [f'{column} = COALESCE({column}, ?)' for column in GCODE_COMPLETED_COLUMNS]
+    cursor.execute(f'''
+        UPDATE gcode_files SET {", ".join(assignments)}
+        WHERE content_hash = ? AND id != ?
+    ''', (*row, content_hash, source_id))
+
+def hash_gcode_file(filepath):
+    sha = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def dedup_gcode_files():
+    """Arquivos enviados antes do armazenamento pelo conteúdo: junta as cópias repetidas.
+
+    Roda numa thread no início. O hash é calculado para quem ainda não tem. A primeira
+    cópia de cada conteúdo vira o arquivo compartilhado (mantém o nome); as outras linhas
+    passam a apontar para ela e os arquivos repetidos (com os .stream/.toolpath/.geometry)
+    são apagados.
+    """
+    conn = sqlite3.connect(DB_NAME)
+    try:
+        cursor = conn.cursor()
+        # Linhas ainda sem referência contada em gcode_blobs
+        cursor.execute('''
+            SELECT id, filename, content_hash FROM gcode_files f
+            WHERE content_hash IS NULL OR NOT EXISTS (
+                SELECT 1 FROM gcode_blobs b WHERE b.content_hash = f.content_hash AND b.filename = f.filename)
+            ORDER BY id
+        ''')
+        pending = cursor.fetchall()
+        if not pending:
+            return
+        start = time.time()
+        freed = 0
+        removed = 0
+        for file_id, filename, content_hash in pending:
+            filepath = os.path.join(app.config['GCODE_FOLDER'], filename)
+            if not os.path.exists(filepath):
+                continue
+            content_hash = content_hash or hash_gcode_file(filepath)
+            file_size = os.path.getsize(filepath)
+            with gcode_blob_transaction(conn) as blob_cursor:
+                blob_filename = find_gcode_blob(blob_cursor, content_hash)
+                if not blob_filename or not os.path.exists(os.path.join(app.config['GCODE_FOLDER'], blob_filename)):
+                    blob_filename = filename  # Primeira cópia (ou a guardada sumiu do cartão)
+                acquire_gcode_blob(blob_cursor, content_hash, blob_filename, file_size)
+                blob_cursor.execute('UPDATE gcode_files SET content_hash = ?, filename = ? WHERE id = ? OR content_hash = ?',
+                                    (content_hash, blob_filename, file_id, content_hash))
+                if blob_filename != filename:
+                    try:
+                        remove_gcode_file(filepath)
+                        freed += file_size
+                        removed += 1
+                    except OSError as e:
+                        print(f"⚠️ Erro ao apagar cópia repetida {filepath}: {e}")
+        print(f"🗂️ {len(pending)} arquivo(s) guardados pelo conteúdo em {time.time() - start:.1f}s: "
+              f"{removed} cópia(s) repetida(s) removida(s), {freed / (1024 * 1024):.1f} MB liberados")
+    except Exception as e:
+        print(f"⚠️ Erro ao juntar arquivos repetidos: {e}")
+    finally:
+        conn.close()
+
+def reindex_gcode_metadata():
+    """Relê os metadados dos arquivos lidos por uma versão anterior do parser (ou nunca lidos).
+
+    Roda numa thread no início; como só o começo e o fim de cada arquivo são lidos, são
+    poucos ms por arquivo.
+    """
+    conn = sqlite3.connect(DB_NAME)
+    try:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, filename, original_name FROM gcode_files
+            WHERE metadata_version IS NULL OR metadata_version < ?
+        ''', (METADATA_PARSER_VERSION,))
+        stale = cursor.fetchall()
+        if not stale:
+            return
+        start = time.time()
+        updated = 0
+        for file_id, filename, original_name in stale:
+            filepath = os.path.join(app.config['GCODE_FOLDER'], filename)
+            if not os.path.exists(filepath):
+                continue
+            save_gcode_metadata(cursor, file_id, parse_gcode_metadata(filepath, original_name))
+            updated += 1
+        conn.commit()
+        print(f"📝 Metadados relidos (parser v{METADATA_PARSER_VERSION}): {updated} arquivo(s) "
+              f"em {time.time() - start:.2f}s")
+    except Exception as e:
+        print(f"⚠️ Erro ao reler metadados: {e}")
+    finally:
+        conn.close()
+
+# Rotas de autenticação
+@app.route('/')
+def index():
+    if 'user_id' in session:
+        return redirect(url_for('dashboard'))
+    return redirect(url_for('login'))
+
+@app.route('/login')
+def login():
+    # Verificar se existem usuários cadastrados
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('SELECT COUNT(*) FROM users')
+    user_count = cursor.fetchone()[0]
+    
+    return render_template('login.html', allow_registration=(user_count == 0))
+
+@app.route('/register')
+def register():
+    # Verificar se já existem usuários
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('SELECT COUNT(*) FROM users')
+    user_count = cursor.fetchone()[0]
     
     # Se já existir usuário, redirecionar para login
     if user_count > 0:
@@ -1164,12 +2888,12 @@ def dashboard():
         return redirect(url_for('login'))
     
     # Buscar últimos 5 arquivos G-code
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('''
         SELECT id, original_name, file_size, uploaded_at, print_count, thumbnail_path,
                print_time, filament_used, filament_type, nozzle_temp, bed_temp, layer_height, infill,
-               slicer, total_layers, filament_density, filament_diameter, max_z_height
+               slicer, total_layers, filament_density, filament_diameter, max_z_height, estimated_seconds
         FROM gcode_files 
         WHERE user_id = ?
         ORDER BY uploaded_at DESC
@@ -1185,7 +2909,7 @@ def dashboard():
             'uploaded': row[3],
             'print_count': row[4],
             'thumbnail': row[5],
-            'print_time': row[6],
+            'print_time': display_print_time(row[6], row[18]),
             'filament_used': row[7],
             'filament_type': row[8],
             'nozzle_temp': row[9],
@@ -1199,7 +2923,6 @@ def dashboard():
             'max_z_height': row[17]
         })
     
-    conn.close()
     return render_template('dashboard.html', username=session.get('username'), recent_files=recent_files)
 
 @app.route('/files')
@@ -1218,14 +2941,13 @@ def viewer(filename=None):
     file_id = None
     if filename:
         # Buscar ID do arquivo pelo nome
-        conn = sqlite3.connect(DB_NAME)
+        conn = get_db()
         cursor = conn.cursor()
         cursor.execute('''
             SELECT id FROM gcode_files 
             WHERE original_name = ? AND user_id = ?
         ''', (filename, session['user_id']))
         result = cursor.fetchone()
-        conn.close()
         
         if result:
             file_id = result[0]
@@ -1233,11 +2955,10 @@ def viewer(filename=None):
         else:
             print(f"✗ Arquivo '{filename}' NÃO encontrado para user_id={session['user_id']}")
             # Tentar listar todos os arquivos para debug
-            conn = sqlite3.connect(DB_NAME)
+            conn = get_db()
             cursor = conn.cursor()
             cursor.execute('SELECT id, original_name FROM gcode_files WHERE user_id = ?', (session['user_id'],))
             all_files = cursor.fetchall()
-            conn.close()
             print(f"  Arquivos disponíveis: {all_files}")
     
     return render_template('gcode_viewer.html', username=session.get('username'), file_id=file_id)
@@ -1258,11 +2979,10 @@ def api_login():
     if not username or not password:
         return jsonify({'success': False, 'message': 'Usuário e senha são obrigatórios'}), 400
     
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('SELECT id, username, password FROM users WHERE username = ?', (username,))
     user = cursor.fetchone()
-    conn.close()
     
     if user and user[2] == hash_password(password):
         session['user_id'] = user[0]
@@ -1283,7 +3003,7 @@ def api_register():
     if len(password) < 6:
         return jsonify({'success': False, 'message': 'A senha deve ter pelo menos 6 caracteres'}), 400
     
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_db()
     cursor = conn.cursor()
     
     # Verificar se já existem usuários (apenas o primeiro pode se registrar)
@@ -1291,7 +3011,6 @@ def api_register():
     user_count = cursor.fetchone()[0]
     
     if user_count > 0:
-        conn.close()
         return jsonify({'success': False, 'message': 'Registro não permitido. Use uma conta existente.'}), 403
     
     try:
@@ -1301,10 +3020,8 @@ def api_register():
         user_id = cursor.lastrowid
         session['user_id'] = user_id
         session['username'] = username
-        conn.close()
         return jsonify({'success': True, 'message': 'Conta criada com sucesso'})
     except sqlite3.IntegrityError:
-        conn.close()
         return jsonify({'success': False, 'message': 'Nome de usuário já existe'}), 409
 
 @app.route('/api/logout', methods=['POST'])
@@ -1312,139 +3029,93 @@ def api_logout():
     session.clear()
     return jsonify({'success': True, 'message': 'Logout realizado com sucesso'})
 
+def parse_print_time_seconds(print_time_str) -> Optional[int]:
+    """Converte "1h 30m 15s" / "52m 31s" (tempo do fatiador) em segundos."""
+    if not print_time_str:
+        return None
+    units = {'h': 3600, 'm': 60, 's': 1}
+    total = sum(int(value) * units[unit] for value, unit in re.findall(r'(\d+)\s*([hms])', print_time_str))
+    return total or None
+
+def format_print_time(total_seconds) -> str:
+    """Segundos no formato de gcode_files.print_time ("1h 2m 3s" / "2m 3s")."""
+    total_seconds = int(round(total_seconds))
+    hours = total_seconds // 3600
+    minutes = (total_seconds % 3600) // 60
+    seconds = total_seconds % 60
+    if hours > 0:
+        return f"{hours}h {minutes}m {seconds}s"
+    return f"{minutes}m {seconds}s"
+
+def display_print_time(print_time, estimated_seconds) -> Optional[str]:
+    """Tempo mostrado na lista: o do fatiador; sem ele, a estimativa cinemática."""
+    if print_time:
+        return print_time
+    return format_print_time(estimated_seconds) if estimated_seconds else None
+
+def _format_hms(total_seconds) -> str:
+    total_seconds = int(total_seconds)
+    return f"{total_seconds // 3600:02d}:{(total_seconds % 3600) // 60:02d}:{total_seconds % 60:02d}"
+
+def compute_print_times(started_at, current_progress, total_seconds=None, remaining_seconds=None):
+    """Calcula (tempo decorrido, tempo restante) no formato HH:MM:SS.
+
+    remaining_seconds vem da estimativa cinemática (busca pelo offset da linha atual);
+    sem ela, usa o tempo total do arquivo (total_seconds) ponderado pelo progresso.
+    """
+    # Calcular tempo decorrido
+    time_elapsed = '00:00:00'
+    time_remaining = 'Calculando...'
+    if started_at:
+        try:
+            start_time = datetime.strptime(started_at, '%Y-%m-%d %H:%M:%S')
+            elapsed = datetime.now() - start_time
+            time_elapsed = _format_hms(elapsed.total_seconds())
+            
+            remaining = None
+            if remaining_seconds is not None:
+                remaining = remaining_seconds
+            elif total_seconds and current_progress > 0:
+                # Ajuste dinâmico: usa tempo do arquivo no início (0-10%)
+                # e gradualmente muda para tempo real calculado (10-100%)
+                if current_progress < 10:
+                    remaining = total_seconds - elapsed.total_seconds()
+                else:
+                    # Quanto maior o progresso, mais confia no tempo real
+                    progress_based_total = elapsed.total_seconds() / (current_progress / 100)
+                    file_weight = max(0, (50 - current_progress) / 50)  # 100% em 0%, 0% em 50%+
+                    weighted_total = (total_seconds * file_weight) + (progress_based_total * (1 - file_weight))
+                    remaining = weighted_total - elapsed.total_seconds()
+            
+            if remaining is not None:
+                time_remaining = _format_hms(max(0, remaining))
+        except Exception as e:
+            print(f"⚠️ Erro ao calcular tempo: {e}, started_at={started_at}")
+    
+    return time_elapsed, time_remaining
+
 # API de controle da impressora
-@app.route('/api/printer/status', methods=['GET'])
-def printer_status():
-    if 'user_id' not in session:
-        return jsonify({'success': False, 'message': 'Não autenticado'}), 401
+@printer_method('status')
+def printer_status_payload() -> dict:
+    """Status servido pelo /api/printer/status (só memória: nada de serial nem banco)."""
+    # Impressão atual vem do estado em memória (o banco é atualizado em segundo plano)
+    job = get_current_job()
     
-    # Buscar informações da impressão atual no banco
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT pj.filename, pj.progress, pj.started_at, gf.print_time
-        FROM print_jobs pj
-        LEFT JOIN gcode_files gf ON pj.filename = gf.original_name
-        WHERE pj.status = 'printing' 
-        ORDER BY pj.started_at DESC 
-        LIMIT 1
-    ''')
-    current_job = cursor.fetchone()
-    conn.close()
+    # Temperaturas vêm do snapshot da telemetria (autoreport/poller) - nada de serial aqui
+    telemetry = dict(printer_telemetry)
     
-    # Se houver impressão ativa, consultar temperatura (M105 é seguro) mas evitar M27
-    if current_job:
-        is_printing = True
-        current_progress = current_job[1] if current_job else 0
-        current_filename = current_job[0] if current_job else ''
-        started_at = current_job[2] if current_job else None
-        print_time_str = current_job[3] if len(current_job) > 3 else None
+    if job:
+        current_progress = job['progress']
+        current_filename = job['filename']
+        started_at = job['started_at']
         
-        # Consultar temperatura via M105, mas com cache para não interferir no streaming do G-code
-        global _temp_last_check_print_ts, _temp_cache_print
-        now_ts = time.time()
-        bed_temp = _temp_cache_print['bed']
-        nozzle_temp = _temp_cache_print['nozzle']
-        target_bed = _temp_cache_print['target_bed']
-        target_nozzle = _temp_cache_print['target_nozzle']
-
-        temp_response = None
-        if TEMP_CHECK_INTERVAL_PRINT_SEC <= 0 or (now_ts - _temp_last_check_print_ts) >= TEMP_CHECK_INTERVAL_PRINT_SEC:
-            _temp_last_check_print_ts = now_ts
-            temp_response = send_gcode('M105')
+        bed_temp = telemetry['bed']
+        nozzle_temp = telemetry['nozzle']
+        target_bed = telemetry['target_bed']
+        target_nozzle = telemetry['target_nozzle']
         
-        if temp_response and 'T:' in temp_response:
-            try:
-                for line in temp_response.split('\n'):
-                    if 'T:' in line:
-                        t_match = re.search(r'T:(\d+\.?\d*)\s*/(\d+\.?\d*)', line)
-                        if t_match:
-                            nozzle_temp = float(t_match.group(1))
-                            target_nozzle = float(t_match.group(2))
-                        b_match = re.search(r'B:(\d+\.?\d*)\s*/(\d+\.?\d*)', line)
-                        if b_match:
-                            bed_temp = float(b_match.group(1))
-                            target_bed = float(b_match.group(2))
-                        break
-            except Exception as e:
-                print(f"⚠️ Erro ao parsear temperatura: {e}")
-
-        # Atualizar cache mesmo se não houve leitura (para manter consistência)
-        _temp_cache_print = {
-            'bed': bed_temp,
-            'nozzle': nozzle_temp,
-            'target_bed': target_bed,
-            'target_nozzle': target_nozzle,
-        }
-        
-        # Calcular tempo decorrido
-        time_elapsed = '00:00:00'
-        time_remaining = 'Calculando...'
-        if started_at:
-            try:
-                start_time = datetime.strptime(started_at, '%Y-%m-%d %H:%M:%S')
-                elapsed = datetime.now() - start_time
-                hours = int(elapsed.total_seconds() // 3600)
-                minutes = int((elapsed.total_seconds() % 3600) // 60)
-                seconds = int(elapsed.total_seconds() % 60)
-                time_elapsed = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-                
-                # Calcular tempo restante usando tempo REAL do arquivo (se disponível)
-                if print_time_str and current_progress > 0:
-                    # Parsear tempo do arquivo (ex: "52m 31s" ou "1h 30m 15s")
-                    file_total_seconds = 0
-                    h_match = re.search(r'(\d+)h', print_time_str)
-                    m_match = re.search(r'(\d+)m', print_time_str)
-                    s_match = re.search(r'(\d+)s', print_time_str)
-                    
-                    if h_match:
-                        file_total_seconds += int(h_match.group(1)) * 3600
-                    if m_match:
-                        file_total_seconds += int(m_match.group(1)) * 60
-                    if s_match:
-                        file_total_seconds += int(s_match.group(1))
-                    
-                    if file_total_seconds > 0:
-                        # Ajuste dinâmico: usa tempo do arquivo no início (0-10%)
-                        # e gradualmente muda para tempo real calculado (10-100%)
-                        if current_progress < 10:
-                            # Início: usa tempo do arquivo
-                            remaining = file_total_seconds - elapsed.total_seconds()
-                        else:
-                            # Durante: faz média ponderada entre arquivo e progresso real
-                            # Quanto maior o progresso, mais confia no tempo real
-                            progress_based_total = elapsed.total_seconds() / (current_progress / 100)
-                            
-                            # Peso do arquivo diminui conforme progresso aumenta
-                            file_weight = max(0, (50 - current_progress) / 50)  # 100% em 0%, 0% em 50%+
-                            progress_weight = 1 - file_weight
-                            
-                            weighted_total = (file_total_seconds * file_weight) + (progress_based_total * progress_weight)
-                            remaining = weighted_total - elapsed.total_seconds()
-                        
-                        if remaining > 0:
-                            r_hours = int(remaining // 3600)
-                            r_minutes = int((remaining % 3600) // 60)
-                            r_seconds = int(remaining % 60)
-                            time_remaining = f"{r_hours:02d}:{r_minutes:02d}:{r_seconds:02d}"
-                        else:
-                            time_remaining = '00:00:00'
-                    else:
-                        # Fallback: calcular com base no progresso
-                        if current_progress > 0:
-                            total_time = elapsed.total_seconds() / (current_progress / 100)
-                            remaining = total_time - elapsed.total_seconds()
-                            if remaining > 0:
-                                r_hours = int(remaining // 3600)
-                                r_minutes = int((remaining % 3600) // 60)
-                                r_seconds = int(remaining % 60)
-                                time_remaining = f"{r_hours:02d}:{r_minutes:02d}:{r_seconds:02d}"
-                            else:
-                                time_remaining = '00:00:00'
-                        else:
-                            time_remaining = '00:00:00'
-            except Exception as e:
-                print(f"⚠️ Erro ao calcular tempo: {e}, started_at={started_at}")
+        time_elapsed, time_remaining = compute_print_times(started_at, current_progress,
+                                                           job['total_seconds'], job['remaining_seconds'])
         
         status = {
             'connected': printer_serial and printer_serial.is_open,
@@ -1454,18 +3125,20 @@ def printer_status():
                 'target_bed': target_bed,
                 'target_nozzle': target_nozzle
             },
-            'state': 'printing',
+            'state': 'paused' if print_paused else 'printing',
             'progress': current_progress,
             'filename': current_filename,
             'time_elapsed': time_elapsed,
             'time_remaining': time_remaining,
-            'filament': check_filament_sensor(during_print=True)
+            'layer': job['layer'],
+            'total_layers': job['total_layers'],
+            'filament': dict(filament_status)
         }
-        return jsonify({'success': True, 'status': status})
+        return status
     
-    # Se NÃO houver impressão, consultar status normal
-    status_data = get_printer_status_serial()
-    filament_info = check_filament_sensor()
+    # Se NÃO houver impressão, status normal (também da memória)
+    status_data = get_printer_status_snapshot()
+    filament_info = dict(filament_status)
     
     status = {
         'connected': status_data['connected'],
@@ -1480,32 +3153,175 @@ def printer_status():
         'filename': '',
         'time_elapsed': '00:00:00',
         'time_remaining': '00:00:00',
+        'layer': 0,
+        'total_layers': 0,
         'filament': filament_info
     }
-    return jsonify({'success': True, 'status': status})
+    return status
 
-@app.route('/api/printer/pause', methods=['POST'])
-def printer_pause():
-    global print_paused, print_paused_by_filament
+def get_status_board_reader() -> Optional[StatusBoardReader]:
+    """Leitor do quadro de status deste processo (None: desligado ou ainda não publicado)."""
+    global _status_board_reader, _status_board_open_ts
+    if not STATUS_BOARD:
+        return None
+    if _status_board_reader is None:
+        # Quadro ainda não existe (dono não iniciou): tentar de novo a cada segundo
+        now = time.monotonic()
+        if now - _status_board_open_ts < 1.0:
+            return None
+        _status_board_open_ts = now
+        try:
+            _status_board_reader = StatusBoardReader(STATUS_BOARD_PATH)
+        except (OSError, ValueError):
+            return None
+    return _status_board_reader
+
+def status_from_board(record: dict) -> dict:
+    """Monta o status do /api/printer/status a partir de um registro do quadro."""
+    if record['state'] != 'idle':
+        started_at = None
+        if record['started_at']:
+            started_at = datetime.fromtimestamp(record['started_at']).strftime('%Y-%m-%d %H:%M:%S')
+        progress = record['progress']
+        filename = record['filename']
+        time_elapsed, time_remaining = compute_print_times(started_at, progress, record['total_seconds'],
+                                                           record['remaining_seconds'])
+        layer, total_layers = record['layer'], record['total_layers']
+    else:
+        progress, filename, layer, total_layers = 0, '', 0, 0
+        time_elapsed = time_remaining = '00:00:00'
+    checked_at = record['filament_checked_at']
+    return {
+        'connected': bool(record['connected']),
+        'temperature': {
+            'bed': record['bed'],
+            'nozzle': record['nozzle'],
+            'target_bed': record['target_bed'],
+            'target_nozzle': record['target_nozzle']
+        },
+        'state': record['state'],
+        'progress': progress,
+        'filename': filename,
+        'time_elapsed': time_elapsed,
+        'time_remaining': time_remaining,
+        'layer': layer,
+        'total_layers': total_layers,
+        'filament': {
+            'has_filament': bool(record['has_filament']),
+            'sensor_enabled': bool(record['filament_sensor']),
+            'source': record['filament_source'],
+            'last_check': datetime.fromtimestamp(checked_at).isoformat() if checked_at else None,
+        }
+    }
+
+def status_board_response() -> Optional[bytes]:
+    """Resposta do /api/printer/status lida do quadro, ou None (usar printer_call).
+
+    A resposta pronta fica guardada enquanto a sequência e o segundo (tempo decorrido)
+    não mudam: com muitos navegadores abertos, a maioria das requisições só lê a sequência.
+    """
+    global _status_board_reader, _status_board_cache
+    reader = get_status_board_reader()
+    if reader is None:
+        return None
+    key = (reader.sequence(), int(time.time()))
+    cached_key, body = _status_board_cache
+    if cached_key == key:
+        return body
+    result = reader.read()
+    if result is None:
+        if not reader.owner_alive():
+            # Dono saiu: reabrir o quadro quando outro publicar
+            _status_board_reader = None
+        return None
+    seq, record = result
+    body = json.dumps({'success': True, 'status': status_from_board(record)}).encode()
+    _status_board_cache = ((seq, key[1]), body)
+    return body
+
+@app.route('/api/printer/status', methods=['GET'])
+def printer_status():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Não autenticado'}), 401
+    
+    # Do quadro em memória compartilhada, sem lock nem pedido ao daemon; senão do dono
+    body = status_board_response()
+    if body is not None:
+        return Response(body, mimetype='application/json')
+    return jsonify({'success': True, 'status': printer_call('status')})
+
+@app.route('/api/events', methods=['GET'])
+def events_stream():
+    """Stream de eventos (SSE): só o que mudou - temperatura, progresso, estado e terminal"""
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Não autenticado'}), 401
     
+    sub = _event_subscribe()
+    if sub is None:
+        # Cliente volta para o polling
+        return jsonify({'success': False, 'message': 'Muitos clientes conectados'}), 503
+    
+    # Estado inicial, para o cliente não precisar de um poll extra
+    try:
+        snapshot = printer_call('events_snapshot')
+    except PrinterDaemonError:
+        _event_unsubscribe(sub)
+        raise
+    with _event_lock:
+        sub.latest.update(snapshot)
+        sub.event.set()
+    
+    def generate():
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                if not sub.event.wait(EVENTS_KEEPALIVE_SEC):
+                    yield ': ping\n\n'
+                    continue
+                chunk = ''.join(
+                    f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
+                    for event_type, data in _event_take(sub)
+                )
+                if chunk:
+                    yield chunk
+        finally:
+            _event_unsubscribe(sub)
+    
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@printer_method('pause')
+def pause_print():
+    global print_paused, print_paused_by_filament
     # Apenas pausar impressão - sem comandos adicionais
     print_paused = True
     print_paused_by_filament = False
     print("⏸️ Impressão pausada")
-    return jsonify({'success': True, 'message': 'Impressão pausada'})
+    publish_printer_state()
 
-@app.route('/api/printer/resume', methods=['POST'])
-def printer_resume():
-    global print_paused, print_paused_by_filament
+@app.route('/api/printer/pause', methods=['POST'])
+def printer_pause():
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Não autenticado'}), 401
     
+    printer_call('pause')
+    return jsonify({'success': True, 'message': 'Impressão pausada'})
+
+@printer_method('resume')
+def resume_print():
+    global print_paused, print_paused_by_filament
     # Apenas retomar impressão - sem comandos adicionais
     print_paused = False
     print_paused_by_filament = False
     print("▶️ Impressão retomada")
+    publish_printer_state()
+
+@app.route('/api/printer/resume', methods=['POST'])
+def printer_resume():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Não autenticado'}), 401
+    
+    printer_call('resume')
     return jsonify({'success': True, 'message': 'Impressão retomada'})
 
 @app.route('/api/printer/connect', methods=['POST'])
@@ -1513,7 +3329,7 @@ def printer_connect():
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Não autenticado'}), 401
     
-    if connect_printer():
+    if printer_call('connect'):
         return jsonify({'success': True, 'message': 'Impressora conectada com sucesso'})
     else:
         return jsonify({'success': False, 'message': 'Falha ao conectar à impressora'}), 500
@@ -1523,29 +3339,30 @@ def printer_disconnect():
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Não autenticado'}), 401
     
-    disconnect_printer()
+    printer_call('disconnect')
     return jsonify({'success': True, 'message': 'Impressora desconectada'})
 
-@app.route('/api/printer/stop', methods=['POST'])
-def printer_stop():
+@printer_method('stop')
+def stop_print():
     global print_stopped, print_paused
-    if 'user_id' not in session:
-        return jsonify({'success': False, 'message': 'Não autenticado'}), 401
-    
     # Sinalizar parada
     print_stopped = True
     print_paused = False
     
-    # Atualizar banco de dados - marcar impressão como cancelada
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE print_jobs 
-        SET status = 'cancelled', completed_at = CURRENT_TIMESTAMP
-        WHERE status = 'printing'
-    ''')
-    conn.commit()
-    conn.close()
+    # Interromper um M109/M190 em andamento (senão os comandos abaixo esperam o aquecimento)
+    send_gcode('M108', wait_for_ok=False)
+    
+    # Marcar impressão como cancelada (memória + banco); sem impressão em memória,
+    # limpar registros que ficaram travados como 'printing'
+    if not finish_job('cancelled'):
+        conn = get_db()
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE print_jobs 
+            SET status = 'cancelled', completed_at = CURRENT_TIMESTAMP
+            WHERE status = 'printing'
+        ''')
+        conn.commit()
     
     # Parar motores e aquecedores
     send_gcode('M104 S0')  # Desligar aquecedor do bico
@@ -1557,7 +3374,15 @@ def printer_stop():
     send_gcode('G28 X Y')  # Home X e Y
     
     print("✗ Impressão PARADA pelo usuário")
+    publish_printer_state()
+
+@app.route('/api/printer/stop', methods=['POST'])
+def printer_stop():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Não autenticado'}), 401
     
+    # Parada e desligamento levam vários comandos: o daemon pode demorar a responder
+    printer_call('stop', call_timeout=PRINTER_DAEMON_TIMEOUT_SEC + 120)
     return jsonify({'success': True, 'message': 'Impressão parada'})
 
 @app.route('/api/printer/start', methods=['POST'])
@@ -1583,42 +3408,83 @@ def send_gcode_api():
     if not command:
         return jsonify({'success': False, 'message': 'Comando vazio'}), 400
     
-    # Registrar comando no histórico
-    with history_lock:
-        commands_history.append({
-            'timestamp': datetime.now().isoformat(),
-            'command': command,
-            'type': 'sent'
-        })
-    
-    # Enviar comando para impressora
+    # Enviar comando para impressora (send_gcode e a thread leitora já registram no histórico)
     response = send_gcode(command)
     
-    # Registrar resposta no histórico
     if response is not None:
-        with history_lock:
-            commands_history.append({
-                'timestamp': datetime.now().isoformat(),
-                'command': response,
-                'type': 'response'
-            })
         return jsonify({'success': True, 'response': response})
     else:
         return jsonify({'success': False, 'message': 'Sem resposta da impressora'}), 500
 
+@printer_method('stream_stats')
+def stream_stats_payload() -> dict:
+    if printing_in_progress:
+        update_stream_rate(recent=False)
+    stats = {k: v for k, v in stream_stats.items() if not k.startswith('_')}
+    if stats['process'] is not None:
+        stats['inflight'] = stats['process'].get('inflight', 0)
+        stats['inflight_bytes'] = stats['process'].get('inflight_bytes', 0)
+    else:
+        stats['inflight'] = len(_ack_waiters)
+        stats['inflight_bytes'] = _link_inflight_bytes
+        if printing_in_progress:
+            stats['ack_to_write'] = stream_jitter.snapshot()
+    stats['command_latency'] = get_command_latency_stats()
+    return stats
+
+@app.route('/api/printer/stream-stats', methods=['GET'])
+def get_stream_stats():
+    """Estatísticas do streaming da impressão atual/última (linhas/s, timeouts, janela)"""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Não autenticado'}), 401
+    
+    return jsonify({'success': True, 'stats': printer_call('stream_stats')})
+
+@app.route('/api/printer/governor', methods=['GET'])
+def get_governor_stats():
+    """O que o controle de admissão adiou/recusou durante as impressões (e por quanto tempo)"""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Não autenticado'}), 401
+    
+    stats = governor.snapshot()
+    stats['analysis'] = analysis_pool.snapshot()
+    return jsonify({'success': True, 'governor': stats})
+
+@printer_method('history')
+def history_payload(since: int = 0) -> dict:
+    """Linhas do terminal depois do cursor since, já formatadas."""
+    entries, last_seq, truncated = get_history_since(since)
+    return {'history': [format_history_entry(entry) for entry in entries],
+            'last_seq': last_seq, 'truncated': truncated}
+
 @app.route('/api/printer/commands-history', methods=['GET'])
 def get_commands_history():
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Não autenticado'}), 401
     
-    with history_lock:
-        history = list(commands_history)
+    # Cursor incremental: ?since=<seq> devolve só as linhas novas
+    try:
+        since = max(0, int(request.args.get('since', 0)))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'since inválido'}), 400
     
-    return jsonify({
+    result = printer_call('history', since=since)
+    history, last_seq, truncated = result['history'], result['last_seq'], result['truncated']
+    
+    # Nada novo: 304 para quem mandou If-None-Match com o último seq
+    etag = f'"h{last_seq}"'
+    if not history and not truncated and request.headers.get('If-None-Match') == etag:
+        return Response(status=304, headers={'ETag': etag})
+    
+    response = jsonify({
         'success': True,
         'history': history,
-        'count': len(history)
+        'count': len(history),
+        'last_seq': last_seq,
+        'truncated': truncated
     })
+    response.headers['ETag'] = etag
+    return response
 
 # API de Gerenciamento de Arquivos G-code
 @app.route('/api/files/list', methods=['GET'])
@@ -1626,12 +3492,13 @@ def list_files():
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Não autenticado'}), 401
     
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('''
         SELECT id, original_name, file_size, uploaded_at, last_printed, print_count, filename, thumbnail_path,
                print_time, filament_used, filament_type, nozzle_temp, bed_temp, layer_height, infill,
-               slicer, total_layers, filament_density, filament_diameter, max_z_height
+               slicer, total_layers, filament_density, filament_diameter, max_z_height, analysis_status,
+               estimated_seconds, analysis_progress
         FROM gcode_files 
         WHERE user_id = ?
         ORDER BY uploaded_at DESC
@@ -1639,6 +3506,11 @@ def list_files():
     
     files = []
     for row in cursor.fetchall():
+        # Status/progresso: da memória quando a análise roda neste processo; senão do banco,
+        # gravado por quem a reservou (outro worker da interface)
+        analysis = analysis_pool.status(row[6])
+        if not analysis or analysis['status'] != 'analyzing':
+            analysis = {'status': row[20], 'progress': row[22]}
         files.append({
             'id': row[0],
             'name': row[1],
@@ -1648,7 +3520,7 @@ def list_files():
             'print_count': row[5],
             'filename': row[6],
             'thumbnail': row[7],
-            'print_time': row[8],
+            'print_time': display_print_time(row[8], row[21]),
             'filament_used': row[9],
             'filament_type': row[10],
             'nozzle_temp': row[11],
@@ -1659,11 +3531,426 @@ def list_files():
             'total_layers': row[16],
             'filament_density': row[17],
             'filament_diameter': row[18],
-            'max_z_height': row[19]
+            'max_z_height': row[19],
+            'analysis_status': analysis['status'],
+            'analysis_progress': analysis['progress']
         })
     
-    conn.close()
-    return jsonify({'success': True, 'files': files})
+    return jsonify({'success': True, 'files': files, 'analysis': analysis_pool.snapshot()})
+
+class _LimitChanges(list):
+    """M201/M203/M204/M205 encontrados durante o upload (consumidor do GcodeUpload)."""
+
+    def feed(self, block, offset):
+        self.extend(find_limit_changes(block, offset))
+
+_upload_numbers = itertools.count(1)
+
+def start_gcode_upload(client_filename):
+    """Destino de um upload de G-code: gcode_files/<timestamp>_<n>_<nome>.part, processado enquanto chega.
+
+    O número separa uploads do mesmo nome no mesmo segundo: o .part e os temporários dos
+    consumidores (.stream/.toolpath) derivam deste nome, e um upload repetido descartado
+    apagaria os do outro.
+    """
+    original_name = secure_filename(client_filename)
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    filepath = os.path.join(app.config['GCODE_FOLDER'],
+                            f"{timestamp}_{os.getpid()}-{next(_upload_numbers)}_{original_name}")
+    # Durante a impressão o upload só grava; a análise fica para a fila (baixa prioridade)
+    consumers = {} if printing_in_progress else gcode_analysis_consumers(filepath)
+    return GcodeUpload(filepath, consumers, queue_bytes=UPLOAD_QUEUE_MB * 1024 * 1024,
+                       throttle=lambda nbytes: governor.throttle('upload', nbytes))
+
+class GcodeUploadRequest(Request):
+    """Uploads de G-code vão direto para gcode_files/ (GcodeUpload), sem passar pelo
+    arquivo temporário do Werkzeug."""
+
+    gcode_uploads = ()
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.endpoint == 'upload_file' and filename and allowed_file(filename):
+            upload = start_gcode_upload(filename)
+            self.gcode_uploads = [*self.gcode_uploads, upload]
+            return upload
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+    def close(self):
+        # Upload interrompido (cliente desconectou no meio): apagar o .part e os temporários
+        for upload in self.gcode_uploads:
+            upload.close()
+        super().close()
+
+app.request_class = GcodeUploadRequest
+
+def finish_gcode_analysis(file_id, filepath, consumers, metadata, content_hash=None, progress=None):
+    """Termina a análise a partir dos consumidores que já viram o arquivo inteiro (upload ou
+    analyze_gcode_file): grava o .stream, junta o .toolpath, estima o tempo e gera a
+    geometria do visualizador - nada disso relê o G-code.
+
+    No fim, os resultados vão também para as linhas com o mesmo conteúdo enviadas enquanto
+    a análise rodava. Erros em alguma etapa não impedem as outras; no fim viram exceção
+    (job 'failed').
+    """
+    progress = progress or (lambda fraction: None)
+    errors = []
+    conn = open_db_connection()
+
+    def deleted():
+        """Arquivo apagado durante a análise: descarta os temporários e o que já foi gerado,
+        para não deixar .stream/.toolpath/.geometry sem o G-code no cartão."""
+        with gcode_blob_transaction(conn) as blob_cursor:
+            if gcode_file_in_use(blob_cursor, os.path.basename(filepath)):
+                return False
+            for consumer in consumers.values():
+                abort = getattr(consumer, 'abort', None)
+                if abort:
+                    abort()
+            remove_gcode_file(filepath)
+        print(f"🗑️ {os.path.basename(filepath)} apagado durante a análise - resultados descartados")
+        return True
+
+    try:
+        start = time.time()
+        cursor = conn.cursor()
+        if deleted():
+            return
+        # Formato de streaming (a impressão começa sem reler/contar o arquivo)
+        compiler = consumers.get('stream')
+        if compiler:
+            try:
+                save_gcode_stream_info(cursor, file_id, compiler.finish(filepath))
+            except Exception as e:
+                print(f"⚠️ Erro ao compilar G-code (será compilado ao imprimir): {e}")
+                errors.append(f"stream: {e}")
+        else:
+            print("⚠️ G-code não compilado no upload (será compilado ao imprimir)")
+        conn.commit()
+        progress(0.2)
+
+        toolpath_builder = consumers.get('toolpath')
+        if toolpath_builder:
+            if deleted():
+                return
+            try:
+                toolpath = toolpath_builder.finish(filepath)
+                save_toolpath_summary(cursor, file_id, toolpath, metadata)
+                progress(0.4)
+                estimate_gcode_file(cursor, file_id, filepath, consumers.get('limits'))
+                conn.commit()
+                progress(0.7)
+                if deleted():
+                    return
+                # Geometria do visualizador 3D (.geometry): ~1 s para 100 MB de G-code
+                with _geometry_lock:
+                    build_geometry(filepath)
+            except Exception as e:
+                print(f"⚠️ Erro ao extrair toolpath: {e}")
+                errors.append(f"toolpath: {e}")
+        # Apagado enquanto o último arquivo era gravado
+        if deleted():
+            return
+        if content_hash:
+            share_gcode_analysis(cursor, file_id, content_hash)
+            conn.commit()
+        print(f"✅ Análise de {os.path.basename(filepath)} concluída em {time.time() - start:.1f}s")
+    finally:
+        conn.close()
+    if errors:
+        raise RuntimeError('; '.join(errors))
+
+def gcode_analysis_consumers(filepath):
+    """Consumidores de uma passada pelo G-code (upload ou analyze_gcode_file)."""
+    consumers = {'stream': GcodeStreamCompiler(filepath), 'limits': _LimitChanges()}
+    if NUMPY_AVAILABLE:
+        consumers['toolpath'] = ToolpathBuilder(filepath)
+    return consumers
+
+def analyze_gcode_file(file_id, filepath, progress=None):
+    """Análise completa de um arquivo já gravado: uma leitura alimenta os mesmos consumidores
+    do upload (uploads durante a impressão, análises interrompidas por reinício). Gera também
+    a miniatura, se ainda não existir."""
+    progress = progress or (lambda fraction: None)
+    conn = open_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT filament_density, filament_diameter, content_hash, thumbnail_path
+            FROM gcode_files WHERE id = ?
+        ''', (file_id,))
+        row = cursor.fetchone()
+        if row and not row[3]:
+            thumbnail_path = extract_thumbnail(filepath, file_id)
+            if thumbnail_path:
+                cursor.execute('UPDATE gcode_files SET thumbnail_path = ? WHERE id = ?', (thumbnail_path, file_id))
+                conn.commit()
+    finally:
+        conn.close()
+    if not row:
+        return
+    metadata = {'filament_density': row[0], 'filament_diameter': row[1]}
+    size = os.path.getsize(filepath) or 1
+    consumers = gcode_analysis_consumers(filepath)
+    try:
+        for block, offset in read_line_blocks(filepath):
+            for consumer in consumers.values():
+                consumer.feed(block, offset)
+            progress(0.6 * (offset + len(block)) / size)
+    except Exception:
+        for consumer in consumers.values():
+            abort = getattr(consumer, 'abort', None)
+            if abort:
+                abort()
+        raise
+    finish_gcode_analysis(file_id, filepath, consumers, metadata, row[2],
+                          lambda fraction: progress(0.6 + 0.4 * fraction))
+
+# A fila de análise é o banco: cada worker da interface (e o app.py sozinho) tem o seu
+# AnalysisPool, mas só analisa o arquivo que reservou em gcode_files (analysis_status =
+# 'analyzing', analysis_pid = o processo). Quem reservou grava o progresso e o resultado;
+# reservas de processos que morreram voltam para 'pending' no início (resume_gcode_analysis)
+
+def process_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def claim_gcode_analysis(filename):
+    """Reserva a análise do arquivo para este processo (atômico: um UPDATE só).
+
+    False se outro processo está analisando ou se ninguém mais pediu (já ficou pronta).
+    """
+    pid = os.getpid()
+    conn = open_db_connection()
+    try:
+        cursor = conn.execute('''
+            UPDATE gcode_files SET analysis_status = 'analyzing', analysis_pid = ?, analysis_progress = 0
+            WHERE filename = ? AND (analysis_status IS NULL OR analysis_status = 'pending' OR analysis_pid = ?)
+              AND NOT EXISTS (SELECT 1 FROM gcode_files WHERE filename = ? AND analysis_status = 'analyzing'
+                              AND analysis_pid IS NOT ?)
+        ''', (pid, filename, pid, filename, pid))
+        conn.commit()
+        return cursor.rowcount > 0
+    finally:
+        conn.close()
+
+def mark_analysis_pending(filename):
+    """Põe o arquivo de volta na fila do banco (refazer a análise), menos se alguém a reservou."""
+    conn = open_db_connection()
+    try:
+        conn.execute('''
+            UPDATE gcode_files SET analysis_status = 'pending'
+            WHERE filename = ? AND analysis_status IS NOT 'analyzing'
+        ''', (filename,))
+        conn.commit()
+    finally:
+        conn.close()
+
+def save_analysis_status(filename, status, error=None):
+    """Resultado da análise (ready/failed) em todas as linhas que usam o arquivo, sem mexer
+    numa reserva de outro processo. 'pending' e 'analyzing' já estão no banco
+    (submit_gcode_analysis e claim_gcode_analysis)."""
+    if status not in ('ready', 'failed'):
+        return
+    conn = open_db_connection()
+    try:
+        conn.execute('''
+            UPDATE gcode_files SET analysis_status = ?, analysis_pid = NULL, analysis_progress = NULL
+            WHERE filename = ? AND (analysis_status IS NOT 'analyzing' OR analysis_pid = ?)
+        ''', (status, filename, os.getpid()))
+        conn.commit()
+    finally:
+        conn.close()
+
+def analysis_progress_reporter(filename, progress):
+    """progress(fração) do job, gravando também no banco a cada ANALYSIS_PROGRESS_SEC."""
+    last_saved = [0.0]
+
+    def report(fraction):
+        progress(fraction)
+        now = time.monotonic()
+        if now - last_saved[0] < ANALYSIS_PROGRESS_SEC:
+            return
+        last_saved[0] = now
+        try:
+            conn = open_db_connection()
+            try:
+                conn.execute('UPDATE gcode_files SET analysis_progress = ? WHERE filename = ? AND analysis_pid = ?',
+                             (round(fraction, 3), filename, os.getpid()))
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"⚠️ Erro ao gravar progresso da análise ({filename}): {e}")
+    return report
+
+# Fila de análise: um job por arquivo no cartão (pedidos repetidos viram o mesmo job)
+analysis_pool = AnalysisPool(ANALYSIS_WORKERS, busy=lambda: printing_in_progress,
+                             on_status=save_analysis_status, claim=claim_gcode_analysis)
+
+# Durante a impressão: upload com banda limitada, visualizador com poucas vagas. Com
+# PRINTER_DAEMON=1 as vagas e os baldes ficam no daemon (print_governor, um para todos os
+# workers da interface) e cada worker pede a ele (RemoteGovernor)
+print_governor = ResourceGovernor(lambda: printing_in_progress,
+                                  rates={'upload': PRINT_UPLOAD_KBPS * 1024},
+                                  slots={'preview': PRINT_PREVIEW_SLOTS},
+                                  wait_sec=PRINT_ADMISSION_WAIT_SEC)
+if PRINTER_DAEMON:
+    governor = RemoteGovernor(lambda: printing_in_progress, lambda method, **params: printer_call(
+        method, call_timeout=PRINT_ADMISSION_WAIT_SEC + PRINTER_DAEMON_TIMEOUT_SEC, **params))
+else:
+    governor = print_governor
+
+# Vagas do print_governor emprestadas a workers da interface: id -> (vaga, pid do worker)
+_governor_slots = {}
+_governor_slot_ids = itertools.count(1)
+_governor_slots_lock = threading.Lock()
+
+def _release_orphan_governor_slots():
+    """Devolve as vagas de workers que morreram sem devolvê-las (ex: reiniciados no meio de
+    uma resposta do visualizador)."""
+    with _governor_slots_lock:
+        orphans = [slot_id for slot_id, (_, pid) in _governor_slots.items() if not process_alive(pid)]
+        slots = [_governor_slots.pop(slot_id)[0] for slot_id in orphans]
+    for slot in slots:
+        slot.release()
+
+@printer_method('governor_admit')
+def governor_admit(category: str, pid: int) -> Optional[int]:
+    """Vaga para um worker da interface: id para devolver, 0 (sem limite agora) ou None (recusada)."""
+    _release_orphan_governor_slots()
+    slot = print_governor.admit(category)
+    if slot is None:
+        return None
+    if not slot.held:
+        return 0
+    with _governor_slots_lock:
+        slot_id = next(_governor_slot_ids)
+        _governor_slots[slot_id] = (slot, pid)
+    return slot_id
+
+@printer_method('governor_release')
+def governor_release(slot_id: int) -> bool:
+    with _governor_slots_lock:
+        entry = _governor_slots.pop(slot_id, None)
+    if entry:
+        entry[0].release()
+    return entry is not None
+
+@printer_method('governor_throttle')
+def governor_throttle(category: str, nbytes: int) -> float:
+    """Segundos que o worker deve dormir antes de gravar nbytes (balde comum a todos)."""
+    return print_governor.reserve(category, nbytes)
+
+@printer_method('governor_record')
+def governor_record(category: str, seconds: float = 0.0, rejected: bool = False) -> bool:
+    print_governor.record(category, seconds, rejected)
+    return True
+
+@printer_method('governor_stats')
+def governor_stats() -> dict:
+    stats = print_governor.snapshot()
+    with _governor_slots_lock:
+        stats['lent_slots'] = len(_governor_slots)
+    return stats
+
+def governor_busy_response(message):
+    """503 com Retry-After: operação recusada enquanto a impressão está em andamento."""
+    response = jsonify({'success': False, 'message': message, 'printing': True})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(int(PRINT_ADMISSION_WAIT_SEC) or 1)
+    return response
+
+def admission_controlled(category):
+    """Rotas caras (ex: visualizador): durante a impressão, só entram com vaga do governor.
+    A vaga fica presa até a resposta terminar de ser enviada (respostas em streaming).
+    Sem sessão: 401 antes de pedir a vaga (cliente não autenticado não ocupa nem espera)."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if 'user_id' not in session:
+                return jsonify({'success': False, 'message': 'Não autenticado'}), 401
+            slot = governor.admit(category)
+            if slot is None:
+                return governor_busy_response('Impressão em andamento: tente de novo em alguns segundos')
+            try:
+                response = app.make_response(view(*args, **kwargs))
+            except Exception:
+                slot.release()
+                raise
+            if response.is_streamed:
+                # direct_passthrough não chama os call_on_close: a vaga sai com o iterável
+                response.response = ClosingIterator(response.response, slot.release)
+            else:
+                slot.release()
+            return response
+        return wrapper
+    return decorator
+
+def submit_gcode_analysis(file_id, filename, consumers=None, metadata=None, content_hash=None, requeue=True):
+    """Pede a análise do arquivo: termina a do upload (consumers) ou lê o arquivo inteiro.
+
+    requeue: 'pending' vai para o banco antes do job entrar na fila, para a reserva dele
+    valer (refazer um arquivo já pronto). False: só o que ainda está pendente no banco.
+    """
+    filepath = os.path.join(app.config['GCODE_FOLDER'], filename)
+    if requeue:
+        mark_analysis_pending(filename)
+    if consumers is None:
+        return analysis_pool.submit(filename, lambda progress: analyze_gcode_file(
+            file_id, filepath, analysis_progress_reporter(filename, progress)))
+    return analysis_pool.submit(filename, lambda progress: finish_gcode_analysis(
+        file_id, filepath, consumers, metadata, content_hash, analysis_progress_reporter(filename, progress)))
+
+def resume_gcode_analysis():
+    """No início de cada processo da interface: devolve à fila as análises reservadas por
+    processos que morreram e enfileira as pendentes e os arquivos antigos que nunca foram
+    analisados (sem .stream ou, com NumPy, sem índice de camadas). Vários workers fazendo
+    isso ao mesmo tempo não repetem trabalho: cada arquivo é analisado por quem o reservar."""
+    conn = open_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT DISTINCT filename, analysis_pid FROM gcode_files WHERE analysis_status = 'analyzing'")
+        for filename, pid in cursor.fetchall():
+            if not process_alive(pid):
+                cursor.execute('''
+                    UPDATE gcode_files SET analysis_status = 'pending', analysis_pid = NULL, analysis_progress = NULL
+                    WHERE filename = ? AND analysis_status = 'analyzing' AND analysis_pid IS ?
+                ''', (filename, pid))
+        conn.commit()
+        cursor.execute('''
+            SELECT MIN(id), filename, stream_commands IS NOT NULL, layer_index IS NOT NULL
+            FROM gcode_files
+            WHERE analysis_status IS NULL OR analysis_status = 'pending'
+            GROUP BY filename
+        ''')
+        rows = cursor.fetchall()
+        queued = 0
+        for file_id, filename, has_stream, has_layers in rows:
+            if not os.path.exists(os.path.join(app.config['GCODE_FOLDER'], filename)):
+                continue
+            if has_stream and (has_layers or not NUMPY_AVAILABLE):
+                cursor.execute('''
+                    UPDATE gcode_files SET analysis_status = 'ready'
+                    WHERE filename = ? AND analysis_status IS NOT 'analyzing'
+                ''', (filename,))
+                conn.commit()
+            else:
+                # Sem requeue: se outro worker terminar antes, a reserva falha e nada se repete
+                submit_gcode_analysis(file_id, filename, requeue=False)
+                queued += 1
+        if queued:
+            print(f"🔬 {queued} arquivo(s) na fila de análise")
+    except Exception as e:
+        print(f"⚠️ Erro ao retomar análises: {e}")
+    finally:
+        conn.close()
 
 @app.route('/api/files/upload', methods=['POST'])
 def upload_file():
@@ -1681,55 +3968,87 @@ def upload_file():
     if not allowed_file(file.filename):
         return jsonify({'success': False, 'message': 'Tipo de arquivo não permitido. Use .gcode, .gco ou .g'}), 400
     
-    original_name = secure_filename(file.filename)
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    filename = f"{timestamp}_{original_name}"
-    filepath = os.path.join(app.config['GCODE_FOLDER'], filename)
-    
-    file.save(filepath)
-    file_info = get_gcode_info(filepath)
+    # O arquivo já foi gravado (e processado) enquanto chegava; aqui só termina
+    upload = file.stream
+    if not isinstance(upload, GcodeUpload):
+        upload = start_gcode_upload(file.filename)
+        shutil.copyfileobj(file.stream, upload, 1024 * 1024)
     
-    # Salvar no banco de dados
-    conn = sqlite3.connect(DB_NAME)
+    original_name = secure_filename(file.filename)
+    content_hash = upload.sha256
+    conn = get_db()
     cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO gcode_files (user_id, filename, original_name, file_size)
-        VALUES (?, ?, ?, ?)
-    ''', (session['user_id'], filename, original_name, file_info['size']))
-    conn.commit()
-    file_id = cursor.lastrowid
+    if not find_gcode_blob(cursor, content_hash):
+        # Conteúdo novo (provavelmente): fsync fora da transação, que só renomeia
+        upload.sync()
     
-    # Extrair thumbnail
-    thumbnail_path = extract_thumbnail(filepath, file_id)
-    if thumbnail_path:
-        cursor.execute('UPDATE gcode_files SET thumbnail_path = ? WHERE id = ?', 
-                      (thumbnail_path, file_id))
-        conn.commit()
-    
-    # Extrair metadados do G-code
-    metadata = parse_gcode_metadata(filepath)
-    if metadata:
+    with gcode_blob_transaction(conn) as cursor:
+        filename = find_gcode_blob(cursor, content_hash)
+        duplicate = bool(filename) and os.path.exists(os.path.join(app.config['GCODE_FOLDER'], filename))
+        # Na resposta, só o que o próprio usuário já enviou: o armazenamento é compartilhado,
+        # mas não pode revelar se outra conta tem o mesmo arquivo
+        cursor.execute('SELECT 1 FROM gcode_files WHERE content_hash = ? AND user_id = ? LIMIT 1',
+                       (content_hash, session['user_id']))
+        already_uploaded = cursor.fetchone() is not None
+        if duplicate:
+            # Mesmo conteúdo já guardado: descarta o .part e o que os consumidores geraram
+            upload.abort()
+        else:
+            filename = gcode_blob_filename(content_hash)
+            try:
+                upload.finish(os.path.join(app.config['GCODE_FOLDER'], filename))
+            except OSError as e:
+                upload.abort()
+                print(f"❌ Erro ao gravar upload: {e}")
+                return jsonify({'success': False, 'message': 'Erro ao gravar o arquivo'}), 500
+            # Registro antigo cujo arquivo sumiu do cartão: as cópias passam a usar o novo
+            cursor.execute('UPDATE gcode_files SET filename = ? WHERE content_hash = ?', (filename, content_hash))
+        acquire_gcode_blob(cursor, content_hash, filename, upload.size)
+        
+        # Salvar no banco de dados. Conteúdo novo: a análise já fica reservada para este
+        # processo, que tem os consumidores do upload (outro worker não a pega do banco)
         cursor.execute('''
-            UPDATE gcode_files 
-            SET print_time = ?, filament_used = ?, filament_type = ?, 
-                nozzle_temp = ?, bed_temp = ?, layer_height = ?, infill = ?,
-                slicer = ?, total_layers = ?, filament_density = ?, 
-                filament_diameter = ?, max_z_height = ?
-            WHERE id = ?
-        ''', (metadata['print_time'], metadata['filament_used'], metadata['filament_type'],
-              metadata['nozzle_temp'], metadata['bed_temp'], metadata['layer_height'], 
-              metadata['infill'], metadata['slicer'], metadata['total_layers'],
-              metadata['filament_density'], metadata['filament_diameter'], 
-              metadata['max_z_height'], file_id))
-        conn.commit()
+            INSERT INTO gcode_files (user_id, filename, original_name, file_size, content_hash, analysis_status,
+                                     analysis_pid)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (session['user_id'], filename, original_name, upload.size, content_hash,
+              'pending' if duplicate else 'analyzing', None if duplicate else os.getpid()))
+        file_id = cursor.lastrowid
+    filepath = os.path.join(app.config['GCODE_FOLDER'], filename)
     
-    conn.close()
+    # Metadados a partir do começo/fim guardados na memória (o nome enviado pode indicar
+    # material/tempo diferentes, então são lidos mesmo para conteúdo repetido)
+    metadata = parse_metadata_windows(original_name, *upload.windows())
+    save_gcode_metadata(cursor, file_id, metadata)
+    if duplicate:
+        # Miniatura, .stream, estimativa e camadas já calculados para o mesmo conteúdo
+        cursor.execute('SELECT MIN(id) FROM gcode_files WHERE content_hash = ? AND id != ?', (content_hash, file_id))
+        share_gcode_analysis(cursor, cursor.fetchone()[0], content_hash)
+        conn.commit()
+        print(f"♻️ {original_name}: conteúdo já existente ({filename}), nada a processar")
+    else:
+        if governor.active():
+            # Miniatura também fica para a fila de análise (analyze_gcode_file)
+            governor.record('thumbnail')
+        else:
+            thumbnail_path = extract_thumbnail(filepath, file_id, head=bytes(upload.head))
+            if thumbnail_path:
+                cursor.execute('UPDATE gcode_files SET thumbnail_path = ? WHERE id = ?', 
+                              (thumbnail_path, file_id))
+        conn.commit()
+        # .stream, toolpath, estimativa de tempo e geometria: na fila de análise, a resposta não espera
+        if upload.consumers:
+            upload.when_processed(lambda: submit_gcode_analysis(file_id, filename, upload.consumers, metadata,
+                                                                content_hash))
+        else:
+            submit_gcode_analysis(file_id, filename)
     
     return jsonify({
         'success': True, 
         'message': 'Arquivo enviado com sucesso',
         'file_id': file_id,
-        'filename': original_name
+        'filename': original_name,
+        'duplicate': already_uploaded
     })
 
 @app.route('/api/files/delete/<int:file_id>', methods=['DELETE'])
@@ -1737,61 +4056,66 @@ def delete_file(file_id):
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Não autenticado'}), 401
     
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_db()
     cursor = conn.cursor()
     
     # Verificar se o arquivo pertence ao usuário
-    cursor.execute('SELECT filename FROM gcode_files WHERE id = ? AND user_id = ?', 
+    cursor.execute('SELECT filename, content_hash FROM gcode_files WHERE id = ? AND user_id = ?', 
                   (file_id, session['user_id']))
     result = cursor.fetchone()
     
     if not result:
-        conn.close()
         return jsonify({'success': False, 'message': 'Arquivo não encontrado'}), 404
     
-    filename = result[0]
-    filepath = os.path.join(app.config['GCODE_FOLDER'], filename)
-    
-    # Deletar arquivo físico
-    try:
-        if os.path.exists(filepath):
-            os.remove(filepath)
-    except Exception as e:
-        conn.close()
-        return jsonify({'success': False, 'message': f'Erro ao deletar arquivo: {str(e)}'}), 500
+    filename, content_hash = result
     
-    # Deletar do banco de dados
-    cursor.execute('DELETE FROM gcode_files WHERE id = ?', (file_id,))
-    conn.commit()
-    conn.close()
+    # Deletar do banco de dados; o arquivo físico só sai com a última referência ao conteúdo
+    with gcode_blob_transaction(conn) as cursor:
+        cursor.execute('DELETE FROM gcode_files WHERE id = ?', (file_id,))
+        unused_filename = release_gcode_blob(cursor, content_hash) if content_hash else filename
+        
+        # Deletar arquivo físico (e os arquivos .stream/.toolpath/.geometry gerados) antes do
+        # commit: outro processo não reaproveita o conteúdo enquanto ele sai do cartão
+        if unused_filename:
+            try:
+                remove_gcode_file(os.path.join(app.config['GCODE_FOLDER'], unused_filename))
+            except Exception as e:
+                return jsonify({'success': False, 'message': f'Erro ao deletar arquivo: {str(e)}'}), 500
     
     return jsonify({'success': True, 'message': 'Arquivo deletado com sucesso'})
 
-@app.route('/api/files/print/<int:file_id>', methods=['POST'])
-def print_file(file_id):
-    if 'user_id' not in session:
-        return jsonify({'success': False, 'message': 'Não autenticado'}), 401
-    
-    conn = sqlite3.connect(DB_NAME)
+@printer_method('print')
+def start_print(file_id: int, user_id: int):
+    """Começa a impressão de um arquivo do usuário: (resposta, status HTTP)."""
+    conn = get_db()
     cursor = conn.cursor()
     
-    cursor.execute('SELECT filename, original_name FROM gcode_files WHERE id = ? AND user_id = ?', 
-                  (file_id, session['user_id']))
+    cursor.execute('''
+        SELECT filename, original_name, print_time, stream_commands, estimated_seconds, time_index, estimate_limits,
+               layer_index
+        FROM gcode_files WHERE id = ? AND user_id = ?
+    ''', (file_id, user_id))
     result = cursor.fetchone()
     
     if not result:
-        conn.close()
-        return jsonify({'success': False, 'message': 'Arquivo não encontrado'}), 404
+        return {'success': False, 'message': 'Arquivo não encontrado'}, 404
     
     filename = result[0]
     original_name = result[1]
+    # Sem estimativa para os limites atuais: tempo do fatiador ou a estimativa antiga
+    file_total_seconds = parse_print_time_seconds(result[2]) or result[4]
+    stream_commands = result[3]
+    estimate = None
+    if result[4] is not None and result[6] == motion_limits_signature(get_motion_limits()):
+        estimate = {'total_seconds': result[4], 'index': json.loads(result[5] or '[]')}
+    # Offset do início de cada camada: camada atual por busca binária no offset enviado
+    layer_offsets = [layer[0] for layer in json.loads(result[7] or '[]')]
     filepath = os.path.join(app.config['GCODE_FOLDER'], filename)
     
     # Verificar se impressora está conectada
     if not printer_serial or not printer_serial.is_open:
         if not connect_printer():
-            conn.close()
-            return jsonify({'success': False, 'message': 'Impressora não conectada'}), 500
+            return {'success': False, 'message': 'Impressora não conectada'}, 500
     
     # Limpar impressões antigas que ficaram travadas como 'printing'
     cursor.execute('''
@@ -1803,8 +4127,7 @@ def print_file(file_id):
     
     # Verificar se arquivo existe
     if not os.path.exists(filepath):
-        conn.close()
-        return jsonify({'success': False, 'message': 'Arquivo G-code não encontrado'}), 404
+        return {'success': False, 'message': 'Arquivo G-code não encontrado'}, 404
     
     # Atualizar contadores
     cursor.execute('''
@@ -1817,252 +4140,296 @@ def print_file(file_id):
     from datetime import datetime
     current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     cursor.execute('''
-        INSERT INTO print_jobs (user_id, filename, status, progress, started_at)
-        VALUES (?, ?, 'printing', 0, ?)
-    ''', (session['user_id'], original_name, current_time))
+        INSERT INTO print_jobs (user_id, filename, file_id, status, progress, started_at)
+        VALUES (?, ?, ?, 'printing', 0, ?)
+    ''', (user_id, original_name, file_id, current_time))
     
     job_id = cursor.lastrowid
     conn.commit()
-    conn.close()
+    start_job(job_id, original_name, current_time,
+              estimate['total_seconds'] if estimate else file_total_seconds, len(layer_offsets))
     
     # Iniciar impressão em thread separada para não bloquear
     import threading
     
     def print_gcode_file():
-        global print_paused, print_stopped, g28_executed, g29_executed, printing_in_progress
+        global print_paused, print_stopped, printing_in_progress
+        nonlocal estimate
         printing_in_progress = True
         try:
             # Resetar flags no início
             print_paused = False
             print_stopped = False
-            g28_executed = False
-            g29_executed = False
+            publish_printer_state()
             
             print(f"\n▶️ Iniciando impressão: {original_name}")
             
             # Verificar se impressora está pronta antes de começar
             if not check_printer_ready():
                 print("✗ Impressão cancelada: impressora não está respondendo")
-                conn_local = sqlite3.connect(DB_NAME)
-                cursor_local = conn_local.cursor()
-                cursor_local.execute('''
-                    UPDATE print_jobs 
-                    SET status = 'error', completed_at = CURRENT_TIMESTAMP
-                    WHERE id = ?
-                ''', (job_id,))
-                conn_local.commit()
-                conn_local.close()
+                finish_job('error')
                 return
             
             # Aguardar um pouco para garantir estabilidade da conexão
             time.sleep(0.1)
             
-            # Comandos de preparação (sem M110 que pode causar reset)
+            # Comandos de preparação
             print("  🛠️ Enviando comandos de inicialização...")
-            if not send_gcode('G21', retries=3):  # Unidades em mm
+            if not send_gcode('G21', retries=3, priority='bulk'):  # Unidades em mm
                 print("✗ Falha no G21")
                 return
-            if not send_gcode('G90', retries=3):  # Modo absoluto
+            if not send_gcode('G90', retries=3, priority='bulk'):  # Modo absoluto
                 print("✗ Falha no G90")
                 return
+            # Numeração de linhas com checksum: ressincroniza só aqui, no início do job
+            if STREAM_MODE == 'window' and STREAM_CHECKSUM:
+                if not stream_resync_line_numbers():
+                    print("✗ Falha no M110")
+                    return
             # M82 removido - deixar G-code controlar modo do extrusor
             
             print("  Comandos de inicialização enviados")
             
-            # Contar total de linhas primeiro
-            with open(filepath, 'r') as f:
-                total_lines = sum(1 for line in f if line.split(';')[0].strip())
+            # G-code compilado no upload; arquivos antigos são compilados agora (uma vez)
+            total_lines = stream_commands
+            if not total_lines or not gcode_stream_is_current(filepath):
+                print("  ⚙️ Compilando G-code para streaming...")
+                compiled = compile_gcode_stream(filepath)
+                total_lines = compiled['commands']
+                conn_local = get_db()
+                save_gcode_stream_info(conn_local.cursor(), file_id, compiled)
+                conn_local.commit()
             
             print(f"  Total de comandos: {total_lines}")
             
-            # Processar arquivo
-            with open(filepath, 'r') as f:
-                line_count = 0
-                lines_sent = 0
+            # Estimativa cinemática: falta (arquivo antigo) ou limites do M503 mudaram
+            if estimate is None:
+                try:
+                    conn_local = get_db()
+                    estimate = estimate_gcode_file(conn_local.cursor(), file_id, filepath)
+                    conn_local.commit()
+                except Exception as e:
+                    print(f"⚠️ Erro ao estimar tempo (usando o tempo do arquivo): {e}")
+            if estimate:
+                print(f"  ⏱️ Tempo estimado: {format_print_time(estimate['total_seconds'])}")
+            
+            stream_mode = STREAM_MODE if STREAM_MODE in ('window', 'sync') else 'sync'
+            reset_stream_stats(stream_mode)
+            print(f"  Modo de streaming: {stream_mode}")
+            
+            last_progress_event_ts = 0.0
+            
+            def report_progress(lines_sent, offset):
+                nonlocal last_progress_event_ts
+                update_stream_rate()
+                progress = (lines_sent / total_lines) * 100
+                remaining_sec = None
+                if estimate:
+                    # Tempo restante: busca pelo offset da linha atual no índice da estimativa
+                    remaining_sec = max(0.0, estimate['total_seconds'] - elapsed_at_offset(estimate['index'], offset))
+                update_job_progress(progress, remaining_sec, offset, bisect.bisect_right(layer_offsets, offset))
+                print(f"  Progresso: {progress:.1f}% ({lines_sent}/{total_lines}) - {stream_stats['recent_lines_per_sec']} linhas/s")
                 
-                for line in f:
-                    # Verificar se impressão foi parada
-                    if print_stopped:
-                        print("✗ Impressão PARADA pelo usuário")
-                        break
-                    
-                    # Verificar se impressão foi pausada
-                    while print_paused and not print_stopped:
-                        print("⏸️ Impressão em PAUSA...")
-                        time.sleep(1)
-                    
-                    # Se parou durante a pausa, sair
-                    if print_stopped:
-                        print("✗ Impressão PARADA durante pausa")
-                        break
+                # Avisar os clientes conectados (no máximo 1 evento/s)
+                if time.time() - last_progress_event_ts >= 1.0:
+                    last_progress_event_ts = time.time()
+                    time_elapsed, time_remaining = compute_print_times(
+                        current_time, progress, file_total_seconds, remaining_sec)
+                    publish_event('progress', {
+                        'progress': progress,
+                        'filename': original_name,
+                        'time_elapsed': time_elapsed,
+                        'time_remaining': time_remaining,
+                    })
+            
+            if STREAM_PROCESS:
+                # Linhas enviadas por um processo próprio (print_streamer.py); a porta volta no fim
+                lines_sent = stream_print_in_process(filepath + GCODE_STREAM_SUFFIX,
+                                                     STREAM_MAX_INFLIGHT if stream_mode == 'window' else 1,
+                                                     report_progress)
+            else:
+                # Processar arquivo compilado: uma thread lê o .stream à frente do envio
+                prefetcher = _GcodePrefetcher(filepath + GCODE_STREAM_SUFFIX, PRINT_PREFETCH_KB * 1024)
+                prefetcher.wait_ready()
+                try:
+                    lines_sent = 0
                     
-                    # ✅ VERIFICAR FILAMENTO - Pausar automaticamente se faltar
-                    filament_check = check_filament_sensor(during_print=True)
-                    if not filament_check.get('has_filament'):
-                        global print_paused_by_filament
-                        print_paused_by_filament = True
-                        print_paused = True
-                        print("🚨 ALERTA: Filamento acabou! Impressão pausada automaticamente.")
-                        print("   Recarregue o filamento e clique em CONTINUAR para retomar.")
+                    for kind, offset, line in prefetcher:
+                        # Verificar se impressão foi parada
+                        if print_stopped:
+                            print("✗ Impressão PARADA pelo usuário")
+                            break
                         
-                        # Aguardar até que filamento volte E usuário clique continuar
+                        # Verificar se impressão foi pausada
+                        if print_paused and stream_mode == 'window':
+                            stream_wait_idle()  # Deixar a impressora terminar o que já recebeu
                         while print_paused and not print_stopped:
-                            filament_check = check_filament_sensor(during_print=True)
-                            if filament_check.get('has_filament') and not print_paused_by_filament:
-                                print("✓ Filamento recarregado e impressão retomada!")
-                                break
+                            print("⏸️ Impressão em PAUSA...")
                             time.sleep(1)
                         
+                        # Se parou durante a pausa, sair
                         if print_stopped:
-                            print("✗ Impressão PARADA durante falta de filamento")
+                            print("✗ Impressão PARADA durante pausa")
                             break
-                    
-                    # Remover comentários e espaços
-                    line = line.split(';')[0].strip()
-                    
-                    # Pular linhas vazias
-                    if not line:
-                        line_count += 1
-                        continue
-                    
-                    # Log para comandos importantes
-                    cmd_upper = line.upper()
-                    
-                    # 🔧 PULAR G28/G29 duplicados (mantém a 1ª execução de cada)
-                    if cmd_upper.startswith('G28'):
-                        if g28_executed:
-                            print("⏭️  Pulando G28 (já foi executado)")
-                            line_count += 1
-                            continue
-                        g28_executed = True
-                        print("  🏠 Executando homing (G28)... pode levar até 60 segundos")
-                    elif cmd_upper.startswith('G29'):
-                        if g29_executed:
-                            print("⏭️  Pulando G29 (já foi executado)")
-                            line_count += 1
-                            continue
-                        g29_executed = True
-                        print("  📐 Executando nivelamento de mesa (G29)... pode levar até 2 minutos")
-                    elif cmd_upper.startswith('M109'):
-                        print("  🔥 Aquecendo bico e aguardando temperatura...")
-                    elif cmd_upper.startswith('M190'):
-                        print("  🔥 Aquecendo mesa e aguardando temperatura...")
-                    elif cmd_upper.startswith('T'):
-                        print(f"  🔧 Selecionando extrusora: {line}")
-                    
-                    # Enviar comando com retry (aguarda resposta "ok" da impressora)
-                    # Nenhum delay extra - send_gcode() já escuta a resposta
-                    response = send_gcode(line, retries=2)
-                    
-                    if response is None:
-                        print(f"⚠️ Comando falhou (linha {line_count}): {line} - CONTINUANDO impressão...")
-                        # NÃO parar a impressão - apenas logar e continuar
-                        # Comandos malformados ou com erro não devem cancelar impressão inteira
-                    
-                    line_count += 1
-                    lines_sent += 1
-                    
-                    # Atualizar progresso a cada 50 linhas
-                    if lines_sent % 50 == 0:
-                        progress = (lines_sent / total_lines) * 100
-                        conn_local = sqlite3.connect(DB_NAME)
-                        cursor_local = conn_local.cursor()
-                        cursor_local.execute('''
-                            UPDATE print_jobs 
-                            SET progress = ?
-                            WHERE id = ?
-                        ''', (progress, job_id))
-                        conn_local.commit()
-                        conn_local.close()
-                        print(f"  Progresso: {progress:.1f}% ({lines_sent}/{total_lines})")
-                    
-                    # NÃO adicionar delay aqui - já foi tratado acima baseado no tipo de comando
+                        
+                        # ✅ VERIFICAR FILAMENTO - Pausar automaticamente se faltar
+                        filament_check = check_filament_sensor(during_print=True)
+                        if not filament_check.get('has_filament'):
+                            global print_paused_by_filament
+                            print_paused_by_filament = True
+                            print_paused = True
+                            if stream_mode == 'window':
+                                stream_wait_idle()
+                            print("🚨 ALERTA: Filamento acabou! Impressão pausada automaticamente.")
+                            publish_printer_state()
+                            print("   Recarregue o filamento e clique em CONTINUAR para retomar.")
+                            
+                            # Aguardar até que filamento volte E usuário clique continuar
+                            while print_paused and not print_stopped:
+                                filament_check = check_filament_sensor(during_print=True)
+                                if filament_check.get('has_filament') and not print_paused_by_filament:
+                                    print("✓ Filamento recarregado e impressão retomada!")
+                                    break
+                                time.sleep(1)
+                            
+                            if print_stopped:
+                                print("✗ Impressão PARADA durante falta de filamento")
+                                break
+                        
+                        # Classe e comando já resolvidos no upload (G28/G29 duplicados removidos)
+                        timeout = GCODE_KINDS[kind][1]
+                        
+                        # Log para comandos importantes
+                        if kind != 'm':
+                            if kind == 'h':
+                                print("  🏠 Executando homing (G28)... pode levar até 60 segundos")
+                            elif kind == 'l':
+                                print("  📐 Executando nivelamento de mesa (G29)... pode levar até 2 minutos")
+                            elif kind == 'w':
+                                target = 'mesa' if line.upper().startswith('M190') else 'bico'
+                                print(f"  🔥 Aquecendo {target} e aguardando temperatura...")
+                            elif kind == 't':
+                                print(f"  🔧 Selecionando extrusora: {line}")
+                        
+                        if stream_mode == 'window':
+                            # Mantém vários comandos em trânsito; os "ok" são lidos conforme a janela enche
+                            if not stream_gcode_line(line, timeout):
+                                print(f"⚠️ Comando falhou (comando {lines_sent + 1}): {line} - CONTINUANDO impressão...")
+                        else:
+                            # Enviar comando com retry (aguarda resposta "ok" da impressora)
+                            # Nenhum delay extra - send_gcode() já escuta a resposta
+                            response = send_gcode(line, timeout=timeout, retries=2, priority='bulk')
+                            stream_stats['lines_sent'] += 1
+                            
+                            if response is None:
+                                print(f"⚠️ Comando falhou (comando {lines_sent + 1}): {line} - CONTINUANDO impressão...")
+                                # NÃO parar a impressão - apenas logar e continuar
+                                # Comandos malformados ou com erro não devem cancelar impressão inteira
+                            else:
+                                stream_stats['lines_acked'] += 1
+                        
+                        lines_sent += 1
+                        
+                        # Atualizar progresso a cada 50 linhas
+                        if lines_sent % 50 == 0:
+                            prefetcher.update_stats()
+                            report_progress(lines_sent, offset)
+                        
+                        # NÃO adicionar delay aqui - já foi tratado acima baseado no tipo de comando
+                finally:
+                    prefetcher.close()
+                    prefetcher.update_stats()
             
-            # Marcar como concluído e salvar tempo real de impressão
-            conn_local = sqlite3.connect(DB_NAME)
-            cursor_local = conn_local.cursor()
+            # Aguardar os "ok" dos últimos comandos antes de finalizar
+            if stream_mode == 'window' and not STREAM_PROCESS:
+                stream_wait_idle()
+            update_stream_rate()
+            if not STREAM_PROCESS:
+                stream_stats['ack_to_write'] = stream_jitter.snapshot()
+            print(f"📈 Streaming ({stream_mode}): {stream_stats['lines_sent']} linhas em "
+                  f"{stream_stats['elapsed_sec']:.1f}s = {stream_stats['lines_per_sec']} linhas/s, "
+                  f"{stream_stats['prefetch_underruns']} underrun(s) na leitura antecipada, "
+                  f"ok→próxima linha p99 {stream_stats['ack_to_write'].get('p99_ms', 0.0)} ms")
+            
+            # Parada pelo usuário: marcar como cancelada (printer_stop normalmente já marcou)
+            if print_stopped:
+                finish_job('cancelled')
+                print(f"✗ Impressão cancelada: {lines_sent} linhas enviadas")
+                return
             
             # Calcular tempo real de impressão
-            cursor_local.execute('SELECT started_at FROM print_jobs WHERE id = ?', (job_id,))
-            started_row = cursor_local.fetchone()
-            actual_print_time = None
+            actual_seconds = None
             
-            if started_row and started_row[0]:
+            if current_time:
                 try:
-                    start_time = datetime.strptime(started_row[0], '%Y-%m-%d %H:%M:%S')
+                    start_time = datetime.strptime(current_time, '%Y-%m-%d %H:%M:%S')
                     elapsed = datetime.now() - start_time
-                    total_seconds = int(elapsed.total_seconds())
-                    hours = total_seconds // 3600
-                    minutes = (total_seconds % 3600) // 60
-                    seconds = total_seconds % 60
-                    
-                    if hours > 0:
-                        actual_print_time = f"{hours}h {minutes}m {seconds}s"
-                    else:
-                        actual_print_time = f"{minutes}m {seconds}s"
+                    actual_seconds = elapsed.total_seconds()
                     
-                    print(f"⏱️ Tempo real de impressão: {actual_print_time}")
+                    print(f"⏱️ Tempo real de impressão: {format_print_time(actual_seconds)}")
+                    if estimate:
+                        error = (estimate['total_seconds'] - elapsed.total_seconds()) / max(elapsed.total_seconds(), 1) * 100
+                        print(f"   Estimado: {format_print_time(estimate['total_seconds'])} ({error:+.1f}%)")
                 except Exception as e:
                     print(f"⚠️ Erro ao calcular tempo real: {e}")
             
-            cursor_local.execute('''
-                UPDATE print_jobs 
-                SET status = 'completed', progress = 100, completed_at = CURRENT_TIMESTAMP
-                WHERE id = ?
-            ''', (job_id,))
+            # Marcar como concluído (grava na hora) e salvar tempo real de impressão
+            finish_job('completed', progress=100)
             
-            # Atualizar tempo real no arquivo G-code (se calculado)
-            if actual_print_time:
-                cursor_local.execute('''
-                    UPDATE gcode_files 
-                    SET print_time = ? 
-                    WHERE original_name = (SELECT filename FROM print_jobs WHERE id = ?)
-                ''', (actual_print_time, job_id))
-                print(f"✓ Tempo real salvo no banco: {actual_print_time}")
-            
-            conn_local.commit()
-            conn_local.close()
+            # Tempo real na impressão (print_jobs.actual_seconds); gcode_files.print_time
+            # continua sendo o do fatiador
+            if actual_seconds is not None:
+                conn_local = get_db()
+                conn_local.execute('UPDATE print_jobs SET actual_seconds = ? WHERE id = ?',
+                                   (actual_seconds, job_id))
+                conn_local.commit()
+                print(f"✓ Tempo real salvo no banco: {format_print_time(actual_seconds)}")
             
             print(f"✓ Impressão concluída: {lines_sent} linhas enviadas")
+            publish_event('progress', {
+                'progress': 100,
+                'filename': original_name,
+                'time_elapsed': compute_print_times(current_time, 100)[0],
+                'time_remaining': '00:00:00',
+            })
             
         except Exception as e:
             print(f"✗ Erro durante impressão: {e}")
             # Marcar como erro
-            try:
-                conn_local = sqlite3.connect(DB_NAME)
-                cursor_local = conn_local.cursor()
-                cursor_local.execute('''
-                    UPDATE print_jobs 
-                    SET status = 'error', completed_at = CURRENT_TIMESTAMP
-                    WHERE id = ?
-                ''', (job_id,))
-                conn_local.commit()
-                conn_local.close()
-            except:
-                pass
+            finish_job('error')
         finally:
+            # Saídas antecipadas (falha no G21/G90/M110) também não podem ficar como 'printing'
+            finish_job('error')
             printing_in_progress = False
+            publish_printer_state()
     
     # Iniciar thread
     thread = threading.Thread(target=print_gcode_file, daemon=True)
     thread.start()
     
-    return jsonify({
+    return {
         'success': True, 
         'message': f'Iniciando impressão de {original_name}'
-    })
+    }, 200
+
+@app.route('/api/files/print/<int:file_id>', methods=['POST'])
+def print_file(file_id):
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Não autenticado'}), 401
+    
+    payload, status = printer_call('print', file_id=file_id, user_id=session['user_id'])
+    return jsonify(payload), status
 
 @app.route('/api/files/download/<int:file_id>', methods=['GET'])
 def download_file(file_id):
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Não autenticado'}), 401
     
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('SELECT filename, original_name FROM gcode_files WHERE id = ? AND user_id = ?', 
                   (file_id, session['user_id']))
     result = cursor.fetchone()
-    conn.close()
     
     if not result:
         return jsonify({'success': False, 'message': 'Arquivo não encontrado'}), 404
@@ -2072,31 +4439,266 @@ def download_file(file_id):
     
     return send_from_directory(app.config['GCODE_FOLDER'], filename, as_attachment=True, download_name=original_name)
 
+def _preview_file_row(file_id):
+    """(caminho, layer_index, layer_seconds) do arquivo do usuário logado, ou None."""
+    cursor = get_db().cursor()
+    cursor.execute('SELECT filename, layer_index, layer_seconds FROM gcode_files WHERE id = ? AND user_id = ?',
+                   (file_id, session['user_id']))
+    result = cursor.fetchone()
+    if not result:
+        return None
+    return os.path.join(app.config['GCODE_FOLDER'], result[0]), result[1], result[2]
+
+def _load_layer_index(file_id, filepath, layer_index_json):
+    """Índice de camadas do banco; arquivos enviados antes dele são indexados agora (uma vez).
+
+    Durante a impressão a indexação vai para a fila de análise e o retorno é None.
+    """
+    if layer_index_json:
+        return json.loads(layer_index_json)
+    if governor.active():
+        governor.record('layer_index')
+        submit_gcode_analysis(file_id, os.path.basename(filepath))
+        return None
+    summary = build_toolpath(filepath)
+    if not summary:
+        return None
+    conn = get_db()
+    save_toolpath_summary(conn.cursor(), file_id, summary)
+    conn.commit()
+    return summary['layer_index']
+
+def _stream_file_range(path, start, end, compress):
+    """Lê [start, end) do arquivo em blocos (gzip opcional), sem carregar o trecho inteiro."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            block = f.read(min(PREVIEW_CHUNK_BYTES, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            if compressor:
+                block = compressor.compress(block)
+                if not block:
+                    continue
+            yield block
+    if compressor:
+        yield compressor.flush()
+
+@app.route('/api/files/layers/<int:file_id>', methods=['GET'])
+@admission_controlled('preview')
+def gcode_layers(file_id):
+    """Índice de camadas: offset/tamanho em bytes de cada camada e o estado no início dela."""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Não autenticado'}), 401
+    
+    row = _preview_file_row(file_id)
+    if not row:
+        return jsonify({'success': False, 'message': 'Arquivo não encontrado'}), 404
+    filepath, layer_index_json, layer_seconds_json = row
+    if not os.path.exists(filepath):
+        return jsonify({'success': False, 'message': 'Arquivo G-code não encontrado'}), 404
+    
+    try:
+        layer_index = _load_layer_index(file_id, filepath, layer_index_json)
+    except Exception as e:
+        print(f"⚠️ Erro ao indexar camadas: {e}")
+        layer_index = None
+    if not layer_index:
+        if governor.active():
+            return governor_busy_response('Índice de camadas na fila de análise: disponível em instantes')
+        return jsonify({'success': False, 'message': 'Índice de camadas indisponível'}), 404
+    
+    size = os.path.getsize(filepath)
+    layer_seconds = json.loads(layer_seconds_json) if layer_seconds_json else []
+    layers = []
+    for i, (offset, z, x0, y0, z0, e0, relative_e) in enumerate(layer_index):
+        end = layer_index[i + 1][0] if i + 1 < len(layer_index) else size
+        layers.append({
+            'z': z,
+            'offset': offset,
+            'length': end - offset,
+            'start': {'x': x0, 'y': y0, 'z': z0, 'e': e0},
+            'relative_e': relative_e,
+            'seconds': layer_seconds[i] if i < len(layer_seconds) else None,
+        })
+    return jsonify({'success': True, 'size': size, 'layers': layers})
+
 @app.route('/api/files/preview/<int:file_id>', methods=['GET'])
+@admission_controlled('preview')
 def preview_gcode(file_id):
+    """G-code cru, em streaming.
+
+    Sem parâmetros: arquivo inteiro, com ETag e Range (bytes=...) para buscar trechos pelos
+    offsets do índice de camadas. Com ?from=<camada>&to=<camada>: só essas camadas, com
+    gzip quando o navegador aceita.
+    """
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Não autenticado'}), 401
     
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute('SELECT filename FROM gcode_files WHERE id = ? AND user_id = ?', 
-                  (file_id, session['user_id']))
-    result = cursor.fetchone()
-    conn.close()
-    
-    if not result:
+    row = _preview_file_row(file_id)
+    if not row:
         return jsonify({'success': False, 'message': 'Arquivo não encontrado'}), 404
+    filepath, layer_index_json, _ = row
+    if not os.path.exists(filepath):
+        return jsonify({'success': False, 'message': 'Arquivo G-code não encontrado'}), 404
     
-    filename = result[0]
-    filepath = os.path.join(app.config['GCODE_FOLDER'], filename)
+    if 'from' not in request.args and 'to' not in request.args:
+        return send_file(filepath, mimetype='text/plain', conditional=True, etag=True, max_age=0)
+    
+    try:
+        layer_index = _load_layer_index(file_id, filepath, layer_index_json)
+    except Exception as e:
+        print(f"⚠️ Erro ao indexar camadas: {e}")
+        layer_index = None
+    if not layer_index:
+        if governor.active():
+            return governor_busy_response('Índice de camadas na fila de análise: disponível em instantes')
+        return jsonify({'success': False, 'message': 'Índice de camadas indisponível'}), 404
+    try:
+        first = int(request.args.get('from', 0))
+        last = int(request.args.get('to', len(layer_index) - 1))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Camadas inválidas'}), 400
+    if first < 0 or last < first or first >= len(layer_index):
+        return jsonify({'success': False, 'message': 'Camadas fora do intervalo'}), 416
+    last = min(last, len(layer_index) - 1)
+    
+    stat = os.stat(filepath)
+    start = layer_index[first][0]
+    end = layer_index[last + 1][0] if last + 1 < len(layer_index) else stat.st_size
+    etag = f"{int(stat.st_mtime)}-{stat.st_size}-L{first}-{last}"
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers={'ETag': f'"{etag}"'})
     
-    # Ler G-code (limitar a 10MB para não sobrecarregar)
+    compress = request.accept_encodings.best_match(['gzip', 'identity']) == 'gzip'
+    headers = {
+        'ETag': f'"{etag}"',
+        'Cache-Control': 'no-cache',
+        'Vary': 'Accept-Encoding',
+        'X-Layer-Range': f'{first}-{last}',
+        'X-Byte-Range': f'{start}-{end - 1}',
+    }
+    if compress:
+        headers['Content-Encoding'] = 'gzip'
+    else:
+        headers['Content-Length'] = str(end - start)
+    return Response(_stream_file_range(filepath, start, end, compress),
+                    mimetype='text/plain', headers=headers, direct_passthrough=True)
+
+@app.route('/api/files/geometry/<int:file_id>', methods=['GET'])
+@admission_controlled('preview')
+def gcode_geometry(file_id):
+    """Índice da geometria binária: onde está cada camada dentro de /api/files/geometry/<id>/data."""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Não autenticado'}), 401
+    
+    row = _preview_file_row(file_id)
+    if not row:
+        return jsonify({'success': False, 'message': 'Arquivo não encontrado'}), 404
+    filepath, layer_index_json, _ = row
+    if not os.path.exists(filepath):
+        return jsonify({'success': False, 'message': 'Arquivo G-code não encontrado'}), 404
+    
+    if governor.active() and read_geometry_header(filepath) is None:
+        # Gerar a geometria (e o toolpath) agora competiria com a impressão
+        governor.record('geometry')
+        submit_gcode_analysis(file_id, os.path.basename(filepath))
+        return governor_busy_response('Geometria na fila de análise: disponível em instantes')
     try:
-        with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
-            gcode_content = f.read(10 * 1024 * 1024)  # Max 10MB
-        return jsonify({'success': True, 'gcode': gcode_content})
+        # Índice antes: arquivos antigos regeneram o .toolpath aqui, e o .geometry sai dele
+        layer_index = _load_layer_index(file_id, filepath, layer_index_json)
+        with _geometry_lock:
+            header = ensure_geometry(filepath)
     except Exception as e:
-        return jsonify({'success': False, 'message': f'Erro ao ler arquivo: {str(e)}'}), 500
+        print(f"⚠️ Erro ao gerar geometria: {e}")
+        header = None
+    if not header:
+        return jsonify({'success': False, 'message': 'Geometria indisponível'}), 404
+    
+    layers = []
+    for i in range(header['layers']):
+        levels = []
+        for level in header['levels']:
+            vertices = level['layer_vertices']
+            levels.append({
+                'offset': level['offset'] + vertices[i] * GEOMETRY_VERTEX_BYTES,
+                'length': (vertices[i + 1] - vertices[i]) * GEOMETRY_VERTEX_BYTES,
+                'vertices': vertices[i + 1] - vertices[i],
+            })
+        layers.append({
+            'z': layer_index[i][1] if layer_index and i < len(layer_index) else None,
+            'levels': levels,
+        })
+    summary = header['summary']
+    return jsonify({
+        'success': True,
+        'version': header['version'],
+        'floats_per_vertex': header['floats_per_vertex'],
+        'size': os.path.getsize(geometry_path(filepath)),
+        'bbox_min': summary.get('bbox_min'),
+        'bbox_max': summary.get('bbox_max'),
+        'levels': [{'tolerance': level['tolerance'], 'infill': level['infill'], 'max_error': level['max_error'],
+                    'vertices': level['layer_vertices'][-1]} for level in header['levels']],
+        'default_budget': GEOMETRY_VERTEX_BUDGET,
+        'layers': layers,
+    })
+
+@app.route('/api/files/geometry/<int:file_id>/data', methods=['GET'])
+@admission_controlled('preview')
+def gcode_geometry_data(file_id):
+    """Geometria binária (float32 little-endian).
+
+    Sem parâmetros: o .geometry inteiro, com ETag e Range. Com ?from=<camada>&to=<camada>:
+    essas camadas em um nível de detalhe - ?level=<n> ou o mais detalhado que caiba em
+    ?budget=<vértices> (padrão GEOMETRY_VERTEX_BUDGET); o nível usado vai em X-Geometry-Level.
+    """
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Não autenticado'}), 401
+    
+    row = _preview_file_row(file_id)
+    if not row:
+        return jsonify({'success': False, 'message': 'Arquivo não encontrado'}), 404
+    path = geometry_path(row[0])
+    header = read_geometry_header(row[0])
+    if not header:
+        return jsonify({'success': False, 'message': 'Geometria indisponível'}), 404
+    
+    if 'from' not in request.args and 'to' not in request.args:
+        # ETag de send_file vem de mtime/tamanho: muda quando o .geometry é regenerado
+        return send_file(path, mimetype='application/octet-stream', conditional=True, etag=True, max_age=0)
+    
+    try:
+        first = int(request.args.get('from', 0))
+        last = min(int(request.args.get('to', header['layers'] - 1)), header['layers'] - 1)
+        budget = int(request.args.get('budget', GEOMETRY_VERTEX_BUDGET))
+        level = int(request.args['level']) if 'level' in request.args else None
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Parâmetros inválidos'}), 400
+    if first < 0 or last < first:
+        return jsonify({'success': False, 'message': 'Camadas fora do intervalo'}), 416
+    if level is None:
+        level = level_for_budget(header, first, last, budget)
+    elif not 0 <= level < len(header['levels']):
+        return jsonify({'success': False, 'message': 'Nível de detalhe inválido'}), 400
+    
+    stat = os.stat(path)
+    start, end = layer_range(header, level, first, last)
+    etag = f"{int(stat.st_mtime)}-{stat.st_size}-L{first}-{last}-D{level}"
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding',
+               'X-Geometry-Level': str(level), 'X-Layer-Range': f'{first}-{last}'}
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+    
+    compress = request.accept_encodings.best_match(['gzip', 'identity']) == 'gzip'
+    if compress:
+        headers['Content-Encoding'] = 'gzip'
+    else:
+        headers['Content-Length'] = str(end - start)
+    return Response(_stream_file_range(path, start, end, compress),
+                    mimetype='application/octet-stream', headers=headers, direct_passthrough=True)
 
 # ==================== ROTAS DE CONFIGURAÇÃO WI-FI ====================
 
@@ -2106,12 +4708,36 @@ def wifi_page():
         return redirect(url_for('login'))
     return render_template('wifi.html')
 
+# Último scan de Wi-Fi (printer_settings, visto por todos os workers): durante a impressão
+# ele é devolvido no lugar de um scan novo (o scan sobe um python3 com sudo e o nmcli, e
+# disputa CPU com o envio das linhas)
+def load_wifi_scan_cache():
+    row = get_db().execute("SELECT value FROM printer_settings WHERE key = 'wifi_scan'").fetchone()
+    return json.loads(row[0]) if row else None
+
+def save_wifi_scan_cache(networks):
+    conn = get_db()
+    conn.execute('''
+        INSERT OR REPLACE INTO printer_settings (key, value, updated_at)
+        VALUES ('wifi_scan', ?, CURRENT_TIMESTAMP)
+    ''', (json.dumps({'networks': networks, 'at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}),))
+    conn.commit()
+
 @app.route('/api/wifi/scan', methods=['GET'])
 def wifi_scan():
     """Escaneia redes Wi-Fi disponíveis"""
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Não autenticado'}), 401
     
+    if governor.active():
+        cached = load_wifi_scan_cache()
+        if cached is None:
+            governor.record('wifi_scan', rejected=True)
+            return governor_busy_response('Busca de redes indisponível durante a impressão')
+        governor.record('wifi_scan')
+        return jsonify({'success': True, 'networks': cached['networks'], 'cached': True,
+                        'scanned_at': cached['at']})
+    
     try:
         result = subprocess.run(['sudo', 'python3', 'wifi_manager.py', 'scan'], 
                               capture_output=True, text=True, timeout=15)
@@ -2130,6 +4756,7 @@ def wifi_scan():
                     'security': security
                 })
         
+        save_wifi_scan_cache(networks)
         return jsonify({'success': True, 'networks': networks})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -2251,14 +4878,26 @@ def mistura():
         return redirect(url_for('login'))
     return render_template('mistura.html', username=session.get('username'))
 
+@printer_method('select_brush')
+def select_brush_command(brush: int) -> bool:
+    """Envia T<n> e guarda o pincel atual (no dono da impressora)."""
+    global current_brush
+    response = send_gcode(f'T{brush}', wait_for_ok=True, timeout=10)
+    if response:
+        current_brush = brush
+        print(f"✓ Pincel T{brush} selecionado")
+    return bool(response)
+
+@printer_method('current_brush')
+def current_brush_payload() -> int:
+    return current_brush
+
 @app.route('/api/printer/select-brush', methods=['POST'])
 def select_brush():
     """Seleciona um pincel (extrusor T0-T18)"""
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Não autenticado'}), 401
     
-    global current_brush
-    
     try:
         data = request.get_json()
         brush = int(data.get('brush', 0))
@@ -2268,12 +4907,7 @@ def select_brush():
             return jsonify({'success': False, 'message': 'Pincel inválido (T0-T18)'}), 400
         
         # Enviar comando para impressora
-        command = f'T{brush}'
-        response = send_gcode(command, wait_for_ok=True, timeout=10)
-        
-        if response:
-            current_brush = brush
-            print(f"✓ Pincel T{brush} selecionado")
+        if printer_call('select_brush', call_timeout=PRINTER_DAEMON_TIMEOUT_SEC + 10, brush=brush):
             return jsonify({
                 'success': True,
                 'message': f'Pincel T{brush} selecionado',
@@ -2295,7 +4929,7 @@ def get_current_brush():
     
     return jsonify({
         'success': True,
-        'brush': current_brush
+        'brush': printer_call('current_brush')
     })
 
 @app.route('/api/printer/send-mixture', methods=['POST'])
@@ -2344,7 +4978,7 @@ def save_brush_mixtures():
         tintaColors = data.get('tintaColors', {})
         
         # Salvar no banco de dados usando SQLite direto
-        conn = sqlite3.connect(DB_NAME)
+        conn = get_db()
         cursor = conn.cursor()
         
         for brush_index, mixture in mixtures.items():
@@ -2361,7 +4995,6 @@ def save_brush_mixtures():
                 continue
         
         conn.commit()
-        conn.close()
         return jsonify({'success': True, 'message': 'Misturas e cores salvas com sucesso'})
     
     except Exception as e:
@@ -2377,11 +5010,10 @@ def load_brush_mixtures():
     try:
         # Tentar carregar do banco de dados
         try:
-            conn = sqlite3.connect(DB_NAME)
+            conn = get_db()
             cursor = conn.cursor()
             cursor.execute("SELECT brush_id, a_percent, b_percent, c_percent, custom_color, tinta_color FROM brush_mixtures")
             rows = cursor.fetchall()
-            conn.close()
             
             mixtures = {}
             colors = {}
@@ -2413,26 +5045,26 @@ def load_brush_mixtures():
         print(f"Erro ao carregar misturas: {str(e)}")
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@printer_method('filament')
+def filament_status_payload() -> dict:
+    return check_filament_sensor(during_print=printing_in_progress)
+
 @app.route('/api/filament/status', methods=['GET'])
 def filament_status_api():
     """Retorna status do sensor de filamento"""
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Não autenticado'}), 401
     
-    status = check_filament_sensor(during_print=printing_in_progress)
+    status = printer_call('filament')
     return jsonify({
         'success': True,
         'filament': status
     })
 
 
-@app.route('/api/filament/debug', methods=['GET'])
-def filament_debug_api():
-    """Diagnóstico do sensor de filamento (especialmente para modo Marlin/M119)."""
-    if 'user_id' not in session:
-        return jsonify({'success': False, 'message': 'Não autenticado'}), 401
-
-    force = request.args.get('force', '').strip() in ('1', 'true', 'True', 'yes', 'YES')
+@printer_method('filament_debug')
+def filament_debug_payload(force: bool = False) -> dict:
+    """Diagnóstico do sensor no dono da impressora (cache, M119 bruto e interpretado)."""
     debug = {
         'mode': FILAMENT_SENSOR_MODE,
         'check_interval_sec': FILAMENT_CHECK_INTERVAL_SEC,
@@ -2467,30 +5099,85 @@ def filament_debug_api():
         debug['m119_candidates'] = _extract_marlin_m119_candidates(raw_m119 or '')
         debug['m119_parsed_has_filament'] = _parse_marlin_m119_for_filament(raw_m119 or '')
 
+    return debug
+
+
+@app.route('/api/filament/debug', methods=['GET'])
+def filament_debug_api():
+    """Diagnóstico do sensor de filamento (especialmente para modo Marlin/M119)."""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Não autenticado'}), 401
+
+    force = request.args.get('force', '').strip() in ('1', 'true', 'True', 'yes', 'YES')
+    debug = printer_call('filament_debug', call_timeout=PRINTER_DAEMON_TIMEOUT_SEC + 10, force=force)
     return jsonify({'success': True, 'debug': debug})
 
-if __name__ == '__main__':
+def start_printer_owner():
+    """Inicia a parte dona da impressora: telemetria e sensor de filamento (app.py sozinho
+    ou printer_daemon.py). A porta serial abre na primeira conexão/impressão."""
+    # Antes de qualquer thread: elas herdam a afinidade sem o núcleo do processo de envio
+    if STREAM_PROCESS:
+        reserve_stream_cpu()
+    
     init_db()
     
+    # Status para os workers da interface (publicado pela telemetria e pela impressão)
+    if STATUS_BOARD:
+        open_status_board()
+    
+    # Telemetria/eventos rodam mesmo antes da impressora conectar (ex: sensor GPIO)
+    start_telemetry()
+    
+    # Manutenção dos arquivos num processo só (o dono), nunca em cada worker da interface:
+    # metadados lidos por uma versão anterior do parser e cópias repetidas de antes do
+    # armazenamento pelo conteúdo. As análises ficam com a interface (start_web)
+    threading.Thread(target=reindex_gcode_metadata, daemon=True).start()
+    threading.Thread(target=dedup_gcode_files, daemon=True).start()
+    
     # Configurar sensor de filamento
     print("\n" + "="*50)
     print("🖨️  Chromasistem - Sistema de Monitoramento 3D")
     print("="*50)
     setup_filament_sensor()
     print("="*50 + "\n")
+
+
+def stop_printer_owner():
+    # Limpar GPIO ao encerrar
+    if GPIO_AVAILABLE:
+        try:
+            GPIO.cleanup()
+            print("✓ GPIO limpo")
+        except:
+            pass
+
+
+def start_web():
+    """Inicia o processo da interface web (python3 app.py ou wsgi.py). Com PRINTER_DAEMON=1
+    só prepara o banco: serial, impressão, sensor e manutenção ficam com o printer_daemon.py.
+    A análise dos G-codes é sempre da interface (fora do processo que envia a impressão)."""
+    if PRINTER_DAEMON:
+        init_db()
+        print(f"🌐 Interface web usando o daemon da impressora em {PRINTER_DAEMON_SOCKET}")
+    else:
+        start_printer_owner()
+    threading.Thread(target=resume_gcode_analysis, daemon=True).start()
+
+
+def stop_web():
+    if not PRINTER_DAEMON:
+        stop_printer_owner()
+
+
+if __name__ == '__main__':
+    start_web()
     
-    # Iniciar servidor
+    # Iniciar servidor (um processo, uma thread por requisição; ver wsgi.py)
     try:
         # porta pode ser ajustada via variável de ambiente PORT (padrão 8080)
         port = int(os.environ.get('PORT', 8080))
-        app.run(host='0.0.0.0', port=port, debug=True, use_reloader=False)
+        app.run(host='0.0.0.0', port=port, threaded=True, use_reloader=False)
     except KeyboardInterrupt:
         print("\n⏹️  Servidor interrompido pelo usuário")
     finally:
-        # Limpar GPIO ao encerrar
-        if GPIO_AVAILABLE:
-            try:
-                GPIO.cleanup()
-                print("✓ GPIO limpo")
-            except:
-                pass
+        stop_web()
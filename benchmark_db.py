@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Benchmark do banco de dados: latência das consultas frequentes conforme
+print_jobs cresce (1k, 10k, 100k impressões), com e sem índices, e abrindo
+uma conexão por consulta (como antes) ou reaproveitando a conexão.
+
+Uso: python3 benchmark_db.py [repetições]
+"""
+
+import os
+import sys
+import time
+import random
+import sqlite3
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app  # noqa: E402  (usa o schema e os índices reais do init_db)
+
+SIZES = (1000, 10000, 100000)
+FILES = 300
+REPEAT = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+INDEXES = {
+    'idx_print_jobs_status_started': 'print_jobs (status, started_at)',
+    'idx_gcode_files_user_uploaded': 'gcode_files (user_id, uploaded_at)',
+    'idx_gcode_files_original_name': 'gcode_files (original_name)',
+}
+
+QUERIES = {
+    # Consulta que o /api/printer/status fazia a cada 2 s por cliente
+    'status_join': ('''
+        SELECT pj.filename, pj.progress, pj.started_at, gf.print_time
+        FROM print_jobs pj
+        LEFT JOIN gcode_files gf ON pj.filename = gf.original_name
+        WHERE pj.status = 'printing'
+        ORDER BY pj.started_at DESC
+        LIMIT 1
+    ''', ()),
+    'list_files': ('''
+        SELECT id, original_name, file_size, uploaded_at, last_printed, print_count
+        FROM gcode_files
+        WHERE user_id = ?
+        ORDER BY uploaded_at DESC
+    ''', (1,)),
+    'file_by_name': ('SELECT print_time FROM gcode_files WHERE original_name = ?', ('arquivo_150.gcode',)),
+}
+
+
+def populate(db_path, jobs):
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.executemany('''
+        INSERT INTO gcode_files (user_id, filename, original_name, file_size, print_time, uploaded_at)
+        VALUES (?, ?, ?, ?, ?, datetime('now', ?))
+    ''', [(1, f'f_{i}.gcode', f'arquivo_{i}.gcode', 1000 * i, '1h 2m 3s', f'-{i} minutes')
+          for i in range(FILES)])
+    cursor.executemany('''
+        INSERT INTO print_jobs (user_id, filename, status, progress, started_at, completed_at)
+        VALUES (?, ?, ?, 100, datetime('now', ?), datetime('now', ?))
+    ''', [(1, f'arquivo_{random.randrange(FILES)}.gcode', random.choice(('completed', 'cancelled', 'error')),
+           f'-{i} minutes', f'-{i} minutes') for i in range(jobs)])
+    cursor.execute('''
+        INSERT INTO print_jobs (user_id, filename, status, progress, started_at)
+        VALUES (1, 'arquivo_10.gcode', 'printing', 42, datetime('now'))
+    ''')
+    conn.commit()
+    conn.close()
+
+
+def set_indexes(db_path, enabled):
+    conn = sqlite3.connect(db_path)
+    for name, target in INDEXES.items():
+        if enabled:
+            conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {target}')
+        else:
+            conn.execute(f'DROP INDEX IF EXISTS {name}')
+    conn.execute('ANALYZE')
+    conn.commit()
+    conn.close()
+
+
+def time_query(sql, params, reuse):
+    """Latência média (ms) de uma consulta."""
+    if reuse:
+        conn = app.open_db_connection()
+        conn.execute(sql, params).fetchall()  # aquecer cache/statement
+        start = time.perf_counter()
+        for _ in range(REPEAT):
+            conn.execute(sql, params).fetchall()
+        elapsed = time.perf_counter() - start
+        conn.close()
+    else:
+        start = time.perf_counter()
+        for _ in range(REPEAT):
+            conn = sqlite3.connect(app.DB_NAME)
+            conn.execute(sql, params).fetchall()
+            conn.close()
+        elapsed = time.perf_counter() - start
+    return elapsed / REPEAT * 1000
+
+
+def main():
+    print("\n" + "=" * 72)
+    print("📊 BENCHMARK DO BANCO DE DADOS")
+    print("=" * 72)
+    print(f"Repetições por medida: {REPEAT}\n")
+    print(f"{'print_jobs':>10}  {'consulta':<14} {'sem índice':>12} {'com índice':>12} {'índice+pool':>12}")
+    print("-" * 72)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for jobs in SIZES:
+            app.DB_NAME = os.path.join(tmp, f'bench_{jobs}.db')
+            app.init_db()
+            populate(app.DB_NAME, jobs)
+
+            results = {}
+            for enabled in (False, True):
+                set_indexes(app.DB_NAME, enabled)
+                for name, (sql, params) in QUERIES.items():
+                    results[(name, enabled, False)] = time_query(sql, params, reuse=False)
+                    if enabled:
+                        results[(name, enabled, True)] = time_query(sql, params, reuse=True)
+
+            for name in QUERIES:
+                print(f"{jobs:>10}  {name:<14} "
+                      f"{results[(name, False, False)]:>9.3f} ms "
+                      f"{results[(name, True, False)]:>9.3f} ms "
+                      f"{results[(name, True, True)]:>9.3f} ms")
+            print()
+
+    print("sem índice / com índice: nova conexão a cada consulta (como as rotas faziam)")
+    print("índice+pool: conexão reaproveitada (get_db) com statements em cache")
+
+
+if __name__ == '__main__':
+    main()
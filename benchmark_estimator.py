@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Benchmark da estimativa de tempo: compara, para cada impressão concluída, o tempo real
+gravado em print_jobs.actual_seconds com as estimativas do arquivo impresso (file_id):
+
+- fatiador: tempo escrito nos comentários do G-code
+- cinemática: gcode_estimator (aceleração trapezoidal, limites do M503)
+- sem aceleração: distância / feedrate
+
+O tempo real inclui aquecimento, homing e nivelamento, que nenhuma das estimativas
+considera; o erro de arquivos curtos fica dominado por isso.
+
+Uso: python3 benchmark_estimator.py [croma.db] [pasta_gcode]
+"""
+
+import os
+import re
+import sys
+import time
+import sqlite3
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app  # noqa: E402  (mesmas funções de metadados e limites do servidor)
+from gcode_toolpath import build_toolpath, load_toolpath  # noqa: E402
+from gcode_estimator import estimate_toolpath, scan_limit_changes  # noqa: E402
+
+DB_PATH = sys.argv[1] if len(sys.argv) > 1 else app.DB_NAME
+GCODE_FOLDER = sys.argv[2] if len(sys.argv) > 2 else app.app.config['GCODE_FOLDER']
+
+
+def slicer_seconds(path):
+    """Tempo do fatiador: cabeçalho (parse_gcode_metadata) ou bloco final (OrcaSlicer/PrusaSlicer)."""
+    metadata = app.parse_gcode_metadata(path) or {}
+    seconds = app.parse_print_time_seconds(metadata.get('print_time'))
+    if seconds:
+        return seconds
+    with open(path, 'rb') as f:
+        f.seek(max(0, os.path.getsize(path) - 64 * 1024))
+        tail = f.read().decode('utf-8', 'ignore')
+    match = re.search(r'estimated printing time[^=]*=\s*([^\n]+)', tail)
+    return app.parse_print_time_seconds(match.group(1)) if match else None
+
+
+def error_pct(estimate, actual):
+    if not estimate or not actual:
+        return None
+    return (estimate - actual) / actual * 100
+
+
+def fmt_error(value):
+    return f"{value:>+8.1f}%" if value is not None else f"{'-':>9}"
+
+
+def main():
+    conn = sqlite3.connect(DB_PATH)
+    app.DB_NAME = DB_PATH
+    # Só impressões concluídas com o tempo medido, ligadas ao arquivo que foi impresso
+    rows = conn.execute('''
+        SELECT gf.filename, gf.original_name, pj.actual_seconds
+        FROM print_jobs pj
+        JOIN gcode_files gf ON gf.id = pj.file_id
+        WHERE pj.status = 'completed' AND pj.actual_seconds IS NOT NULL
+        ORDER BY pj.started_at
+    ''').fetchall()
+    conn.close()
+
+    limits = app.get_motion_limits()
+
+    print("\n" + "=" * 96)
+    print("⏱️ BENCHMARK DA ESTIMATIVA DE TEMPO")
+    print("=" * 96)
+    print(f"Banco: {DB_PATH}  |  impressões concluídas: {len(rows)}")
+    print(f"Limites: aceleração {limits['accel_print']:.0f} mm/s², "
+          f"{'junction deviation ' + str(limits['junction_deviation']) if limits['junction_deviation'] else 'jerk clássico'}\n")
+    print(f"{'arquivo':<32} {'real':>9} {'fatiador':>9} {'cinemát.':>9} {'s/ acel.':>9} {'calc.':>7}")
+    print("-" * 96)
+
+    errors = {'slicer': [], 'kinematic': [], 'naive': []}
+    for filename, original_name, actual in rows:
+        path = os.path.join(GCODE_FOLDER, filename)
+        if not actual or not os.path.exists(path):
+            continue
+
+        slicer = slicer_seconds(path)
+
+        start = time.perf_counter()
+        toolpath = load_toolpath(path)
+        if toolpath is None:
+            build_toolpath(path)
+            toolpath = load_toolpath(path)
+        estimate = estimate_toolpath(toolpath, limits, scan_limit_changes(path))
+        elapsed = time.perf_counter() - start
+
+        results = {
+            'slicer': error_pct(slicer, actual),
+            'kinematic': error_pct(estimate['total_seconds'], actual),
+            'naive': error_pct(estimate['naive_seconds'], actual),
+        }
+        for name, value in results.items():
+            if value is not None:
+                errors[name].append(abs(value))
+        print(f"{original_name[:32]:<32} {actual / 60:>7.1f}m "
+              f"{fmt_error(results['slicer'])} {fmt_error(results['kinematic'])} "
+              f"{fmt_error(results['naive'])} {elapsed:>6.2f}s")
+
+    print("-" * 96)
+    for name, label in (('slicer', 'fatiador'), ('kinematic', 'cinemática'), ('naive', 'sem aceleração')):
+        values = sorted(errors[name])
+        if values:
+            print(f"{label:<16} erro absoluto médio {sum(values) / len(values):6.1f}%   "
+                  f"mediana {values[len(values) // 2]:6.1f}%   ({len(values)} impressões)")
+    print("\nErro = (estimado - real) / real. Tempo real inclui aquecimento e homing.")
+
+
+if __name__ == '__main__':
+    main()
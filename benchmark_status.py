@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Benchmark do /api/printer/status com muitos clientes: pedido ao daemon x quadro de status.
+
+Sobe o daemon da impressora (printer_daemon.py, sem impressora: uma impressão simulada
+atualiza o progresso --writes-per-sec vezes por segundo) e a interface web (app.py com
+PRINTER_DAEMON=1) em processos separados, como na Raspberry. --clients threads fazem
+GET /api/printer/status sem parar, por --seconds em cada modo:
+
+- daemon: STATUS_BOARD=0, cada requisição pede o status ao daemon pelo socket Unix
+- quadro: STATUS_BOARD=1, a interface lê o registro da memória compartilhada
+
+Mostra requisições/s e latência (p50, p99, máximo) de cada modo, e quantas leituras/s um
+processo consegue fazer direto do quadro (com as escritas do daemon acontecendo).
+
+Uso: python3 benchmark_status.py [--clients 50] [--seconds 5] [--writes-per-sec 20]
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+
+# Daemon com uma impressão simulada em andamento (sem serial: o status vem da memória)
+DAEMON_BOOTSTRAP = '''
+import sys, time, threading
+sys.path.insert(0, {root!r})
+import app, printer_daemon
+app.init_db()
+app.start_job(1, 'benchmark_status.gcode', time.strftime('%Y-%m-%d %H:%M:%S'), 3600, 250)
+
+def simulate_print(interval):
+    offset = 0
+    while True:
+        offset += 1000
+        progress = (offset / 10000000 * 100) % 100
+        app.update_job_progress(progress, 3600 * (1 - progress / 100), offset, offset // 40000)
+        time.sleep(interval)
+
+threading.Thread(target=simulate_print, args=({interval!r},), daemon=True).start()
+printer_daemon.main()
+'''
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_http(port, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def request(port, method, path, body=None, cookie=None):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    headers = {'Content-Type': 'application/json'}
+    if cookie:
+        headers['Cookie'] = cookie
+    conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+    response = conn.getresponse()
+    data = response.read()
+    set_cookie = response.getheader('Set-Cookie')
+    conn.close()
+    return response.status, data, set_cookie
+
+
+def client_worker(port, cookie, deadline, latencies, errors):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            status, data, _ = request(port, 'GET', '/api/printer/status', cookie=cookie)
+        except OSError:
+            errors.append(1)
+            continue
+        if status != 200:
+            errors.append(status)
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def run_mode(tmp, env, status_board, clients, seconds):
+    port = free_port()
+    web_env = dict(env, PRINTER_DAEMON='1', STATUS_BOARD='1' if status_board else '0', PORT=str(port))
+    with open(os.path.join(tmp, 'web.log'), 'a') as log:
+        web = subprocess.Popen([sys.executable, os.path.join(ROOT, 'app.py')], cwd=tmp, env=web_env,
+                               stdout=log, stderr=subprocess.STDOUT)
+    try:
+        if not wait_http(port):
+            raise RuntimeError('interface web não subiu (ver web.log)')
+        # Primeiro usuário (o registro só é permitido uma vez) ou login
+        status, _, cookie = request(port, 'POST', '/api/register', {'username': 'bench', 'password': 'bench123'})
+        if status != 200:
+            status, _, cookie = request(port, 'POST', '/api/login', {'username': 'bench', 'password': 'bench123'})
+        cookie = cookie.split(';', 1)[0]
+        # Aquecimento: conexão com o daemon, assinatura de eventos, quadro aberto
+        for _ in range(20):
+            request(port, 'GET', '/api/printer/status', cookie=cookie)
+            time.sleep(0.05)
+        latencies, errors = [], []
+        deadline = time.perf_counter() + seconds
+        threads = [threading.Thread(target=client_worker, args=(port, cookie, deadline, latencies, errors))
+                   for _ in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        latencies.sort()
+        return {
+            'requests_per_sec': len(latencies) / seconds,
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'max_ms': (latencies[-1] if latencies else 0.0) * 1000,
+            'errors': len(errors),
+        }
+    finally:
+        web.terminate()
+        web.wait(10)
+
+
+def board_reads_per_sec(path, seconds=1.0):
+    from status_board import StatusBoardReader
+    reader = StatusBoardReader(path)
+    reads = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for _ in range(1000):
+            reader.read()
+        reads += 1000
+    stats = dict(reader.stats)
+    reader.close()
+    return reads / seconds, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark do /api/printer/status (daemon x quadro de status)')
+    parser.add_argument('--clients', type=int, default=50, help='clientes simultâneos')
+    parser.add_argument('--seconds', type=float, default=5, help='duração de cada modo')
+    parser.add_argument('--writes-per-sec', type=float, default=20, help='atualizações de progresso do daemon')
+    args = parser.parse_args()
+
+    shm = '/dev/shm' if os.path.isdir('/dev/shm') else None
+    with tempfile.TemporaryDirectory() as tmp, tempfile.TemporaryDirectory(dir=shm) as shm_tmp:
+        env = dict(os.environ,
+                   PRINTER_DAEMON_SOCKET=os.path.join(tmp, 'printer.sock'),
+                   STATUS_BOARD_PATH=os.path.join(shm_tmp, 'croma-status'),
+                   STATUS_BOARD='1',
+                   SECRET_KEY='benchmark-status',
+                   FILAMENT_SENSOR_MODE='none')
+        bootstrap = DAEMON_BOOTSTRAP.format(root=ROOT, interval=1.0 / args.writes_per_sec)
+        with open(os.path.join(tmp, 'daemon.log'), 'w') as log:
+            daemon = subprocess.Popen([sys.executable, '-c', bootstrap], cwd=tmp, env=env,
+                                      stdout=log, stderr=subprocess.STDOUT)
+        try:
+            deadline = time.time() + 20
+            while not os.path.exists(env['PRINTER_DAEMON_SOCKET']) and time.time() < deadline:
+                time.sleep(0.2)
+            results = []
+            for name, status_board in (('daemon', False), ('quadro', True)):
+                print(f"▶️ Modo {name}: {args.clients} clientes por {args.seconds:.0f}s...")
+                results.append((name, run_mode(tmp, env, status_board, args.clients, args.seconds)))
+            reads, reader_stats = board_reads_per_sec(env['STATUS_BOARD_PATH'])
+        finally:
+            daemon.terminate()
+            daemon.wait(10)
+
+    print("\n" + "=" * 70)
+    print("📊 BENCHMARK DO /api/printer/status")
+    print("=" * 70)
+    print(f"{args.clients} clientes simultâneos, {args.seconds:.0f}s por modo, "
+          f"daemon publicando {args.writes_per_sec:.0f} atualizações/s\n")
+    print(f"{'modo':<10} {'req/s':>9} {'p50':>10} {'p99':>10} {'máximo':>10} {'erros':>7}")
+    print("-" * 70)
+    for name, r in results:
+        print(f"{name:<10} {r['requests_per_sec']:>9.0f} {r['p50_ms']:>8.2f}ms {r['p99_ms']:>8.2f}ms "
+              f"{r['max_ms']:>8.2f}ms {r['errors']:>7}")
+    print(f"\nLeitura direta do quadro: {reads:,.0f} leituras/s num processo "
+          f"({reader_stats['retries']} releituras por escrita em andamento)")
+
+
+if __name__ == '__main__':
+    main()
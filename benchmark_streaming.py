@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Benchmark do envio da impressão: thread no processo do Flask x processo próprio (STREAM_PROCESS=1).
+
+Uma impressora falsa (outro processo, ligado por um pseudo-terminal) responde "ok" a cada
+linha depois de --ack-ms, como o Marlin tirando comandos do buffer. A impressão passa pela
+rota real (/api/files/print) e, enquanto ela roda, --load threads fazem requisições ao Flask
+(status, lista de arquivos, histórico) e geram lixo com ciclos (coletas da geração 2).
+
+Mede o intervalo entre o "ok" que abriu vaga na janela e a escrita da linha seguinte
+(ack_to_write: média, p50, p95, p99, máximo) e linhas/s, nos dois modos. Num Raspberry Pi
+carregado, o p99 e o máximo do modo processo devem cair.
+
+Uso: python3 benchmark_streaming.py [arquivo.gcode] [--lines N] [--load N] [--ack-ms X]
+"""
+
+import io
+import os
+import re
+import sys
+import tty
+import json
+import time
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+FAKE_TEMPERATURE = b'ok T:210.0 /210.0 B:60.0 /60.0 @:0 B@:0\n'
+_LINE_NUMBER_RE = re.compile(rb'^N\d+ (.*?)\*\d+$')
+
+
+def fake_printer(fd, ack_sec):
+    """Processo filho: responde como o Marlin (ok, M105, M115) pelo lado mestre do pty."""
+    buffer = b''
+    while True:
+        try:
+            data = os.read(fd, 4096)
+        except OSError:
+            os._exit(0)
+        if not data:
+            os._exit(0)
+        buffer += data
+        while b'\n' in buffer:
+            raw, buffer = buffer.split(b'\n', 1)
+            line = raw.strip()
+            match = _LINE_NUMBER_RE.match(line)
+            if match:
+                line = match.group(1)
+            if not line:
+                continue
+            if ack_sec and line.startswith((b'G0', b'G1', b'G2', b'G3')):
+                time.sleep(ack_sec)
+            if line.startswith(b'M105'):
+                os.write(fd, FAKE_TEMPERATURE)
+            elif line.startswith(b'M115'):
+                os.write(fd, b'FIRMWARE_NAME:Marlin bench\nCap:AUTOREPORT_TEMP:0\nok\n')
+            else:
+                os.write(fd, b'ok\n')
+
+
+def synthetic_gcode(lines):
+    out = io.StringIO()
+    out.write('; benchmark\nG28\nG90\n')
+    for i in range(lines):
+        out.write(f'G1 X{(i * 7) % 200 + 0.5:.3f} Y{(i * 13) % 200 + 0.25:.3f} E{i * 0.0123:.5f} F3000\n')
+    return out.getvalue().encode()
+
+
+def load_worker(client, stop):
+    """Carga típica do Flask: JSON, rotas, regex e objetos com ciclos (lixo para o coletor)."""
+    garbage = []
+    while not stop.is_set():
+        client.get('/api/printer/status')
+        client.get('/api/files/list')
+        client.get('/api/printer/commands-history')
+        node = {'items': [{'n': i, 'text': f'linha {i}'} for i in range(200)]}
+        node['self'] = node
+        garbage.append(node)
+        if len(garbage) > 50:
+            garbage.clear()
+        json.dumps(node['items'])
+
+
+def run_print(app, client, file_id, process_mode, load):
+    app.STREAM_PROCESS = process_mode
+    stop = threading.Event()
+    workers = [threading.Thread(target=load_worker, args=(client, stop), daemon=True) for _ in range(load)]
+    for worker in workers:
+        worker.start()
+    try:
+        start = time.perf_counter()
+        response = client.post(f'/api/files/print/{file_id}')
+        assert response.status_code == 200, response.get_json()
+        time.sleep(0.5)
+        while app.printing_in_progress or app.get_current_job():
+            time.sleep(0.2)
+        total_sec = time.perf_counter() - start
+    finally:
+        stop.set()
+        for worker in workers:
+            worker.join()
+    stats = dict(app.stream_stats)
+    return total_sec, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark do envio da impressão (thread x processo)')
+    parser.add_argument('gcode', nargs='?', help='arquivo G-code (padrão: movimentos sintéticos)')
+    parser.add_argument('--lines', type=int, default=5000, help='movimentos do G-code sintético')
+    parser.add_argument('--load', type=int, default=2, help='threads de carga no Flask')
+    parser.add_argument('--ack-ms', type=float, default=0.3, help='tempo da impressora falsa por movimento')
+    args = parser.parse_args()
+
+    if args.gcode:
+        with open(args.gcode, 'rb') as f:
+            data = f.read()
+    else:
+        data = synthetic_gcode(args.lines)
+
+    # Impressora falsa antes de qualquer thread do app (fork)
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    port = os.ttyname(slave)
+    pid = os.fork()
+    if pid == 0:
+        os.close(slave)
+        fake_printer(master, args.ack_ms / 1000.0)
+    os.close(master)
+
+    import app  # noqa: E402
+
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = os.path.join(tmp, 'gcode_files')
+        thumbs = os.path.join(tmp, 'thumbnails')
+        os.makedirs(folder)
+        os.makedirs(thumbs)
+        app.DB_NAME = os.path.join(tmp, 'bench.db')
+        app.app.config['GCODE_FOLDER'] = folder
+        app.app.config['THUMBNAIL_FOLDER'] = thumbs
+        app.init_db()
+        app.SERIAL_PORT = port
+        app.FILAMENT_SENSOR_MODE = 'none'
+        if not app.connect_printer():
+            print("✗ Impressora falsa não respondeu")
+            sys.exit(1)
+
+        client = app.app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        response = client.post('/api/files/upload', content_type='multipart/form-data',
+                               data={'file': (io.BytesIO(data), 'bench.gcode')})
+        assert response.status_code == 200, response.get_json()
+        file_id = response.get_json()['file_id']
+        app.analysis_pool.wait_idle()
+
+        results = []
+        for name, process_mode in (('thread', False), ('processo', True)):
+            print(f"\n▶️ Modo {name}...")
+            results.append((name,) + run_print(app, client, file_id, process_mode, args.load))
+        app.disconnect_printer()
+    os.kill(pid, 9)
+    os.waitpid(pid, 0)
+
+    print("\n" + "=" * 78)
+    print("⚡ BENCHMARK DO ENVIO (ok → próxima linha)")
+    print("=" * 78)
+    print(f"{len(data) / 1024:.0f} KB de G-code, {args.load} threads de carga, impressora falsa com "
+          f"{args.ack_ms} ms por movimento\n")
+    print(f"{'modo':<10} {'linhas/s':>9} {'média':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'máximo':>9}  escalonamento")
+    print("-" * 78)
+    for name, total_sec, stats in results:
+        jitter = stats.get('ack_to_write') or {}
+        process = stats.get('process') or {}
+        placement = f"{process.get('scheduler', '-')}, núcleo {process.get('cpu')}" if process else '-'
+        print(f"{name:<10} {stats['lines_per_sec']:>9.0f} {jitter.get('avg_ms', 0):>7.3f}ms "
+              f"{jitter.get('p50_ms', 0):>7.3f}ms {jitter.get('p95_ms', 0):>7.3f}ms "
+              f"{jitter.get('p99_ms', 0):>7.3f}ms {jitter.get('max_ms', 0):>7.3f}ms  {placement}")
+    for name, total_sec, stats in results:
+        process = stats.get('process') or {}
+        if process.get('gc'):
+            gc_stats = process['gc']
+            print(f"\nColetor no processo de envio: {gc_stats['collections']} coletas (só na espera por 'ok'), "
+                  f"máximo {gc_stats['max_ms']} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Benchmark do upload: tempo até a resposta e bytes lidos do disco para processar um G-code.
+
+- antes: como o upload fazia - o Werkzeug grava o arquivo num temporário, file.save()
+  copia para gcode_files/ e cada etapa (miniatura, metadados, .stream, .toolpath,
+  limites de movimento, geometria) relê o arquivo, tudo com o cliente esperando
+- agora: POST real em /api/files/upload (Flask test client); o arquivo é processado
+  enquanto chega (GcodeUpload, numa thread própria) e a resposta volta depois do
+  fsync. O .stream, o toolpath, a estimativa e a geometria terminam na fila de análise
+
+Os bytes lidos vêm de /proc/self/io (read_bytes, leituras reais do disco). Antes de cada
+etapa os arquivos envolvidos saem do cache de páginas (posix_fadvise DONTNEED), como
+num Raspberry Pi com pouca memória livre para um G-code de 100 MB.
+
+Uso: python3 benchmark_upload.py <arquivo.gcode>
+"""
+
+import io
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app  # noqa: E402  (rota real de upload)
+from gcode_toolpath import build_toolpath  # noqa: E402
+from gcode_geometry import build_geometry  # noqa: E402
+
+
+def read_bytes():
+    with open('/proc/self/io') as f:
+        for line in f:
+            if line.startswith('read_bytes:'):
+                return int(line.split()[1])
+    return 0
+
+
+def evict(*paths):
+    """Tira os arquivos do cache de páginas (a próxima leitura vai ao disco)."""
+    for path in paths:
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def mb(value):
+    return f"{value / (1024 * 1024):8.1f} MB"
+
+
+def setup(tmp):
+    folder = os.path.join(tmp, 'gcode_files')
+    thumbs = os.path.join(tmp, 'thumbnails')
+    os.makedirs(folder)
+    os.makedirs(thumbs)
+    app.DB_NAME = os.path.join(tmp, 'bench.db')
+    app.app.config['GCODE_FOLDER'] = folder
+    app.app.config['THUMBNAIL_FOLDER'] = thumbs
+    app.init_db()
+    return folder
+
+
+def run_before(source, folder):
+    """Etapas do upload antigo, cada uma com o G-code fora do cache."""
+    path = os.path.join(folder, 'antes.gcode')
+    spool = os.path.join(folder, 'werkzeug.tmp')
+    steps = []
+
+    def step(name, fn, *paths):
+        evict(*paths)
+        before = read_bytes()
+        start = time.perf_counter()
+        fn()
+        steps.append((name, time.perf_counter() - start, read_bytes() - before))
+
+    conn = sqlite3.connect(app.DB_NAME)
+    file_id = conn.execute("INSERT INTO gcode_files (user_id, filename, original_name) VALUES (1, 'antes.gcode', 'antes.gcode')").lastrowid
+    conn.commit()
+    conn.close()
+
+    step('recebe (temporário do Werkzeug)', lambda: shutil.copyfile(source, spool), source)
+    step('file.save()', lambda: shutil.copyfile(spool, path), spool)
+    os.remove(spool)
+    step('miniatura', lambda: app.extract_thumbnail(path, file_id), path)
+    step('metadados', lambda: app.parse_gcode_metadata(path), path)
+    step('.stream', lambda: app.compile_gcode_stream(path), path)
+    step('.toolpath', lambda: build_toolpath(path), path)
+    conn = sqlite3.connect(app.DB_NAME)
+    step('estimativa', lambda: app.estimate_gcode_file(conn.cursor(), file_id, path),
+         path, path + app.TOOLPATH_SUFFIX)
+    conn.commit()
+    conn.close()
+    step('geometria', lambda: build_geometry(path), path + app.TOOLPATH_SUFFIX)
+    return steps
+
+
+def run_now(source):
+    """POST real; o G-code chega da memória (como da rede)."""
+    with open(source, 'rb') as f:
+        data = f.read()
+    client = app.app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+
+    # A análise em segundo plano também lê do disco (temporários do toolpath fora do cache)
+    analyze = app.finish_gcode_analysis
+    analysis = {}
+
+    def timed_analyze(file_id, filepath, consumers, *args):
+        if 'toolpath' in consumers:
+            evict(*consumers['toolpath'].tmp_paths.values())
+        start = time.perf_counter()
+        analyze(file_id, filepath, consumers, *args)
+        analysis['seconds'] = time.perf_counter() - start
+
+    app.finish_gcode_analysis = timed_analyze
+    try:
+        before = read_bytes()
+        start = time.perf_counter()
+        response = client.post('/api/files/upload', content_type='multipart/form-data',
+                               data={'file': (io.BytesIO(data), 'agora.gcode')})
+        response_sec = time.perf_counter() - start
+        assert response.status_code == 200, response.get_json()
+        # Thread do upload (consumidores) e depois a fila de análise
+        for thread in threading.enumerate():
+            if thread is not threading.current_thread() and thread.daemon and not thread.name.startswith('analysis'):
+                thread.join()
+        app.analysis_pool.wait_idle()
+        total_sec = time.perf_counter() - start
+        return response_sec, total_sec, analysis.get('seconds', 0.0), read_bytes() - before
+    finally:
+        app.finish_gcode_analysis = analyze
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Uso: python3 benchmark_upload.py <arquivo.gcode>")
+        sys.exit(1)
+    source = sys.argv[1]
+    size = os.path.getsize(source)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = setup(tmp)
+        steps = run_before(source, folder)
+        response_sec, total_sec, analysis_sec, now_read = run_now(source)
+
+    before_read = sum(read for _, _, read in steps)
+    before_sec = sum(sec for _, sec, _ in steps)
+
+    print("\n" + "=" * 72)
+    print("📤 BENCHMARK DO UPLOAD")
+    print("=" * 72)
+    print(f"Arquivo: {source} ({mb(size).strip()})\n")
+    print(f"{'antes: etapa':<34} {'tempo':>10} {'lido do disco':>16}")
+    print("-" * 72)
+    for name, sec, read in steps:
+        print(f"{name:<34} {sec * 1000:>7.0f} ms {mb(read):>16}")
+    print("-" * 72)
+    print(f"{'total (cliente esperando)':<34} {before_sec * 1000:>7.0f} ms {mb(before_read):>16} "
+          f"({before_read / size:.1f}x o arquivo)")
+
+    print(f"\n{'agora':<34} {'tempo':>10} {'lido do disco':>16}")
+    print("-" * 72)
+    print(f"{'até a resposta (após fsync)':<34} {response_sec * 1000:>7.0f} ms")
+    print(f"{'análise depois dos blocos':<34} {analysis_sec * 1000:>7.0f} ms")
+    print(f"{'total':<34} {total_sec * 1000:>7.0f} ms {mb(now_read):>16} "
+          f"({now_read / size:.1f}x o arquivo)")
+    print("\nAgora o G-code não é relido: o que a análise lê são as colunas temporárias do")
+    print("toolpath, juntadas no .toolpath final, e o .toolpath para a geometria.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Benchmark do visualizador 3D: o que o navegador precisa receber e guardar até o
+primeiro quadro, com o G-code em texto (antes) e com a geometria binária (.geometry).
+
+- texto: /api/files/preview inteiro, interpretado no navegador, um Mesh (cilindro de
+  8 lados) por segmento
+- geometria: índice + 1º lote (2 MB) de /api/files/geometry/<id>/data no nível de
+  detalhe mais grosso (como o visualizador começa), uma LineSegments por camada
+
+Também lista cada nível de detalhe: tolerância, erro medido, vértices e bytes (cru e
+gzip, como o servidor manda).
+
+Mede no servidor (Flask test client, banco temporário) o tempo até os bytes do 1º
+quadro e calcula memória de GPU/draw calls de cada abordagem. O tempo do 1º quadro no
+navegador (com upload para a GPU) aparece no console do visualizador
+("⏱️ Primeiro quadro em ... ms").
+
+Uso: python3 benchmark_viewer.py <arquivo.gcode>
+"""
+
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import tempfile
+import zlib
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app  # noqa: E402  (rotas reais)
+from gcode_toolpath import build_toolpath  # noqa: E402
+from gcode_geometry import build_geometry, geometry_path, GEOMETRY_VERTEX_BYTES  # noqa: E402
+
+FIRST_BATCH_BYTES = 2 * 1024 * 1024  # Mesmo lote do ensureGeometryLayers
+# CylinderGeometry(r, r, h, 8, 1) com tampas: 52 vértices (posição, normal, uv) + 96 índices Uint16
+CYLINDER_GPU_BYTES = 52 * 8 * 4 + 96 * 2
+
+
+def mb(value):
+    return f"{value / (1024 * 1024):8.1f} MB"
+
+
+def gzip_size(path, start, end):
+    """Tamanho do trecho comprimido como em _stream_file_range (gzip nível 6)."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    size = 0
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            block = f.read(min(1024 * 1024, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            size += len(compressor.compress(block))
+    return size + len(compressor.flush())
+
+
+def timed_get(client, url, headers=None):
+    start = time.perf_counter()
+    response = client.get(url, headers=headers or {})
+    data = response.get_data()
+    return time.perf_counter() - start, response, data
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Uso: python3 benchmark_viewer.py <arquivo.gcode>")
+        sys.exit(1)
+    source = sys.argv[1]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = os.path.join(tmp, 'gcode_files')
+        os.makedirs(folder)
+        path = os.path.join(folder, 'bench.gcode')
+        shutil.copyfile(source, path)
+
+        # Geração no upload (uma vez por arquivo)
+        start = time.perf_counter()
+        summary = build_toolpath(path)
+        toolpath_sec = time.perf_counter() - start
+        tracemalloc.start()
+        start = time.perf_counter()
+        header = build_geometry(path)
+        geometry_sec = time.perf_counter() - start
+        geometry_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        app.DB_NAME = os.path.join(tmp, 'bench.db')
+        app.app.config['GCODE_FOLDER'] = folder
+        app.init_db()
+        conn = sqlite3.connect(app.DB_NAME)
+        file_id = conn.execute('''
+            INSERT INTO gcode_files (user_id, filename, original_name, file_size)
+            VALUES (1, 'bench.gcode', 'bench.gcode', ?)
+        ''', (os.path.getsize(path),)).lastrowid
+        app.save_toolpath_summary(conn.cursor(), file_id, summary)
+        conn.commit()
+        conn.close()
+
+        client = app.app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+
+        # Antes: arquivo inteiro em texto
+        text_sec, _, text = timed_get(client, f'/api/files/preview/{file_id}')
+
+        # Agora: índice + 1º lote de camadas no nível mais grosso
+        index_sec, response, _ = timed_get(client, f'/api/files/geometry/{file_id}')
+        index = response.get_json()
+        layers = index['layers']
+        coarse = len(index['levels']) - 1
+        total = 0
+        last = 0
+        for i, layer in enumerate(layers):
+            total += layer['levels'][coarse]['length']
+            if i > 0 and total > FIRST_BATCH_BYTES:
+                break
+            last = i
+        batch_sec, response, batch = timed_get(
+            client, f'/api/files/geometry/{file_id}/data?from=0&to={last}&level={coarse}')
+        assert response.status_code == 200
+
+        level_sizes = []
+        for level in header['levels']:
+            start_byte = level['offset']
+            end_byte = start_byte + level['layer_vertices'][-1] * GEOMETRY_VERTEX_BYTES
+            level_sizes.append((end_byte - start_byte, gzip_size(geometry_path(path), start_byte, end_byte)))
+
+    segments = header['levels'][0]['layer_vertices'][-1] // 2
+    geometry_bytes = segments * 2 * GEOMETRY_VERTEX_BYTES
+
+    print("\n" + "=" * 72)
+    print("🧊 BENCHMARK DO VISUALIZADOR 3D")
+    print("=" * 72)
+    print(f"Arquivo: {source} ({mb(len(text)).strip()}, {header['layers']} camadas, {segments} segmentos)")
+    print(f"Geração no upload: toolpath {toolpath_sec:.2f}s + geometria {geometry_sec:.2f}s "
+          f"(pico de memória {mb(geometry_peak).strip()})\n")
+
+    print(f"{'':<28} {'texto (antes)':>18} {'geometria':>18}")
+    print("-" * 72)
+    print(f"{'bytes até o 1º quadro':<28} {mb(len(text)):>18} {mb(len(batch)):>18}")
+    print(f"{'servidor até o 1º quadro':<28} {text_sec * 1000:>15.0f} ms "
+          f"{(index_sec + batch_sec) * 1000:>15.0f} ms")
+    print(f"{'camadas no 1º quadro':<28} {header['layers']:>18} {last + 1:>18}")
+    print(f"{'bytes do modelo inteiro':<28} {mb(len(text)):>18} {mb(geometry_bytes):>18}")
+    print(f"{'memória de GPU (modelo)':<28} {mb(segments * CYLINDER_GPU_BYTES):>18} {mb(geometry_bytes):>18}")
+    print(f"{'objetos / draw calls':<28} {segments:>18} {header['layers']:>18}")
+    print("\nTexto: o navegador ainda interpreta o arquivo inteiro e cria um Mesh por segmento")
+    print("antes do 1º quadro. Geometria: os bytes vão direto para um Float32Array/GPU.")
+
+    print(f"\n{'nível':<6} {'tolerância':>10} {'erro medido':>12} {'segmentos':>10} {'cru':>11} {'gzip':>11}")
+    print("-" * 72)
+    for level, (info, (raw, compressed)) in enumerate(zip(header['levels'], level_sizes)):
+        note = '' if info['infill'] else '  sem preenchimento'
+        print(f"{level:<6} {info['tolerance']:>8.2f}mm {info['max_error']:>10.3f}mm "
+              f"{info['layer_vertices'][-1] // 2:>10} {mb(raw)} {mb(compressed)}{note}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Fila de análise dos G-codes (.stream, toolpath, estimativa, geometria)
+
+A análise de um arquivo grande leva segundos de CPU e não pode atrasar nem a
+resposta do upload nem o envio de linhas para a impressora. AnalysisPool guarda
+os pedidos numa fila e os executa em threads próprias:
+
+- um pedido por chave (o arquivo no cartão): pedir de novo um arquivo que já está
+  na fila ou sendo analisado devolve o mesmo job
+- status de cada job: pending -> analyzing -> ready/failed, com o progresso (0 a 1)
+  informado pela própria tarefa
+- `workers` threads normais, que param de pegar jobs enquanto busy() for verdadeiro
+  (impressão em andamento), e uma thread de baixa prioridade (nice BACKGROUND_NICE e
+  I/O na classe idle), a única que continua trabalhando durante a impressão
+- jobs pedidos durante a impressão contam como adiados (deferred/deferred_sec: tempo
+  na fila até começar)
+
+on_status(chave, status, erro) é chamado a cada mudança de status (ex: gravar no banco).
+Com vários processos pedindo análises do mesmo arquivo (workers da interface web),
+claim(chave) decide, antes de começar, se este processo fica com o job: False (outro já
+analisou ou está analisando) descarta o job sem rodar.
+"""
+
+import time
+import threading
+from collections import deque, OrderedDict
+
+from resource_governor import lower_thread_priority
+
+ANALYSIS_STATUSES = ('pending', 'analyzing', 'ready', 'failed')
+BACKGROUND_NICE = 10  # Niceness da thread que roda durante a impressão
+BUSY_POLL_SEC = 1.0  # Threads normais conferem busy() nesse intervalo enquanto esperam
+
+
+class AnalysisJob:
+    """Um pedido de análise: fn(progress) roda numa thread do pool."""
+
+    def __init__(self, key, fn):
+        self.key = key
+        self.fn = fn
+        self.status = 'pending'
+        self.progress = 0.0
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.submitted_busy = False  # Pedido durante a impressão
+        self.done = threading.Event()
+
+    def set_progress(self, fraction):
+        self.progress = min(1.0, max(self.progress, float(fraction)))
+
+    def as_dict(self):
+        return {'status': self.status, 'progress': round(self.progress, 3), 'error': self.error}
+
+
+class AnalysisPool:
+    def __init__(self, workers=2, busy=None, on_status=None, claim=None, background_nice=BACKGROUND_NICE):
+        self.workers = max(0, workers)
+        self.busy = busy or (lambda: False)
+        self.on_status = on_status
+        self.claim = claim
+        self.background_nice = background_nice
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._jobs = OrderedDict()  # chave -> job pendente ou em andamento
+        self._threads = []
+        self.stats = {'submitted': 0, 'deduplicated': 0, 'ready': 0, 'failed': 0, 'claimed_elsewhere': 0,
+                      'background_jobs': 0, 'deferred': 0, 'deferred_sec': 0.0}
+
+    def _start(self):
+        # Threads criadas no primeiro pedido (o app e os scripts importam sem iniciar nada)
+        if self._threads:
+            return
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, args=(False,), daemon=True,
+                                      name=f"analysis-{index}")
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._work, args=(True,), daemon=True, name="analysis-background")
+        thread.start()
+        self._threads.append(thread)
+
+    def submit(self, key, fn):
+        """Enfileira fn(progress) para a chave; se ela já está na fila/em andamento, devolve o job existente."""
+        with self._cond:
+            self._start()
+            job = self._jobs.get(key)
+            if job is not None:
+                self.stats['deduplicated'] += 1
+                return job
+            job = AnalysisJob(key, fn)
+            job.submitted_busy = bool(self.busy())
+            self._jobs[key] = job
+            self._queue.append(job)
+            self.stats['submitted'] += 1
+            self._cond.notify_all()
+        self._notify(job)
+        return job
+
+    def status(self, key):
+        """{'status', 'progress', 'error'} de um job pendente/em andamento, ou None."""
+        with self._cond:
+            job = self._jobs.get(key)
+            return job.as_dict() if job else None
+
+    def snapshot(self):
+        with self._cond:
+            return {
+                'queued': len(self._queue),
+                'running': sum(1 for job in self._jobs.values() if job.status == 'analyzing'),
+                'busy': bool(self.busy()),
+                **self.stats,
+                'deferred_sec': round(self.stats['deferred_sec'], 3),
+            }
+
+    def wait_idle(self, timeout=None):
+        """Espera a fila esvaziar (scripts e benchmarks)."""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self._jobs:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def _claim(self, job):
+        if not self.claim:
+            return True
+        try:
+            return bool(self.claim(job.key))
+        except Exception as e:
+            print(f"⚠️ Erro ao reservar a análise de {job.key}: {e}")
+            return False
+
+    def _finish(self, job, stat):
+        with self._cond:
+            self.stats[stat] += 1
+            del self._jobs[job.key]
+            self._cond.notify_all()
+        job.done.set()
+
+    def _notify(self, job):
+        if self.on_status:
+            try:
+                self.on_status(job.key, job.status, job.error)
+            except Exception as e:
+                print(f"⚠️ Erro ao gravar status da análise ({job.key}): {e}")
+
+    def _work(self, background):
+        if background:
+            lower_thread_priority(self.background_nice)
+        while True:
+            with self._cond:
+                while True:
+                    if self._queue and (background or not self.busy()):
+                        break
+                    # Com fila e impressão em andamento, só a thread de baixa prioridade trabalha
+                    self._cond.wait(BUSY_POLL_SEC if self._queue else None)
+                job = self._queue.popleft()
+            if not self._claim(job):
+                self._finish(job, 'claimed_elsewhere')  # Outro processo ficou com ele
+                continue
+            with self._cond:
+                job.status = 'analyzing'
+                job.started_at = time.time()
+                if background:
+                    self.stats['background_jobs'] += 1
+                if job.submitted_busy:
+                    self.stats['deferred'] += 1
+                    self.stats['deferred_sec'] += job.started_at - job.submitted_at
+            self._notify(job)
+            try:
+                job.fn(job.set_progress)
+                job.status = 'ready'
+                job.progress = 1.0
+            except Exception as e:
+                job.status = 'failed'
+                job.error = str(e)
+                print(f"⚠️ Erro na análise de {job.key}: {e}")
+            job.finished_at = time.time()
+            self._notify(job)
+            self._finish(job, job.status)
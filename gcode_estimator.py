@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+Estimativa do tempo de impressão pela cinemática (aceleração trapezoidal)
+
+Simula o planner do Marlin sobre os movimentos do .toolpath (gcode_toolpath.py):
+velocidade nominal limitada pelo feedrate máximo de cada eixo (M203), aceleração
+por tipo de movimento (M204 P/R/T) e por eixo (M201), velocidade nas junções por
+jerk clássico ou junction deviation (M205), e perfil trapezoidal em cada movimento.
+Os limites vêm do M503 da impressora (parse_marlin_settings); sem ele, valores
+padrão do Marlin.
+
+O resultado é numérico: total em segundos, segundos acumulados ao fim de cada
+camada e um índice (offset no G-code -> segundos acumulados), então o tempo
+restante durante a impressão é só uma busca pelo offset da linha atual.
+
+Não entram no cálculo: aquecimento (M109/M190), pausas (G4), homing e nivelamento.
+"""
+
+import os
+import re
+import json
+import mmap
+import bisect
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+ESTIMATE_CHUNK_MOVES = 250000    # Movimentos processados por vez (memória limitada)
+ESTIMATE_INDEX_STRIDE = 1000     # Um ponto do índice offset -> segundos a cada N movimentos
+_PLANNER_PASSES = 32             # Iterações (vetorizadas) das passadas para trás/frente
+_MIN_DISTANCE = 1e-6
+
+# Padrões do Marlin 2.x (Configuration.h) - usados quando o M503 não foi lido
+DEFAULT_MOTION_LIMITS = {
+    'max_feedrate': {'x': 300.0, 'y': 300.0, 'z': 5.0, 'e': 25.0},       # M203 (mm/s)
+    'max_accel': {'x': 3000.0, 'y': 3000.0, 'z': 100.0, 'e': 10000.0},   # M201 (mm/s²)
+    'accel_print': 3000.0,                                               # M204 P
+    'accel_retract': 3000.0,                                             # M204 R
+    'accel_travel': 3000.0,                                              # M204 T
+    'jerk': {'x': 10.0, 'y': 10.0, 'z': 0.3, 'e': 5.0},                  # M205 X/Y/Z/E (mm/s)
+    'junction_deviation': None,                                          # M205 J (mm)
+    'min_feedrate': 0.0,                                                 # M205 S
+    'min_travel_feedrate': 0.0,                                          # M205 T
+}
+
+_SETTING_LINE_RE = re.compile(r'\b(M20[1345])((?:\s+[A-Z]-?\d+\.?\d*)+)', re.IGNORECASE)
+_SETTING_PARAM_RE = re.compile(r'([A-Z])(-?\d+\.?\d*)', re.IGNORECASE)
+_GCODE_SETTING_RE = re.compile(rb'^[ \t]*(M20[1345][^;\r\n]*)', re.MULTILINE | re.IGNORECASE)
+
+
+def default_motion_limits():
+    return json.loads(json.dumps(DEFAULT_MOTION_LIMITS))
+
+
+def parse_marlin_settings(text, base=None):
+    """Lê M201/M203/M204/M205 da resposta do M503 e retorna os limites (sobre base/padrões).
+
+    Retorna None se a resposta não tiver nenhuma dessas linhas.
+    """
+    limits = json.loads(json.dumps(base)) if base else default_motion_limits()
+    found = False
+    for match in _SETTING_LINE_RE.finditer(text or ''):
+        cmd = match.group(1).upper()
+        params = {letter.upper(): float(value) for letter, value in _SETTING_PARAM_RE.findall(match.group(2))}
+        found = True
+        if cmd == 'M203':
+            for axis in 'XYZE':
+                if axis in params:
+                    limits['max_feedrate'][axis.lower()] = params[axis]
+        elif cmd == 'M201':
+            for axis in 'XYZE':
+                if axis in params:
+                    limits['max_accel'][axis.lower()] = params[axis]
+        elif cmd == 'M204':
+            # S (legado) vale para impressão e deslocamento; P/R/T são específicos
+            if 'S' in params:
+                limits['accel_print'] = limits['accel_travel'] = params['S']
+            limits['accel_print'] = params.get('P', limits['accel_print'])
+            limits['accel_retract'] = params.get('R', limits['accel_retract'])
+            limits['accel_travel'] = params.get('T', limits['accel_travel'])
+        elif cmd == 'M205':
+            for axis in 'XYZE':
+                if axis in params:
+                    limits['jerk'][axis.lower()] = params[axis]
+            if 'J' in params:
+                limits['junction_deviation'] = params['J']
+            limits['min_feedrate'] = params.get('S', limits['min_feedrate'])
+            limits['min_travel_feedrate'] = params.get('T', limits['min_travel_feedrate'])
+    return limits if found else None
+
+
+def scan_limit_changes(gcode_path):
+    """M201/M203/M204/M205 dentro do próprio G-code: [(offset, comando), ...].
+
+    O fatiador costuma definir limites no início e trocar a aceleração por região
+    (primeira camada, perímetros); o firmware aplica a partir daquela linha.
+    """
+    with open(gcode_path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return find_limit_changes(data)
+
+
+def find_limit_changes(data, base_offset=0):
+    """Como scan_limit_changes, num bloco de linhas completas que começa em `base_offset`."""
+    return [(base_offset + match.start(), match.group(1).decode('ascii', 'ignore'))
+            for match in _GCODE_SETTING_RE.finditer(data)]
+
+
+def motion_limits_signature(limits):
+    """Texto estável dos limites (para saber se uma estimativa gravada ainda vale)."""
+    return json.dumps(limits, sort_keys=True)
+
+
+def _axis_limit(values, ratios):
+    """Menor valor permitido entre os eixos que participam (limite_eixo / fração do eixo)."""
+    result = None
+    for value, ratio in zip(values, ratios):
+        with np.errstate(divide='ignore'):
+            axis_limit = np.where(ratio > 0, value / np.maximum(ratio, 1e-12), np.inf)
+        result = axis_limit if result is None else np.minimum(result, axis_limit)
+    return result
+
+
+def _junction_speeds(prev_unit, unit, v_limit, limits, accel):
+    """Velocidade máxima na junção entre o movimento anterior e o atual."""
+    jd = limits.get('junction_deviation')
+    if jd:
+        # Junction deviation (Marlin 2): ângulo entre as direções XYZE
+        cos_theta = -sum(p * u for p, u in zip(prev_unit, unit))
+        cos_theta = np.clip(cos_theta, -1.0, 1.0)
+        sin_half = np.sqrt(np.maximum(0.5 * (1.0 - cos_theta), 0.0))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            v_sq = accel * jd * sin_half / np.maximum(1.0 - sin_half, 1e-9)
+        return np.minimum(v_limit, np.sqrt(v_sq))
+
+    # Jerk clássico: a mudança de velocidade em cada eixo não pode passar do jerk do eixo
+    jerk = limits['jerk']
+    factor = np.ones_like(v_limit)
+    for p, u, axis in zip(prev_unit, unit, 'xyze'):
+        dv = v_limit * np.abs(p - u)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            factor = np.minimum(factor, np.where(dv > jerk[axis], jerk[axis] / dv, 1.0))
+    return v_limit * factor
+
+
+def _trapezoid_times(distance, v_entry, v_exit, v_cruise, accel):
+    """Duração de cada movimento com perfil trapezoidal (ou triangular, se for curto)."""
+    v_cruise = np.maximum(v_cruise, np.maximum(v_entry, v_exit))
+    accel_dist = (v_cruise ** 2 - v_entry ** 2) / (2 * accel)
+    decel_dist = (v_cruise ** 2 - v_exit ** 2) / (2 * accel)
+    cruise_dist = distance - accel_dist - decel_dist
+    trapezoid = ((v_cruise - v_entry) + (v_cruise - v_exit)) / accel + \
+        np.maximum(cruise_dist, 0.0) / np.maximum(v_cruise, 1e-9)
+    v_peak = np.sqrt(np.maximum((2 * accel * distance + v_entry ** 2 + v_exit ** 2) / 2, 0.0))
+    v_peak = np.maximum(v_peak, np.maximum(v_entry, v_exit))
+    triangle = ((v_peak - v_entry) + (v_peak - v_exit)) / accel
+    return np.where(cruise_dist >= 0, trapezoid, triangle)
+
+
+def _plan_chunk(x, y, z, e, f, prev, limits, last_chunk):
+    """Tempos dos movimentos de um bloco. prev: posição/direção/velocidade do último movimento anterior."""
+    dx = np.diff(x, prepend=prev['x'])
+    dy = np.diff(y, prepend=prev['y'])
+    dz = np.diff(z, prepend=prev['z'])
+    xyz_dist = np.sqrt(dx * dx + dy * dy + dz * dz)
+    e_only = xyz_dist < _MIN_DISTANCE
+    distance = np.where(e_only, np.abs(e), xyz_dist)
+    times = np.zeros(len(x))
+    naive = np.zeros(len(x))
+    if len(x):
+        prev.update({'x': float(x[-1]), 'y': float(y[-1]), 'z': float(z[-1])})
+
+    # Linhas sem deslocamento (ex: "G1 F1800") não chegam ao planner
+    moving = np.flatnonzero(distance >= _MIN_DISTANCE)
+    if not len(moving):
+        return times, naive
+    dx, dy, dz, e, f = dx[moving], dy[moving], dz[moving], e[moving], f[moving]
+    e_only, distance = e_only[moving], distance[moving]
+
+    ratios = [np.where(e_only, 0.0, np.abs(d)) / distance for d in (dx, dy, dz)] + [np.abs(e) / distance]
+    unit = [np.where(e_only, 0.0, d) / distance for d in (dx, dy, dz)] + [e / distance]
+
+    extruding = e > 0
+    feed = f / 60.0
+    feed = np.where(feed > 0, feed, limits['max_feedrate']['x'])
+    feed = np.maximum(feed, np.where(extruding | e_only, limits['min_feedrate'], limits['min_travel_feedrate']))
+    max_feed = limits['max_feedrate']
+    v_nominal = np.minimum(feed, _axis_limit([max_feed[a] for a in 'xyze'], ratios))
+
+    base_accel = np.where(e_only, limits['accel_retract'],
+                          np.where(extruding, limits['accel_print'], limits['accel_travel']))
+    max_accel = limits['max_accel']
+    accel = np.minimum(base_accel, _axis_limit([max_accel[a] for a in 'xyze'], ratios))
+    accel = np.maximum(accel, 1.0)
+
+    # Junções: direção/velocidade do movimento anterior (o último do bloco anterior para o 1º)
+    prev_unit = [np.concatenate(([prev['unit'][i]], unit[i][:-1])) for i in range(4)]
+    prev_nominal = np.concatenate(([prev['v_nominal']], v_nominal[:-1]))
+    v_limit = np.minimum(prev_nominal, v_nominal)
+    v_junction = _junction_speeds(prev_unit, unit, v_limit, limits, accel)
+
+    # Passadas do planner (para trás e para frente), vetorizadas: cada iteração propaga
+    # a restrição de aceleração por um movimento; param quando nada mais muda.
+    # Fim do arquivo: para; fim do bloco: segue na velocidade nominal do último movimento.
+    tail_exit = 0.0 if last_chunk else float(v_nominal[-1])
+    reach = 2 * accel * distance
+    prev_entry = np.concatenate(([prev['v_entry']], np.zeros(len(reach) - 1)))
+    prev_reach = np.concatenate(([prev['reach']], reach[:-1]))
+    v_entry = v_junction
+    for _ in range(_PLANNER_PASSES):
+        v_exit = np.append(v_entry[1:], tail_exit)
+        planned = np.minimum(v_entry, np.sqrt(v_exit ** 2 + reach))
+        prev_entry[1:] = planned[:-1]
+        planned = np.minimum(planned, np.sqrt(prev_entry ** 2 + prev_reach))
+        settled = np.allclose(planned, v_entry, rtol=1e-4, atol=1e-3)
+        v_entry = planned
+        if settled:
+            break
+    v_exit = np.append(v_entry[1:], tail_exit)
+
+    times[moving] = _trapezoid_times(distance, v_entry, v_exit, v_nominal, accel)
+    naive[moving] = distance / np.maximum(v_nominal, 1e-9)
+    prev.update({'unit': [float(u[-1]) for u in unit], 'v_nominal': float(v_nominal[-1]),
+                 'v_entry': float(v_entry[-1]), 'reach': float(reach[-1])})
+    return times, naive
+
+
+def estimate_toolpath(toolpath, limits=None, changes=None, chunk_moves=ESTIMATE_CHUNK_MOVES,
+                      index_stride=ESTIMATE_INDEX_STRIDE):
+    """Estima o tempo de um toolpath aberto com load_toolpath().
+
+    limits: limites da impressora (M503); changes: scan_limit_changes() do G-code.
+    Retorna {'total_seconds', 'naive_seconds', 'layer_seconds', 'index'}:
+    - layer_seconds[i]: segundos acumulados ao fim da camada i
+    - index: [[offset, segundos acumulados antes da linha], ...] a cada index_stride movimentos
+    """
+    if not NUMPY_AVAILABLE or toolpath is None:
+        return None
+    limits = limits or DEFAULT_MOTION_LIMITS
+    changes = list(changes or [])
+    count = toolpath['count']
+    prev = {'x': 0.0, 'y': 0.0, 'z': 0.0, 'unit': [0.0, 0.0, 0.0, 0.0],
+            'v_nominal': 0.0, 'v_entry': 0.0, 'reach': 0.0}
+    elapsed = 0.0
+    naive_total = 0.0
+    layer_seconds = []
+    index = []
+
+    for start in range(0, count, chunk_moves):
+        sl = slice(start, min(count, start + chunk_moves))
+        columns = [np.asarray(toolpath[name][sl], dtype=np.float64) for name in ('x', 'y', 'z', 'e', 'f')]
+        offsets = np.asarray(toolpath['offset'][sl])
+
+        # Trechos entre trocas de limites feitas pelo próprio G-code
+        times = np.empty(len(offsets))
+        piece_start = 0
+        while piece_start < len(offsets):
+            while changes and changes[0][0] < offsets[piece_start]:
+                limits = parse_marlin_settings(changes.pop(0)[1], limits) or limits
+            piece_end = len(offsets)
+            if changes:
+                piece_end = max(int(np.searchsorted(offsets, changes[0][0])), piece_start + 1)
+            piece = slice(piece_start, piece_end)
+            last_piece = sl.stop == count and piece_end == len(offsets)
+            times[piece], naive = _plan_chunk(*(column[piece] for column in columns), prev, limits, last_piece)
+            naive_total += float(naive.sum())
+            piece_start = piece_end
+
+        cumulative = elapsed + np.cumsum(times)
+
+        # Índice: tempo acumulado ANTES de cada linha amostrada
+        first = (-start) % index_stride
+        before = cumulative - times
+        for i in range(first, len(times), index_stride):
+            index.append([int(offsets[i]), round(float(before[i]), 2)])
+
+        # Camadas (não decrescentes): tempo acumulado no último movimento de cada uma
+        layers = np.asarray(toolpath['layer'][sl])
+        last_of_layer = np.append(np.flatnonzero(np.diff(layers)), len(layers) - 1)
+        for i in last_of_layer:
+            layer = int(layers[i])
+            while len(layer_seconds) <= layer:
+                layer_seconds.append(layer_seconds[-1] if layer_seconds else 0.0)
+            layer_seconds[layer] = round(float(cumulative[i]), 2)
+
+        elapsed = float(cumulative[-1])
+
+    return {
+        'total_seconds': round(elapsed, 2),
+        'naive_seconds': round(naive_total, 2),
+        'layer_seconds': layer_seconds,
+        'index': index,
+    }
+
+
+def elapsed_at_offset(index, offset):
+    """Segundos acumulados (estimados) até a linha no offset, interpolando entre os pontos do índice."""
+    if not index:
+        return 0.0
+    pos = bisect.bisect_right(index, [offset, float('inf')]) - 1
+    if pos < 0:
+        return 0.0
+    if pos + 1 >= len(index):
+        return index[pos][1]
+    (o0, t0), (o1, t1) = index[pos], index[pos + 1]
+    if o1 <= o0:
+        return t0
+    return t0 + (t1 - t0) * (offset - o0) / (o1 - o0)
+
+
+if __name__ == '__main__':
+    import os
+    import sys
+    import time
+    from gcode_toolpath import build_toolpath, load_toolpath
+
+    if len(sys.argv) < 2:
+        print("Uso: python3 gcode_estimator.py <arquivo.gcode> [resposta_m503.txt]")
+        sys.exit(1)
+
+    limits = None
+    if len(sys.argv) > 2:
+        with open(sys.argv[2]) as f:
+            limits = parse_marlin_settings(f.read())
+
+    toolpath = load_toolpath(sys.argv[1])
+    if toolpath is None:
+        build_toolpath(sys.argv[1])
+        toolpath = load_toolpath(sys.argv[1])
+
+    start = time.time()
+    result = estimate_toolpath(toolpath, limits, scan_limit_changes(sys.argv[1]))
+    elapsed = time.time() - start
+    total = result['total_seconds']
+    print(f"📄 {os.path.basename(sys.argv[1])}: {toolpath['count']} movimentos, "
+          f"{len(result['layer_seconds'])} camadas")
+    print(f"⏱️ Estimado: {int(total // 3600)}h {int(total % 3600 // 60)}m {int(total % 60)}s "
+          f"(sem aceleração: {result['naive_seconds'] / 60:.1f} min) - calculado em {elapsed:.2f}s")
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+Geometria binária do visualizador 3D (gerada a partir do .toolpath)
+
+"<gcode>.geometry" guarda, camada por camada, os segmentos de extrusão prontos para
+um THREE.LineSegments: vértices intercalados [x, y, z, r, g, b] em float32
+little-endian (24 bytes por vértice, 2 vértices por segmento). O navegador só copia
+os bytes para um BufferGeometry - nada de interpretar texto nem criar um objeto por
+segmento - e cada camada vira um único draw call.
+
+Níveis de detalhe (GEOMETRY_LEVELS): o nível 0 é o toolpath exato; nos seguintes,
+sequências contínuas de segmentos (mesma camada e tipo de extrusão) são simplificadas
+removendo vértices enquanto nenhum ponto original fica a mais que a tolerância (mm)
+da linha simplificada - segmentos colineares e curtos viram um só. Os níveis mais
+grossos podem deixar de fora o preenchimento interno (invisível por fora da peça).
+
+Formato: 1ª linha = cabeçalho JSON (completado com espaços até múltiplo de 64 bytes),
+depois os blocos de cada nível. Em levels[k], layer_vertices[i] é o índice do 1º
+vértice da camada i no bloco (o último elemento é o total), então a camada i ocupa
+os bytes offset + layer_vertices[i] * 24 até offset + layer_vertices[i + 1] * 24.
+
+Coordenadas em mm do G-code (x, y, z); a troca de eixos para a cena fica no cliente.
+Cor: gradiente por altura (mesmo do visualizador antigo).
+"""
+
+import os
+import json
+import colorsys
+
+from gcode_toolpath import NUMPY_AVAILABLE, INFILL_FEATURES, load_toolpath, toolpath_path
+
+if NUMPY_AVAILABLE:
+    import numpy as np
+
+GEOMETRY_SUFFIX = '.geometry'
+GEOMETRY_MAGIC = 'CROMA-GEOMETRY'
+GEOMETRY_VERSION = 2
+GEOMETRY_FLOATS_PER_VERTEX = 6
+GEOMETRY_VERTEX_BYTES = GEOMETRY_FLOATS_PER_VERTEX * 4
+GEOMETRY_CHUNK_MOVES = 250000
+# (tolerância em mm, inclui preenchimento interno) - do mais fino ao mais grosso
+GEOMETRY_LEVELS = ((0.0, True), (0.05, True), (0.25, True), (0.5, False))
+# Nível com mais que essa fração dos vértices do último gravado reaproveita os dados dele
+GEOMETRY_MIN_REDUCTION = 0.9
+_SIMPLIFY_MAX_PASSES = 64
+
+
+def geometry_path(gcode_path):
+    return gcode_path + GEOMETRY_SUFFIX
+
+
+def layer_color(layer, total_layers):
+    """Cor RGB (0-1) da camada: matiz de 0.15 a 0.85 conforme a altura."""
+    hue = 0.15 + (layer / max(total_layers, 1)) * 0.7
+    return colorsys.hls_to_rgb(hue % 1.0, 0.5, 1.0)
+
+
+def _extrusion_segments(toolpath, start, stop, prev_xyz):
+    """Segmentos com extrusão das linhas [start, stop): (início, fim, camada, tipo, última posição)."""
+    xyz = np.stack([np.asarray(toolpath[axis][start:stop], dtype=np.float32) for axis in 'xyz'], axis=1)
+    previous = np.concatenate((np.asarray([prev_xyz], dtype=np.float32), xyz[:-1]))
+    e = np.asarray(toolpath['e'][start:stop])
+    moved = np.any(xyz != previous, axis=1)
+    keep = (e > 0) & moved
+    layers = np.asarray(toolpath['layer'][start:stop])[keep]
+    features = np.asarray(toolpath['feature'][start:stop])[keep]
+    return previous[keep], xyz[keep], layers, features, tuple(float(v) for v in xyz[-1])
+
+
+def _point_segment_distance(p, a, b):
+    """Distância (por linha) de cada ponto p ao segmento a-b."""
+    ab = b - a
+    length2 = np.einsum('ij,ij->i', ab, ab)
+    t = np.einsum('ij,ij->i', p - a, ab) / np.where(length2 > 0, length2, 1)
+    offset = p - a - np.clip(t, 0.0, 1.0)[:, None] * ab
+    return np.sqrt(np.einsum('ij,ij->i', offset, offset))
+
+
+def _to_polylines(seg_start, seg_end, layers, features):
+    """Junta segmentos consecutivos que continuam do ponto anterior em polilinhas.
+
+    Retorna (pontos, polilinha de cada ponto, camada e tipo de cada polilinha).
+    """
+    n = len(seg_start)
+    new_chain = np.ones(n, dtype=bool)
+    if n > 1:
+        new_chain[1:] = ((seg_start[1:] != seg_end[:-1]).any(axis=1)
+                         | (layers[1:] != layers[:-1]) | (features[1:] != features[:-1]))
+    chain = np.cumsum(new_chain) - 1
+    # Cada polilinha: ponto inicial do 1º segmento + ponto final de todos
+    end_slot = np.arange(n) + chain + 1
+    points = np.empty((n + int(chain[-1]) + 1, 3), dtype=np.float64)
+    points[end_slot] = seg_end
+    points[end_slot[new_chain] - 1] = seg_start[new_chain]
+    point_chain = np.empty(len(points), dtype=np.int64)
+    point_chain[end_slot] = chain
+    point_chain[end_slot[new_chain] - 1] = chain[new_chain]
+    return points, point_chain, layers[new_chain], features[new_chain]
+
+
+def simplify_polylines(points, chain, tolerance, keep=None, error=None):
+    """Vértices mantidos (máscara) e erro de cada trecho, com nenhum ponto original a mais
+    de `tolerance` mm da polilinha simplificada.
+
+    Vetorizado em passadas: em cada uma, vértices internos alternados (nunca dois
+    vizinhos) são testados; o vértice sai se o erro acumulado do trecho que ele fecha
+    continua dentro da tolerância. O erro de cada trecho é guardado no vértice que o
+    termina: ao remover v entre a e b, todo ponto já removido entre a e b fica a no
+    máximo max(erro(a-v), erro(v-b)) + distância(v, a-b) do novo segmento. Um vértice
+    reprovado só volta a ser testado quando um vizinho sai.
+
+    keep/error de uma tolerância menor podem ser passados para continuar dali.
+    """
+    n = len(points)
+    keep = np.ones(n, dtype=bool) if keep is None else keep.copy()
+    error = np.zeros(n) if error is None else error.copy()
+    interior = np.zeros(n, dtype=bool)
+    if n > 2:
+        interior[1:-1] = (chain[1:-1] == chain[:-2]) & (chain[1:-1] == chain[2:])
+    pending = interior & keep
+    for step in range(_SIMPLIFY_MAX_PASSES):
+        candidates = np.flatnonzero(pending)
+        if not len(candidates):
+            break
+        kept = np.flatnonzero(keep)
+        rank = np.searchsorted(kept, candidates)
+        same_parity = rank % 2 == step % 2
+        v, j = candidates[same_parity], rank[same_parity]
+        a, b = kept[j - 1], kept[j + 1]
+        bound = np.maximum(error[v], error[b]) + _point_segment_distance(points[v], points[a], points[b])
+        ok = bound <= tolerance
+        pending[v] = False
+        keep[v[ok]] = False
+        error[b[ok]] = bound[ok]
+        pending[a[ok]] = interior[a[ok]]
+        pending[b[ok]] = interior[b[ok]]
+    return keep, error
+
+
+def simplification_error(points, keep):
+    """Maior distância (mm) de um vértice removido até o segmento que o substituiu."""
+    if keep.all():
+        return 0.0
+    index = np.arange(len(points))
+    previous = np.maximum.accumulate(np.where(keep, index, -1))
+    following = np.minimum.accumulate(np.where(keep, index, len(points))[::-1])[::-1]
+    removed = ~keep
+    return float(_point_segment_distance(points[removed], points[previous[removed]],
+                                         points[following[removed]]).max())
+
+
+def _level_vertices(points, chain, keep, chain_layers, allowed, colors):
+    """Vértices intercalados dos segmentos entre vértices mantidos e a camada de cada segmento."""
+    kept = np.flatnonzero(keep)
+    seg_chain = chain[kept[1:]]
+    pair = (seg_chain == chain[kept[:-1]]) & allowed[seg_chain]
+    layers = chain_layers[seg_chain[pair]]
+
+    vertices = np.empty((len(layers), 2, GEOMETRY_FLOATS_PER_VERTEX), dtype='<f4')
+    rgb = colors[np.minimum(layers, len(colors) - 1)]
+    vertices[:, 0, :3] = points[kept[:-1][pair]]
+    vertices[:, 1, :3] = points[kept[1:][pair]]
+    vertices[:, 0, 3:] = rgb
+    vertices[:, 1, 3:] = rgb
+    return vertices, layers
+
+
+def build_geometry(gcode_path, chunk_moves=GEOMETRY_CHUNK_MOVES, levels=GEOMETRY_LEVELS):
+    """Gera o .geometry a partir do .toolpath. Retorna o cabeçalho ou None (sem NumPy/toolpath).
+
+    Uma passada pelo toolpath; cada nível vai para um arquivo temporário, juntado ao
+    cabeçalho no fim (como o .toolpath). As tolerâncias de `levels` não podem diminuir:
+    cada nível continua a simplificação do anterior. Polilinhas não atravessam blocos
+    de chunk_moves.
+    """
+    if not NUMPY_AVAILABLE:
+        return None
+    toolpath = load_toolpath(gcode_path)
+    if toolpath is None:
+        return None
+    count = toolpath['count']
+    total_layers = max(int(toolpath['summary']['layers']), 1)
+    colors = np.array([layer_color(layer, total_layers) for layer in range(total_layers)], dtype=np.float32)
+
+    out_path = geometry_path(gcode_path)
+    tmp_paths = [f"{out_path}.{level}.tmp" for level in range(len(levels))]
+    per_layer = [np.zeros(total_layers, dtype=np.int64) for _ in levels]
+    errors = [0.0 for _ in levels]
+    try:
+        tmp_files = [open(path, 'wb') for path in tmp_paths]
+        try:
+            prev_xyz = (0.0, 0.0, 0.0)
+            for start in range(0, count, chunk_moves):
+                seg_start, seg_end, layers, features, prev_xyz = _extrusion_segments(
+                    toolpath, start, min(count, start + chunk_moves), prev_xyz)
+                if not len(layers):
+                    continue
+                points, chain, chain_layers, chain_features = _to_polylines(seg_start, seg_end, layers, features)
+                solid = ~np.isin(chain_features, INFILL_FEATURES)
+                keep, error = np.ones(len(points), dtype=bool), np.zeros(len(points))
+                for level, (tolerance, infill) in enumerate(levels):
+                    if tolerance > 0:
+                        keep, error = simplify_polylines(points, chain, tolerance, keep, error)
+                        errors[level] = max(errors[level], simplification_error(points, keep))
+                    vertices, level_layers = _level_vertices(
+                        points, chain, keep, chain_layers, np.ones_like(solid) if infill else solid, colors)
+                    tmp_files[level].write(vertices.tobytes())
+                    per_layer[level] += np.bincount(np.minimum(level_layers, total_layers - 1),
+                                                    minlength=total_layers) * 2
+        finally:
+            for fh in tmp_files:
+                fh.close()
+
+        header = {'version': GEOMETRY_VERSION, 'floats_per_vertex': GEOMETRY_FLOATS_PER_VERTEX,
+                  'layers': total_layers, 'summary': toolpath['summary'], 'data_offset': 0, 'levels': []}
+        stored = []  # Níveis gravados; os demais apontam para o último gravado antes deles
+        for level, (tolerance, infill) in enumerate(levels):
+            total = int(per_layer[level].sum())
+            if stored and total > GEOMETRY_MIN_REDUCTION * per_layer[stored[-1]].sum():
+                source = header['levels'][stored[-1]]
+                header['levels'].append(dict(source, tolerance=tolerance, same_as=stored[-1]))
+                continue
+            stored.append(level)
+            header['levels'].append({
+                'tolerance': tolerance,
+                'infill': infill,
+                'max_error': round(errors[level], 4),
+                'offset': 0,
+                'layer_vertices': [0] + [int(v) for v in np.cumsum(per_layer[level])],
+            })
+        while True:
+            # Offsets fazem parte do próprio cabeçalho: repetir até o tamanho estabilizar
+            raw = (GEOMETRY_MAGIC + ' ' + json.dumps(header, separators=(',', ':'))).encode()
+            data_offset = (len(raw) + 1 + 63) // 64 * 64
+            if data_offset == header['data_offset']:
+                break
+            header['data_offset'] = offset = data_offset
+            for level in stored:
+                header['levels'][level]['offset'] = offset
+                offset += header['levels'][level]['layer_vertices'][-1] * GEOMETRY_VERTEX_BYTES
+            for level in header['levels']:
+                if 'same_as' in level:
+                    level['offset'] = header['levels'][level['same_as']]['offset']
+
+        tmp_out = out_path + '.tmp'
+        with open(tmp_out, 'wb') as out:
+            out.write(raw.ljust(data_offset - 1, b' ') + b'\n')
+            for path in (tmp_paths[level] for level in stored):
+                with open(path, 'rb') as src:
+                    while True:
+                        block = src.read(1024 * 1024)
+                        if not block:
+                            break
+                        out.write(block)
+        os.replace(tmp_out, out_path)
+        return header
+    finally:
+        for path in tmp_paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def layer_range(header, level, first, last):
+    """(início, fim) em bytes das camadas first..last no nível informado."""
+    info = header['levels'][level]
+    vertices = info['layer_vertices']
+    return (info['offset'] + vertices[first] * GEOMETRY_VERTEX_BYTES,
+            info['offset'] + vertices[last + 1] * GEOMETRY_VERTEX_BYTES)
+
+
+def level_for_budget(header, first, last, budget):
+    """Nível mais detalhado cujas camadas first..last cabem em `budget` vértices (senão o mais grosso)."""
+    for level, info in enumerate(header['levels']):
+        vertices = info['layer_vertices']
+        if vertices[last + 1] - vertices[first] <= budget:
+            return level
+    return len(header['levels']) - 1
+
+
+def read_geometry_header(gcode_path):
+    """Cabeçalho do .geometry, ou None se não existir, for de outra versão ou estiver desatualizado."""
+    path = geometry_path(gcode_path)
+    try:
+        # Invalidado quando o G-code (ou o toolpath de onde saiu) é mais novo
+        mtime = os.path.getmtime(path)
+        if mtime < os.path.getmtime(gcode_path) or mtime < os.path.getmtime(toolpath_path(gcode_path)):
+            return None
+        with open(path, 'rb') as f:
+            line = f.readline()
+    except OSError:
+        return None
+    prefix = (GEOMETRY_MAGIC + ' ').encode()
+    if not line.startswith(prefix):
+        return None
+    try:
+        header = json.loads(line[len(prefix):])
+    except ValueError:
+        return None
+    if header.get('version') != GEOMETRY_VERSION:
+        return None
+    return header
+
+
+def ensure_geometry(gcode_path):
+    """Cabeçalho do .geometry em cache, gerando (e o .toolpath, se preciso) quando faltar."""
+    header = read_geometry_header(gcode_path)
+    if header is not None:
+        return header
+    if load_toolpath(gcode_path) is None:
+        from gcode_toolpath import build_toolpath
+        if not build_toolpath(gcode_path):
+            return None
+    return build_geometry(gcode_path)
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    if len(sys.argv) < 2:
+        print("Uso: python3 gcode_geometry.py <arquivo.gcode>")
+        sys.exit(1)
+
+    start = time.time()
+    header = ensure_geometry(sys.argv[1])
+    elapsed = time.time() - start
+    print(f"🧊 {header['layers']} camadas em {elapsed:.2f}s")
+    for level, info in enumerate(header['levels']):
+        vertices = info['layer_vertices'][-1]
+        print(f"  nível {level}: tolerância {info['tolerance']} mm "
+              f"(erro medido {info['max_error']} mm){'' if info['infill'] else ', sem preenchimento'}: "
+              f"{vertices // 2} segmentos, {vertices * GEOMETRY_VERTEX_BYTES / (1024 * 1024):.1f} MB"
+              f"{' (dados do nível %d)' % info['same_as'] if 'same_as' in info else ''}")
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Upload de G-code numa passada só
+
+O Werkzeug normalmente grava o upload num arquivo temporário, o app copia para
+gcode_files/ e depois cada etapa (miniatura, metadados, .stream, .toolpath, limites
+de movimento) relê o arquivo do cartão SD. GcodeUpload é o destino do upload
+(stream_factory do Werkzeug): os bytes vão direto para "<arquivo>.part" e, enquanto
+chegam, passam uma vez por:
+
+- SHA-256 do conteúdo
+- contagem de linhas
+- começo (METADATA_HEAD_BYTES) e fim (METADATA_TAIL_BYTES) guardados na memória,
+  para miniatura e metadados no fim sem reler o arquivo
+- consumidores com feed(bloco, offset): recebem blocos de linhas completas
+  (INGEST_BLOCK_BYTES), ex: compilador do .stream e ToolpathBuilder
+
+Os consumidores rodam numa thread própria, alimentada por uma fila limitada
+(INGEST_QUEUE_BYTES): a gravação nunca espera por eles. finish() faz fsync e renomeia
+o .part para o nome final - a partir daí o arquivo está no cartão e a resposta pode
+voltar, enquanto os consumidores terminam em segundo plano (when_processed()).
+"""
+
+import os
+import io
+import hashlib
+import threading
+from collections import deque
+
+from gcode_metadata import metadata_windows, METADATA_HEAD_BYTES, METADATA_TAIL_BYTES
+
+INGEST_BLOCK_BYTES = 4 * 1024 * 1024  # Bloco entregue aos consumidores (linhas completas)
+INGEST_QUEUE_BYTES = 32 * 1024 * 1024  # Máximo na fila antes de os consumidores lerem do arquivo
+PART_SUFFIX = '.part'
+
+
+def _fsync_dir(path):
+    """Grava no cartão a entrada do diretório (o rename do .part)."""
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class GcodeUpload:
+    """Arquivo de destino do upload: grava em "<path>.part" e processa cada bloco ao chegar.
+
+    Só escrita: o Werkzeug chama write() e, no fim da parte, seek(0). Quem recebe o
+    upload chama finish() (fsync + rename) e responde; os consumidores rodam numa thread
+    própria e, quando terminam, ela chama a função passada em when_processed().
+
+    A fila entre a gravação e os consumidores guarda até queue_bytes. Se os consumidores
+    ficarem para trás (upload mais rápido que o processamento), a gravação não espera:
+    o resto é lido de volta do próprio arquivo (ainda no cache de páginas, em geral).
+    Se a requisição terminar antes do finish() (erro, cliente desconectou), close()
+    apaga o .part e avisa os consumidores (abort()).
+    """
+
+    def __init__(self, path, consumers=None, block_bytes=INGEST_BLOCK_BYTES, queue_bytes=INGEST_QUEUE_BYTES,
+                 head_bytes=METADATA_HEAD_BYTES, tail_bytes=METADATA_TAIL_BYTES, throttle=None):
+        self.path = path
+        self.throttle = throttle  # throttle(n): chamado antes de gravar n bytes (pode dormir)
+        self.part_path = path + PART_SUFFIX
+        self.consumers = consumers or {}  # nome -> objeto com feed(bloco, offset)
+        self.block_bytes = block_bytes
+        self.queue_bytes = max(queue_bytes, block_bytes)
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+        self.size = 0
+        self.lines = 0
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.finished = False
+        self.closed = False
+        self.synced = False  # .part já no cartão (sync()); finish() só renomeia
+        self.spilled_bytes = 0  # Bytes que os consumidores leram do arquivo em vez da fila
+        self._hash = hashlib.sha256()
+        self._pending = bytearray()  # Bytes recebidos depois da última linha completa
+        self._pending_offset = 0
+        self._file = open(self.part_path, 'wb')
+        self._reader = open(self.part_path, 'rb')  # Continua válido depois do rename
+        self._cond = threading.Condition()
+        self._blocks = deque()  # (bloco, offset) esperando os consumidores
+        self._queued_bytes = 0
+        self._spill_offset = None  # A partir daqui os consumidores leem do arquivo
+        self._written = 0  # Bytes já entregues ao sistema (visíveis para o _reader)
+        self._on_processed = None
+        self._thread = threading.Thread(target=self._consume, daemon=True)
+        self._thread.start()
+
+    # Interface de arquivo usada pelo Werkzeug/FileStorage
+    def write(self, data):
+        if self.throttle:
+            self.throttle(len(data))
+        self._file.write(data)
+        self._hash.update(data)
+        self.size += len(data)
+        self.lines += data.count(b'\n')
+        if len(self.head) < self.head_bytes:
+            self.head += data[:self.head_bytes - len(self.head)]
+        self.tail += data
+        if len(self.tail) > 2 * self.tail_bytes:
+            del self.tail[:-self.tail_bytes]
+        if self._spill_offset is not None:
+            # Consumidores atrasados: leem do arquivo o que já foi gravado
+            self._file.flush()
+            with self._cond:
+                self._written = self.size
+                self._cond.notify_all()
+            return len(data)
+        self._pending += data
+        if len(self._pending) >= self.block_bytes:
+            cut = self._pending.rfind(b'\n') + 1
+            if cut:
+                self._enqueue(bytes(self._pending[:cut]))
+                del self._pending[:cut]
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        # O Werkzeug volta ao início quando a parte termina; o arquivo é só de escrita
+        return self.size
+
+    def tell(self):
+        return self.size
+
+    def read(self, size=-1):
+        raise io.UnsupportedOperation('GcodeUpload é só de escrita')
+
+    def readable(self):
+        return False
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if not self.finished:
+            self.abort()
+        elif self._on_processed is None:
+            # Upload gravado, mas ninguém vai usar o resultado dos consumidores
+            self.when_processed(None)
+
+    def _enqueue(self, block):
+        offset = self._pending_offset
+        self._pending_offset += len(block)
+        with self._cond:
+            if self._queued_bytes + len(block) > self.queue_bytes:
+                self._file.flush()
+                self._spill_offset = offset
+                self._written = self.size
+            else:
+                self._blocks.append((block, offset))
+                self._queued_bytes += len(block)
+            self._cond.notify_all()
+
+    def _feed(self, block, offset):
+        """Entrega o bloco a cada consumidor; um consumidor com erro sai do upload (o
+        arquivo continua sendo gravado e a etapa dele pode ser refeita depois)."""
+        for name, consumer in list(self.consumers.items()):
+            try:
+                consumer.feed(block, offset)
+            except Exception as e:
+                print(f"⚠️ Erro ao processar o upload ({name}): {e}")
+                del self.consumers[name]
+                abort = getattr(consumer, 'abort', None)
+                if abort:
+                    abort()
+
+    def _consume(self):
+        try:
+            while True:
+                with self._cond:
+                    while (not self._blocks and self._spill_offset is None and not self.finished
+                           and not self.closed):
+                        self._cond.wait()
+                    if self.closed and not self.finished:
+                        self._abort_consumers()
+                        return
+                    item = self._blocks.popleft() if self._blocks else None
+                    if item:
+                        self._queued_bytes -= len(item[0])
+                if item:
+                    self._feed(*item)
+                elif self._spill_offset is not None:
+                    self._consume_file(self._spill_offset)
+                    break
+                else:
+                    break
+            with self._cond:
+                while self._on_processed is None and not (self.closed and not self.finished):
+                    self._cond.wait()
+                if self.closed and not self.finished:
+                    self._abort_consumers()
+                    return
+                callback = self._on_processed
+        finally:
+            self._reader.close()
+        if callback:
+            callback()
+        else:
+            self._abort_consumers()
+
+    def _abort_consumers(self):
+        for consumer in self.consumers.values():
+            abort = getattr(consumer, 'abort', None)
+            if abort:
+                abort()
+
+    def _consume_file(self, pos):
+        """Modo atrasado: lê do arquivo, em blocos de linhas completas, até o fim do upload."""
+        self.spilled_bytes = 0
+        rest = b''
+        while True:
+            with self._cond:
+                while self._written <= pos + len(rest) and not self.finished and not self.closed:
+                    self._cond.wait()
+                if self.closed and not self.finished:
+                    return
+                available = self._written
+                finished = self.finished
+            start = pos + len(rest)
+            if start < available:
+                self._reader.seek(start)
+                data = self._reader.read(min(self.block_bytes, available - start))
+                self.spilled_bytes += len(data)
+                rest += data
+            if finished and pos + len(rest) >= available:
+                if rest:
+                    self._feed(rest, pos)
+                return
+            cut = rest.rfind(b'\n') + 1
+            if cut:
+                self._feed(rest[:cut], pos)
+                pos += cut
+                rest = rest[cut:]
+
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+    def windows(self):
+        """Janelas de cabeçalho/rodapé para gcode_metadata.parse_metadata_windows()."""
+        return metadata_windows(bytes(self.head), bytes(self.tail[-self.tail_bytes:]), self.size)
+
+    def sync(self):
+        """Grava o .part no cartão (fsync) sem renomear. Opcional: quem precisa segurar um
+        lock só durante o rename chama sync() antes; finish() não repete o fsync."""
+        if self.synced:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self.synced = True
+
+    def finish(self, path=None):
+        """Grava no cartão (fsync) e troca o .part pelo nome final (path, se informado).
+
+        Os consumidores podem ainda estar processando: ver when_processed().
+        """
+        if path:
+            self.path = path
+        if self.tail and not self.tail.endswith(b'\n'):
+            self.lines += 1  # Última linha sem quebra
+        if self._pending and self._spill_offset is None:
+            with self._cond:
+                self._blocks.append((bytes(self._pending), self._pending_offset))
+                self._queued_bytes += len(self._pending)
+        self._pending = bytearray()
+        self.sync()
+        os.replace(self.part_path, self.path)
+        _fsync_dir(self.path)
+        with self._cond:
+            self._written = self.size
+            self.finished = True
+            self.closed = True
+            self._cond.notify_all()
+        return {'size': self.size, 'sha256': self.sha256, 'lines': self.lines}
+
+    def when_processed(self, callback):
+        """Chama callback() na thread dos consumidores quando todos terminarem de processar
+        (None: descartar o resultado dos consumidores)."""
+        with self._cond:
+            self._on_processed = callback if callback is not None else False
+            self._cond.notify_all()
+
+    def wait_processed(self, timeout=None):
+        """Espera a thread dos consumidores (incluindo o callback)."""
+        self._thread.join(timeout)
+
+    def abort(self):
+        """Descarta o upload: apaga o .part; a thread dos consumidores apaga os temporários
+        deles assim que terminar o bloco atual (sem fazer quem chamou esperar)."""
+        with self._cond:
+            if self.closed:
+                return
+            self.closed = True
+            self._cond.notify_all()
+        self._file.close()
+        if os.path.exists(self.part_path):
+            os.remove(self.part_path)
+
+
+def read_line_blocks(path, block_bytes=INGEST_BLOCK_BYTES):
+    """Percorre um arquivo já gravado em blocos de linhas completas: (bloco, offset)."""
+    offset = 0
+    rest = b''
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(block_bytes)
+            if not data:
+                break
+            data = rest + data
+            cut = data.rfind(b'\n') + 1
+            if not cut:
+                rest = data
+                continue
+            yield data[:cut], offset
+            offset += cut
+            rest = data[cut:]
+    if rest:
+        yield rest, offset
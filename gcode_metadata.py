@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Leitura dos metadados do fatiador (tempo, filamento, temperaturas, camadas...)
+
+O OrcaSlicer/PrusaSlicer/BambuStudio escrevem parte dos metadados no cabeçalho
+(";HEADER_BLOCK", "; total layer number") e a maior parte no rodapé
+("; estimated printing time", "; filament used [g]", bloco de configuração).
+O Cura escreve tudo no começo (";TIME:", ";LAYER_COUNT:", ";Filament used:").
+
+O arquivo é aberto com mmap e só duas janelas são lidas: METADATA_HEAD_BYTES do
+começo e METADATA_TAIL_BYTES do fim. As chaves dos comentários são encontradas por
+uma única regex compilada (todas as chaves de _COMMENT_KEYS), e cada chave aponta
+para o campo e o conversor do valor - sem testar linha a linha.
+
+METADATA_PARSER_VERSION vai para o banco junto com os valores: ao mudar a leitura,
+basta aumentar a versão para que só os arquivos lidos por versões antigas sejam
+relidos.
+"""
+
+import os
+import re
+import mmap
+
+# Aumentar quando a leitura mudar (arquivos com versão menor são relidos no início)
+METADATA_PARSER_VERSION = 2
+METADATA_HEAD_BYTES = 512 * 1024  # Cabeçalho, miniaturas e G-code inicial (M104/M140)
+METADATA_TAIL_BYTES = 256 * 1024  # Resumo e bloco de configuração do fatiador
+
+METADATA_FIELDS = ('print_time', 'filament_used', 'filament_type', 'nozzle_temp', 'bed_temp',
+                   'layer_height', 'infill', 'slicer', 'total_layers', 'filament_density',
+                   'filament_diameter', 'max_z_height')
+
+FILENAME_MATERIALS = ('PETG', 'PLA', 'ABS', 'TPU', 'NYLON', 'ASA', 'PC')
+
+
+def _first_value(value):
+    """Primeiro valor de listas por extrusora ("210,190,190" / "PETG;PLA")."""
+    return re.split(r'[,;]', value, 1)[0].strip().strip('"\'')
+
+
+def _to_float(value):
+    match = re.match(r'[-+]?\d*\.?\d+', _first_value(value))
+    return float(match.group()) if match else None
+
+
+def _to_int(value):
+    number = _to_float(value)
+    return int(number) if number is not None else None
+
+
+def _to_text(value):
+    return _first_value(value) or None
+
+
+def _to_percent(value):
+    """"15%", "15" ou "0.15" -> 15."""
+    number = _to_float(value)
+    if number is None:
+        return None
+    return int(round(number * 100)) if number < 1 else int(number)
+
+
+def _to_meters_mm(value):
+    """Cura: ";Filament used: 1.2345m" -> mm."""
+    number = _to_float(value)
+    return number * 1000 if number is not None else None
+
+
+def _to_total_time(value):
+    """BambuStudio/Orca: "; model printing time: 1h 2m; total estimated time: 1h 5m"."""
+    match = re.search(r'total estimated time:\s*([^;]+)', value)
+    return match.group(1).strip() if match else None
+
+
+def format_seconds(total_seconds):
+    hours = total_seconds // 3600
+    minutes = (total_seconds % 3600) // 60
+    seconds = total_seconds % 60
+    if hours > 0:
+        return f"{hours}h {minutes}m {seconds}s"
+    return f"{minutes}m {seconds}s"
+
+
+def _to_seconds_text(value):
+    """Cura: ";TIME:7200" -> "2h 0m 0s"."""
+    number = _to_int(value)
+    return format_seconds(number) if number is not None else None
+
+
+# chave do comentário (como o fatiador escreve) -> (campo, conversor, prioridade). Quando
+# mais de uma chave preenche o mesmo campo, fica a de menor prioridade (empate: a primeira
+# no arquivo). filament_g/filament_mm são combinados em filament_used no fim.
+_COMMENT_KEYS = {
+    'total layer number': ('total_layers', _to_int, 0),
+    'total layers count': ('total_layers', _to_int, 1),
+    'LAYER_COUNT': ('total_layers', _to_int, 2),
+    'max_z_height': ('max_z_height', _to_float, 0),
+    'filament_density': ('filament_density', _to_float, 0),
+    'filament_diameter': ('filament_diameter', _to_float, 0),
+    'estimated printing time (normal mode)': ('print_time', _to_text, 0),
+    'model printing time': ('print_time', _to_total_time, 1),
+    'TIME': ('print_time', _to_seconds_text, 2),
+    'total filament used [g]': ('filament_g', _to_float, 0),
+    'filament used [g]': ('filament_g', _to_float, 1),
+    'filament used [mm]': ('filament_mm', _to_float, 0),
+    'Filament used': ('filament_mm', _to_meters_mm, 1),
+    'filament_type': ('filament_type', _to_text, 0),
+    'nozzle_temperature_initial_layer': ('nozzle_temp', _to_int, 0),
+    'first_layer_temperature': ('nozzle_temp', _to_int, 0),
+    'nozzle_temperature': ('nozzle_temp', _to_int, 1),
+    'temperature': ('nozzle_temp', _to_int, 2),
+    'first_layer_bed_temperature': ('bed_temp', _to_int, 0),
+    'hot_plate_temp_initial_layer': ('bed_temp', _to_int, 0),
+    'bed_temperature': ('bed_temp', _to_int, 1),
+    'hot_plate_temp': ('bed_temp', _to_int, 1),
+    'layer_height': ('layer_height', _to_float, 0),
+    'Layer height': ('layer_height', _to_float, 1),
+    'sparse_infill_density': ('infill', _to_percent, 0),
+    'fill_density': ('infill', _to_percent, 0),
+    'sparse infill density': ('infill', _to_percent, 1),
+}
+
+# "; chave = valor" ou "; chave: valor", uma regex para todas as chaves (mais longas
+# primeiro, para "filament used [g]" não virar "filament used"). Ancorada no "\n;" e sem
+# IGNORECASE: ~1 ms por 512 KB, contra ~7 ms com "^" + re.MULTILINE + re.IGNORECASE
+_COMMENT_RE = re.compile(
+    rb'\n;[ \t]*(' +
+    b'|'.join(re.escape(key.encode()) for key in sorted(_COMMENT_KEYS, key=len, reverse=True)) +
+    rb')[ \t]*[:=][ \t]*([^\r\n]*)')
+_SLICER_RE = re.compile(rb'\n;[ \t]*generated (?:by|with)[ \t]+([A-Za-z_]+?)[ _]?v?(\d[\d.]*)', re.IGNORECASE)
+_SLICER_SEARCH_BYTES = 16 * 1024  # "generated by" fica nas primeiras linhas
+# Primeiras temperaturas do G-code inicial (têm prioridade sobre a configuração)
+_TEMPERATURE_RE = re.compile(rb'\n(M10[49]|M1[49]0)[ \t][^\r\n;]*?S([1-9]\d*)')
+
+
+def filament_grams(length_mm, density=None, diameter=None):
+    """Massa do filamento pelo comprimento (densidade em g/cm³, diâmetro em mm)."""
+    if density and diameter:
+        radius = diameter / 2
+        return round((3.14159 * (radius ** 2) * length_mm / 1000) * density, 2)
+    # Estimativa padrão para PLA 1.75mm
+    return round(length_mm * 0.0028, 2)
+
+
+def _metadata_from_filename(gcode_path, metadata):
+    """Nomes do tipo "Cubo_PETG_52m31s.gcode": tempo e material."""
+    filename = os.path.basename(gcode_path)
+    time_match = re.search(r'(\d+)h(\d+)m(\d+)s', filename)
+    if time_match:
+        h, m, s = time_match.groups()
+        metadata['print_time'] = f"{h}h {m}m {s}s"
+    else:
+        time_match = re.search(r'(\d+)m(\d+)s', filename)
+        if time_match:
+            m, s = time_match.groups()
+            metadata['print_time'] = f"{m}m {s}s"
+    for material in FILENAME_MATERIALS:
+        if material in filename.upper():
+            metadata['filament_type'] = material
+            break
+
+
+def metadata_windows(first, last, size):
+    """Cabeçalho e rodapé a partir dos primeiros e dos últimos bytes de um arquivo de `size` bytes.
+
+    Cada janela começa numa quebra de linha (as regex ancoram no início da linha assim);
+    um bloco só quando as janelas se encontram.
+    """
+    if size <= len(first) + len(last):
+        return b'\n' + first + last[len(last) - (size - len(first)):], b''
+    # Começar o rodapé numa linha inteira
+    return b'\n' + first, last[last.find(b'\n'):]
+
+
+def scan_gcode_metadata(gcode_path, head_bytes=METADATA_HEAD_BYTES, tail_bytes=METADATA_TAIL_BYTES, name=None):
+    """Metadados do fatiador a partir do começo e do fim do G-code.
+
+    Retorna um dict com METADATA_FIELDS (None quando o fatiador não informou) e
+    'parser_version'. O nome do arquivo ("..._PETG_52m31s.gcode") é usado quando os
+    comentários não trazem o tempo, e tem prioridade para o material; name é o nome
+    enviado pelo usuário quando o arquivo no disco tem outro (ex: guardado pelo hash).
+    """
+    head = tail = b''
+    try:
+        size = os.path.getsize(gcode_path)
+        if size:
+            with open(gcode_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                head, tail = metadata_windows(mm[:head_bytes], mm[max(0, size - tail_bytes):], size)
+    except (OSError, ValueError) as e:
+        print(f"Erro ao ler metadados do G-code: {e}")
+    return parse_metadata_windows(name or gcode_path, head, tail)
+
+
+def parse_metadata_windows(gcode_path, head, tail):
+    """Metadados a partir das janelas de metadata_windows() (já na memória, ex: upload).
+
+    gcode_path só serve para o nome do arquivo (tempo e material, ver scan_gcode_metadata).
+    """
+    metadata = dict.fromkeys(METADATA_FIELDS)
+    metadata['parser_version'] = METADATA_PARSER_VERSION
+    _metadata_from_filename(gcode_path, metadata)
+    filename_type = metadata['filament_type']
+
+    found = {}  # campo -> (prioridade, valor)
+    for window in (head, tail):
+        for match in _COMMENT_RE.finditer(window):
+            field, convert, priority = _COMMENT_KEYS[match.group(1).decode()]
+            if field in found and found[field][0] <= priority:
+                continue
+            value = convert(match.group(2).decode('utf-8', 'ignore').strip())
+            if value is not None:
+                found[field] = (priority, value)
+    values = {field: value for field, (_, value) in found.items()}
+
+    slicer_match = _SLICER_RE.search(head, 0, _SLICER_SEARCH_BYTES)
+    if slicer_match:
+        name = slicer_match.group(1).decode()
+        metadata['slicer'] = 'Cura' if 'cura' in name.lower() else f"{name} {slicer_match.group(2).decode()}"
+
+    for field in ('total_layers', 'max_z_height', 'filament_density', 'filament_diameter',
+                  'nozzle_temp', 'bed_temp', 'layer_height', 'infill'):
+        if field in values:
+            metadata[field] = values[field]
+    if 'print_time' in values:
+        metadata['print_time'] = values['print_time']
+    if not filename_type and 'filament_type' in values:
+        metadata['filament_type'] = values['filament_type']
+
+    temperatures = {}
+    for match in _TEMPERATURE_RE.finditer(head):
+        field = 'bed_temp' if match.group(1) in (b'M140', b'M190') else 'nozzle_temp'
+        temperatures.setdefault(field, int(match.group(2)))
+        if len(temperatures) == 2:
+            break
+    metadata.update(temperatures)
+
+    if 'filament_g' in values:
+        metadata['filament_used'] = values['filament_g']
+    elif 'filament_mm' in values:
+        metadata['filament_used'] = filament_grams(values['filament_mm'], metadata['filament_density'],
+                                                   metadata['filament_diameter'])
+    return metadata
+
+
+if __name__ == '__main__':
+    import sys
+    import json
+    import time
+
+    if len(sys.argv) < 2:
+        print("Uso: python3 gcode_metadata.py <arquivo.gcode>")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    result = scan_gcode_metadata(sys.argv[1])
+    elapsed = time.perf_counter() - start
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    print(f"⏱️ {os.path.getsize(sys.argv[1]) / (1024 * 1024):.1f} MB em {elapsed * 1000:.1f} ms")
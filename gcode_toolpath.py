@@ -0,0 +1,536 @@
+#!/usr/bin/env python3
+"""
+Extração do toolpath de um G-code em arrays colunares (NumPy)
+
+Lê o arquivo uma vez, em blocos, e gera "<gcode>.toolpath" ao lado do original:
+uma coluna por campo (x, y, z, e, f, tool, offset, layer), uma linha por movimento
+G0/G1/G2/G3. O arquivo pode ser aberto com np.memmap sem carregar tudo na memória,
+então estimativa de tempo, índice de camadas, visualizador e estatísticas de
+filamento leem daqui em vez de reprocessar o texto.
+
+- x, y, z: posição absoluta (mm) ao fim do movimento
+- e: filamento extrudado no movimento (mm, já resolvido M82/M83/G92)
+- f: feedrate (mm/min)
+- tool: extrusora/pincel ativo (T<n>)
+- offset: posição em bytes da linha no G-code
+- layer: camada (0 = primeira camada impressa)
+- feature: tipo de extrusão pelo comentário do fatiador (";TYPE:" / "; FEATURE:"), ver FEATURES
+
+Arcos (G2/G3) são aproximados por uma reta até o ponto final.
+"""
+
+import os
+import json
+import mmap
+import threading
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+    print("⚠️ NumPy não disponível - extração de toolpath desabilitada")
+
+TOOLPATH_SUFFIX = '.toolpath'
+TOOLPATH_MAGIC = b'CROMA-TOOLPATH'
+TOOLPATH_VERSION = 2
+TOOLPATH_HEADER_SIZE = 4096
+TOOLPATH_CHUNK_BYTES = 8 * 1024 * 1024
+
+# (nome, dtype) na ordem em que as colunas são gravadas
+TOOLPATH_COLUMNS = (
+    ('x', '<f4'),
+    ('y', '<f4'),
+    ('z', '<f4'),
+    ('e', '<f4'),
+    ('f', '<f4'),
+    ('tool', '<u1'),
+    ('offset', '<u4'),
+    ('layer', '<u4'),
+    ('feature', '<u1'),
+)
+
+# Códigos da coluna feature (índice na tupla)
+FEATURES = ('other', 'wall', 'sparse_infill', 'solid_infill', 'surface', 'support', 'skirt')
+# Preenchimento interno: não aparece por fora da peça
+INFILL_FEATURES = (FEATURES.index('sparse_infill'), FEATURES.index('solid_infill'))
+_FEATURE_PREFIXES = (b';TYPE:', b'; FEATURE:')
+
+_TOKEN_WIDTH = 16  # Caracteres máximos de um número ("-123.456789")
+_PARAM_LETTERS = b'XYZEF'
+_LAYER_EPSILON = 1e-4
+
+
+def _ffill(values, initial):
+    """Propaga o último valor válido sobre os NaN (modal do G-code)."""
+    valid = ~np.isnan(values)
+    idx = np.where(valid, np.arange(len(values)), -1)
+    np.maximum.accumulate(idx, out=idx)
+    return np.where(idx >= 0, values[np.maximum(idx, 0)], initial)
+
+
+def _set_position_values(text):
+    """Posições definidas por G92/G28: {'x': 0.0, 'e': 0.0, ...}."""
+    words = text.split()
+    if not words:
+        return {}
+    params = {}
+    for word in words[1:]:
+        try:
+            params[word[0]] = float(word[1:]) if len(word) > 1 else None
+        except ValueError:
+            continue
+
+    if words[0] == 'G92':
+        if not params:
+            return {'x': 0.0, 'y': 0.0, 'z': 0.0, 'e': 0.0}
+        return {axis.lower(): params[axis] for axis in 'XYZE' if params.get(axis) is not None}
+    if words[0] == 'G28':
+        axes = [axis for axis in 'XYZ' if axis in params] or ['X', 'Y', 'Z']
+        return {axis.lower(): 0.0 for axis in axes}
+    return {}
+
+
+def _resolve_relative(values, moving, initial):
+    """Posição em modo relativo: soma os deslocamentos, reiniciando onde G92/G28 definiu o valor."""
+    deltas = np.where(moving & ~np.isnan(values), values, 0.0)
+    total = np.cumsum(deltas)
+    resets = np.flatnonzero(~moving & ~np.isnan(values))
+    if not len(resets):
+        return initial + total
+    group = np.cumsum(~moving & ~np.isnan(values))
+    base = np.concatenate(([initial], values[resets]))
+    base_total = np.concatenate(([0.0], total[resets]))
+    return base[group] + total - base_total[group]
+
+
+def feature_code(name):
+    """Código de FEATURES para o nome do OrcaSlicer/PrusaSlicer/Cura ("Sparse infill", "FILL"...)."""
+    name = name.strip().lower()
+    if 'support' in name:
+        return FEATURES.index('support')
+    if any(word in name for word in ('skirt', 'brim', 'prime tower', 'wipe tower')):
+        return FEATURES.index('skirt')
+    if any(word in name for word in ('top', 'bottom', 'bridge', 'ironing', 'skin')):
+        return FEATURES.index('surface')
+    if 'solid' in name:
+        return FEATURES.index('solid_infill')
+    if 'infill' in name or name == 'fill':
+        return FEATURES.index('sparse_infill')
+    if any(word in name for word in ('wall', 'perimeter')):
+        return FEATURES.index('wall')
+    return FEATURES.index('other')
+
+
+def _parse_event(text, state):
+    """Aplica um comando que muda o modo (G90/G91/M82/M83/T<n>)."""
+    words = text.split()
+    if not words:
+        return
+    cmd = words[0]
+
+    if cmd == 'G90':
+        state['rel_xyz'] = False
+    elif cmd == 'G91':
+        state['rel_xyz'] = True
+    elif cmd == 'M82':
+        state['e_mode'] = 'abs'
+    elif cmd == 'M83':
+        state['e_mode'] = 'rel'
+    elif cmd.startswith('T'):
+        try:
+            state['tool'] = int(cmd[1:])
+        except ValueError:
+            pass
+
+
+def _parse_chunk(buf, base_offset, state):
+    """Extrai as colunas dos movimentos de um bloco de linhas completas."""
+    nl = np.flatnonzero(buf == 10)
+    if not len(nl):
+        return None
+    starts = np.empty(len(nl), dtype=np.int64)
+    starts[0] = 0
+    starts[1:] = nl[:-1] + 1
+
+    # Fim da parte de código de cada linha (antes do ';')
+    code_end = nl.copy()
+    semi = np.flatnonzero(buf == 59)
+    if len(semi):
+        semi_line = np.searchsorted(starts, semi, 'right') - 1
+        lines_with_semi, first = np.unique(semi_line, return_index=True)
+        code_end[lines_with_semi] = semi[first]
+
+    # Palavra de comando: letra + número inteiro de até 3 dígitos (G1, G92, M83, T2...)
+    padded = np.concatenate((buf, np.zeros(_TOKEN_WIDTH + 1, dtype=np.uint8)))
+    letter = padded[starts]
+    head = padded[starts[:, None] + np.arange(1, 5)]
+    is_digit = (head >= 48) & (head <= 57)
+    digit_prefix = np.logical_and.accumulate(is_digit, axis=1)
+    ndigits = digit_prefix.sum(axis=1)
+    weights = np.array([1000, 100, 10, 1])
+    number = np.where(digit_prefix, head - 48, 0)
+    number = (number * weights).sum(axis=1) // (10 ** (4 - ndigits))
+    number = np.where(ndigits > 0, number, -1)
+    word_end = padded[starts + 1 + ndigits]
+    whole_word = (word_end != 46)  # G29.1, M600.x etc. não são o comando inteiro
+
+    is_g = (letter == 71) & whole_word
+    is_m = (letter == 77) & whole_word
+    motion = is_g & (number >= 0) & (number <= 3) & (ndigits > 0) & (code_end > starts)
+    # G92/G28 definem posição: entram como linhas "fantasma" na tabela, para que a
+    # propagação vetorizada já parta do valor definido (removidas no fim)
+    set_pos = is_g & np.isin(number, (28, 92))
+    modes = ((is_g & np.isin(number, (90, 91)))
+             | (is_m & np.isin(number, (82, 83)))
+             | ((letter == 84) & (ndigits > 0)))
+
+    row_mask = motion | set_pos
+    row_lines = np.flatnonzero(row_mask)
+    n_rows = len(row_lines)
+    row_of_line = np.cumsum(row_mask) - 1
+    is_move = motion[row_lines]
+
+    # Parâmetros X/Y/Z/E/F das linhas de movimento (dentro da parte de código)
+    columns = {}
+    cand = np.flatnonzero(np.isin(buf, np.frombuffer(_PARAM_LETTERS, dtype=np.uint8)))
+    if len(cand):
+        cand_line = np.searchsorted(starts, cand, 'right') - 1
+        keep = motion[cand_line] & (cand < code_end[cand_line]) & (cand > starts[cand_line])
+        cand = cand[keep]
+        cand_line = cand_line[keep]
+    for axis in 'xyzef':
+        columns[axis] = np.full(n_rows, np.nan)
+    if len(cand):
+        window = padded[cand[:, None] + np.arange(1, _TOKEN_WIDTH + 1)]
+        numeric = ((window >= 48) & (window <= 57)) | (window == 46) | (window == 45) | (window == 43)
+        prefix = np.logical_and.accumulate(numeric, axis=1)
+        has_value = prefix[:, 0]
+        window = np.where(prefix, window, 0).astype(np.uint8)
+        tokens = np.ascontiguousarray(window[has_value]).view(f'S{_TOKEN_WIDTH}').ravel()
+        try:
+            values = tokens.astype(np.float64)
+        except ValueError:
+            # Número malformado ("-", "1.2.3"): converter um a um e descartar os inválidos
+            values = np.array([_safe_float(token) for token in tokens])
+        rows = row_of_line[cand_line[has_value]]
+        letters = buf[cand[has_value]]
+        for axis, code in zip('xyzef', _PARAM_LETTERS):
+            sel = letters == code
+            columns[axis][rows[sel]] = values[sel]
+
+    # Valores definidos por G92/G28 (poucas linhas: texto interpretado em Python)
+    set_rows = np.flatnonzero(~is_move)
+    for row in set_rows:
+        line = row_lines[row]
+        text = bytes(buf[starts[line]:code_end[line]]).decode('ascii', 'ignore')
+        for axis, value in _set_position_values(text.strip().upper()).items():
+            columns[axis][row] = value
+
+    out = {name: np.empty(n_rows, dtype=np.float64) for name in ('x', 'y', 'z', 'e', 'f', 'e_pos')}
+    out['tool'] = np.empty(n_rows, dtype=np.uint8)
+    out['rel_e'] = np.empty(n_rows, dtype=bool)
+
+    # Segmentos entre mudanças de modo (G90/G91/M82/M83/T): vetorizado dentro de cada um
+    mode_lines = np.flatnonzero(modes)
+    boundaries = list(row_of_line[mode_lines] + 1) + [n_rows]
+    segment_start = 0
+    for boundary, mode_line in zip(boundaries, list(mode_lines) + [None]):
+        if boundary > segment_start:
+            sl = slice(segment_start, boundary)
+            moving = is_move[sl]
+            for axis in 'xyz':
+                values = columns[axis][sl]
+                if state['rel_xyz']:
+                    out[axis][sl] = _resolve_relative(values, moving, state[axis])
+                else:
+                    out[axis][sl] = _ffill(values, state[axis])
+                state[axis] = float(out[axis][boundary - 1])
+
+            e_values = columns['e'][sl]
+            rel_e = state['e_mode'] == 'rel' or (state['e_mode'] is None and state['rel_xyz'])
+            if rel_e:
+                e_pos = _resolve_relative(e_values, moving, state['e'])
+                out['e'][sl] = np.where(moving & ~np.isnan(e_values), e_values, 0.0)
+            else:
+                e_pos = _ffill(e_values, state['e'])
+                out['e'][sl] = np.diff(e_pos, prepend=state['e'])
+            state['e'] = float(e_pos[-1])
+            out['e_pos'][sl] = e_pos
+            out['rel_e'][sl] = rel_e
+
+            out['f'][sl] = _ffill(columns['f'][sl], state['f'])
+            state['f'] = float(out['f'][boundary - 1])
+            out['tool'][sl] = state['tool']
+            segment_start = boundary
+
+        if mode_line is not None:
+            text = bytes(buf[starts[mode_line]:code_end[mode_line]]).decode('ascii', 'ignore')
+            _parse_event(text.strip().upper(), state)
+
+    if len(set_rows):
+        out = {name: column[is_move] for name, column in out.items()}
+    n_moves = len(out['x'])
+    move_lines = row_lines[is_move]
+
+    # Camadas: sobe quando um movimento com extrusão passa da maior altura já impressa
+    extruding_z = np.where(out['e'] > 0, out['z'], -np.inf)
+    running_max = np.maximum.accumulate(np.concatenate(([state['max_z']], extruding_z)))
+    layer_up = running_max[1:] > running_max[:-1] + _LAYER_EPSILON
+    layer_count = state['layer_count'] + np.cumsum(layer_up)
+    if n_moves:
+        state['max_z'] = float(running_max[-1])
+        state['layer_count'] = int(layer_count[-1])
+    out['layer'] = np.maximum(layer_count - 1, 0)
+    out['layer_start'] = layer_up
+    out['offset'] = starts[move_lines] + base_offset
+
+    # Tipo de extrusão: vale do comentário ";TYPE:" até o próximo
+    comment_lines = np.flatnonzero(letter == 59)
+    feature_lines = []
+    feature_codes = []
+    for prefix in _FEATURE_PREFIXES:
+        window = padded[starts[comment_lines][:, None] + np.arange(len(prefix))]
+        match = (window == np.frombuffer(prefix, dtype=np.uint8)).all(axis=1)
+        for line in comment_lines[match]:
+            name = bytes(buf[starts[line] + len(prefix):nl[line]]).decode('ascii', 'ignore')
+            feature_lines.append(line)
+            feature_codes.append(feature_code(name))
+    order = np.argsort(feature_lines)
+    feature_lines = np.asarray(feature_lines, dtype=np.int64)[order]
+    feature_codes = np.concatenate(([state['feature']], np.asarray(feature_codes, dtype=np.uint8)[order]))
+    out['feature'] = feature_codes[np.searchsorted(feature_lines, move_lines, 'right')]
+    state['feature'] = int(feature_codes[-1])
+    return out
+
+
+def _safe_float(token):
+    try:
+        return float(token)
+    except ValueError:
+        return np.nan
+
+
+def toolpath_path(gcode_path):
+    return gcode_path + TOOLPATH_SUFFIX
+
+
+class ToolpathBuilder:
+    """Gera o .toolpath a partir de blocos de linhas completas, na ordem do arquivo.
+
+    feed() pode ser chamado enquanto o G-code ainda está sendo gravado (upload): cada
+    coluna vai para um arquivo temporário, juntado ao cabeçalho em finish(). Os
+    temporários têm nome único, então duas gerações do mesmo arquivo não se atrapalham.
+    """
+
+    def __init__(self, gcode_path):
+        self.out_path = toolpath_path(gcode_path)
+        unique = f"{os.getpid()}-{threading.get_ident()}"
+        self.tmp_paths = {name: f"{self.out_path}.{name}.{unique}.tmp" for name, _ in TOOLPATH_COLUMNS}
+        self.tmp_files = {name: open(path, 'wb') for name, path in self.tmp_paths.items()}
+        self.state = {'x': 0.0, 'y': 0.0, 'z': 0.0, 'e': 0.0, 'f': 0.0, 'tool': 0,
+                      'rel_xyz': False, 'e_mode': None, 'max_z': -np.inf, 'layer_count': 0, 'feature': 0}
+        self.moves = 0
+        self.layer_index = []
+        self.last_xyz = (0.0, 0.0, 0.0)
+        self.filament_mm = 0.0
+        self.bbox_min = np.full(3, np.inf)
+        self.bbox_max = np.full(3, -np.inf)
+
+    def feed(self, data, offset):
+        """Processa um bloco que começa em `offset` no G-code e termina no fim de uma linha."""
+        if not len(data):
+            return
+        chunk = np.frombuffer(data, dtype=np.uint8)
+        if chunk[-1] != 10:
+            chunk = np.concatenate((chunk, np.array([10], dtype=np.uint8)))
+        cols = _parse_chunk(chunk, offset, self.state)
+        if cols is None or not len(cols['x']):
+            return
+
+        self.moves += len(cols['x'])
+        self.last_xyz = _collect_layer_starts(cols, self.last_xyz, self.layer_index)
+        # Soma líquida: retrações voltam no recuo seguinte
+        self.filament_mm += float(cols['e'].sum())
+        extruding = cols['e'] > 0
+        if extruding.any():
+            xyz = np.stack((cols['x'][extruding], cols['y'][extruding], cols['z'][extruding]))
+            self.bbox_min = np.minimum(self.bbox_min, xyz.min(axis=1))
+            self.bbox_max = np.maximum(self.bbox_max, xyz.max(axis=1))
+        for name, dtype in TOOLPATH_COLUMNS:
+            self.tmp_files[name].write(np.ascontiguousarray(cols[name], dtype=dtype).tobytes())
+
+    def finish(self, gcode_path=None):
+        """Grava o .toolpath e retorna o resumo (ver build_toolpath).
+
+        gcode_path: nome final do G-code, se mudou depois do início (upload guardado pelo hash).
+        """
+        try:
+            for fh in self.tmp_files.values():
+                fh.close()
+
+            layer_index = self.layer_index
+            # A 1ª camada começa no início do arquivo (inclui o G-code inicial e a purga)
+            if layer_index:
+                layer_index[0][0] = 0
+                layer_index[0][2:] = [0.0, 0.0, 0.0, 0.0, False]
+
+            moves = self.moves
+            bbox_min, bbox_max = self.bbox_min, self.bbox_max
+            summary = {
+                'moves': moves,
+                'layers': self.state['layer_count'],
+                'filament_mm': round(self.filament_mm, 2),
+                'bbox_min': [round(float(v), 3) for v in bbox_min] if moves and np.isfinite(bbox_min).all() else None,
+                'bbox_max': [round(float(v), 3) for v in bbox_max] if moves and np.isfinite(bbox_max).all() else None,
+            }
+            _write_toolpath(toolpath_path(gcode_path) if gcode_path else self.out_path,
+                            self.tmp_paths, moves, summary)
+            summary['layer_index'] = layer_index
+            return summary
+        finally:
+            self.abort()
+
+    def abort(self):
+        """Fecha e apaga os temporários (sem gerar o .toolpath)."""
+        for name, fh in self.tmp_files.items():
+            fh.close()
+            if os.path.exists(self.tmp_paths[name]):
+                os.remove(self.tmp_paths[name])
+
+
+def build_toolpath(gcode_path, chunk_bytes=TOOLPATH_CHUNK_BYTES):
+    """Gera o .toolpath do G-code e retorna o resumo (movimentos, camadas, filamento, limites).
+
+    O resumo também traz 'layer_index' (fica fora do cabeçalho): onde cada camada começa
+    no G-code e o estado naquele ponto - ver _collect_layer_starts.
+
+    Memória limitada: o arquivo é lido em blocos e cada coluna vai para um arquivo
+    temporário, que no fim é juntado ao cabeçalho.
+    """
+    if not NUMPY_AVAILABLE:
+        return None
+
+    builder = ToolpathBuilder(gcode_path)
+    try:
+        with open(gcode_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+            try:
+                pos = 0
+                while pos < size:
+                    end = min(pos + chunk_bytes, size)
+                    if end < size:
+                        newline = data.rfind(b'\n', pos, end)
+                        end = newline + 1 if newline >= pos else data.find(b'\n', end) + 1 or size
+                    builder.feed(data[pos:end], pos)
+                    pos = end
+            finally:
+                if size:
+                    data.close()
+    except BaseException:
+        builder.abort()
+        raise
+    return builder.finish()
+
+
+def _collect_layer_starts(cols, last_xyz, layer_index):
+    """Acrescenta ao índice o início de cada camada do bloco: [offset, z, x0, y0, z0, e0, e_relativo].
+
+    x0/y0/z0/e0 é o estado logo antes da linha (posição e valor de E como o G-code o vê),
+    para que o trecho da camada possa ser interpretado sozinho.
+    """
+    for i in np.flatnonzero(cols['layer_start']):
+        if i > 0:
+            x0, y0, z0 = float(cols['x'][i - 1]), float(cols['y'][i - 1]), float(cols['z'][i - 1])
+        else:
+            x0, y0, z0 = last_xyz
+        e0 = float(cols['e_pos'][i] - cols['e'][i])
+        layer_index.append([int(cols['offset'][i]), round(float(cols['z'][i]), 3),
+                            round(x0, 3), round(y0, 3), round(z0, 3), round(e0, 5), bool(cols['rel_e'][i])])
+    return float(cols['x'][-1]), float(cols['y'][-1]), float(cols['z'][-1])
+
+
+def _write_toolpath(out_path, tmp_paths, count, summary):
+    """Cabeçalho JSON (4 KB) + colunas alinhadas em 64 bytes."""
+    columns = []
+    offset = TOOLPATH_HEADER_SIZE
+    for name, dtype in TOOLPATH_COLUMNS:
+        offset = (offset + 63) // 64 * 64
+        columns.append({'name': name, 'dtype': dtype, 'offset': offset})
+        offset += count * np.dtype(dtype).itemsize
+
+    header = json.dumps({'version': TOOLPATH_VERSION, 'count': count,
+                         'columns': columns, 'summary': summary}).encode()
+    header = TOOLPATH_MAGIC + b' ' + header + b'\n'
+    if len(header) > TOOLPATH_HEADER_SIZE:
+        raise ValueError('Cabeçalho do toolpath maior que o reservado')
+
+    tmp_out = f"{out_path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    with open(tmp_out, 'wb') as out:
+        out.write(header.ljust(TOOLPATH_HEADER_SIZE, b' '))
+        for column in columns:
+            out.write(b'\0' * (column['offset'] - out.tell()))
+            with open(tmp_paths[column['name']], 'rb') as src:
+                while True:
+                    block = src.read(1024 * 1024)
+                    if not block:
+                        break
+                    out.write(block)
+    os.replace(tmp_out, out_path)
+
+
+def read_toolpath_header(gcode_path):
+    """Cabeçalho do .toolpath (versão, total, colunas, resumo) ou None se não existir/for antigo."""
+    path = toolpath_path(gcode_path)
+    try:
+        if os.path.getmtime(path) < os.path.getmtime(gcode_path):
+            return None
+        with open(path, 'rb') as f:
+            raw = f.read(TOOLPATH_HEADER_SIZE)
+    except OSError:
+        return None
+    if not raw.startswith(TOOLPATH_MAGIC + b' '):
+        return None
+    try:
+        header = json.loads(raw[len(TOOLPATH_MAGIC) + 1:].split(b'\n', 1)[0])
+    except ValueError:
+        return None
+    if header.get('version') != TOOLPATH_VERSION:
+        return None
+    return header
+
+
+def load_toolpath(gcode_path):
+    """Abre as colunas do .toolpath com np.memmap: {'count', 'summary', 'x': array, ...} ou None."""
+    if not NUMPY_AVAILABLE:
+        return None
+    header = read_toolpath_header(gcode_path)
+    if header is None:
+        return None
+    path = toolpath_path(gcode_path)
+    result = {'count': header['count'], 'summary': header['summary']}
+    for column in header['columns']:
+        if header['count']:
+            result[column['name']] = np.memmap(path, dtype=column['dtype'], mode='r',
+                                               offset=column['offset'], shape=(header['count'],))
+        else:
+            result[column['name']] = np.zeros(0, dtype=column['dtype'])
+    return result
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    if len(sys.argv) < 2:
+        print("Uso: python3 gcode_toolpath.py <arquivo.gcode>")
+        sys.exit(1)
+
+    start = time.time()
+    result = build_toolpath(sys.argv[1])
+    elapsed = time.time() - start
+    size_mb = os.path.getsize(sys.argv[1]) / (1024 * 1024)
+    print(json.dumps(result, indent=2))
+    print(f"⏱️ {size_mb:.1f} MB em {elapsed:.2f}s ({size_mb / elapsed:.1f} MB/s)")
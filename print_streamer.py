@@ -0,0 +1,762 @@
+#!/usr/bin/env python3
+"""
+Envio das linhas da impressão num processo próprio (STREAM_PROCESS=1)
+
+No modo normal, a thread de impressão divide o GIL com as requisições do Flask (JSON,
+templates, regex) e para junto com o coletor de lixo do processo inteiro. Neste modo, o
+app empresta a porta serial (o descritor já aberto, sem reiniciar a placa) a um processo
+filho durante a impressão, que só faz o envio:
+
+- fixado num núcleo (STREAM_CPU) e com prioridade de tempo real (SCHED_FIFO) quando o
+  sistema permite; senão nice negativo; senão prioridade normal
+- coletor de lixo congelado (gc.freeze) e desligado durante a impressão: as gerações
+  0 e 1 são coletadas só enquanto ele espera "ok" com a janela cheia, a 2 nunca
+- caminho de envio pré-alocado: os comandos do .stream continuam em bytes (sem
+  decode/encode), a linha numerada é montada num buffer fixo e escrita com os.write
+- um laço só (poll na serial e no canal de controle), sem threads; a leitura antecipada
+  do .stream fica com o kernel (posix_fadvise WILLNEED)
+
+O app continua dono da impressão (pausa, parada, filamento, progresso, banco): manda
+ordens pelo canal de controle (socketpair, uma mensagem JSON por linha) e recebe as
+linhas do firmware que não são só "ok" (temperatura, echo, erros, //action:) e o
+progresso. Enquanto o filho está com a porta, send_gcode() do app é encaminhado a ele.
+
+AckJitter mede o intervalo entre receber o "ok" que abriu vaga na janela e escrever a
+linha seguinte; o modo em thread usa a mesma medida, para comparar os dois.
+"""
+
+import os
+import re
+import gc
+import sys
+import json
+import time
+import select
+import socket
+import threading
+import subprocess
+from array import array
+from collections import deque
+
+STREAMER_SCRIPT = os.path.abspath(__file__)
+JITTER_SAMPLES = 4096  # Amostras recentes usadas nos percentis
+FRAME_BYTES = 256  # Buffer da linha montada: "N<n> " + comando + "*<cs>\n"
+SERIAL_READ_BYTES = 4096
+STREAM_READ_BYTES = 64 * 1024  # Bloco lido do .stream
+PROGRESS_INTERVAL_SEC = 0.5  # Intervalo das mensagens de progresso para o app
+GC_IDLE_THRESHOLD = 700  # Objetos novos antes de coletar a geração 0 (na espera por "ok")
+STREAMER_NICE = -10  # Sem permissão para SCHED_FIFO
+EXIT_TIMEOUT_SEC = 300  # Espera pelos comandos em trânsito ao devolver a porta (ex: G28)
+READY_TIMEOUT_SEC = 10
+
+_ADVANCED_OK_SLOTS_RE = re.compile(rb'\bB(\d+)')
+_RESEND_RE = re.compile(rb'(?:resend|rs)[:\s]\s*n?(\d+)')
+
+
+class AckJitter:
+    """Intervalo entre o "ok" que abriu vaga e a escrita da próxima linha (em segundos).
+
+    Guarda as últimas JITTER_SAMPLES amostras num array fixo (percentis) e, de todas,
+    a soma e o máximo.
+    """
+
+    def __init__(self, samples=JITTER_SAMPLES):
+        self._samples = array('d', bytes(8 * samples))
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self._samples[self.count % len(self._samples)] = seconds
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def snapshot(self):
+        n = min(self.count, len(self._samples))
+        samples = sorted(self._samples[:n])
+
+        def percentile(p):
+            return round(samples[min(n - 1, int(n * p))] * 1000.0, 3) if n else 0.0
+
+        return {
+            'count': self.count,
+            'avg_ms': round(self.total / self.count * 1000.0, 3) if self.count else 0.0,
+            'p50_ms': percentile(0.50),
+            'p95_ms': percentile(0.95),
+            'p99_ms': percentile(0.99),
+            'max_ms': round(self.max * 1000.0, 3),
+        }
+
+
+def xor_checksum(data):
+    """Checksum do Marlin (XOR de todos os bytes), dobrando o inteiro ao meio: O(log n)
+    operações em vez de uma por byte."""
+    value = int.from_bytes(data, 'little')
+    span = 1
+    while span < len(data):
+        span <<= 1
+    while span > 1:
+        span >>= 1
+        value = (value ^ (value >> (8 * span))) & ((1 << (8 * span)) - 1)
+    return value
+
+
+def encode_frame(line, number=None):
+    """Linha como vai para a serial: b"N<n> <linha>*<cs>\n", ou b"<linha>\n" sem número."""
+    if number is None:
+        return line + b'\n'
+    body = b'N%d ' % number + line
+    return body + b'*%d\n' % xor_checksum(body)
+
+
+def frame_size(line, number=None):
+    """Bytes que _transmit escreve: "N<n> <linha>*<cs>\n", ou "<linha>\n" sem número.
+
+    O número e o checksum crescem com a impressão (N1234567 tem 8 bytes); contar o tamanho
+    real evita estourar o buffer de recepção do Marlin em arquivos longos.
+    """
+    if number is None:
+        return len(line) + 1
+    prefix = b'N%d ' % number
+    checksum = xor_checksum(prefix) ^ xor_checksum(line)  # XOR: checksum(a + b) = a ^ b
+    return len(prefix) + len(line) + len(b'*%d\n' % checksum)
+
+
+def plan_resend(number, last_number, history_size, numbered_inflight, resend_from, resend_ignore):
+    """Decide o que fazer com um "Resend: N" do firmware (aqui e no modo em thread do app).
+
+    last_number: última linha numerada enviada; history_size: quantas das últimas linhas
+    ainda estão guardadas; numbered_inflight: linhas numeradas esperando "ok" (a que gerou
+    o pedido inclusive); resend_from/resend_ignore: estado deixado pelo pedido anterior.
+
+    Retorna (ação, resend_from, resend_ignore) com o estado novo:
+    - 'ignore': repetição do pedido anterior - cada linha numerada que já estava em trânsito
+      depois da corrompida gera outro "Resend: N" igual
+    - 'resync': N fora do histórico; não há como reenviar: descartar a fila de reenvio e
+      ressincronizar a numeração ("M110 N<last_number>")
+    - 'resend': reenviar de N até last_number
+    """
+    if number == resend_from and resend_ignore > 0:
+        return 'ignore', resend_from, resend_ignore - 1
+    first = max(1, last_number - history_size + 1)
+    if number < first or number > last_number:
+        return 'resync', None, 0
+    return 'resend', number, max(0, numbered_inflight - 1)
+
+
+def tune_realtime(cpu=None, rt_priority=0):
+    """Fixa o processo atual num núcleo e sobe a prioridade (SCHED_FIFO, senão nice)."""
+    placement = {'cpu': None, 'scheduler': 'normal'}
+    if cpu is not None and hasattr(os, 'sched_setaffinity'):
+        try:
+            os.sched_setaffinity(0, {cpu})
+            placement['cpu'] = cpu
+        except OSError as e:
+            print(f"⚠️ Envio: não foi possível fixar no núcleo {cpu}: {e}")
+    if rt_priority > 0 and hasattr(os, 'sched_setscheduler'):
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(rt_priority))
+            placement['scheduler'] = f'fifo {rt_priority}'
+            return placement
+        except OSError:
+            pass  # Sem CAP_SYS_NICE / LimitRTPRIO: tentar o nice
+    try:
+        os.setpriority(os.PRIO_PROCESS, 0, STREAMER_NICE)
+        placement['scheduler'] = f'nice {STREAMER_NICE}'
+    except OSError:
+        pass
+    return placement
+
+
+class _Pending:
+    """Linha escrita aguardando o "ok" (fila FIFO, como no app)."""
+
+    __slots__ = ('nbytes', 'timeout', 'number', 'command_id', 'responses', 'queued_ms')
+
+    def __init__(self, nbytes, timeout, number=None, command_id=None, queued_ms=0.0):
+        self.nbytes = nbytes
+        self.timeout = timeout
+        self.number = number
+        self.command_id = command_id  # None: linha do .stream
+        self.responses = []
+        self.queued_ms = queued_ms
+
+
+class StreamerLink:
+    """Lado do processo filho: envia o .stream pela serial e atende o app pelo canal de controle."""
+
+    def __init__(self, serial_fd, control, config):
+        self.fd = serial_fd
+        self.control = control
+        self.checksum = config['checksum']
+        self.rx_buffer_bytes = config['rx_buffer_bytes']
+        self.max_inflight = max(1, config['max_inflight'])
+        self.timeouts = {kind.encode(): seconds for kind, seconds in config['timeouts'].items()}
+        self.command_timeout = config['command_timeout']
+        self.prefetch_bytes = config['prefetch_bytes']
+        self.stream_file = open(config['stream_path'], 'rb')
+        self.stream_file.readline()  # cabeçalho
+        self.fadvised = 0
+        self.records = deque()
+        self.buffered_bytes = 0
+        self.eof = False
+        self.next_record = None  # (timeout, offset, comando) esperando vaga na janela
+        self.offset = 0  # Offset no G-code original da última linha enviada
+        self.inflight = deque()
+        self.inflight_bytes = 0
+        self.slots_hint = None
+        self.last_progress = time.monotonic()
+        self.line_number = 0
+        self.history = [b''] * max(1, config['resend_history'])
+        self.resend_queue = deque()
+        self.resend_from = None
+        self.resend_ignore = 0
+        self.interactive = deque()  # (id, comando, timeout, recebido em)
+        self.bulk = deque()
+        self.started = False
+        self.paused = False
+        self.paused_sent = False
+        self.stopping = False
+        self.exiting = False
+        self.done_sent = False
+        self.control_open = True
+        self.rx = bytearray()
+        self.control_rx = bytearray()
+        self.frame = bytearray(FRAME_BYTES)
+        self.view = memoryview(self.frame)
+        self.jitter = AckJitter()
+        self.ack_ts = None
+        self.last_report = 0.0
+        self.stats = {'lines_sent': 0, 'lines_acked': 0, 'timeouts': 0, 'max_inflight': 0,
+                      'resends': 0, 'resent_lines': 0, 'prefetch_underruns': 0,
+                      'prefetch_underrun_ms': 0.0}
+        self.gc_stats = {'collections': 0, 'total_ms': 0.0, 'max_ms': 0.0}
+
+    # Canal de controle
+    def send(self, message):
+        if not self.control_open:
+            return
+        try:
+            self.control.sendall(json.dumps(message).encode() + b'\n')
+        except OSError:
+            self.control_open = False
+
+    def _read_control(self):
+        try:
+            data = self.control.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if not data:
+            # App encerrado: não mandar linhas novas e sair quando a janela esvaziar
+            self.control_open = False
+            self.stopping = True
+            self.exiting = True
+            return
+        self.control_rx += data
+        while True:
+            end = self.control_rx.find(b'\n')
+            if end < 0:
+                break
+            message = json.loads(bytes(self.control_rx[:end]))
+            del self.control_rx[:end + 1]
+            self._handle_control(message)
+
+    def _handle_control(self, message):
+        op = message['op']
+        if op == 'send':
+            line = message['line'].encode()
+            timeout = message.get('timeout') or self.command_timeout
+            if message.get('priority') == 'emergency' and self.started:
+                # Fora da janela: o EMERGENCY_PARSER do Marlin age na recepção
+                self._transmit(line, None, timeout, message['id'])
+            elif message.get('priority') == 'emergency':
+                self.interactive.appendleft((message['id'], line, timeout, time.perf_counter()))
+            else:
+                queue = self.bulk if message.get('priority') == 'bulk' else self.interactive
+                queue.append((message['id'], line, timeout, time.perf_counter()))
+        elif op == 'start':
+            self.started = True
+            self._refill()
+        elif op == 'pause':
+            self.paused = True
+            self.paused_sent = False
+        elif op == 'resume':
+            self.paused = False
+        elif op == 'stop':
+            self.stopping = True
+        elif op == 'exit':
+            self.exiting = True
+
+    # Leitura do .stream
+    def _refill(self):
+        if self.eof:
+            return
+        if self.fadvised <= self.stream_file.tell() + self.prefetch_bytes:
+            # Leitura antecipada pelo kernel, sem thread: pedir a próxima janela
+            try:
+                os.posix_fadvise(self.stream_file.fileno(), self.fadvised, 2 * self.prefetch_bytes,
+                                 os.POSIX_FADV_WILLNEED)
+            except (AttributeError, OSError):
+                pass
+            self.fadvised += 2 * self.prefetch_bytes
+        chunk = self.stream_file.readlines(STREAM_READ_BYTES)
+        if not chunk:
+            self.eof = True
+            return
+        self.records.extend(chunk)
+        self.buffered_bytes += sum(len(record) for record in chunk)
+
+    def _peek(self):
+        """Próxima linha do .stream (fica em next_record até ser enviada)."""
+        if self.next_record is None:
+            if not self.records and not self.eof:
+                self.stats['prefetch_underruns'] += 1
+                start = time.perf_counter()
+                self._refill()
+                self.stats['prefetch_underrun_ms'] += (time.perf_counter() - start) * 1000.0
+            if not self.records:
+                return None
+            record = self.records.popleft()
+            self.buffered_bytes -= len(record)
+            kind, offset, line = record[:-1].split(b' ', 2)
+            self.next_record = (self.timeouts.get(kind, self.command_timeout), int(offset), line)
+        return self.next_record
+
+    # Escrita
+    def _write(self, data):
+        view = memoryview(data)
+        while view:
+            try:
+                written = os.write(self.fd, view)
+                view = view[written:]
+            except (BlockingIOError, InterruptedError):
+                select.select([], [self.fd], [], 1.0)
+
+    def _transmit(self, line, number, timeout, command_id=None, queued_at=None):
+        """Monta a linha no buffer fixo e escreve; registra quem espera o "ok"."""
+        size = len(line)
+        if size > FRAME_BYTES - 32:
+            view = memoryview(encode_frame(line, number))
+        else:
+            view = self.view
+            if number is None:
+                view[:size] = line
+                view[size] = 10
+                size += 1
+            else:
+                prefix = b'N%d ' % number
+                start = len(prefix)
+                view[:start] = prefix
+                view[start:start + size] = line
+                size += start
+                tail = b'*%d\n' % xor_checksum(view[:size])
+                view[size:size + len(tail)] = tail
+                size += len(tail)
+            view = view[:size]
+
+        if not self.inflight:
+            self.last_progress = time.monotonic()
+        self._write(view)
+
+        queued_ms = (time.perf_counter() - queued_at) * 1000.0 if queued_at else 0.0
+        self.inflight.append(_Pending(len(view), timeout, number, command_id, queued_ms))
+        self.inflight_bytes += len(view)
+        if self.slots_hint is not None:
+            self.slots_hint -= 1
+        if len(self.inflight) > self.stats['max_inflight']:
+            self.stats['max_inflight'] = len(self.inflight)
+
+    def _has_room(self, nbytes):
+        if not self.inflight:
+            return True
+        if len(self.inflight) >= self.max_inflight:
+            return False
+        if self.slots_hint is not None and self.slots_hint <= 0:
+            return False
+        return self.inflight_bytes + nbytes <= self.rx_buffer_bytes
+
+    def _fill(self):
+        """Escreve enquanto houver vaga: interativos, reenvios, bulk e, por fim, o .stream."""
+        if not self.started:
+            return  # A thread leitora do app ainda pode estar com a porta
+        while True:
+            queue = self.interactive if self.interactive else None
+            if queue is None and not self.resend_queue and self.bulk:
+                queue = self.bulk
+            if queue is not None:
+                command_id, line, timeout, queued_at = queue[0]
+                if not self._has_room(frame_size(line)):
+                    return
+                queue.popleft()
+                self._transmit(line, None, timeout, command_id, queued_at)
+                continue
+            if self.resend_queue:
+                number, line = self.resend_queue[0]
+                if not self._has_room(frame_size(line, number)):
+                    return
+                self.resend_queue.popleft()
+                self._transmit(line, number, self.command_timeout)
+                continue
+            if self.paused or self.stopping:
+                return
+            record = self._peek()
+            if record is None:
+                return
+            timeout, offset, line = record
+            number = self.line_number + 1 if self.checksum else None
+            if not self._has_room(frame_size(line, number)):
+                return
+            if self.ack_ts is not None:
+                self.jitter.record(time.perf_counter() - self.ack_ts)
+                self.ack_ts = None
+            self.next_record = None
+            if self.checksum:
+                self.line_number = number
+                self.history[number % len(self.history)] = line
+            self._transmit(line, number, timeout)
+            self.offset = offset
+            self.stats['lines_sent'] += 1
+
+    # Leitura da serial
+    def _read_serial(self):
+        try:
+            data = os.read(self.fd, SERIAL_READ_BYTES)
+        except (BlockingIOError, InterruptedError):
+            return True
+        except OSError as e:
+            print(f"✗ Envio: erro na porta serial: {e}")
+            return False
+        if not data:
+            return False
+        self.rx += data
+        while True:
+            end = self.rx.find(b'\n')
+            if end < 0:
+                break
+            line = bytes(self.rx[:end]).strip()
+            del self.rx[:end + 1]
+            if line:
+                self._handle_line(line)
+        return True
+
+    def _handle_line(self, line):
+        lower = line.lower()
+        if lower.startswith(b'ok'):
+            if not self.inflight:
+                return  # "ok" sem dono
+            slots_match = _ADVANCED_OK_SLOTS_RE.search(line)
+            self.slots_hint = int(slots_match.group(1)) if slots_match else None
+            self._resolve(True, line)
+            if self.next_record is not None and not self.paused and not self.stopping:
+                self.ack_ts = time.perf_counter()
+            if b'T:' in line:
+                self.send({'t': 'line', 'line': line.decode('utf-8', errors='ignore')})
+            return
+        if lower.startswith((b'resend', b'rs ')):
+            match = _RESEND_RE.match(lower)
+            if match and self.checksum:
+                self._request_resend(int(match.group(1)))
+            return
+        if lower.startswith((b'echo:busy', b'busy:')):
+            self.last_progress = time.monotonic()  # Ocupado (ex: aquecendo) mas vivo
+            return
+        text = line.decode('utf-8', errors='ignore')
+        if self.inflight and self.inflight[0].command_id is not None:
+            self.inflight[0].responses.append(text)
+        self.send({'t': 'line', 'line': text})
+
+    def _resolve(self, ok, line=None):
+        pending = self.inflight.popleft()
+        self.inflight_bytes -= pending.nbytes
+        self.last_progress = time.monotonic()
+        if pending.command_id is not None:
+            if line is not None:
+                pending.responses.append(line.decode('utf-8', errors='ignore'))
+            self.send({'t': 'reply', 'id': pending.command_id, 'ok': ok, 'responses': pending.responses,
+                       'queued_ms': round(pending.queued_ms, 3)})
+        elif ok:
+            self.stats['lines_acked'] += 1
+        return pending
+
+    def _expire(self):
+        if not self.inflight:
+            return
+        oldest = self.inflight[0]
+        if time.monotonic() - self.last_progress < oldest.timeout:
+            return
+        self.slots_hint = None
+        self._resolve(False)
+        if oldest.command_id is None:
+            self.stats['timeouts'] += 1
+            print(f"⚠️ Envio: sem 'ok' para a linha {oldest.number} após {oldest.timeout}s - CONTINUANDO impressão...")
+
+    def _request_resend(self, number):
+        """Agenda o reenvio a partir da linha pedida (plan_resend, a mesma regra do modo em thread)."""
+        size = len(self.history)
+        numbered_inflight = sum(1 for p in self.inflight if p.number is not None)
+        action, self.resend_from, self.resend_ignore = plan_resend(
+            number, self.line_number, size, numbered_inflight,
+            self.resend_from, self.resend_ignore)
+        if action == 'ignore':
+            return
+        self.resend_queue.clear()
+        if action == 'resync':
+            first = max(1, self.line_number - size + 1)
+            print(f"⚠️ Reenvio da linha {number} impossível (histórico {first}-{self.line_number}) - CONTINUANDO impressão...")
+            self._transmit(b'M110 N%d' % self.line_number, None, 5.0)
+            return
+        for n in range(number, self.line_number + 1):
+            self.resend_queue.append((n, self.history[n % size]))
+        self.stats['resends'] += 1
+        self.stats['resent_lines'] += len(self.resend_queue)
+        print(f"  🔁 Firmware pediu reenvio a partir da linha {number} ({len(self.resend_queue)} linhas)")
+
+    # Laço principal
+    def _stream_inflight(self):
+        return bool(self.resend_queue) or any(p.command_id is None for p in self.inflight)
+
+    def _collect_idle(self):
+        """Coleta as gerações novas só enquanto espera "ok" (a 2 fica para o fim)."""
+        counts = gc.get_count()
+        if counts[0] < GC_IDLE_THRESHOLD:
+            return
+        start = time.perf_counter()
+        gc.collect(1 if counts[1] >= 10 else 0)
+        ms = (time.perf_counter() - start) * 1000.0
+        self.gc_stats['collections'] += 1
+        self.gc_stats['total_ms'] += ms
+        if ms > self.gc_stats['max_ms']:
+            self.gc_stats['max_ms'] = ms
+
+    def snapshot(self):
+        return {
+            **self.stats,
+            'prefetch_bytes': self.buffered_bytes,
+            'prefetch_underrun_ms': round(self.stats['prefetch_underrun_ms'], 1),
+            'inflight': len(self.inflight),
+            'inflight_bytes': self.inflight_bytes,
+            'ack_to_write': self.jitter.snapshot(),
+            'gc': {**self.gc_stats, 'total_ms': round(self.gc_stats['total_ms'], 3),
+                   'max_ms': round(self.gc_stats['max_ms'], 3)},
+        }
+
+    def _report(self):
+        self.last_report = time.monotonic()
+        self.send({'t': 'progress', 'sent': self.stats['lines_sent'], 'offset': self.offset,
+                   'stats': self.snapshot()})
+
+    def run(self):
+        poller = select.poll()
+        poller.register(self.control.fileno(), select.POLLIN)
+        serial_registered = False
+        while True:
+            if self.started and not serial_registered:
+                poller.register(self.fd, select.POLLIN)
+                serial_registered = True
+            self._expire()
+            self._fill()
+
+            if self.paused and not self.paused_sent and not self._stream_inflight():
+                self.paused_sent = True
+                self.send({'t': 'paused'})
+            finished = self.stopping or (self.eof and not self.records and self.next_record is None)
+            if self.started and finished and not self.done_sent and not self._stream_inflight():
+                self.done_sent = True
+                self._report()
+                self.send({'t': 'done', 'reason': 'stopped' if self.stopping else 'eof', 'sent': self.stats['lines_sent'],
+                           'stats': self.snapshot()})
+            if self.exiting and not self.started:
+                # A porta nunca chegou a ser usada: quem esperava fica sem resposta
+                for command_id, *_ in list(self.interactive) + list(self.bulk):
+                    self.send({'t': 'reply', 'id': command_id, 'ok': False, 'responses': [], 'queued_ms': 0.0})
+                return
+            if self.exiting and not self.inflight and not self.interactive and not self.bulk:
+                return
+
+            # Nada para escrever agora: janela cheia, pausa ou fim
+            if self.started and not self.eof and self.buffered_bytes < self.prefetch_bytes:
+                self._refill()
+            self._collect_idle()
+            if self.started and time.monotonic() - self.last_report >= PROGRESS_INTERVAL_SEC:
+                self._report()
+
+            wait_ms = 100 if self.inflight else int(PROGRESS_INTERVAL_SEC * 1000)
+            for fd, _ in poller.poll(wait_ms):
+                if fd == self.fd:
+                    if not self._read_serial():
+                        # Porta fechada: ninguém mais vai responder
+                        while self.inflight:
+                            self._resolve(False)
+                        self.interactive.clear()
+                        self.bulk.clear()
+                        self.stopping = True
+                        self.exiting = True
+                        poller.unregister(self.fd)
+                else:
+                    self._read_control()
+
+
+class StreamProcess:
+    """Lado do app: inicia o processo de envio e conversa com ele pelo canal de controle.
+
+    O processo já nasce com o descritor da serial, mas só lê/escreve depois de start()
+    (a thread leitora do app precisa soltar a porta antes). on_line(linha) recebe as
+    linhas do firmware que o app deve tratar (temperatura, echo, erros, //action:).
+    """
+
+    def __init__(self, serial_fd, config, on_line=None):
+        self.on_line = on_line
+        self.ready = threading.Event()
+        self.paused = threading.Event()
+        self.done = threading.Event()
+        self.info = {}
+        self.progress = {'sent': 0, 'offset': 0, 'stats': {}}
+        self.result = None
+        self.closed = False
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._replies = {}
+        self._next_id = 0
+        self._sock, child = socket.socketpair()
+        try:
+            self.process = subprocess.Popen(
+                [sys.executable, '-u', STREAMER_SCRIPT, str(serial_fd), str(child.fileno()), json.dumps(config)],
+                pass_fds=(serial_fd, child.fileno()))
+        finally:
+            child.close()
+        self._thread = threading.Thread(target=self._read_loop, daemon=True, name='stream-process')
+        self._thread.start()
+
+    def _read_loop(self):
+        try:
+            with self._sock.makefile('rb') as f:
+                for raw in f:
+                    message = json.loads(raw)
+                    kind = message['t']
+                    if kind == 'line':
+                        if self.on_line:
+                            try:
+                                self.on_line(message['line'])
+                            except Exception as e:
+                                print(f"Erro ao tratar linha do processo de envio: {e}")
+                    elif kind == 'reply':
+                        with self._lock:
+                            waiter = self._replies.pop(message['id'], None)
+                        if waiter:
+                            waiter[1] = message
+                            waiter[0].set()
+                    elif kind == 'progress':
+                        self.progress = message
+                    elif kind == 'paused':
+                        self.paused.set()
+                    elif kind == 'ready':
+                        self.info = message
+                        self.ready.set()
+                    elif kind == 'done':
+                        self.result = message
+                        self.done.set()
+        except (OSError, ValueError) as e:
+            print(f"✗ Canal com o processo de envio encerrado: {e}")
+        finally:
+            self.closed = True
+            with self._lock:
+                waiters, self._replies = self._replies, {}
+            for waiter in waiters.values():
+                waiter[0].set()
+            self.ready.set()
+            if self.result is None:
+                self.result = {'reason': 'error', 'sent': self.progress['sent'], 'stats': self.progress['stats']}
+            self.done.set()
+
+    def _send(self, message):
+        with self._send_lock:
+            try:
+                self._sock.sendall(json.dumps(message).encode() + b'\n')
+                return True
+            except OSError:
+                return False
+
+    def start(self):
+        """A porta é do processo a partir daqui."""
+        self._send({'op': 'start'})
+
+    def wait_ready(self, timeout=READY_TIMEOUT_SEC):
+        return self.ready.wait(timeout) and not self.closed
+
+    def command(self, line, priority='interactive', timeout=None, wait=True):
+        """Envia um comando pela janela do processo; devolve a resposta ({'ok', 'responses',
+        'queued_ms'}) ou None (sem resposta / processo encerrado)."""
+        waiter = [threading.Event(), None]
+        with self._lock:
+            self._next_id += 1
+            command_id = self._next_id
+            if wait:
+                self._replies[command_id] = waiter
+        if self.closed or not self._send({'op': 'send', 'id': command_id, 'line': line,
+                                          'priority': priority, 'timeout': timeout}):
+            with self._lock:
+                self._replies.pop(command_id, None)
+            return None
+        if not wait:
+            return None
+        # O processo aplica o timeout do comando; aqui só se espera ele responder ou sair
+        while not waiter[0].wait(1.0):
+            if self.closed:
+                break
+        return waiter[1]
+
+    def pause(self):
+        self.paused.clear()
+        self._send({'op': 'pause'})
+
+    def resume(self):
+        self.paused.clear()
+        self._send({'op': 'resume'})
+
+    def stop(self):
+        self._send({'op': 'stop'})
+
+    def close(self, timeout=EXIT_TIMEOUT_SEC):
+        """Pede a saída (depois dos comandos em trânsito) e espera o processo terminar."""
+        self._send({'op': 'exit'})
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            print("⚠️ Processo de envio não terminou - encerrando à força")
+            self.process.kill()
+            self.process.wait()
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._thread.join(5)
+        self._sock.close()
+
+
+def main():
+    serial_fd = int(sys.argv[1])
+    control = socket.socket(fileno=int(sys.argv[2]))
+    config = json.loads(sys.argv[3])
+    link = StreamerLink(serial_fd, control, config)
+    placement = tune_realtime(config.get('cpu'), config.get('rt_priority', 0))
+    # Objetos do import e da configuração não são mais examinados pelo coletor
+    gc.collect()
+    gc.freeze()
+    gc.disable()
+    link.send({'t': 'ready', 'pid': os.getpid(), **placement})
+    try:
+        link.run()
+    finally:
+        gc.enable()
+        control.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""
+Daemon da impressora (PRINTER_DAEMON=1)
+
+Normalmente o app.py é um processo só: a interface web e o dono da porta serial. Assim
+não dá para rodar a interface com vários workers (cada um abriria /dev/ttyACM0) nem
+reiniciá-la sem derrubar a impressão. Com o daemon:
+
+- printer_daemon.py (este arquivo) é o único dono da porta serial, da impressão
+  (estado, pausa, parada, progresso), da telemetria e do sensor de filamento
+- o app.py com PRINTER_DAEMON=1 é só a interface web: as rotas da impressora chamam
+  as operações do daemon por um socket Unix (PRINTER_DAEMON_SOCKET) e uma assinatura
+  de eventos alimenta o /api/events de cada worker
+
+Protocolo: uma mensagem JSON por linha, nos dois sentidos.
+
+- pedido: {"id": 1, "method": "pause", "params": {}}
+- resposta: {"id": 1, "result": ...} ou {"id": 1, "error": "mensagem"}
+- cada pedido roda numa thread própria: um comando demorado (M109, G28) não segura os
+  outros pedidos da mesma conexão, e as respostas podem voltar fora de ordem
+- "subscribe" transforma a conexão num canal de eventos: a resposta traz o estado
+  inicial e depois chegam {"event": tipo, "data": ...} (mesmos eventos do /api/events,
+  mais {"event": "ping"} a cada intervalo sem eventos)
+
+As operações em si (status, gcode, print, pause, stop...) ficam no app.py, registradas
+com @printer_method; o daemon importa o app e as serve. O governor da impressão também
+fica aqui (governor_admit, governor_release...): um só para todos os workers da
+interface, que usam um RemoteGovernor. Uso:
+
+    python3 printer_daemon.py          # daemon (dono da serial)
+    PRINTER_DAEMON=1 python3 app.py    # interface web
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import threading
+
+SOCKET_BACKLOG = 16
+RECONNECT_SEC = 1.0  # Espera entre tentativas de reconectar ao daemon
+EVENTS_STALE_SEC = 60  # Canal de eventos sem nada (nem ping) nesse tempo: reconectar
+
+
+class PrinterDaemonError(RuntimeError):
+    """Daemon fora do ar, sem resposta ou erro na operação pedida."""
+
+
+class _Connection:
+    """Socket com escrita serializada (várias threads respondem pela mesma conexão)."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self._lock = threading.Lock()
+
+    def send(self, message):
+        data = json.dumps(message).encode() + b'\n'
+        with self._lock:
+            try:
+                self.sock.sendall(data)
+                return True
+            except OSError:
+                return False
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class PrinterDaemonServer:
+    """Lado do daemon: atende as instâncias da interface web no socket Unix.
+
+    methods: nome -> função(**params) com resultado serializável em JSON.
+    subscribe(): (estado inicial, iterador de lotes [(tipo, dados), ...]) ou None (limite
+    de assinantes); um lote vazio vira ping. context(): gerenciador de contexto em volta
+    de cada pedido (ex: app.app_context, para usar o pool de conexões do banco).
+    """
+
+    def __init__(self, path, methods, subscribe=None, context=None):
+        self.path = path
+        self.methods = methods
+        self.subscribe = subscribe
+        self.context = context
+        self.stats = {'connections': 0, 'requests': 0, 'errors': 0, 'subscribers': 0}
+        self._sock = None
+        self._closed = False
+
+    def bind(self):
+        """Cria o socket; falha se outro daemon já estiver atendendo no mesmo caminho."""
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except OSError:
+                os.unlink(self.path)  # Sobra de um daemon que não saiu direito
+            else:
+                raise PrinterDaemonError(f'outro daemon já está atendendo em {self.path}')
+            finally:
+                probe.close()
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(self.path)
+        os.chmod(self.path, 0o660)  # Só o usuário (e o grupo) do serviço
+        self._sock.listen(SOCKET_BACKLOG)
+
+    def serve_forever(self):
+        if self._sock is None:
+            self.bind()
+        while not self._closed:
+            try:
+                sock, _ = self._sock.accept()
+            except OSError:
+                if self._closed:
+                    break
+                raise
+            self.stats['connections'] += 1
+            threading.Thread(target=self._serve, args=(_Connection(sock),), daemon=True,
+                             name='printer-daemon-conn').start()
+
+    def close(self):
+        self._closed = True
+        if self._sock is not None:
+            self._sock.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def _serve(self, conn):
+        try:
+            with conn.sock.makefile('rb') as f:
+                for raw in f:
+                    try:
+                        message = json.loads(raw)
+                        request_id = message.get('id')
+                        method = message['method']
+                    except (ValueError, KeyError, AttributeError):
+                        conn.send({'id': None, 'error': 'pedido inválido'})
+                        continue
+                    if method == 'subscribe':
+                        # A conexão passa a ser só do canal de eventos
+                        self._stream_events(conn, request_id)
+                        return
+                    threading.Thread(target=self._handle, args=(conn, request_id, method, message.get('params')),
+                                     daemon=True, name=f'printer-daemon-{method}').start()
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+    def _handle(self, conn, request_id, method, params):
+        self.stats['requests'] += 1
+        fn = self.methods.get(method)
+        if fn is None:
+            conn.send({'id': request_id, 'error': f'operação desconhecida: {method}'})
+            return
+        try:
+            if self.context:
+                with self.context():
+                    result = fn(**(params or {}))
+            else:
+                result = fn(**(params or {}))
+        except Exception as e:
+            self.stats['errors'] += 1
+            print(f"⚠️ Erro na operação '{method}' do daemon: {e}")
+            conn.send({'id': request_id, 'error': str(e) or e.__class__.__name__})
+            return
+        conn.send({'id': request_id, 'result': result})
+
+    def _stream_events(self, conn, request_id):
+        subscription = self.subscribe() if self.subscribe else None
+        if subscription is None:
+            conn.send({'id': request_id, 'error': 'limite de assinantes atingido'})
+            return
+        snapshot, batches = subscription
+        self.stats['subscribers'] += 1
+        try:
+            if not conn.send({'id': request_id, 'result': snapshot}):
+                return
+            for batch in batches:
+                if not batch:
+                    batch = [('ping', None)]
+                for event_type, data in batch:
+                    if not conn.send({'event': event_type, 'data': data}):
+                        return
+        finally:
+            batches.close()
+            self.stats['subscribers'] -= 1
+
+
+class PrinterDaemonClient:
+    """Lado da interface web: chama as operações do daemon e recebe os eventos dele.
+
+    Uma conexão para os pedidos (vários em andamento ao mesmo tempo, respostas pelo id)
+    e outra para os eventos, cada uma com uma thread leitora. Se o daemon cair ou for
+    reiniciado, os pedidos em andamento falham com PrinterDaemonError e as duas conexões
+    são refeitas sozinhas. on_event(tipo, dados) recebe o estado inicial de cada
+    assinatura e os eventos seguintes; depois de uma reconexão, antes do estado inicial,
+    vem ('resync', {'reason': 'printer_daemon'}) - eventos podem ter se perdido.
+    """
+
+    def __init__(self, path, on_event=None, timeout=30.0):
+        self.path = path
+        self.on_event = on_event
+        self.timeout = timeout
+        self.connected = False
+        self._lock = threading.Lock()
+        self._conn = None
+        self._replies = {}
+        self._next_id = 0
+        self._events_thread = None
+        self._closed = False
+
+    def _connect_locked(self):
+        if self._conn is not None:
+            return self._conn
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+        except OSError as e:
+            sock.close()
+            raise PrinterDaemonError(f'daemon da impressora indisponível ({self.path}): {e}')
+        self._conn = _Connection(sock)
+        threading.Thread(target=self._read_loop, args=(self._conn,), daemon=True,
+                         name='printer-daemon-client').start()
+        return self._conn
+
+    def _read_loop(self, conn):
+        try:
+            with conn.sock.makefile('rb') as f:
+                for raw in f:
+                    message = json.loads(raw)
+                    with self._lock:
+                        waiter = self._replies.pop(message.get('id'), None)
+                    if waiter:
+                        waiter[1] = message
+                        waiter[0].set()
+        except (OSError, ValueError):
+            pass
+        finally:
+            with self._lock:
+                if self._conn is conn:
+                    self._conn = None
+                waiters, self._replies = self._replies, {}
+            for waiter in waiters.values():
+                waiter[0].set()
+            conn.close()
+
+    def call(self, method, params=None, timeout=None):
+        """Executa a operação no daemon e devolve o resultado (PrinterDaemonError em falha)."""
+        waiter = [threading.Event(), None]
+        with self._lock:
+            conn = self._connect_locked()
+            self._next_id += 1
+            request_id = self._next_id
+            self._replies[request_id] = waiter
+        if not conn.send({'id': request_id, 'method': method, 'params': params or {}}):
+            with self._lock:
+                self._replies.pop(request_id, None)
+            raise PrinterDaemonError('conexão com o daemon da impressora perdida')
+        if not waiter[0].wait(timeout or self.timeout):
+            with self._lock:
+                self._replies.pop(request_id, None)
+            raise PrinterDaemonError(f"daemon da impressora não respondeu ('{method}')")
+        reply = waiter[1]
+        if reply is None:
+            raise PrinterDaemonError('conexão com o daemon da impressora perdida')
+        if 'error' in reply:
+            raise PrinterDaemonError(f"erro no daemon da impressora ('{method}'): {reply['error']}")
+        return reply.get('result')
+
+    def start_events(self):
+        """Inicia (uma vez) a thread que assina os eventos do daemon."""
+        with self._lock:
+            if self._events_thread is None:
+                self._events_thread = threading.Thread(target=self._events_loop, daemon=True,
+                                                       name='printer-daemon-events')
+                self._events_thread.start()
+
+    def _emit(self, event_type, data):
+        if self.on_event:
+            try:
+                self.on_event(event_type, data)
+            except Exception as e:
+                print(f"Erro ao tratar evento do daemon ({event_type}): {e}")
+
+    def _events_loop(self):
+        lost = False
+        while not self._closed:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.path)
+                sock.settimeout(EVENTS_STALE_SEC)
+                sock.sendall(json.dumps({'id': 0, 'method': 'subscribe'}).encode() + b'\n')
+                with sock.makefile('rb') as f:
+                    reply = json.loads(f.readline() or b'{}')
+                    if 'result' not in reply:
+                        raise PrinterDaemonError(reply.get('error', 'assinatura recusada'))
+                    self.connected = True
+                    if lost:
+                        print("✓ Reconectado ao daemon da impressora")
+                        self._emit('resync', {'reason': 'printer_daemon'})
+                    for event_type, data in reply['result'].items():
+                        self._emit(event_type, data)
+                    for raw in f:
+                        message = json.loads(raw)
+                        if message['event'] != 'ping':
+                            self._emit(message['event'], message['data'])
+            except (OSError, ValueError, KeyError, PrinterDaemonError) as e:
+                if self.connected or not lost:
+                    print(f"⚠️ Sem eventos do daemon da impressora ({self.path}): {e}")
+            finally:
+                sock.close()
+            if self.connected:
+                self.connected = False
+                self._emit('state', {'state': 'idle', 'connected': False, 'paused_by_filament': False})
+            lost = True
+            time.sleep(RECONNECT_SEC)
+
+    def close(self):
+        self._closed = True
+        with self._lock:
+            conn, self._conn = self._conn, None
+        if conn is not None:
+            conn.close()
+
+
+def main():
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app
+
+    # O daemon é o dono da impressora mesmo com PRINTER_DAEMON=1 no ambiente compartilhado
+    app.PRINTER_DAEMON = False
+    app.governor = app.print_governor
+    server = PrinterDaemonServer(app.PRINTER_DAEMON_SOCKET, app.PRINTER_METHODS,
+                                 subscribe=app.printer_daemon_subscribe, context=app.app.app_context)
+    try:
+        server.bind()
+    except (OSError, PrinterDaemonError) as e:
+        print(f"✗ Não foi possível abrir {app.PRINTER_DAEMON_SOCKET}: {e}")
+        sys.exit(1)
+
+    app.start_printer_owner()
+    print(f"🖨️  Daemon da impressora atendendo em {app.PRINTER_DAEMON_SOCKET}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n⏹️  Daemon interrompido pelo usuário")
+    finally:
+        server.close()
+        app.stop_printer_owner()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Controle de admissão de CPU e I/O durante a impressão
+
+O Raspberry Pi tem um cartão SD e 4 núcleos. Um upload de 100 MB, a análise de um
+G-code, o visualizador lendo camadas ou um scan de Wi-Fi ao mesmo tempo que a
+impressão podem atrasar a thread que envia as linhas - e o planner do Marlin esvazia
+(travadinhas, bolhas, camadas deslocadas). ResourceGovernor só age enquanto active()
+for verdadeiro (impressão em andamento):
+
+- throttle(categoria, n): limita a banda (ex: gravação do upload) com um balde de
+  tokens; quem chama dorme o necessário
+- admit(categoria): poucas vagas para operações caras (ex: preview); quem não consegue
+  vaga em wait_sec é recusado (a rota responde 503)
+- record(categoria, segundos): adiamentos feitos por outros (ex: miniatura que ficou
+  para a fila de análise)
+
+snapshot() mostra, por categoria, quantas vezes algo foi adiado/recusado e por quanto
+tempo. Com vários processos na interface web (PRINTER_DAEMON=1), as vagas, os baldes e os
+contadores ficam num só (o daemon da impressora) e cada worker usa um RemoteGovernor, com
+a mesma interface, que pede a ele. lower_thread_priority() baixa a prioridade de CPU
+(nice) e de I/O (classe idle do ionice) da thread atual, para workers em segundo plano.
+"""
+
+import os
+import time
+import shutil
+import threading
+import subprocess
+
+THROTTLE_BURST_SEC = 0.25  # Quanto adiantado o balde de tokens aceita antes de dormir
+
+
+def lower_thread_priority(nice=10, io_idle=True):
+    """Baixa a prioridade da thread atual (no Linux, nice e ionice valem por thread)."""
+    tid = threading.get_native_id()
+    try:
+        os.setpriority(os.PRIO_PROCESS, tid, nice)
+    except (AttributeError, OSError) as e:
+        print(f"⚠️ Não foi possível baixar a prioridade de CPU: {e}")
+    if io_idle and shutil.which('ionice'):
+        try:
+            # Classe idle: só usa o cartão quando ninguém mais está usando
+            subprocess.run(['ionice', '-c', '3', '-p', str(tid)], capture_output=True, timeout=5)
+        except (OSError, subprocess.SubprocessError) as e:
+            print(f"⚠️ Não foi possível baixar a prioridade de I/O: {e}")
+
+
+class _Slot:
+    """Vaga obtida por admit(); release() pode ser chamado mais de uma vez."""
+
+    def __init__(self, semaphore=None):
+        self._semaphore = semaphore
+        self._lock = threading.Lock()
+
+    @property
+    def held(self):
+        """Ocupa uma vaga de verdade (False: a categoria estava sem limite)."""
+        return self._semaphore is not None
+
+    def release(self):
+        with self._lock:
+            semaphore, self._semaphore = self._semaphore, None
+        if semaphore:
+            semaphore.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class ResourceGovernor:
+    def __init__(self, active, rates=None, slots=None, wait_sec=5.0):
+        """active: função que diz se há impressão em andamento.
+        rates: categoria -> bytes/s; slots: categoria -> vagas simultâneas."""
+        self.active = active
+        self.rates = dict(rates or {})
+        self.wait_sec = wait_sec
+        self._semaphores = {name: threading.BoundedSemaphore(count) for name, count in (slots or {}).items()}
+        self._lock = threading.Lock()
+        self._next_free = {}  # categoria -> instante em que o balde esvazia
+        self._stats = {}
+
+    def _category(self, name):
+        stats = self._stats.get(name)
+        if stats is None:
+            stats = self._stats[name] = {'deferred': 0, 'deferred_sec': 0.0, 'max_wait_sec': 0.0,
+                                         'rejected': 0}
+        return stats
+
+    def record(self, category, seconds=0.0, rejected=False):
+        with self._lock:
+            stats = self._category(category)
+            if rejected:
+                stats['rejected'] += 1
+            else:
+                stats['deferred'] += 1
+                stats['deferred_sec'] += seconds
+                stats['max_wait_sec'] = max(stats['max_wait_sec'], seconds)
+
+    def reserve(self, category, nbytes):
+        """Conta nbytes no balde da categoria e devolve quanto quem chamou deve dormir (s)."""
+        rate = self.rates.get(category)
+        if not rate or not self.active():
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            start = max(self._next_free.get(category, now), now)
+            self._next_free[category] = start + nbytes / rate
+            delay = self._next_free[category] - now - THROTTLE_BURST_SEC
+        if delay <= 0:
+            return 0.0
+        self.record(category, delay)
+        return delay
+
+    def throttle(self, category, nbytes):
+        """Dorme o suficiente para manter a categoria em rates[categoria] bytes/s (só imprimindo)."""
+        delay = self.reserve(category, nbytes)
+        if delay > 0:
+            time.sleep(delay)
+
+    def admit(self, category):
+        """Vaga para uma operação cara: _Slot (liberar com release()/with) ou None se recusada."""
+        semaphore = self._semaphores.get(category)
+        if semaphore is None or not self.active():
+            return _Slot()
+        if semaphore.acquire(blocking=False):
+            return _Slot(semaphore)
+        start = time.monotonic()
+        if semaphore.acquire(timeout=self.wait_sec):
+            self.record(category, time.monotonic() - start)
+            return _Slot(semaphore)
+        self.record(category, rejected=True)
+        return None
+
+    def snapshot(self):
+        with self._lock:
+            categories = {name: {**stats, 'deferred_sec': round(stats['deferred_sec'], 3),
+                                 'max_wait_sec': round(stats['max_wait_sec'], 3)}
+                          for name, stats in self._stats.items()}
+        return {
+            'active': bool(self.active()),
+            'rates': dict(self.rates),
+            'categories': categories,
+        }
+
+
+class _RemoteSlot:
+    """Vaga guardada noutro processo: release() a devolve (uma vez)."""
+
+    def __init__(self, release):
+        self._release = release
+        self._lock = threading.Lock()
+
+    def release(self):
+        with self._lock:
+            release, self._release = self._release, None
+        if release:
+            release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class RemoteGovernor:
+    """Mesma interface do ResourceGovernor, com o estado noutro processo.
+
+    call(método, **params) executa lá: governor_admit(category, pid) -> id da vaga (0: sem
+    limite, None: recusada), governor_release(slot_id), governor_throttle(category, nbytes)
+    -> segundos a dormir, governor_record(category, seconds, rejected) e governor_stats().
+    active() é a cópia local do estado da impressão: sem impressão, nada é pedido.
+    Falhas de comunicação em admit() sobem para quem chamou; em throttle() e record() só
+    são avisadas (o upload segue sem limite e o contador se perde).
+    """
+
+    def __init__(self, active, call):
+        self.active = active
+        self.call = call
+
+    def admit(self, category):
+        if not self.active():
+            return _Slot()
+        slot_id = self.call('governor_admit', category=category, pid=os.getpid())
+        if slot_id is None:
+            return None
+        if not slot_id:
+            return _Slot()
+        return _RemoteSlot(lambda: self._release(slot_id))
+
+    def _release(self, slot_id):
+        try:
+            self.call('governor_release', slot_id=slot_id)
+        except Exception as e:
+            print(f"⚠️ Não foi possível devolver a vaga {slot_id} do governor: {e}")
+
+    def throttle(self, category, nbytes):
+        if not self.active():
+            return
+        try:
+            delay = self.call('governor_throttle', category=category, nbytes=nbytes)
+        except Exception as e:
+            print(f"⚠️ Governor indisponível ({category}): {e}")
+            return
+        if delay > 0:
+            time.sleep(delay)
+
+    def record(self, category, seconds=0.0, rejected=False):
+        try:
+            self.call('governor_record', category=category, seconds=seconds, rejected=rejected)
+        except Exception as e:
+            print(f"⚠️ Governor indisponível ({category}): {e}")
+
+    def snapshot(self):
+        return self.call('governor_stats')
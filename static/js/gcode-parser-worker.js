@@ -0,0 +1,159 @@
+// Web Worker: lê o G-code em streaming (fetch + ReadableStream) e devolve, camada por
+// camada, os segmentos de extrusão como Float32Array [x1, y1, z1, x2, y2, z2, ...] em mm
+// do G-code (transferidos, sem cópia). Só a camada atual e o bloco de texto em leitura
+// ficam na memória daqui.
+//
+// Mensagens recebidas: { url }
+// Mensagens enviadas:
+//   { type: 'layer', layer, z, vertices }   (vertices: Float32Array transferido)
+//   { type: 'progress', bytes, total }
+//   { type: 'done', layers, segments, bytes }
+//   { type: 'error', message }
+
+const LAYER_EPSILON = 1e-4; // Mesma regra de camada do gcode_toolpath.py
+const PARAM_RE = /([XYZEF])\s*([-+]?(?:\d+\.?\d*|\.\d+))/g;
+
+class LayerStream {
+    constructor() {
+        this.pos = { x: 0, y: 0, z: 0, e: 0 };
+        this.relXYZ = false;
+        this.relE = null; // null = segue o G90/G91 até aparecer M82/M83
+        this.maxZ = -Infinity;
+        this.layer = -1;
+        this.layerZ = 0;
+        this.vertices = new Float32Array(6 * 4096);
+        this.count = 0; // floats usados em this.vertices
+        this.segments = 0;
+    }
+
+    push(x1, y1, z1, x2, y2, z2) {
+        if (this.count + 6 > this.vertices.length) {
+            const grown = new Float32Array(this.vertices.length * 2);
+            grown.set(this.vertices);
+            this.vertices = grown;
+        }
+        const v = this.vertices;
+        const i = this.count;
+        v[i] = x1; v[i + 1] = y1; v[i + 2] = z1;
+        v[i + 3] = x2; v[i + 4] = y2; v[i + 5] = z2;
+        this.count += 6;
+        this.segments++;
+    }
+
+    // Envia a camada atual (cópia do tamanho exato, transferida) e recomeça o buffer
+    flush() {
+        if (this.layer >= 0 && this.count > 0) {
+            const vertices = this.vertices.slice(0, this.count);
+            postMessage({ type: 'layer', layer: this.layer, z: this.layerZ, vertices }, [vertices.buffer]);
+        }
+        this.count = 0;
+    }
+
+    line(raw) {
+        const semicolon = raw.indexOf(';');
+        const line = (semicolon >= 0 ? raw.slice(0, semicolon) : raw).trim().toUpperCase();
+        if (!line) return;
+        const space = line.search(/\s/);
+        const cmd = space < 0 ? line : line.slice(0, space);
+
+        if (cmd === 'G0' || cmd === 'G1' || cmd === 'G2' || cmd === 'G3' ||
+            cmd === 'G00' || cmd === 'G01' || cmd === 'G02' || cmd === 'G03') {
+            this.move(line);
+        } else if (cmd === 'G90') {
+            this.relXYZ = false;
+        } else if (cmd === 'G91') {
+            this.relXYZ = true;
+        } else if (cmd === 'M82') {
+            this.relE = false;
+        } else if (cmd === 'M83') {
+            this.relE = true;
+        } else if (cmd === 'G92') {
+            let any = false;
+            for (const match of line.matchAll(PARAM_RE)) {
+                const axis = match[1].toLowerCase();
+                if (axis !== 'f') {
+                    this.pos[axis] = parseFloat(match[2]);
+                    any = true;
+                }
+            }
+            if (!any) this.pos = { x: 0, y: 0, z: 0, e: 0 };
+        }
+    }
+
+    move(line) {
+        const pos = this.pos;
+        const relE = this.relE === null ? this.relXYZ : this.relE;
+        let x = pos.x, y = pos.y, z = pos.z, e = null;
+        for (const match of line.matchAll(PARAM_RE)) {
+            const value = parseFloat(match[2]);
+            switch (match[1]) {
+                case 'X': x = this.relXYZ ? pos.x + value : value; break;
+                case 'Y': y = this.relXYZ ? pos.y + value : value; break;
+                case 'Z': z = this.relXYZ ? pos.z + value : value; break;
+                case 'E': e = value; break;
+            }
+        }
+        let extruding = false;
+        let nextE = pos.e;
+        if (e !== null) {
+            extruding = relE ? e > 0 : e > pos.e;
+            nextE = relE ? pos.e + e : e;
+        }
+
+        if (extruding) {
+            // Nova camada: extrusão acima da maior altura já impressa
+            if (z > this.maxZ + LAYER_EPSILON) {
+                this.flush();
+                this.maxZ = z;
+                this.layer++;
+                this.layerZ = z;
+            }
+            if (x !== pos.x || y !== pos.y || z !== pos.z) {
+                this.push(pos.x, pos.y, pos.z, x, y, z);
+            }
+        }
+        this.pos = { x, y, z, e: nextE };
+    }
+}
+
+self.onmessage = async (event) => {
+    const { url } = event.data;
+    try {
+        const response = await fetch(url);
+        if (!response.ok) {
+            let message = `HTTP ${response.status}`;
+            try {
+                message = (await response.json()).message || message;
+            } catch (error) { /* corpo não é JSON */ }
+            postMessage({ type: 'error', message });
+            return;
+        }
+        const total = parseInt(response.headers.get('Content-Length')) || null;
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        const stream = new LayerStream();
+        let rest = '';
+        let bytes = 0;
+
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            bytes += value.length;
+            const text = rest + decoder.decode(value, { stream: true });
+            const lastNewline = text.lastIndexOf('\n');
+            rest = text.slice(lastNewline + 1);
+            let start = 0;
+            while (start <= lastNewline) {
+                const end = text.indexOf('\n', start);
+                stream.line(text.slice(start, end));
+                start = end + 1;
+            }
+            postMessage({ type: 'progress', bytes, total });
+        }
+        stream.line(rest + decoder.decode());
+        stream.flush();
+        postMessage({ type: 'done', layers: stream.layer + 1, segments: stream.segments, bytes });
+    } catch (error) {
+        postMessage({ type: 'error', message: String(error) });
+    }
+};
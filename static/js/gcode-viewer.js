@@ -6,10 +6,20 @@ class GCodeViewer {
         this.camera = null;
         this.renderer = null;
         this.controls = null;
-        this.lines = [];
-        this.currentLayer = 0;
         this.totalLayers = 0;
-        this.parsedLayers = []; // Armazenar camadas parseadas
+        this.layerLoading = Promise.resolve();
+        // Cada camada é uma LineSegments: da geometria binária (/api/files/geometry) ou,
+        // sem ela, do G-code interpretado em um Web Worker (gcode-parser-worker.js)
+        this.worker = null;
+        this.layerMaterials = []; // Cor por camada no modo Worker (a geometria traz cor por vértice)
+        this.geometryLayers = null;
+        this.geometryLevels = [];
+        this.layerObjects = [];
+        this.layerLevels = []; // Nível de detalhe carregado de cada camada (0 = exato)
+        this.layerGroup = null;
+        this.visibleLayers = Infinity;
+        this.lineMaterial = new THREE.LineBasicMaterial({ vertexColors: true });
+        this.stats = { firstFrameMs: null, gpuBytes: 0, segments: 0, drawCalls: 0, downloaded: 0 };
         
         this.init();
     }
@@ -75,162 +85,258 @@ class GCodeViewer {
         window.addEventListener('resize', () => this.onWindowResize());
     }
     
-    parseGCode(gcodeText) {
-        const lines = gcodeText.split('\n');
-        let currentPosition = { x: 0, y: 0, z: 0, e: 0 };
-        let currentZ = -1;
-        const layers = [];
-        let currentLayerPoints = [];
+    // Cena vazia para um novo arquivo
+    resetLayers(totalLayers) {
+        this.clearLines();
+        this.totalLayers = totalLayers;
+        this.layerObjects = new Array(totalLayers);
+        this.visibleLayers = Infinity;
+        this.stats = { firstFrameMs: null, gpuBytes: 0, segments: 0, drawCalls: 0, downloaded: 0 };
+        this.loadStarted = performance.now();
         
-        console.log('🔍 Iniciando parse do G-code...');
+        // Vértices vêm em mm do G-code (x, y, z): a matriz do grupo faz (x - 100, z, y - 100)
+        this.layerGroup = new THREE.Group();
+        this.layerGroup.matrixAutoUpdate = false;
+        this.layerGroup.matrix.set(
+            1, 0, 0, -100,
+            0, 0, 1, 0,
+            0, 1, 0, -100,
+            0, 0, 0, 1
+        );
+        this.scene.add(this.layerGroup);
+    }
+    
+    setGeometryIndex(index) {
+        this.resetLayers(index.layers.length);
+        this.geometryLayers = index.layers;
+        this.geometryLevels = index.levels;
+        this.layerLevels = new Array(index.layers.length);
+    }
+    
+    // Mesma cor por altura da geometria do servidor (gcode_geometry.layer_color)
+    layerColor(layer, totalLayers) {
+        return new THREE.Color().setHSL(0.15 + (layer / Math.max(totalLayers, 1)) * 0.7, 1.0, 0.5);
+    }
+    
+    noteFirstFrame() {
+        if (this.stats.firstFrameMs === null && this.stats.drawCalls > 0) {
+            this.stats.firstFrameMs = -1;
+            requestAnimationFrame(() => {
+                this.stats.firstFrameMs = performance.now() - this.loadStarted;
+                console.log(`⏱️ Primeiro quadro em ${this.stats.firstFrameMs.toFixed(0)} ms`);
+            });
+        }
+    }
+    
+    // Sem geometria no servidor: o G-code é lido em streaming e interpretado no Worker;
+    // cada camada entra na cena assim que chega (onLayer/onProgress para a interface)
+    streamGCode(fileId, { onLayer = null, onProgress = null } = {}) {
+        this.resetLayers(0);
+        const group = this.layerGroup;
+        const worker = new Worker('/static/js/gcode-parser-worker.js');
+        this.worker = worker;
         
-        for (let line of lines) {
-            // Remover comentários
-            line = line.split(';')[0].trim();
-            if (!line) continue;
-            
-            // Comandos de movimento
-            if (line.startsWith('G0') || line.startsWith('G1')) {
-                const x = this.parseCoord(line, 'X', currentPosition.x);
-                const y = this.parseCoord(line, 'Y', currentPosition.y);
-                const z = this.parseCoord(line, 'Z', currentPosition.z);
-                const e = this.parseCoord(line, 'E', currentPosition.e);
-                
-                // Detectar mudança de camada (mudança em Z)
-                if (z !== currentPosition.z && z > currentZ) {
-                    if (currentLayerPoints.length > 0) {
-                        layers.push([...currentLayerPoints]);
-                        console.log(`  Camada ${layers.length}: Z=${currentZ.toFixed(2)}mm, ${currentLayerPoints.length} segmentos`);
-                        currentLayerPoints = [];
-                    }
-                    currentZ = z;
-                }
-                
-                // Adicionar QUALQUER movimento com extrusão (e > posição anterior)
-                if (e > currentPosition.e) {
-                    currentLayerPoints.push({
-                        start: { ...currentPosition },
-                        end: { x, y, z }
+        return new Promise((resolve, reject) => {
+            worker.onmessage = (event) => {
+                const message = event.data;
+                if (this.layerGroup !== group) return; // Outro arquivo foi aberto
+                if (message.type === 'layer') {
+                    const geometry = new THREE.BufferGeometry();
+                    const position = new THREE.BufferAttribute(message.vertices, 3);
+                    position.onUpload(function () { this.array = null; }); // Já está na GPU
+                    geometry.setAttribute('position', position);
+                    geometry.computeBoundingSphere();
+                    // Total ainda desconhecido: cor provisória, acertada no fim
+                    const material = new THREE.LineBasicMaterial({
+                        color: this.layerColor(message.layer, message.layer + 1)
                     });
+                    this.layerMaterials[message.layer] = material;
+                    const segments = new THREE.LineSegments(geometry, material);
+                    segments.visible = message.layer < this.visibleLayers;
+                    this.totalLayers = Math.max(this.totalLayers, message.layer + 1);
+                    this.replaceLayerObject(message.layer, segments,
+                        { length: message.vertices.byteLength, vertices: message.vertices.length / 3 });
+                    this.noteFirstFrame();
+                    if (onLayer) onLayer(message.layer, message.z);
+                } else if (message.type === 'progress') {
+                    this.stats.downloaded = message.bytes;
+                    if (onProgress) onProgress(message.bytes, message.total);
+                } else if (message.type === 'done') {
+                    this.layerMaterials.forEach((material, layer) => {
+                        if (material) material.color.copy(this.layerColor(layer, message.layers));
+                    });
+                    worker.terminate();
+                    this.worker = null;
+                    resolve(message);
+                } else if (message.type === 'error') {
+                    worker.terminate();
+                    this.worker = null;
+                    reject(new Error(message.message));
                 }
-                
-                currentPosition = { x, y, z, e };
-            }
+            };
+            worker.onerror = (event) => {
+                worker.terminate();
+                this.worker = null;
+                reject(new Error(event.message));
+            };
+            worker.postMessage({ url: new URL(`/api/files/preview/${fileId}`, location.href).href });
+        });
+    }
+    
+    get coarsestLevel() {
+        return this.geometryLevels.length - 1;
+    }
+    
+    // Baixa as camadas first..last em um nível (level) ou no mais detalhado que caiba em
+    // budget vértices (escolhido pelo servidor); só troca camadas que ficam mais detalhadas
+    async loadGeometryRange(fileId, first, last, { level = null, budget = null } = {}) {
+        const group = this.layerGroup;
+        const query = level !== null ? `level=${level}` : `budget=${budget}`;
+        const response = await fetch(`/api/files/geometry/${fileId}/data?from=${first}&to=${last}&${query}`);
+        if (!response.ok) {
+            throw new Error(`HTTP ${response.status} ao carregar geometria ${first}-${last}`);
         }
+        const loadedLevel = parseInt(response.headers.get('X-Geometry-Level'));
+        const buffer = await response.arrayBuffer();
+        if (this.layerGroup !== group) return; // Outro arquivo foi aberto nesse meio tempo
+        this.stats.downloaded += buffer.byteLength;
         
-        // Adicionar última camada
-        if (currentLayerPoints.length > 0) {
-            layers.push(currentLayerPoints);
-            console.log(`  Camada ${layers.length}: Z=${currentZ.toFixed(2)}mm, ${currentLayerPoints.length} segmentos`);
+        let position = 0;
+        for (let i = first; i <= last; i++) {
+            const layer = this.geometryLayers[i].levels[loadedLevel];
+            const offset = position;
+            position += layer.length;
+            if (this.layerLevels[i] !== undefined && this.layerLevels[i] <= loadedLevel) continue;
+            
+            let segments = null;
+            if (layer.vertices) {
+                // [x, y, z, r, g, b] float32 por vértice, direto da resposta para a GPU
+                const data = new Float32Array(buffer, offset, layer.length / 4);
+                const interleaved = new THREE.InterleavedBuffer(data, 6);
+                interleaved.onUpload(function () { this.array = null; }); // Já está na GPU
+                const geometry = new THREE.BufferGeometry();
+                geometry.setAttribute('position', new THREE.InterleavedBufferAttribute(interleaved, 3, 0));
+                geometry.setAttribute('color', new THREE.InterleavedBufferAttribute(interleaved, 3, 3));
+                geometry.computeBoundingSphere();
+                segments = new THREE.LineSegments(geometry, this.lineMaterial);
+                segments.visible = i < this.visibleLayers;
+            }
+            this.replaceLayerObject(i, segments, layer);
+            this.layerLevels[i] = loadedLevel;
         }
         
-        this.totalLayers = layers.length;
-        console.log(`✅ Total: ${layers.length} camadas detectadas`);
-        return layers;
+        this.noteFirstFrame();
+        console.log(`📥 Geometria das camadas ${first + 1}-${last + 1}, nível ${loadedLevel} ` +
+            `(${(buffer.byteLength / 1024).toFixed(1)} KB)`);
     }
     
-    parseCoord(line, axis, defaultValue) {
-        const match = line.match(new RegExp(axis + '([\\d.-]+)'));
-        return match ? parseFloat(match[1]) : defaultValue;
+    replaceLayerObject(i, segments, layer) {
+        const old = this.layerObjects[i];
+        if (old) {
+            this.layerGroup.remove(old);
+            old.geometry.dispose();
+            this.stats.gpuBytes -= old.userData.bytes;
+            this.stats.segments -= old.userData.segments;
+            this.stats.drawCalls--;
+        }
+        this.layerObjects[i] = segments;
+        if (segments) {
+            segments.userData = { bytes: layer.length, segments: layer.vertices / 2 };
+            this.layerGroup.add(segments);
+            this.stats.gpuBytes += layer.length;
+            this.stats.segments += layer.vertices / 2;
+            this.stats.drawCalls++;
+        }
     }
     
-    loadGCode(gcodeText) {
-        console.log('📥 Carregando G-code... tamanho:', gcodeText.length, 'caracteres');
-        
-        // Limpar linhas anteriores
-        this.clearLines();
-        
-        // Parsear G-code
-        const layers = this.parseGCode(gcodeText);
-        this.parsedLayers = layers; // Salvar para controle de camadas
-        
-        console.log('📊 Camadas encontradas:', layers.length);
-        console.log('📐 Total de segmentos:', layers.reduce((sum, layer) => sum + layer.length, 0));
-        
-        if (layers.length === 0) {
-            console.error('❌ Nenhuma camada encontrada no G-code!');
-            alert('Erro: Nenhuma camada encontrada no G-code');
-            return;
-        }
-        
-        // Renderizar todas as camadas
-        this.renderLayers(layers);
-        
-        console.log('✅ G-code renderizado com', this.lines.length, 'linhas');
-        
-        // Centralizar câmera
-        this.centerCamera();
+    // Baixa em lotes de até batchBytes as camadas 0..maxLayer ainda não carregadas, no nível
+    // informado; cada lote já aparece na cena ao chegar (onBatch é chamado depois de cada um)
+    ensureGeometryLayers(fileId, maxLayer, level, batchBytes = 2 * 1024 * 1024, onBatch = null) {
+        return this.queueGeometry(async () => {
+            const layers = this.geometryLayers;
+            let first = null;
+            let bytes = 0;
+            for (let i = 0; i <= maxLayer && this.geometryLayers === layers; i++) {
+                const loaded = this.layerLevels[i] !== undefined;
+                if (!loaded && first === null) {
+                    first = i;
+                    bytes = 0;
+                }
+                if (first !== null) {
+                    bytes += loaded ? 0 : layers[i].levels[level].length;
+                    if (loaded || bytes >= batchBytes || i === maxLayer) {
+                        await this.loadGeometryRange(fileId, first, loaded ? i - 1 : i, { level });
+                        first = null;
+                        if (onBatch) onBatch();
+                    }
+                }
+            }
+        });
     }
     
-    renderLayers(layers, maxLayer = null) {
-        const layersToRender = maxLayer !== null ? layers.slice(0, maxLayer + 1) : layers;
-        const lineWidth = 0.8; // Aumentar espessura para 0.8mm
-        
-        layersToRender.forEach((layer, layerIndex) => {
-            // Cor baseada na altura (gradiente) - cores sólidas e vibrantes
-            const hue = (layerIndex / layers.length) * 0.7;
-            const color = new THREE.Color().setHSL(0.15 + hue, 1.0, 0.5);
-            
-            // Material com iluminação para parecer sólido - SEM CULLING
-            const material = new THREE.MeshPhongMaterial({ 
-                color: color,
-                shininess: 30,
-                specular: 0x333333,
-                transparent: false,
-                opacity: 1.0,
-                flatShading: false,
-                side: THREE.DoubleSide  // Renderizar ambos os lados
-            });
-            
-            layer.forEach(segment => {
-                const start = new THREE.Vector3(
-                    segment.start.x - 100, 
-                    segment.start.z, 
-                    segment.start.y - 100
-                );
-                const end = new THREE.Vector3(
-                    segment.end.x - 100, 
-                    segment.end.z, 
-                    segment.end.y - 100
-                );
-                
-                // Criar tubo cilíndrico representando a linha de extrusão
-                const direction = new THREE.Vector3().subVectors(end, start);
-                const length = direction.length();
-                
-                if (length > 0.01) { // Evitar linhas muito pequenas
-                    const geometry = new THREE.CylinderGeometry(
-                        lineWidth / 2,  // raio topo
-                        lineWidth / 2,  // raio base
-                        length,         // altura
-                        8,              // segmentos radiais (otimizado para performance)
-                        1,              // segmentos de altura
-                        false           // sem tampa
-                    );
-                    
-                    const cylinder = new THREE.Mesh(geometry, material);
-                    
-                    // Posicionar e orientar o cilindro
-                    cylinder.position.copy(start).add(direction.multiplyScalar(0.5));
-                    cylinder.quaternion.setFromUnitVectors(
-                        new THREE.Vector3(0, 1, 0),
-                        direction.normalize()
-                    );
-                    
-                    this.scene.add(cylinder);
-                    this.lines.push(cylinder);
+    // Refina as camadas mais próximas da altura focusZ (mm): janela com até budget vértices
+    // no nível mais detalhado; o servidor desce de nível se a janela não couber
+    refineAround(fileId, focusZ, budget, onDone = null) {
+        return this.queueGeometry(async () => {
+            const layers = this.geometryLayers;
+            if (!layers) return;
+            let focus = 0;
+            layers.forEach((layer, i) => {
+                if (layer.z !== null && Math.abs(layer.z - focusZ) < Math.abs((layers[focus].z || 0) - focusZ)) {
+                    focus = i;
                 }
             });
+            let lo = focus;
+            let hi = focus;
+            let vertices = layers[focus].levels[0].vertices;
+            while (true) {
+                const below = lo > 0 ? layers[lo - 1].levels[0].vertices : Infinity;
+                const above = hi < layers.length - 1 ? layers[hi + 1].levels[0].vertices : Infinity;
+                const next = Math.min(below, above);
+                if (next === Infinity || vertices + next > budget) break;
+                vertices += next;
+                if (below <= above) lo--; else hi++;
+            }
+            let needed = false;
+            for (let i = lo; i <= hi; i++) {
+                if (this.layerLevels[i] === undefined || this.layerLevels[i] > 0) needed = true;
+            }
+            if (!needed) return;
+            await this.loadGeometryRange(fileId, lo, hi, { budget });
+            if (onDone) onDone();
         });
     }
     
-    clearLines() {
-        this.lines.forEach(line => {
-            this.scene.remove(line);
-            if (line.geometry) line.geometry.dispose();
-            if (line.material) line.material.dispose();
+    // Pedidos de geometria em fila; um lote que falhou não pode travar os próximos
+    queueGeometry(task) {
+        this.layerLoading = this.layerLoading.catch(() => {}).then(task);
+        return this.layerLoading;
+    }
+    
+    // Slider de camadas: só liga/desliga a visibilidade, nada é recriado
+    showLayers(maxLayer) {
+        this.visibleLayers = maxLayer + 1;
+        this.layerObjects.forEach((segments, i) => {
+            if (segments) segments.visible = i <= maxLayer;
         });
-        this.lines = [];
+    }
+    
+    clearLines() {
+        if (this.worker) {
+            this.worker.terminate();
+            this.worker = null;
+        }
+        this.layerMaterials.forEach(material => material && material.dispose());
+        this.layerMaterials = [];
+        
+        if (this.layerGroup) {
+            this.layerGroup.children.forEach(segments => segments.geometry.dispose());
+            this.scene.remove(this.layerGroup);
+            this.layerGroup = null;
+        }
+        this.geometryLayers = null;
+        this.layerObjects = [];
+        this.layerLevels = [];
     }
     
     centerCamera() {
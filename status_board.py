@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Quadro de status em memória compartilhada (STATUS_BOARD=1)
+
+O dono da impressora (app.py sozinho ou printer_daemon.py) publica um registro binário
+de tamanho fixo num arquivo em /dev/shm: estado, progresso, offset no arquivo, camada,
+temperaturas e alvos, filamento, horários e um contador de sequência. Qualquer worker da
+interface web mapeia o mesmo arquivo e serve o /api/printer/status dali: sem lock, sem
+banco e sem pedido ao daemon.
+
+Leitura no estilo seqlock: um único escritor (serializado por um lock no processo dono)
+incrementa a sequência para um número ímpar, grava o corpo e incrementa de novo (par). O
+leitor copia a sequência, o corpo e a sequência outra vez; se ela era ímpar ou mudou no
+meio, a leitura pegou uma escrita pela metade e é refeita.
+
+Só a sequência não basta fora do x86: o Python não emite barreiras de memória, e num ARM
+(Raspberry Pi) o leitor pode ver as gravações fora de ordem - o corpo pela metade entre
+duas leituras da mesma sequência par. Por isso o corpo leva um CRC-32, calculado pelo
+escritor antes de gravar: o leitor só aceita a cópia cujo CRC confere e, senão, tenta de
+novo. A sequência continua servindo para detectar mudanças (cache) e evitar cópias inúteis.
+
+Layout (little-endian): cabeçalho de 16 bytes (magic, versão, reservado, sequência), o
+corpo em _BODY e o CRC-32 do corpo. Mudou o layout: suba STATUS_BOARD_VERSION (leitores
+antigos ignoram).
+"""
+
+import os
+import math
+import mmap
+import time
+import zlib
+import struct
+import threading
+
+STATUS_BOARD_MAGIC = b'CRST'
+STATUS_BOARD_VERSION = 2
+STATUS_STATES = ('idle', 'printing', 'paused')
+FILENAME_BYTES = 200
+SOURCE_BYTES = 8
+READ_RETRIES = 1000  # Tentativas antes de desistir (escritor morto no meio de uma escrita)
+OWNER_CHECK_SEC = 1.0  # Intervalo entre as conferências de que o dono ainda está vivo
+
+_HEADER = struct.Struct('<4sHHQ')
+_SEQ = struct.Struct('<Q')
+_SEQ_OFFSET = 8
+_BODY_OFFSET = _HEADER.size
+_BODY = struct.Struct(f'<IBBBBB3xdQIIddddddddddq{SOURCE_BYTES}s{FILENAME_BYTES}s')
+BODY_FIELDS = (
+    'pid',                 # processo dono (o leitor confere se ainda está vivo)
+    'state',               # índice em STATUS_STATES
+    'connected',
+    'paused_by_filament',
+    'has_filament',
+    'filament_sensor',     # sensor habilitado
+    'progress',            # %
+    'offset',              # bytes do G-code já enviados (offset da linha atual)
+    'layer',               # camada atual (1..total_layers; 0: antes da primeira)
+    'total_layers',
+    'nozzle',
+    'bed',
+    'target_nozzle',
+    'target_bed',
+    'temperature_at',      # time.time() da última leitura de temperatura
+    'filament_checked_at',
+    'started_at',          # time.time() do início da impressão
+    'total_seconds',       # tempo total estimado (NaN: sem estimativa)
+    'remaining_seconds',   # tempo restante da estimativa cinemática (NaN: sem)
+    'updated_at',          # time.time() desta publicação
+    'job_id',
+    'filament_source',
+    'filename',
+)
+_CRC = struct.Struct('<I')
+_CRC_OFFSET = _BODY_OFFSET + _BODY.size
+_RECORD_END = _CRC_OFFSET + _CRC.size
+STATUS_BOARD_SIZE = _RECORD_END
+
+
+def _float(value):
+    return math.nan if value is None else float(value)
+
+
+def _text(value, size):
+    """Texto UTF-8 cortado em size bytes sem partir um caractere."""
+    raw = (value or '').encode('utf-8')[:size]
+    return raw.decode('utf-8', 'ignore').encode('utf-8')
+
+
+class StatusBoard:
+    """Lado do dono da impressora: publica o registro (um escritor; threads serializadas).
+
+    O arquivo é reaproveitado (mesmo inode) quando o dono reinicia: os leitores que já o
+    mapearam continuam válidos e a sequência continua de onde parou.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.stats = {'writes': 0}
+        self._lock = threading.Lock()
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < STATUS_BOARD_SIZE:
+                os.ftruncate(fd, STATUS_BOARD_SIZE)
+            self._mm = mmap.mmap(fd, STATUS_BOARD_SIZE)
+        finally:
+            os.close(fd)
+        magic, version, _, seq = _HEADER.unpack_from(self._mm, 0)
+        if magic != STATUS_BOARD_MAGIC or version != STATUS_BOARD_VERSION:
+            seq = 0
+        self._seq = seq + (seq & 1)
+        _HEADER.pack_into(self._mm, 0, STATUS_BOARD_MAGIC, STATUS_BOARD_VERSION, 0, self._seq)
+
+    def publish(self, fields):
+        """Grava o registro inteiro (fields: nomes de BODY_FIELDS; faltando = zero)."""
+        values = (
+            os.getpid(),
+            STATUS_STATES.index(fields.get('state', 'idle')),
+            bool(fields.get('connected')),
+            bool(fields.get('paused_by_filament')),
+            bool(fields.get('has_filament')),
+            bool(fields.get('filament_sensor')),
+            float(fields.get('progress') or 0.0),
+            int(fields.get('offset') or 0),
+            int(fields.get('layer') or 0),
+            int(fields.get('total_layers') or 0),
+            float(fields.get('nozzle') or 0.0),
+            float(fields.get('bed') or 0.0),
+            float(fields.get('target_nozzle') or 0.0),
+            float(fields.get('target_bed') or 0.0),
+            _float(fields.get('temperature_at')),
+            _float(fields.get('filament_checked_at')),
+            _float(fields.get('started_at')),
+            _float(fields.get('total_seconds')),
+            _float(fields.get('remaining_seconds')),
+            time.time(),
+            int(fields.get('job_id') or 0),
+            _text(fields.get('filament_source'), SOURCE_BYTES),
+            _text(fields.get('filename'), FILENAME_BYTES),
+        )
+        body = _BODY.pack(*values)
+        record = body + _CRC.pack(zlib.crc32(body))
+        with self._lock:
+            # Ímpar: escrita em andamento; os leitores esperam o próximo número par
+            _SEQ.pack_into(self._mm, _SEQ_OFFSET, self._seq + 1)
+            self._mm[_BODY_OFFSET:_RECORD_END] = record
+            self._seq += 2
+            _SEQ.pack_into(self._mm, _SEQ_OFFSET, self._seq)
+            self.stats['writes'] += 1
+
+    def close(self):
+        self._mm.close()
+
+
+class StatusBoardReader:
+    """Lado da interface web: leitura sem lock (várias threads ao mesmo tempo)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.stats = {'reads': 0, 'retries': 0, 'torn': 0}
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), STATUS_BOARD_SIZE, access=mmap.ACCESS_READ)
+        magic, version, _, _ = _HEADER.unpack_from(self._mm, 0)
+        if magic != STATUS_BOARD_MAGIC or version != STATUS_BOARD_VERSION:
+            self._mm.close()
+            raise ValueError(f'{path}: quadro de status de outra versão')
+        self._owner_checked = 0.0
+        self._owner_alive = True
+
+    def sequence(self) -> int:
+        """Sequência atual (muda a cada publicação; ímpar durante uma escrita)."""
+        return _SEQ.unpack_from(self._mm, _SEQ_OFFSET)[0]
+
+    def owner_alive(self) -> bool:
+        """O processo dono ainda existe? (conferido no máximo a cada OWNER_CHECK_SEC)"""
+        now = time.monotonic()
+        if now - self._owner_checked >= OWNER_CHECK_SEC:
+            pid = struct.unpack_from('<I', self._mm, _BODY_OFFSET)[0]
+            if not pid:
+                return False  # Nada publicado ainda: conferir de novo na próxima leitura
+            self._owner_checked = now
+            try:
+                os.kill(pid, 0)
+                self._owner_alive = True
+            except ProcessLookupError:
+                self._owner_alive = False
+            except PermissionError:
+                self._owner_alive = True
+        return self._owner_alive
+
+    def read(self):
+        """(sequência, {campo: valor}) consistente, ou None (sem dono / escrita travada)."""
+        if not self.owner_alive():
+            return None
+        mm = self._mm
+        for _ in range(READ_RETRIES):
+            seq = _SEQ.unpack_from(mm, _SEQ_OFFSET)[0]
+            if seq & 1:
+                self.stats['retries'] += 1
+                time.sleep(0)  # Deixar o escritor terminar
+                continue
+            raw = mm[_BODY_OFFSET:_RECORD_END]  # Cópia: o CRC é conferido nela
+            if _SEQ.unpack_from(mm, _SEQ_OFFSET)[0] != seq:
+                self.stats['retries'] += 1
+                continue
+            if not seq:
+                return None  # Nada publicado ainda
+            if zlib.crc32(raw[:_BODY.size]) != _CRC.unpack_from(raw, _BODY.size)[0]:
+                # Corpo pela metade com a sequência igual (gravações vistas fora de ordem)
+                self.stats['retries'] += 1
+                self.stats['torn'] += 1
+                time.sleep(0)
+                continue
+            values = _BODY.unpack_from(raw)
+            self.stats['reads'] += 1
+            record = dict(zip(BODY_FIELDS, values))
+            record['state'] = STATUS_STATES[record['state']]
+            record['filename'] = record['filename'].rstrip(b'\0').decode('utf-8', 'ignore')
+            record['filament_source'] = record['filament_source'].rstrip(b'\0').decode('utf-8', 'ignore')
+            for key in ('temperature_at', 'filament_checked_at', 'started_at', 'total_seconds',
+                        'remaining_seconds'):
+                if math.isnan(record[key]):
+                    record[key] = None
+            return seq, record
+        return None
+
+    def close(self):
+        self._mm.close()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Testes da fila de análise com vários processos (gcode_analysis.py + reserva no banco do
+app.py): cada arquivo é analisado por um processo só, e reservas de processos que
+morreram voltam para a fila.
+
+Uso: python3 -m pytest -q test_gcode_analysis.py
+"""
+
+import os
+import time
+import sqlite3
+import multiprocessing
+
+import pytest
+
+from gcode_analysis import AnalysisPool
+
+app = pytest.importorskip('app')
+
+FILE_COUNT = 30
+WAIT_SEC = 30
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'DB_NAME', str(tmp_path / 'croma.db'))
+    monkeypatch.setitem(app.app.config, 'GCODE_FOLDER', str(tmp_path))
+    app.init_db()
+    return app.DB_NAME
+
+
+def add_file(db, filename, status='pending', pid=None):
+    conn = sqlite3.connect(db)
+    conn.execute('''
+        INSERT INTO gcode_files (user_id, filename, original_name, analysis_status, analysis_pid)
+        VALUES (1, ?, ?, ?, ?)
+    ''', (filename, filename, status, pid))
+    conn.commit()
+    conn.close()
+
+
+def analysis_rows(db):
+    conn = sqlite3.connect(db)
+    rows = conn.execute('SELECT filename, analysis_status, analysis_pid FROM gcode_files ORDER BY id').fetchall()
+    conn.close()
+    return rows
+
+
+def test_pool_drops_job_claimed_elsewhere():
+    ran = []
+    pool = AnalysisPool(1, claim=lambda key: key != 'outro.gcode')
+    pool.submit('outro.gcode', lambda progress: ran.append('outro.gcode'))
+    pool.submit('meu.gcode', lambda progress: ran.append('meu.gcode'))
+    assert pool.wait_idle(WAIT_SEC)
+    assert ran == ['meu.gcode']
+    assert pool.stats['claimed_elsewhere'] == 1 and pool.stats['ready'] == 1
+
+
+def analyze_all(db, log_path):
+    """Um "worker da interface": pede a análise de todos os arquivos, como o resume faz."""
+    app.DB_NAME = db
+    pool = AnalysisPool(2, on_status=app.save_analysis_status, claim=app.claim_gcode_analysis)
+
+    def job(filename):
+        def run(progress):
+            with open(log_path, 'a') as f:
+                f.write(f'{filename} {os.getpid()}\n')
+            time.sleep(0.01)
+        return run
+
+    for i in range(FILE_COUNT):
+        filename = f'{i}.gcode'
+        pool.submit(filename, job(filename))
+    assert pool.wait_idle(WAIT_SEC)
+
+
+def test_each_file_analyzed_by_one_process(db, tmp_path):
+    for i in range(FILE_COUNT):
+        add_file(db, f'{i}.gcode')
+    log_path = str(tmp_path / 'analyzed.log')
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=analyze_all, args=(db, log_path)) for _ in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(WAIT_SEC)
+        assert worker.exitcode == 0
+
+    with open(log_path) as f:
+        analyzed = [line.split()[0] for line in f]
+    assert sorted(analyzed) == sorted(f'{i}.gcode' for i in range(FILE_COUNT))
+    assert all(status == 'ready' and pid is None for _, status, pid in analysis_rows(db))
+
+
+def test_claim_respects_live_owner(db):
+    add_file(db, 'a.gcode', 'analyzing', os.getppid())  # Reservada por outro processo vivo
+    assert not app.claim_gcode_analysis('a.gcode')
+    app.mark_analysis_pending('a.gcode')
+    app.save_analysis_status('a.gcode', 'failed')
+    assert analysis_rows(db) == [('a.gcode', 'analyzing', os.getppid())]
+
+    add_file(db, 'b.gcode', 'analyzing', os.getpid())  # Reserva deste processo (upload)
+    assert app.claim_gcode_analysis('b.gcode')
+    app.save_analysis_status('b.gcode', 'ready')
+    assert analysis_rows(db)[1] == ('b.gcode', 'ready', None)
+
+
+def test_resume_takes_over_dead_claims(db, tmp_path):
+    context = multiprocessing.get_context('fork')
+    dead = context.Process(target=lambda: None)
+    dead.start()
+    dead.join()
+
+    with open(tmp_path / 'morto.gcode', 'w') as f:
+        f.write(';LAYER:0\nG1 Z0.2 F600\nG1 X10 Y10 E1 F1200\n;LAYER:1\nG1 Z0.4\nG1 X20 Y20 E2\n')
+    add_file(db, 'morto.gcode', 'analyzing', dead.pid)
+    add_file(db, 'vivo.gcode', 'analyzing', os.getppid())
+
+    app.resume_gcode_analysis()
+    assert app.analysis_pool.wait_idle(WAIT_SEC)
+    assert analysis_rows(db) == [('morto.gcode', 'ready', None), ('vivo.gcode', 'analyzing', os.getppid())]
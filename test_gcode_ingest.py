@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Testes do GcodeUpload (gcode_ingest.py): fila, modo atrasado (leitura do arquivo),
+abort() e rename do .part.
+
+Uso: python3 -m pytest -q test_gcode_ingest.py
+"""
+
+import os
+import random
+import hashlib
+import threading
+
+import pytest
+
+from gcode_ingest import GcodeUpload, PART_SUFFIX
+
+WAIT_SEC = 10
+
+
+class RecordingConsumer:
+    """Consumidor que guarda (bloco, offset); gate segura o primeiro feed() (consumidor lento)."""
+
+    def __init__(self, gate=None):
+        self.gate = gate
+        self.blocks = []
+        self.aborted = threading.Event()
+        self.feeding = threading.Event()
+
+    def feed(self, block, offset):
+        self.feeding.set()
+        if self.gate is not None:
+            assert self.gate.wait(WAIT_SEC)
+        self.blocks.append((bytes(block), offset))
+
+    def abort(self):
+        self.aborted.set()
+
+
+def synthetic_gcode(lines, seed=0):
+    rng = random.Random(seed)
+    out = []
+    for i in range(lines):
+        if i % 17 == 0:
+            out.append(f'; camada {i // 17} - comentário não ASCII ✓\n')
+        out.append(f'G1 X{rng.uniform(0, 200):.3f} Y{rng.uniform(0, 200):.3f} E{i * 0.01:.4f}\n')
+    return ''.join(out).encode()
+
+
+def write_in_pieces(upload, data, seed=0):
+    """Escreve como o Werkzeug: pedaços de tamanho variável, cortando linhas no meio."""
+    rng = random.Random(seed)
+    pos = 0
+    while pos < len(data):
+        size = rng.randint(1, 700)
+        upload.write(data[pos:pos + size])
+        pos += size
+
+
+def assert_each_byte_once_in_order(consumer, data):
+    expected_offset = 0
+    for block, offset in consumer.blocks:
+        assert offset == expected_offset
+        assert block, 'bloco vazio'
+        expected_offset += len(block)
+    assert b''.join(block for block, _ in consumer.blocks) == data
+    # Blocos de linhas completas (só o último pode terminar sem quebra)
+    for block, _ in consumer.blocks[:-1]:
+        assert block.endswith(b'\n')
+
+
+def finish_and_wait(upload, path=None):
+    processed = threading.Event()
+    info = upload.finish(path)
+    upload.when_processed(processed.set)
+    upload.wait_processed(WAIT_SEC)
+    assert processed.is_set()
+    return info
+
+
+@pytest.mark.parametrize('queue_bytes', [64 * 1024 * 1024, 256])
+def test_consumers_see_every_byte_once_in_order(tmp_path, queue_bytes):
+    data = synthetic_gcode(3000)
+    path = str(tmp_path / 'peca.gcode')
+    consumer = RecordingConsumer()
+    upload = GcodeUpload(path, {'rec': consumer}, block_bytes=256, queue_bytes=queue_bytes)
+    write_in_pieces(upload, data)
+    info = finish_and_wait(upload)
+
+    assert_each_byte_once_in_order(consumer, data)
+    assert not consumer.aborted.is_set()
+    assert info['size'] == len(data)
+    assert info['sha256'] == hashlib.sha256(data).hexdigest()
+    assert info['lines'] == data.count(b'\n')
+
+
+def test_slow_consumer_forces_spill_to_file(tmp_path):
+    data = synthetic_gcode(3000, seed=1) + b'G1 X0 Y0'  # Última linha sem quebra
+    path = str(tmp_path / 'peca.gcode')
+    gate = threading.Event()
+    slow = RecordingConsumer(gate)
+    fast = RecordingConsumer()
+    upload = GcodeUpload(path, {'slow': slow, 'fast': fast}, block_bytes=256, queue_bytes=512)
+
+    # O consumidor fica parado no primeiro bloco enquanto o upload inteiro chega
+    write_in_pieces(upload, data[:len(data) // 2], seed=2)
+    assert slow.feeding.wait(WAIT_SEC)
+    write_in_pieces(upload, data[len(data) // 2:], seed=3)
+    assert upload._spill_offset is not None
+    gate.set()
+    finish_and_wait(upload)
+
+    assert upload.spilled_bytes > 0
+    assert_each_byte_once_in_order(slow, data)
+    assert slow.blocks == fast.blocks
+    assert not slow.aborted.is_set()
+
+
+def test_spill_before_finish_then_rename(tmp_path):
+    """Os consumidores leem do arquivo pelo descritor aberto: o rename no meio não importa."""
+    data = synthetic_gcode(2000, seed=4)
+    path = str(tmp_path / 'upload.tmp')
+    final = str(tmp_path / 'final.gcode')
+    gate = threading.Event()
+    consumer = RecordingConsumer(gate)
+    upload = GcodeUpload(path, {'rec': consumer}, block_bytes=128, queue_bytes=128)
+    write_in_pieces(upload, data, seed=5)
+    assert consumer.feeding.wait(WAIT_SEC)
+    upload.finish(final)
+    gate.set()
+    processed = threading.Event()
+    upload.when_processed(processed.set)
+    upload.wait_processed(WAIT_SEC)
+
+    assert processed.is_set()
+    assert_each_byte_once_in_order(consumer, data)
+    assert not os.path.exists(path + PART_SUFFIX)
+    with open(final, 'rb') as f:
+        assert f.read() == data
+
+
+def test_abort_mid_upload_removes_part_and_aborts_consumers(tmp_path):
+    data = synthetic_gcode(1000, seed=6)
+    path = str(tmp_path / 'peca.gcode')
+    consumer = RecordingConsumer()
+    upload = GcodeUpload(path, {'rec': consumer}, block_bytes=256, queue_bytes=1024)
+    write_in_pieces(upload, data[:len(data) // 2], seed=7)
+    assert os.path.exists(path + PART_SUFFIX)
+
+    upload.close()  # Requisição terminou antes do finish()
+    upload.wait_processed(WAIT_SEC)
+
+    assert consumer.aborted.wait(WAIT_SEC)
+    assert not os.path.exists(path + PART_SUFFIX)
+    assert not os.path.exists(path)
+
+
+def test_abort_while_consuming_from_file(tmp_path):
+    data = synthetic_gcode(2000, seed=8)
+    path = str(tmp_path / 'peca.gcode')
+    gate = threading.Event()
+    consumer = RecordingConsumer(gate)
+    upload = GcodeUpload(path, {'rec': consumer}, block_bytes=128, queue_bytes=128)
+    write_in_pieces(upload, data, seed=9)
+    assert consumer.feeding.wait(WAIT_SEC)
+    assert upload._spill_offset is not None
+
+    upload.abort()
+    gate.set()
+    upload.wait_processed(WAIT_SEC)
+
+    assert not upload._thread.is_alive()
+    assert consumer.aborted.is_set()
+    assert not os.path.exists(path + PART_SUFFIX)
+    # Nada além do que já estava sendo entregue quando veio o abort()
+    assert sum(len(block) for block, _ in consumer.blocks) < len(data)
+
+
+def test_failing_consumer_is_dropped_and_aborted(tmp_path):
+    class Failing(RecordingConsumer):
+        def feed(self, block, offset):
+            raise ValueError('falha no consumidor')
+
+    data = synthetic_gcode(500, seed=10)
+    path = str(tmp_path / 'peca.gcode')
+    failing = Failing()
+    ok = RecordingConsumer()
+    upload = GcodeUpload(path, {'failing': failing, 'ok': ok}, block_bytes=256)
+    write_in_pieces(upload, data, seed=11)
+    finish_and_wait(upload)
+
+    assert failing.aborted.is_set()
+    assert 'failing' not in upload.consumers
+    assert_each_byte_once_in_order(ok, data)
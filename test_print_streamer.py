@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Testes do protocolo de linha com a impressora (print_streamer.py): montagem da linha
+numerada, plan_resend e o reenvio nos dois modos de envio - o processo de envio
+(StreamerLink) e a thread do app (_stream_request_resend) - que usam a mesma regra:
+reenvio de dentro do histórico, pedido fora do histórico (M110) e os "Resend: N"
+repetidos ignorados.
+
+Uso: python3 -m pytest -q test_print_streamer.py
+"""
+
+import os
+import socket
+from collections import deque
+
+import pytest
+
+from print_streamer import StreamerLink, encode_frame, frame_size, plan_resend, xor_checksum
+
+HISTORY = 4
+WINDOW = 4
+
+
+def test_encode_frame_matches_marlin_checksum():
+    line = b'G1 X10.5 Y20 E0.123'
+    body = b'N123 ' + line
+    checksum = 0
+    for byte in body:
+        checksum ^= byte
+    assert xor_checksum(body) == checksum
+    assert encode_frame(line, 123) == body + b'*%d\n' % checksum
+    assert encode_frame(line) == line + b'\n'
+    for number in (None, 1, 9, 10, 1234567):
+        assert frame_size(line, number) == len(encode_frame(line, number))
+
+
+def test_plan_resend():
+    # Dentro do histórico: reenviar de N até a última; ignorar os pedidos das outras em trânsito
+    assert plan_resend(8, 10, 4, 3, None, 0) == ('resend', 8, 2)
+    # Repetições do mesmo pedido: ignoradas até o contador zerar
+    assert plan_resend(8, 10, 4, 3, 8, 2) == ('ignore', 8, 1)
+    assert plan_resend(8, 10, 4, 3, 8, 1) == ('ignore', 8, 0)
+    assert plan_resend(8, 10, 4, 3, 8, 0) == ('resend', 8, 2)
+    # Fora do histórico (antes da primeira guardada ou depois da última enviada)
+    assert plan_resend(6, 10, 4, 3, None, 0) == ('resync', None, 0)
+    assert plan_resend(11, 10, 4, 3, 8, 2) == ('resync', None, 0)
+    # Início da impressão: o histórico ainda não encheu
+    assert plan_resend(1, 2, 4, 2, None, 0) == ('resend', 1, 1)
+
+
+# Processo de envio (StreamerLink)
+
+@pytest.fixture
+def link(tmp_path):
+    stream_path = tmp_path / 'peca.gcode.stream'
+    with open(stream_path, 'wb') as f:
+        f.write(b';CROMA-STREAM 2\n')
+        for i in range(1, 21):
+            f.write(b'm %d G1 X%d\n' % (i * 10, i))
+    serial_r, serial_w = os.pipe()
+    os.set_blocking(serial_r, False)
+    control, peer = socket.socketpair()
+    config = {
+        'checksum': True,
+        'rx_buffer_bytes': 4096,
+        'max_inflight': WINDOW,
+        'timeouts': {'m': 5.0},
+        'command_timeout': 5.0,
+        'prefetch_bytes': 4096,
+        'stream_path': str(stream_path),
+        'resend_history': HISTORY,
+    }
+    link = StreamerLink(serial_w, control, config)
+    link.started = True
+    link.serial_out = lambda: _drain(serial_r)
+    yield link
+    link.stream_file.close()
+    for fd in (serial_r, serial_w):
+        os.close(fd)
+    control.close()
+    peer.close()
+
+
+def _drain(fd):
+    data = b''
+    while True:
+        try:
+            chunk = os.read(fd, 65536)
+        except BlockingIOError:
+            return data
+        if not chunk:
+            return data
+        data += chunk
+
+
+def test_streamer_resend_within_history(link):
+    link._fill()
+    assert link.line_number == WINDOW
+    assert link.serial_out() == b''.join(encode_frame(b'G1 X%d' % n, n) for n in range(1, 5))
+
+    link._handle_line(b'Resend: 2')
+    assert list(link.resend_queue) == [(n, b'G1 X%d' % n) for n in range(2, 5)]
+    assert (link.resend_from, link.resend_ignore) == (2, WINDOW - 1)
+    assert link.stats['resends'] == 1
+
+    # As outras três linhas em trânsito pedem o mesmo reenvio: nenhum efeito
+    for remaining in (2, 1, 0):
+        link._handle_line(b'Resend: 2')
+        assert link.resend_ignore == remaining
+        assert len(link.resend_queue) == 3
+    assert link.stats['resends'] == 1
+
+    # Vagas abertas: os reenvios saem antes das linhas novas, com o número original
+    for _ in range(WINDOW):
+        link._handle_line(b'ok')
+    link._fill()
+    sent = link.serial_out()
+    resent = b''.join(encode_frame(b'G1 X%d' % n, n) for n in range(2, 5))
+    assert sent.startswith(resent)
+    assert sent[len(resent):] == encode_frame(b'G1 X5', 5)
+
+
+def test_streamer_resend_outside_history_resyncs(link):
+    while link.line_number < 10:
+        link._fill()
+        link._handle_line(b'ok')
+    link._fill()
+    link.serial_out()
+    last = link.line_number
+
+    link._handle_line(b'Resend: 3')  # Histórico: só as últimas HISTORY linhas
+    assert not link.resend_queue
+    assert (link.resend_from, link.resend_ignore) == (None, 0)
+    assert link.serial_out() == b'M110 N%d\n' % last
+
+
+# Modo em thread do app (_stream_request_resend)
+
+class FakeSerial:
+    is_open = True
+
+    def __init__(self):
+        self.written = []
+
+    def write(self, data):
+        self.written.append(data)
+
+
+@pytest.fixture
+def thread_link(monkeypatch):
+    app = pytest.importorskip('app')
+    serial = FakeSerial()
+    monkeypatch.setattr(app, 'printer_serial', serial)
+    monkeypatch.setattr(app, 'STREAM_CHECKSUM', True)
+    monkeypatch.setattr(app, '_ack_waiters', deque())
+    monkeypatch.setattr(app, '_link_inflight_bytes', 0)
+    monkeypatch.setattr(app, '_stream_slots_hint', None)
+    monkeypatch.setattr(app, '_stream_line_number', 0)
+    monkeypatch.setattr(app, '_stream_sent_history', deque(maxlen=HISTORY))
+    monkeypatch.setattr(app, '_stream_resend_queue', deque())
+    monkeypatch.setattr(app, '_stream_resend_from', None)
+    monkeypatch.setattr(app, '_stream_resend_ignore', 0)
+    monkeypatch.setattr(app, 'stream_stats', dict(app.stream_stats, resends=0, resent_lines=0))
+    return app, serial
+
+
+def test_thread_mode_resend_within_history(thread_link):
+    app, serial = thread_link
+    for n in range(1, 5):
+        app._stream_write_line(f'G1 X{n}', timeout=5)
+    assert serial.written == [encode_frame(b'G1 X%d' % n, n) for n in range(1, 5)]
+
+    app._stream_request_resend(2)
+    assert list(app._stream_resend_queue) == [(n, f'G1 X{n}') for n in range(2, 5)]
+    assert (app._stream_resend_from, app._stream_resend_ignore) == (2, 3)
+
+    for remaining in (2, 1, 0):
+        app._stream_request_resend(2)
+        assert app._stream_resend_ignore == remaining
+    assert app.stream_stats['resends'] == 1
+
+    # Um quarto pedido igual (já sem linhas em trânsito para gerá-lo) é um reenvio novo
+    app._stream_request_resend(2)
+    assert app.stream_stats['resends'] == 2
+
+
+def test_thread_mode_resend_outside_history_resyncs(thread_link):
+    app, serial = thread_link
+    for n in range(1, 11):
+        app._stream_write_line(f'G1 X{n}', timeout=5)
+    serial.written.clear()
+
+    app._stream_request_resend(3)
+    assert not app._stream_resend_queue
+    assert (app._stream_resend_from, app._stream_resend_ignore) == (None, 0)
+    assert serial.written == [b'M110 N10\n']
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Testes da interface com vários workers (PRINTER_DAEMON=1): o governor da impressão
+servido pelo daemon (vagas emprestadas, devolvidas e recuperadas de workers mortos) e
+um daemon de verdade com dois processos da interface - a mesma sessão vale nos dois,
+os uploads de cada um são analisados e o governor é o mesmo para todos.
+
+Uso: python3 -m pytest -q test_printer_daemon.py
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import subprocess
+import http.client
+import multiprocessing
+
+import pytest
+
+from resource_governor import ResourceGovernor, RemoteGovernor
+
+app = pytest.importorskip('app')
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+WAIT_SEC = 30
+
+
+# Governor no daemon (chamadas diretas aos @printer_method, sem socket)
+
+@pytest.fixture
+def daemon_governor(monkeypatch):
+    printing = {'active': True}
+    governor = ResourceGovernor(lambda: printing['active'], rates={'upload': 1024 * 1024},
+                                slots={'preview': 1}, wait_sec=0.05)
+    monkeypatch.setattr(app, 'print_governor', governor)
+    monkeypatch.setattr(app, '_governor_slots', {})
+    remote = RemoteGovernor(lambda: printing['active'],
+                            lambda method, **params: app.PRINTER_METHODS[method](**params))
+    return remote, printing
+
+
+def test_remote_slot_shared_and_released(daemon_governor):
+    remote, printing = daemon_governor
+    slot = remote.admit('preview')
+    assert slot is not None
+    assert remote.admit('preview') is None  # Uma vaga só, para todos os workers
+    slot.release()
+    slot.release()  # Devolver duas vezes não libera uma vaga a mais
+    with remote.admit('preview'):
+        assert remote.snapshot()['lent_slots'] == 1
+    assert remote.snapshot()['lent_slots'] == 0
+    stats = remote.snapshot()['categories']['preview']
+    assert stats['rejected'] == 1
+
+    printing['active'] = False
+    assert remote.admit('preview') is not None and remote.admit('preview') is not None
+    assert remote.snapshot()['lent_slots'] == 0
+
+
+def test_slot_of_dead_worker_is_recovered(daemon_governor):
+    remote, printing = daemon_governor
+    dead = multiprocessing.get_context('fork').Process(target=lambda: None)
+    dead.start()
+    dead.join()
+    assert app.governor_admit('preview', pid=dead.pid)
+    assert remote.snapshot()['lent_slots'] == 1
+    slot = remote.admit('preview')  # A vaga do worker morto volta no próximo pedido
+    assert slot is not None
+    slot.release()
+    assert remote.snapshot()['lent_slots'] == 0
+
+
+def test_upload_bucket_shared(daemon_governor):
+    remote, printing = daemon_governor
+    # 1 MiB/s: dois workers mandando 1 MiB cada dividem o mesmo balde
+    first = app.governor_throttle('upload', 1024 * 1024)
+    second = app.governor_throttle('upload', 1024 * 1024)
+    assert second == pytest.approx(first + 1.0, abs=0.1)
+    assert remote.snapshot()['categories']['upload']['deferred'] >= 1
+
+
+# Daemon de verdade com dois processos da interface
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def request(port, method, path, body=None, headers=None):
+    deadline = time.monotonic() + WAIT_SEC
+    while True:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=WAIT_SEC)
+            conn.request(method, path, body=body, headers=headers or {})
+            response = conn.getresponse()
+            return response.status, response.read(), response.getheader('Set-Cookie')
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+def upload(port, cookie, filename, data):
+    boundary = 'CROMA'
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            'Content-Type: application/octet-stream\r\n\r\n').encode() + data + f'\r\n--{boundary}--\r\n'.encode()
+    status, body, _ = request(port, 'POST', '/api/files/upload', body,
+                              {'Cookie': cookie, 'Content-Type': f'multipart/form-data; boundary={boundary}'})
+    assert status == 200, body
+    return json.loads(body)
+
+
+@pytest.fixture
+def web_workers(tmp_path):
+    env = dict(os.environ, PRINTER_DAEMON_SOCKET=str(tmp_path / 'printer.sock'),
+               STATUS_BOARD_PATH=str(tmp_path / 'status'), FILAMENT_SENSOR_MODE='none')
+    env.pop('SECRET_KEY', None)  # Os workers combinam a chave pelo .secret_key
+    processes = []
+
+    def spawn(script, log, **extra):
+        process = subprocess.Popen([sys.executable, os.path.join(HERE, script)], cwd=tmp_path,
+                                   env=dict(env, **extra), stdout=open(tmp_path / log, 'w'),
+                                   stderr=subprocess.STDOUT)
+        processes.append(process)
+        return process
+
+    try:
+        spawn('printer_daemon.py', 'daemon.log')
+        deadline = time.monotonic() + WAIT_SEC
+        while not os.path.exists(env['PRINTER_DAEMON_SOCKET']):
+            assert time.monotonic() < deadline, (tmp_path / 'daemon.log').read_text()
+            time.sleep(0.1)
+        ports = [free_port(), free_port()]
+        for i, port in enumerate(ports):
+            spawn('app.py', f'web{i}.log', PRINTER_DAEMON='1', PORT=str(port))
+        yield ports, tmp_path
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(WAIT_SEC)
+
+
+def test_two_web_workers_share_session_analysis_and_governor(web_workers):
+    (port_a, port_b), tmp_path = web_workers
+    credentials = json.dumps({'username': 'operador', 'password': 'segredo123'})
+    status, body, cookie = request(port_a, 'POST', '/api/register', credentials,
+                                   {'Content-Type': 'application/json'})
+    assert status == 200, body
+    cookie = cookie.split(';')[0]
+
+    # A sessão criada num worker vale no outro (mesma chave)
+    status, _, _ = request(port_b, 'GET', '/api/files/list', headers={'Cookie': cookie})
+    assert status == 200
+
+    # Um upload em cada worker: os dois terminam analisados, na interface (não no daemon)
+    ids = []
+    for i, port in enumerate((port_a, port_b)):
+        data = b''.join(b'G1 X%d Y%d E%d\n' % (n % 200, i, n) for n in range(2000))
+        ids.append(upload(port, cookie, f'peca{i}.gcode', data)['file_id'])
+    deadline = time.monotonic() + WAIT_SEC
+    while True:
+        _, body, _ = request(port_b, 'GET', '/api/files/list', headers={'Cookie': cookie})
+        files = {f['id']: f['analysis_status'] for f in json.loads(body)['files']}
+        if all(files.get(file_id) == 'ready' for file_id in ids):
+            break
+        assert time.monotonic() < deadline, files
+        time.sleep(0.2)
+    assert 'Análise de' not in (tmp_path / 'daemon.log').read_text()
+
+    # O governor é um só, no daemon
+    for port in (port_a, port_b):
+        status, body, _ = request(port, 'GET', '/api/printer/governor', headers={'Cookie': cookie})
+        assert status == 200
+        assert 'lent_slots' in json.loads(body)['governor']
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Testes do quadro de status (status_board.py): registro publicado x lido, leituras
+concorrentes com o escritor (thread e outro processo), CRC do corpo e dono morto.
+
+Uso: python3 -m pytest -q test_status_board.py
+"""
+
+import os
+import mmap
+import time
+import threading
+import multiprocessing
+
+import pytest
+
+import status_board
+from status_board import StatusBoard, StatusBoardReader, STATUS_STATES
+
+PUBLISH_COUNT = 20000
+
+
+def fields_for(i):
+    """Registro em que todo campo é derivado de i (offset): uma leitura misturada não confere."""
+    return {
+        'state': STATUS_STATES[i % 3],
+        'connected': i % 2 == 1,
+        'paused_by_filament': i % 5 == 0,
+        'has_filament': i % 7 != 0,
+        'filament_sensor': True,
+        'progress': (i % 10000) / 100.0,
+        'offset': i,
+        'layer': i % 1000,
+        'total_layers': 1000 + i % 3,
+        'nozzle': float(i),
+        'bed': i / 2.0,
+        'target_nozzle': float(i + 1),
+        'target_bed': float(i + 2),
+        'temperature_at': 1e9 + i,
+        'filament_checked_at': None if i % 4 == 0 else 2e9 + i,
+        'started_at': 3e9 + i,
+        'total_seconds': float(i * 3),
+        'remaining_seconds': None if i % 6 == 0 else float(i * 2),
+        'job_id': i + 7,
+        'filament_source': ('gpio', 'm119', 'none')[i % 3],
+        'filename': f'peça-{i}-' + 'x' * (i % 150) + '.gcode',
+    }
+
+
+def assert_consistent(record):
+    expected = fields_for(record['offset'])
+    for key, value in expected.items():
+        assert record[key] == value, (key, record['offset'], record[key], value)
+
+
+def publish_many(path, count, start=1):
+    board = StatusBoard(path)
+    for i in range(start, start + count):
+        board.publish(fields_for(i))
+    board.close()
+
+
+def read_until(reader, done, accepted):
+    last_seq = 0
+    while not done():
+        result = reader.read()
+        if result is None:
+            continue
+        seq, record = result
+        assert seq % 2 == 0 and seq >= last_seq
+        last_seq = seq
+        assert_consistent(record)
+        accepted.append(record['offset'])
+
+
+@pytest.fixture
+def board_path(tmp_path):
+    shm = '/dev/shm'
+    if os.path.isdir(shm) and os.access(shm, os.W_OK):
+        path = os.path.join(shm, f'croma-status-test-{os.getpid()}-{time.monotonic_ns()}')
+        yield path
+        if os.path.exists(path):
+            os.remove(path)
+    else:
+        yield str(tmp_path / 'croma-status')
+
+
+def test_roundtrip(board_path):
+    board = StatusBoard(board_path)
+    reader = StatusBoardReader(board_path)
+    assert reader.read() is None  # Nada publicado ainda
+
+    board.publish(fields_for(12))
+    seq, record = reader.read()
+    assert seq == 2
+    assert record['pid'] == os.getpid()
+    assert record['filament_checked_at'] is None and record['remaining_seconds'] is None
+    assert_consistent(record)
+
+    # Nome maior que o campo: cortado sem partir um caractere UTF-8
+    board.publish(dict(fields_for(13), filename='ç' * 150))
+    assert reader.read()[1]['filename'] == 'ç' * (status_board.FILENAME_BYTES // 2)
+    reader.close()
+    board.close()
+
+
+def test_reopen_continues_sequence(board_path):
+    board = StatusBoard(board_path)
+    board.publish(fields_for(1))
+    board.publish(fields_for(2))
+    board.close()
+    reader = StatusBoardReader(board_path)
+    before = reader.sequence()
+
+    board = StatusBoard(board_path)  # Dono reiniciou: mesmo arquivo, sequência continua
+    board.publish(fields_for(3))
+    seq, record = reader.read()
+    assert seq > before and seq % 2 == 0
+    assert record['offset'] == 3
+    reader.close()
+    board.close()
+
+
+def test_reads_during_publish_from_thread(board_path):
+    StatusBoard(board_path).publish(fields_for(0))
+    reader = StatusBoardReader(board_path)
+    writer = threading.Thread(target=publish_many, args=(board_path, PUBLISH_COUNT))
+    accepted = []
+    writer.start()
+    read_until(reader, lambda: not writer.is_alive(), accepted)
+    writer.join()
+
+    assert accepted
+    assert reader.read()[1]['offset'] == PUBLISH_COUNT
+    reader.close()
+
+
+def test_reads_during_publish_from_other_process(board_path):
+    """Escritor noutro processo: leitura e escrita realmente em paralelo (sem o GIL entre elas)."""
+    StatusBoard(board_path).publish(fields_for(0))
+    reader = StatusBoardReader(board_path)
+    context = multiprocessing.get_context('fork')
+    writer = context.Process(target=publish_many, args=(board_path, PUBLISH_COUNT * 5))
+    accepted = []
+    writer.start()
+    read_until(reader, lambda: not writer.is_alive(), accepted)
+    writer.join()
+
+    assert writer.exitcode == 0
+    assert len(set(accepted)) > 1
+    reader.close()
+
+
+def test_reader_rejects_body_that_fails_crc(board_path, monkeypatch):
+    """Corpo pela metade com a sequência par (o que um ARM pode mostrar): nunca aceito."""
+    monkeypatch.setattr(status_board, 'READ_RETRIES', 50)
+    board = StatusBoard(board_path)
+    board.publish(fields_for(42))
+    reader = StatusBoardReader(board_path)
+    assert reader.read()[1]['offset'] == 42
+
+    # Metade do registro novo sobre o antigo, sem mexer na sequência
+    torn = status_board._BODY.pack(*_body_values(board_path, 43))
+    with open(board_path, 'r+b') as f:
+        mm = mmap.mmap(f.fileno(), status_board.STATUS_BOARD_SIZE)
+        half = len(torn) // 2
+        mm[status_board._BODY_OFFSET:status_board._BODY_OFFSET + half] = torn[:half]
+        mm.close()
+
+    assert reader.read() is None
+    assert reader.stats['torn'] == 50
+
+    board.publish(fields_for(44))  # A próxima publicação completa volta a valer
+    assert reader.read()[1]['offset'] == 44
+    reader.close()
+    board.close()
+
+
+def _body_values(path, i):
+    """Valores do corpo como StatusBoard.publish gravaria (lidos de volta de um quadro temporário)."""
+    scratch = path + '.scratch'
+    board = StatusBoard(scratch)
+    board.publish(fields_for(i))
+    board.close()
+    with open(scratch, 'rb') as f:
+        data = f.read()
+    os.remove(scratch)
+    return status_board._BODY.unpack_from(data, status_board._BODY_OFFSET)
+
+
+def test_owner_alive_detects_dead_owner(board_path, monkeypatch):
+    monkeypatch.setattr(status_board, 'OWNER_CHECK_SEC', 0.0)
+    context = multiprocessing.get_context('fork')
+    owner = context.Process(target=publish_many, args=(board_path, 3))
+    owner.start()
+    owner.join()
+    assert owner.exitcode == 0
+
+    reader = StatusBoardReader(board_path)
+    assert not reader.owner_alive()
+    assert reader.read() is None
+
+    # Novo dono (este processo) publica no mesmo arquivo: volta a valer
+    board = StatusBoard(board_path)
+    board.publish(fields_for(5))
+    assert reader.owner_alive()
+    assert reader.read()[1]['offset'] == 5
+    reader.close()
+    board.close()
@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+"""
+Ponto de entrada WSGI da interface web (produção)
+
+    gunicorn --workers 1 --threads 16 --bind 0.0.0.0:8080 wsgi:application
+    PRINTER_DAEMON=1 gunicorn --workers 3 --threads 8 --bind 0.0.0.0:8080 wsgi:application
+
+Sem o daemon da impressora, o processo da interface é também o dono da porta serial:
+um worker só. Com PRINTER_DAEMON=1 (printer_daemon.py rodando), vários workers: o
+governor da impressão fica no daemon, a fila de análise e o último scan de Wi-Fi no
+banco, e cada worker assina os eventos do daemon para o seu /api/events. Sem --preload:
+cada worker importa este arquivo depois do fork e inicia as próprias threads em
+start_web(). As threads atendem as requisições longas (upload, /api/events) sem segurar
+as outras. Sem gunicorn, python3 app.py sobe o mesmo app no servidor do Werkzeug (com
+threads, sem debug).
+"""
+
+import atexit
+
+import app as croma
+
+croma.start_web()
+atexit.register(croma.stop_web)
+
+application = croma.app